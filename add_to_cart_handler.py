@@ -10,12 +10,10 @@ quando o usuário clica no botão "Adicionar ao Carrinho".
 import logging
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import CallbackContext
+from log_setup import setup_logging
 
 # Configuração de logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+setup_logging()
 logger = logging.getLogger('add_to_cart')
 
 def add_to_cart_handler(update: Update, context: CallbackContext, db):
@@ -88,7 +86,7 @@ def add_to_cart_handler(update: Update, context: CallbackContext, db):
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
         
-        logger.info(f"Produto '{product['name']}' adicionado ao carrinho do usuário {user_id}")
+        logger.info("Produto '%s' adicionado ao carrinho do usuário %s", product['name'], user_id)
         
     except Exception as e:
         logger.error(f"Erro ao adicionar produto ao carrinho: {e}")
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de notificações adaptativas para o administrador.
+Com pouco movimento cada pedido (PIX gerado e pagamento confirmado) gera a
+sua própria notificação. Quando a taxa de notificações passa de um limite
+(por exemplo, durante uma promoção), os pedidos passam a ser agrupados em
+um resumo que é editado periodicamente, com os pagos e os aguardando
+pagamento contados à parte, o total pago e botões por pedido em páginas.
+Cada pedido aparece uma única vez no resumo, com o status mais recente.
+Assim o volume de mensagens no chat do admin fica limitado, seja qual for a
+taxa de pedidos. Um pedido agrupado só conta como notificado (para o outbox)
+quando o envio ou a edição do resumo que o mostra é confirmado.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+
+from metrics import registry
+
+logger = logging.getLogger('admin_digest')
+
+# Configuração via variáveis de ambiente
+ADMIN_DIGEST_THRESHOLD = int(os.getenv("ADMIN_DIGEST_THRESHOLD", "5"))
+ADMIN_DIGEST_WINDOW = float(os.getenv("ADMIN_DIGEST_WINDOW", "60"))
+ADMIN_DIGEST_INTERVAL = float(os.getenv("ADMIN_DIGEST_INTERVAL", "30"))
+ADMIN_DIGEST_PAGE_SIZE = int(os.getenv("ADMIN_DIGEST_PAGE_SIZE", "5"))
+# Um resumo é encerrado (e um novo é iniciado) ao atingir este número de pedidos
+ADMIN_DIGEST_MAX_ORDERS = 200
+# Resumos antigos mantidos em memória para a paginação continuar funcionando
+ADMIN_DIGEST_KEEP = 10
+
+admin_notifications_counter = registry.counter(
+    "admin_notifications_total",
+    "Pedidos notificados ao admin por modo (individual ou resumo)",
+    labels=("mode",)
+)
+
+class Digest:
+    """Resumo de pedidos exibido em uma única mensagem editável."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.entries = OrderedDict()  # id do pedido -> dict com id, customer, total e status
+        self.message_id = None
+        self.send_future = None
+        self.page = 0
+        self.last_text = None
+        self.dirty = False
+        self.closed = False
+        self.waiters = []  # Futures dos pedidos ainda não mostrados em um envio confirmado
+
+    def paid(self):
+        """Pedidos do resumo com pagamento confirmado."""
+        return [entry for entry in self.entries.values() if entry.get("status", "pago") == "pago"]
+
+    @property
+    def total(self):
+        """Soma dos pedidos pagos (os pendentes ainda podem expirar)."""
+        return sum(entry.get("total", 0) for entry in self.paid())
+
+class AdminDigestNotifier:
+    """Alterna entre notificações individuais e um resumo editado periodicamente."""
+
+    def __init__(self, outbound, chat_id, threshold=ADMIN_DIGEST_THRESHOLD,
+                 window_seconds=ADMIN_DIGEST_WINDOW, page_size=ADMIN_DIGEST_PAGE_SIZE,
+                 max_orders=ADMIN_DIGEST_MAX_ORDERS):
+        """Inicializa o notificador.
+
+        Args:
+            outbound (OutboundQueue): Fila de saída usada nos envios e edições
+            chat_id: Chat do administrador
+            threshold (int): Pedidos dentro da janela que ativam o modo resumo
+            window_seconds (float): Janela usada para medir a taxa de pedidos
+            page_size (int): Pedidos por página no teclado do resumo
+            max_orders (int): Pedidos por resumo antes de iniciar um novo
+        """
+        self.outbound = outbound
+        self.chat_id = chat_id
+        self.threshold = max(1, threshold)
+        self.window_seconds = window_seconds
+        self.page_size = max(1, page_size)
+        self.max_orders = max_orders
+
+        self._lock = threading.Lock()
+        self._recent = deque()     # timestamps dos pedidos na janela
+        self._current = None       # Digest em andamento (modo resumo)
+        self._closed = OrderedDict()  # message_id -> Digest encerrado
+
+    @property
+    def digest_mode(self):
+        return self._current is not None
+
+    def notify(self, entry, send_individual):
+        """Registra um pedido novo (PIX gerado) ou pago.
+
+        Args:
+            entry (dict): Resumo do pedido com as chaves id, customer, total e
+                status ("pendente" ou "pago"; sem status, conta como pago)
+            send_individual (callable): Envia a notificação completa do pedido e
+                retorna o Future do envio
+
+        Returns:
+            concurrent.futures.Future: O envio individual, ou, no modo resumo,
+                resolvido quando o resumo com o pedido for enviado ou editado
+        """
+        now = time.time()
+        with self._lock:
+            self._recent.append(now)
+            self._prune(now)
+
+            if self._current is None and len(self._recent) <= self.threshold:
+                mode = "individual"
+            else:
+                if self._current is None:
+                    logger.info(
+                        "%s pedidos em %.0fs: "
+                        "notificações do admin agrupadas em resumo",
+                        len(self._recent), self.window_seconds
+                    )
+                    self._current = Digest()
+                elif len(self._current.entries) >= self.max_orders and entry["id"] not in self._current.entries:
+                    self._close_current()
+                    self._current = Digest()
+                # O mesmo pedido (pendente e depois pago) ocupa uma única linha,
+                # movida para o topo com o status novo
+                self._current.entries.pop(entry["id"], None)
+                self._current.entries[entry["id"]] = entry
+                self._current.dirty = True
+                published = Future()
+                self._current.waiters.append(published)
+                mode = "digest"
+
+        admin_notifications_counter.inc(mode=mode)
+        if mode == "individual":
+            return send_individual()
+        return published
+
+    def flush(self):
+        """Envia ou edita o resumo atual; chamado periodicamente pelo job_queue."""
+        with self._lock:
+            now = time.time()
+            self._prune(now)
+            digest = self._current
+            if digest is None:
+                return
+
+            if digest.message_id is None and digest.send_future is not None:
+                if not digest.send_future.done():
+                    return  # primeira mensagem ainda na fila de saída
+                try:
+                    digest.message_id = digest.send_future.result().message_id
+                except Exception as e:
+                    logger.warning("Falha ao enviar o resumo do admin; tentando novamente: %s", e)
+                    digest.send_future = None
+                    digest.dirty = True
+
+            if digest.dirty:
+                self._publish(digest)
+
+            # Taxa voltou ao normal: encerrar o resumo (histerese de metade do limite)
+            if digest.message_id is not None and not digest.dirty \
+                    and len(self._recent) <= self.threshold // 2:
+                logger.info("Movimento normalizado: notificações individuais reativadas")
+                self._close_current()
+
+    def render(self, digest, page=None):
+        """Gera o texto e o teclado de uma página do resumo.
+
+        Returns:
+            tuple: (texto, linhas do teclado como listas de (rótulo, callback_data))
+        """
+        entries = list(digest.entries.values())
+        paid = digest.paid()
+        pages = max(1, -(-len(entries) // self.page_size))
+        page = digest.page if page is None else page
+        page = min(max(page, 0), pages - 1)
+        digest.page = page
+
+        started = datetime.fromtimestamp(digest.started_at).strftime("%H:%M")
+        updated = datetime.now().strftime("%H:%M:%S")
+        status = "encerrado" if digest.closed else "em andamento"
+        lines = [
+            f"📊 RESUMO DE PEDIDOS ({status})",
+            "",
+            f"✅ Pagos desde {started}: {len(paid)}",
+            f"💰 Total pago: R${digest.total:.2f}",
+            f"⏳ Aguardando pagamento: {len(entries) - len(paid)}",
+            f"🕒 Atualizado às {updated}",
+            "",
+            f"Página {page + 1}/{pages} (mais recentes primeiro):",
+        ]
+
+        newest_first = entries[::-1]
+        chunk = newest_first[page * self.page_size:(page + 1) * self.page_size]
+        keyboard = []
+        for entry in chunk:
+            icon = "✅" if entry.get("status", "pago") == "pago" else "⏳"
+            lines.append(f"{icon} #{entry['id']} - {entry.get('customer', '?')} - R${entry.get('total', 0):.2f}")
+            keyboard.append([(f"👁️ Pedido #{entry['id']}", f"admin_digest_open_{entry['id']}")])
+
+        navigation = []
+        if page > 0:
+            navigation.append(("◀️ Anterior", f"admin_digest_page_{page - 1}"))
+        if page < pages - 1:
+            navigation.append(("Próxima ▶️", f"admin_digest_page_{page + 1}"))
+        if navigation:
+            keyboard.append(navigation)
+
+        return "\n".join(lines), keyboard
+
+    def page(self, message_id, page):
+        """Muda a página de um resumo (atual ou encerrado) a partir do callback.
+
+        Returns:
+            tuple | None: (texto, teclado) da página, ou None se o resumo não existir mais
+        """
+        with self._lock:
+            digest = self._current if self._current and self._current.message_id == message_id \
+                else self._closed.get(message_id)
+            if digest is None:
+                return None
+            text, keyboard = self.render(digest, page)
+            digest.last_text = text
+            return text, keyboard
+
+    # Implementação
+
+    def _prune(self, now):
+        limit = now - self.window_seconds
+        while self._recent and self._recent[0] < limit:
+            self._recent.popleft()
+
+    def _publish(self, digest):
+        text, keyboard = self.render(digest)
+        if text == digest.last_text:
+            digest.dirty = False
+            _settle(self._take_waiters(digest))
+            return
+        markup = _markup(keyboard)
+        if digest.message_id is None:
+            if digest.send_future is None:
+                from outbound_queue import PRIORITY_ADMIN
+                digest.send_future = self.outbound.send_message(
+                    chat_id=self.chat_id, text=text, reply_markup=markup, priority=PRIORITY_ADMIN
+                )
+                self._resolve_with(digest, digest.send_future)
+                digest.last_text = text
+                digest.dirty = False
+            return
+        future = self.outbound.edit_message_text(self.chat_id, digest.message_id, text, reply_markup=markup)
+        self._resolve_with(digest, future)
+        digest.last_text = text
+        digest.dirty = False
+
+    def _take_waiters(self, digest):
+        waiters, digest.waiters = digest.waiters, []
+        return waiters
+
+    def _resolve_with(self, digest, future):
+        """Os pedidos já no resumo contam como notificados quando este envio for confirmado."""
+        waiters = self._take_waiters(digest)
+        if waiters:
+            future.add_done_callback(lambda done: _settle(waiters, done.exception()))
+
+    def _close_current(self):
+        digest = self._current
+        self._current = None
+        if digest is None:
+            return
+        digest.closed = True
+        if digest.message_id is None:
+            # Encerrado sem nunca ter sido mostrado: o outbox tenta esses pedidos de novo
+            _settle(self._take_waiters(digest), RuntimeError("resumo encerrado antes do envio"))
+        if digest.message_id is not None:
+            self._publish(digest)
+            self._closed[digest.message_id] = digest
+            while len(self._closed) > ADMIN_DIGEST_KEEP:
+                self._closed.popitem(last=False)
+
+def _settle(waiters, error=None):
+    for waiter in waiters:
+        if waiter.done():
+            continue
+        if error is None:
+            waiter.set_result(None)
+        else:
+            waiter.set_exception(error)
+
+def _markup(keyboard):
+    """Converte as linhas de (rótulo, callback_data) em InlineKeyboardMarkup."""
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(label, callback_data=data) for label, data in row]
+        for row in keyboard
+    ])
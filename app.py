@@ -1,14 +1,85 @@
-from flask import Flask, render_template, jsonify
+from flask import Flask, Response, render_template, jsonify, request, stream_with_context
 import os
-from models import DataStore
+import json
+import gzip
+import time
+import hashlib
 from config import ADMIN_ID
+from metrics import registry
+from dashboard_source import DashboardData
+from order_export import export_filename, export_orders, parse_export_query
+from dashboard_query import (QueryError, page_orders, page_users, parse_order_query,
+                             parse_stats_query, parse_user_query, project)
+
+# Respostas JSON menores que isso não compensam a compressão
+GZIP_MIN_SIZE = 1024
+# Duração de uma conexão de /api/changes; o EventSource reconecta sozinho (segundos)
+CHANGES_STREAM_SECONDS = 300
+# Comentário enviado sem alterações para manter a conexão aberta em proxies (segundos)
+CHANGES_KEEPALIVE_SECONDS = 15
 
 # Create Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "secret-key")
 
-# Get data store
-data_store = DataStore()
+# The bot's data, read in place from its SQLite store (its JSON files before the first run)
+dashboard = DashboardData()
+
+def with_user(order_data, users=None):
+    """Embed the order's customer (users caches lookups within one response)"""
+    users = {} if users is None else users
+    user_id = order_data.get("user_id")
+    if user_id not in users:
+        users[user_id] = dashboard.source.get_user(user_id)
+    if users[user_id]:
+        order_data["user"] = users[user_id]
+    return order_data
+
+def api_response(build):
+    """JSON response for the current data, with a weak ETag and 304 when unchanged
+
+    The ETag comes from the change feed position and the query, so an
+    unchanged page is answered without being built. The payload carries
+    the change cursor to follow /api/changes from.
+    """
+    source = dashboard.source
+    source.refresh()
+    cursor = source.changes.cursor()
+    etag = hashlib.sha1(f"{cursor} {request.full_path}".encode()).hexdigest()[:20]
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        payload = build()
+        payload["change_cursor"] = cursor
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        response = app.response_class(body, mimetype="application/json")
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def change_payload(event):
+    data = dict(event["data"])
+    if event["kind"] == "order":
+        with_user(data)
+    return {"kind": event["kind"], "id": event["id"], "data": data}
+
+@app.errorhandler(QueryError)
+def query_error(error):
+    return jsonify({"error": str(error)}), 400
+
+@app.after_request
+def compress_response(response):
+    """Gzip JSON responses for clients that accept it"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype != "application/json" or "Content-Encoding" in response.headers):
+        return response
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE or "gzip" not in request.headers.get("Accept-Encoding", ""):
+        return response
+    response.set_data(gzip.compress(data, compresslevel=5))
+    response.headers["Content-Encoding"] = "gzip"
+    return response
 
 @app.route('/')
 def index():
@@ -17,34 +88,127 @@ def index():
 
 @app.route('/api/orders')
 def get_orders():
-    """Get all orders as JSON"""
-    orders = []
-    for order_id in data_store.orders:
-        order = data_store.orders[order_id]
-        user_id = order.user_id
-        user = data_store.get_user(user_id)
-        
-        order_data = order.to_dict()
-        if user:
-            order_data["user"] = user.to_dict()
-        
-        orders.append(order_data)
-    
-    return jsonify({"orders": orders})
+    """Get a page of orders as JSON
+
+    Query string: status (comma separated), user_id, since/until (AAAA-MM-DD),
+    cursor (from next_cursor), limit and fields (comma separated; "user" embeds the customer).
+    """
+    query = parse_order_query(request.args)
+
+    def build():
+        records = dashboard.source.iter_orders(statuses=query["statuses"], user_id=query["user_id"])
+        page, next_cursor = page_orders(records, query)
+        orders = []
+        users = {}  # só os clientes da página, uma vez cada
+        for order in page:
+            order_data = dict(order)
+            if query["fields"] is None or "user" in query["fields"]:
+                with_user(order_data, users)
+            orders.append(project(order_data, query["fields"]))
+        return {"orders": orders, "next_cursor": next_cursor}
+
+    return api_response(build)
 
 @app.route('/api/users')
 def get_users():
-    """Get all users as JSON"""
-    users = []
-    for user_id in data_store.users:
-        user = data_store.users[user_id]
-        users.append(user.to_dict())
-    
-    return jsonify({"users": users})
+    """Get a page of users as JSON (query string: q, cursor, limit and fields)"""
+    query = parse_user_query(request.args)
+
+    def build():
+        page, next_cursor = page_users(dashboard.source.iter_users(), query)
+        return {"users": [project(user, query["fields"]) for user in page],
+                "next_cursor": next_cursor}
+
+    return api_response(build)
+
+@app.route('/api/orders/export')
+def export_orders_file():
+    """Download orders as CSV or NDJSON, streamed as they are read
+
+    Query string: format (csv or ndjson), status (comma separated), user_id,
+    since/until (AAAA-MM-DD) and gzip=1.
+    """
+    query = parse_export_query(request.args)
+    orders = dashboard.source.iter_orders(statuses=query["statuses"], user_id=query["user_id"])
+    if query["gzip"]:
+        mimetype = "application/gzip"
+    else:
+        mimetype = "text/csv" if query["format"] == "csv" else "application/x-ndjson"
+    response = Response(stream_with_context(export_orders(orders, query)), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f'attachment; filename="{export_filename(query)}"'
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.route('/api/stats')
+def get_stats():
+    """Sales totals from the rollups as JSON
+
+    Query string: since/until (AAAA-MM-DD), status (comma separated),
+    product (repeatable) and group_by (comma separated: day, product, status).
+    Answered from the day × product × status buckets, not from the orders.
+    """
+    query = parse_stats_query(request.args)
+
+    def build():
+        rollup = dashboard.sales()
+        result = rollup.query(since=query["since"], until=query["until"], statuses=query["statuses"],
+                              products=query["products"], group_by=query["group_by"])
+        result["buckets"] = rollup.bucket_count()
+        return result
+
+    return api_response(build)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text metrics of this process (includes the bot's when it runs here)"""
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/api/changes')
+def get_changes():
+    """Order and user changes after a change cursor, as Server-Sent Events
+
+    The cursor comes from Last-Event-ID (sent by EventSource when it
+    reconnects) or ?since= (the change_cursor of a snapshot). An unknown or
+    too old cursor gets a "reset" event: the client reloads the snapshot.
+    With ?format=json it long-polls instead and returns the changes as JSON
+    (409 when the snapshot must be reloaded).
+    """
+    feed = dashboard.source.changes
+    seq = feed.parse_cursor(request.headers.get("Last-Event-ID") or request.args.get("since"))
+
+    if request.args.get("format") == "json":
+        events = feed.wait(seq, CHANGES_KEEPALIVE_SECONDS) if seq is not None else None
+        if events is None:
+            return jsonify({"error": "cursor expirado", "change_cursor": feed.cursor()}), 409
+        return jsonify({
+            "changes": [change_payload(event) for event in events],
+            "change_cursor": feed.cursor(events[-1]["seq"] if events else seq),
+        })
+
+    def stream(seq):
+        yield "retry: 2000\n\n"
+        deadline = time.monotonic() + CHANGES_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            events = feed.wait(seq, CHANGES_KEEPALIVE_SECONDS) if seq is not None else None
+            if events is None:
+                yield f"event: reset\ndata: {json.dumps({'change_cursor': feed.cursor()})}\n\n"
+                return
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for event in events:
+                data = json.dumps(change_payload(event), ensure_ascii=False, separators=(",", ":"))
+                yield f"id: {feed.cursor(event['seq'])}\nevent: {event['kind']}\ndata: {data}\n\n"
+            seq = events[-1]["seq"]
+
+    response = Response(stream_with_context(stream(seq)), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # nginx: não acumular os eventos
+    return response
 
 if __name__ == '__main__':
     # Create data directory if it doesn't exist
     os.makedirs("data", exist_ok=True)
-    
+
     # Run Flask app
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000, debug=True)
@@ -33,9 +33,12 @@ from handlers.products_admin import (
 from handlers.registration import start, handle_name, handle_phone, cancel
 from models import db
 from utils import MAIN_KEYBOARD, ADMIN_KEYBOARD
+from instrumentation import METRICS_PORT, instrument_bot_api, instrument_dispatcher, start_metrics_server
+from update_watchdog import watchdog
+from log_setup import setup_logging
 
 # Set up logging
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # States for registration
@@ -149,6 +152,10 @@ class TelegramBot:
         # Error handler
         self.dispatcher.add_error_handler(self._error_handler)
 
+        # Latency, error and in-flight metrics for every handler registered above
+        instrument_dispatcher(self.dispatcher)
+        instrument_bot_api()
+
     def _help_command(self, update, context):
         """Send help information"""
         user_id = update.effective_user.id
@@ -205,5 +212,8 @@ class TelegramBot:
     def run(self):
         """Start the bot"""
         logger.info("Starting bot polling...")
+        watchdog.start()
+        if METRICS_PORT:
+            start_metrics_server(METRICS_PORT)
         self.updater.start_polling()
         self.updater.idle()
\ No newline at end of file
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import re
 import json
+import hashlib
 import logging
 import os
 import time
@@ -9,20 +11,20 @@ import uuid
 import sys
 import io
 import signal
+import threading
 import requests
+from queue import Queue
 import subprocess
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from log_setup import setup_logging
 
 # Importações locais (serão resolvidas após a definição do logger)
 # Essas importações serão tratadas mais adiante no código
 git_manager = None
 catalog_manager = None
 
-# Configuração inicial de logging básico para permitir logs antes da configuração completa
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Logging centralizado: fila com escritor em segundo plano (ver log_setup)
+setup_logging()
 logger = logging.getLogger('bot')
 
 try:
@@ -42,19 +44,20 @@ try:
         sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
         logger.info("Configuração de codificação UTF-8 aplicada aos streams de saída")
 except Exception as e:
-    logger.warning(f"Não foi possível configurar encoding UTF-8 para saída: {e}")
+    logger.warning("Não foi possível configurar encoding UTF-8 para saída: %s", e)
     logger.warning("Caracteres especiais podem não ser exibidos corretamente")
 
 # Carregar variáveis de ambiente do arquivo .env se existir
 load_dotenv()
 
 try:
-    import mercadopago
     from telegram import (InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton,
                         ReplyKeyboardMarkup, Update)
+    from telegram.error import BadRequest
     from telegram.ext import (CallbackContext, CallbackQueryHandler,
-                            CommandHandler, ConversationHandler, Filters,
-                            MessageHandler, Updater)
+                            CommandHandler, ConversationHandler, Dispatcher, DispatcherHandlerStop,
+                            ExtBot, Filters, JobQueue, MessageHandler, TypeHandler, Updater)
+    from telegram.utils.request import Request
 except ImportError as e:
     print(f"Erro ao importar dependências: {e}")
     print("Por favor, instale as dependências com: pip install -r requirements_render.txt")
@@ -123,7 +126,7 @@ try:
     import catalog_manager
     logger.info("Módulos de gerenciamento de Git e catálogo importados com sucesso")
 except ImportError as e:
-    logger.warning(f"Não foi possível importar módulos de Git/catálogo/GitHub: {e}")
+    logger.warning("Não foi possível importar módulos de Git/catálogo/GitHub: %s", e)
     # Definir funções dummy para não quebrar o código
     class DummyManager:
         @staticmethod
@@ -155,8 +158,116 @@ except ImportError as e:
     if catalog_manager is None:
         catalog_manager = DummyManager()
 
-# Inicializar cliente Mercado Pago
-mp = mercadopago.SDK(MERCADO_PAGO_TOKEN)
+# Acesso ao Mercado Pago protegido por circuit breaker e retentativas limitadas
+from circuit_breaker import OPEN as CIRCUIT_OPEN
+from payment_gateway import (PaymentGateway, PaymentUnavailableError,
+                             create_sdk, payment_error_message)
+
+# Inicializar cliente Mercado Pago (MERCADO_PAGO_BASE_URL permite usar o servidor falso)
+mp = create_sdk(MERCADO_PAGO_TOKEN)
+payment_gateway = PaymentGateway(mp)
+
+# Agenda de expiração de pedidos não pagos e carrinhos abandonados
+from expiry_scheduler import ExpiryScheduler
+
+# Outbox persistente das notificações de mudança de estado dos pedidos
+from outbox import Outbox, OUTBOX_INTERVAL, PermanentDeliveryError
+
+# Imagens de QR Code PIX
+from pix_qr import pix_qr_image
+
+# Idempotência do checkout (evita pedidos e cobranças PIX duplicadas)
+from payment_idempotency import (IDEMPOTENCY_WINDOW, build_request_options,
+                                 cart_fingerprint, checkout_locks)
+
+# Modo multiprocesso (BOT_WORKERS > 1): um processo de ingestão distribui os updates
+# por usuário entre workers; pedidos e usuários ficam em um SQLite compartilhado
+from sharding import (BOT_WORKERS, IS_INGEST, IS_WORKER, WORKER_CHECK_INTERVAL, WORKER_INDEX,
+                      ShardRouter, adopt_legacy_file, owns_user,
+                      serve_updates, shard_of, shard_path, worker_share)
+from shared_store import SharedStore
+
+# Latência por handler, chamadas à Bot API e gravações em disco, expostas em /metrics
+from instrumentation import (METRICS_PORT, instrument_bot_api, instrument_dispatcher,
+                             start_metrics_server, store_flush_histogram)
+from update_watchdog import watchdog
+from profiler import PROFILE_MAX_SECONDS, install_signal_handler, profile_in_background
+instrument_bot_api()
+
+# Fila de saída com prioridade e limites de taxa para avisos fora do fluxo de resposta
+# (no modo multiprocesso o limite global é dividido entre os workers)
+from outbound_queue import OutboundQueue, OUTBOUND_GLOBAL_RATE, PRIORITY_CUSTOMER, PRIORITY_ADMIN
+outbound = OutboundQueue(global_rate=worker_share(OUTBOUND_GLOBAL_RATE))
+
+# Notificações do admin: individuais com pouco movimento, resumo editado em rajadas
+from admin_digest import AdminDigestNotifier, ADMIN_DIGEST_INTERVAL
+admin_digest = AdminDigestNotifier(outbound, ADMIN_ID)
+
+# Envio em massa retomável para todos os usuários cadastrados
+from broadcast import (BROADCAST_IDS_FILE, BROADCAST_STATE_FILE, BroadcastEngine,
+                       format_status as format_broadcast_status)
+
+def notify_broadcast_finished(state):
+    """Avisa o admin quando um broadcast termina"""
+    if ADMIN_ID:
+        outbound.send_message(chat_id=ADMIN_ID, text=format_broadcast_status(state), priority=PRIORITY_ADMIN)
+
+# Broadcasts são criados pelo admin: o worker dele assume um envio interrompido
+broadcaster = BroadcastEngine(
+    outbound,
+    state_file=adopt_legacy_file(BROADCAST_STATE_FILE, owner=shard_of(ADMIN_ID)),
+    ids_file=adopt_legacy_file(BROADCAST_IDS_FILE, owner=shard_of(ADMIN_ID)),
+    on_finish=notify_broadcast_finished
+)
+
+# Offset de updates persistido: deploys não descartam nem repetem toques dos clientes
+from update_offset import UpdateOffsetTracker, catch_up, updates_counter
+update_tracker = UpdateOffsetTracker()
+ALLOWED_UPDATES = ['message', 'callback_query', 'chat_member']
+UPDATE_OFFSET_SAVE_INTERVAL = 5
+
+# Eleição de líder: só o detentor do lease faz polling (evita "terminated by other
+# getUpdates request"); as outras instâncias ficam em espera para assumir
+from leader_lease import LeaderLease, create_lease_store
+
+# Passagem de bastão em reinícios: o processo novo assume sem perder updates
+# nem as verificações de pagamento em andamento
+from handoff import HandoffChannel, InflightWork, HANDOFF_DRAIN_SECONDS
+handoff = HandoffChannel()
+payment_checks = InflightWork("payment_checks")
+
+# Sessões (user_data e conversas) gravadas de forma incremental em data/sessions.jsonl
+from session_persistence import (JournalPersistence, SESSIONS_FILE, SESSION_FLUSH_INTERVAL,
+                                 SESSION_CONVERSATION_TIMEOUT)
+session_store = JournalPersistence(shard_path(SESSIONS_FILE))
+SESSION_EVICT_INTERVAL = 60
+# Dados de fluxos interrompidos, removidos quando a sessão expira
+SESSION_FLOW_KEYS = ('admin_action', 'admin_category', 'admin_edit_field',
+                     'admin_product_index', 'product_temp')
+SESSION_EXPIRED_TEXT = (
+    "⌛ Sua sessão expirou por inatividade.\n\n"
+    "Use /start ou o menu abaixo para recomeçar."
+)
+# Botões cujos handlers dependem de dados da sessão ou do estado de uma conversa
+# (quantidade e carrinho do produto escolhido, passos do cadastro de produtos)
+SESSION_CALLBACKS = re.compile(
+    r'^(qty_|add_to_cart|back_to_products|admin_(cat_|prod_|add_|back_to_(?!pending)|cancel_add|'
+    r'type_|confirm_delete|edit_|delete_|set_discount_))'
+)
+
+def answer_query(query, *args, **kwargs):
+    """Answer a callback query, ignoring queries too old to be answered
+    
+    Callbacks from the backlog processed after a restart may have expired;
+    that must not interrupt the rest of the handler.
+    """
+    try:
+        return query.answer(*args, **kwargs)
+    except BadRequest as e:
+        if "query is too old" in str(e).lower() or "query id is invalid" in str(e).lower():
+            logger.debug("Callback %s expirado; resposta ignorada", query.id)
+            return False
+        raise
 
 # Configurar identidade Git para commits automáticos se estiver em um repositório Git
 try:
@@ -167,7 +278,7 @@ try:
         )
         logger.info("Identidade Git configurada para commits automáticos")
 except Exception as e:
-    logger.warning(f"Não foi possível configurar identidade Git: {e}")
+    logger.warning("Não foi possível configurar identidade Git: %s", e)
 
 # Teclado principal
 MAIN_KEYBOARD = ReplyKeyboardMarkup([
@@ -198,9 +309,6 @@ CONFIRM_DELETE = 6
 EDIT_PRODUCT_FIELD = 7
 EDIT_PRODUCT_VALUE = 8
 
-# Dados temporários para admin
-product_temp_data = {}
-
 # CLASSES DE MODELO
 
 class User:
@@ -238,16 +346,22 @@ class CartItem:
         )
 
 class Order:
-    def __init__(self, id, user_id, items, status="pendente", payment_id=None):
+    def __init__(self, id, user_id, items, status="pendente", payment_id=None, idempotency_key=None):
         self.id = id
         self.user_id = user_id
         self.items = [CartItem.from_dict(item) if isinstance(item, dict) else item for item in items]
         self.status = status
         self.payment_id = payment_id
         self.created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # Impressão digital do carrinho que originou o pedido (idempotência do checkout)
+        self.idempotency_key = idempotency_key
+        # Código PIX copia e cola, guardado para reexibir o pagamento sem nova cobrança
+        self.pix_code = None
+        # file_id do QR Code já enviado ao Telegram (reenvio sem novo upload)
+        self.qr_file_id = None
         
     def to_dict(self):
-        return {
+        data = {
             'id': self.id,
             'user_id': self.user_id,
             'items': [item.to_dict() for item in self.items],
@@ -255,78 +369,220 @@ class Order:
             'payment_id': self.payment_id,
             'created_at': self.created_at
         }
+        if self.idempotency_key:
+            data['idempotency_key'] = self.idempotency_key
+        if self.pix_code:
+            data['pix_code'] = self.pix_code
+        if self.qr_file_id:
+            data['qr_file_id'] = self.qr_file_id
+        return data
+        
+    def age_seconds(self):
+        """Tempo em segundos desde a criação do pedido"""
+        try:
+            created = datetime.strptime(self.created_at, "%Y-%m-%d %H:%M:%S")
+        except (TypeError, ValueError):
+            return float('inf')
+        return (datetime.now() - created).total_seconds()
         
     @classmethod
     def from_dict(cls, data):
-        return cls(
+        order = cls(
             id=data['id'],
             user_id=data['user_id'],
             items=data['items'],
             status=data.get('status', 'pendente'),
-            payment_id=data.get('payment_id')
+            payment_id=data.get('payment_id'),
+            idempotency_key=data.get('idempotency_key')
         )
+        # Preservar a data original do pedido ao recarregar do arquivo
+        if data.get('created_at'):
+            order.created_at = data['created_at']
+        order.pix_code = data.get('pix_code')
+        order.qr_file_id = data.get('qr_file_id')
+        return order
 
 class DataStore:
     """Handle in-memory data persistence for users, carts, and orders with file backup"""
     
-    def __init__(self):
+    def __init__(self, shared=None):
         self.users = {}  # user_id -> User
         self.carts = {}  # user_id -> [CartItem]
         self.orders = {}  # order_id -> Order
+        self.cart_versions = {}  # user_id -> versão do carrinho (microssegundos da última alteração)
+        self.orders_by_key = {}  # idempotency_key -> order_id
+        self._lock = threading.RLock()
+        self._listeners = []  # callbacks chamados a cada alteração (evento, dados)
         self.users_file = os.path.join("data", "users.json")
         self.orders_file = os.path.join("data", "orders.json")
-        self.carts_file = os.path.join("data", "carts.json")
+        # Cada worker do modo multiprocesso tem os carrinhos e o outbox dos seus usuários
+        self.carts_file = shard_path(os.path.join("data", "carts.json"))
+        # Versões gravadas junto com os carrinhos: a chave de idempotência de um
+        # carrinho não muda com um reinício nem se repete com outro conteúdo
+        self.cart_versions_file = shard_path(os.path.join("data", "cart_versions.json"))
+        # Notificações pendentes, gravadas junto com os dados
+        self.outbox = Outbox(adopt_legacy_file(os.path.join("data", "outbox.json")))
+        self._file_hashes = {}  # arquivo -> hash do conteúdo carregado
+        # Pedidos e usuários no SQLite compartilhado (modo multiprocesso) em vez dos JSON
+        self.shared = shared
+        self._synced_seq = {"orders": 0, "users": 0}  # última sequência lida do shared
         
         # Garantir que o diretório de dados existe
         os.makedirs("data", exist_ok=True)
         
         # Carregar dados salvos anteriormente, se existirem
         self._load_data()
+        self.outbox.load()
     
-    def _load_data(self):
-        """Carrega dados dos arquivos JSON"""
+    def _load_data(self, files=None):
+        """Carrega dados dos arquivos JSON (todos, ou só os indicados em files)"""
         try:
+            if self.shared:
+                self.sync()
+            
             # Carregar usuários
-            if os.path.exists(self.users_file):
-                with open(self.users_file, 'r', encoding='utf-8') as f:
-                    users_data = json.load(f)
-                    for user_id, user_data in users_data.items():
-                        self.users[int(user_id)] = User(
-                            int(user_id),
-                            user_data['nome'],
-                            user_data['telefone']
-                        )
-                logger.info(f"Carregados {len(self.users)} usuários do arquivo")
+            if not self.shared and os.path.exists(self.users_file) and (files is None or self.users_file in files):
+                users_data = self._read_json(self.users_file)
+                self.users = {}
+                for user_id, user_data in users_data.items():
+                    self.users[int(user_id)] = User(
+                        int(user_id),
+                        user_data['nome'],
+                        user_data['telefone']
+                    )
+                logger.info("Carregados %s usuários do arquivo", len(self.users))
             
             # Carregar carrinhos
-            if os.path.exists(self.carts_file):
-                with open(self.carts_file, 'r', encoding='utf-8') as f:
-                    carts_data = json.load(f)
-                    for user_id, cart_items in carts_data.items():
+            carts_file = self._carts_source()
+            if carts_file and (files is None or self.carts_file in files):
+                carts_data = self._read_json(carts_file)
+                self.carts = {}
+                for user_id, cart_items in carts_data.items():
+                    if owns_user(int(user_id)):
                         self.carts[int(user_id)] = [CartItem.from_dict(item) for item in cart_items]
-                logger.info(f"Carregados {len(self.carts)} carrinhos do arquivo")
+                versions = self._read_json(self.cart_versions_file) if os.path.exists(self.cart_versions_file) else {}
+                self.cart_versions = {
+                    user_id: int(versions.get(str(user_id)) or self._next_cart_version(user_id))
+                    for user_id in self.carts
+                }
+                logger.info("Carregados %s carrinhos do arquivo", len(self.carts))
             
             # Carregar pedidos
-            if os.path.exists(self.orders_file):
-                with open(self.orders_file, 'r', encoding='utf-8') as f:
-                    orders_data = json.load(f)
-                    for order_id, order_data in orders_data.items():
-                        self.orders[order_id] = Order.from_dict(order_data)
-                logger.info(f"Carregados {len(self.orders)} pedidos do arquivo")
+            if not self.shared and os.path.exists(self.orders_file) and (files is None or self.orders_file in files):
+                orders_data = self._read_json(self.orders_file)
+                self.orders = {}
+                self.orders_by_key = {}
+                for order_id, order_data in orders_data.items():
+                    order = Order.from_dict(order_data)
+                    self.orders[order_id] = order
+                    if order.idempotency_key:
+                        self.orders_by_key[order.idempotency_key] = order_id
+                logger.info("Carregados %s pedidos do arquivo", len(self.orders))
         
         except Exception as e:
-            logger.error(f"Erro ao carregar dados: {e}")
+            logger.error("Erro ao carregar dados: %s", e)
+    
+    def _carts_source(self):
+        """Carts file to load: this worker's own, or on its first run the single-process one"""
+        if os.path.exists(self.carts_file):
+            return self.carts_file
+        legacy_file = os.path.join("data", "carts.json")
+        if legacy_file != self.carts_file and os.path.exists(legacy_file):
+            return legacy_file
+        return None
+    
+    def sync(self):
+        """Apply the orders and users other processes wrote to the shared store
+        
+        Only rows written since the previous call are read, so calling this
+        before every lookup is cheap.
+        """
+        if not self.shared:
+            return 0
+        with self._lock:
+            orders, self._synced_seq["orders"] = self.shared.changes("orders", self._synced_seq["orders"])
+            for data in orders:
+                order = Order.from_dict(data)
+                self._cache_order(order)
+                self._emit("order_synced", order=order)
+            users, self._synced_seq["users"] = self.shared.changes("users", self._synced_seq["users"])
+            for data in users:
+                self.users[int(data['id'])] = User(int(data['id']), data['nome'], data['telefone'])
+            return len(orders) + len(users)
+    
+    def _cache_order(self, order):
+        self.orders[order.id] = order
+        if order.idempotency_key:
+            self.orders_by_key[order.idempotency_key] = order.id
+    
+    def _read_json(self, path):
+        """Read a JSON file, remembering the hash of its content"""
+        with open(path, 'rb') as f:
+            raw = f.read()
+        self._file_hashes[path] = hashlib.sha1(raw).hexdigest()
+        return json.loads(raw)
+    
+    def _file_changed(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return hashlib.sha1(f.read()).hexdigest() != self._file_hashes.get(path)
+        except OSError:
+            return False
+    
+    def refresh(self):
+        """Reload only the files another process changed since they were loaded
+        
+        Used after a state handoff: the snapshot loaded at startup is kept and
+        only what the previous process wrote afterwards is parsed again.
+        """
+        with self._lock:
+            files = (self.carts_file,) if self.shared else (self.users_file, self.carts_file, self.orders_file)
+            changed = [path for path in files if self._file_changed(path)]
+            self.sync()
+            if changed:
+                self._load_data(files=changed)
+            self.outbox.load()
+            return changed
+    
+    def flush(self):
+        """Write all data to disk now"""
+        self._save_data()
     
+    def add_listener(self, callback):
+        """Register a callback(event, data) for store changes
+        
+        Callbacks run inside the store lock, after the change is applied and
+        before it is written, so anything they record goes in the same write.
+        """
+        self._listeners.append(callback)
+        
+    def _emit(self, event, **data):
+        """Notify listeners about a change"""
+        for callback in self._listeners:
+            try:
+                callback(event, data)
+            except Exception as e:
+                logger.error("Erro no listener do evento %s: %s", event, e)
+        
     def _save_data(self):
         """Salva todos os dados em arquivos JSON"""
+        with self._lock, store_flush_histogram.time(store="data"):
+            self._write_files()
+        
+    def _write_files(self):
         try:
-            # Salvar usuários
-            users_data = {}
-            for user_id, user in self.users.items():
-                users_data[str(user_id)] = user.to_dict()
+            # Salvar outbox primeiro: uma notificação sem a transição gravada é
+            # descartada na entrega, mas uma transição sem notificação se perderia
+            self.outbox.save()
             
-            with open(self.users_file, 'w', encoding='utf-8') as f:
-                json.dump(users_data, f, ensure_ascii=False, indent=2)
+            # Salvar usuários (no modo compartilhado cada alteração já foi gravada no SQLite)
+            if not self.shared:
+                users_data = {}
+                for user_id, user in self.users.items():
+                    users_data[str(user_id)] = user.to_dict()
+                
+                with open(self.users_file, 'w', encoding='utf-8') as f:
+                    json.dump(users_data, f, ensure_ascii=False, indent=2)
             
             # Salvar carrinhos
             carts_data = {}
@@ -335,86 +591,450 @@ class DataStore:
             
             with open(self.carts_file, 'w', encoding='utf-8') as f:
                 json.dump(carts_data, f, ensure_ascii=False, indent=2)
+            with open(self.cart_versions_file, 'w', encoding='utf-8') as f:
+                json.dump({str(user_id): version for user_id, version in self.cart_versions.items()}, f)
             
             # Salvar pedidos
-            orders_data = {}
-            for order_id, order in self.orders.items():
-                orders_data[order_id] = order.to_dict()
-            
-            with open(self.orders_file, 'w', encoding='utf-8') as f:
-                json.dump(orders_data, f, ensure_ascii=False, indent=2)
+            if not self.shared:
+                orders_data = {}
+                for order_id, order in self.orders.items():
+                    orders_data[order_id] = order.to_dict()
+                
+                with open(self.orders_file, 'w', encoding='utf-8') as f:
+                    json.dump(orders_data, f, ensure_ascii=False, indent=2)
             
             logger.info("Dados salvos em arquivos com sucesso")
             
         except Exception as e:
-            logger.error(f"Erro ao salvar dados: {e}")
+            logger.error("Erro ao salvar dados: %s", e)
         
     def save_user(self, user_id, name, phone):
         """Save user information"""
-        self.users[user_id] = User(user_id, name, phone)
-        # Salvar imediatamente
-        self._save_data()
-        return self.users[user_id]
+        with self._lock:
+            self.users[user_id] = User(user_id, name, phone)
+            if self.shared:
+                self.shared.put_user(self.users[user_id].to_dict())
+            self._emit("user_saved", user=self.users[user_id])
+            # Salvar imediatamente
+            self._save_data()
+            return self.users[user_id]
         
     def get_user(self, user_id):
         """Get user by ID"""
+        self.sync()
         return self.users.get(user_id)
+    
+    def user_count(self):
+        """Number of registered users"""
+        self.sync()
+        return len(self.users)
+    
+    def iter_user_ids(self):
+        """Iterate over registered user IDs (snapshot, without touching the User objects)"""
+        with self._lock:
+            self.sync()
+            user_ids = list(self.users.keys())
+        return iter(user_ids)
         
     def add_to_cart(self, user_id, item):
         """Add item to user's cart"""
-        if user_id not in self.carts:
-            self.carts[user_id] = []
-            
-        # Convert dict to CartItem if needed
-        if isinstance(item, dict):
-            item = CartItem.from_dict(item)
-            
-        self.carts[user_id].append(item)
-        # Salvar imediatamente
-        self._save_data()
-        return self.carts[user_id]
+        with self._lock:
+            if user_id not in self.carts:
+                self.carts[user_id] = []
+                
+            # Convert dict to CartItem if needed
+            if isinstance(item, dict):
+                item = CartItem.from_dict(item)
+                
+            self.carts[user_id].append(item)
+            self.cart_versions[user_id] = self._next_cart_version(user_id)
+            self._emit("cart_changed", user_id=user_id)
+            # Salvar imediatamente
+            self._save_data()
+            return self.carts[user_id]
         
     def get_cart(self, user_id):
         """Get user's cart"""
         return self.carts.get(user_id, [])
         
+    def get_cart_version(self, user_id):
+        """Get the version of the user's cart (changes on every cart change)"""
+        return self.cart_versions.get(user_id, 0)
+        
+    def _next_cart_version(self, user_id):
+        # Relógio em microssegundos, sempre crescente por usuário: não se repete
+        # depois de um reinício, de uma passagem de bastão ou de um carrinho removido
+        return max(time.time_ns() // 1000, self.cart_versions.get(user_id, 0) + 1)
+        
     def clear_cart(self, user_id):
         """Clear user's cart"""
-        self.carts[user_id] = []
-        # Salvar imediatamente
-        self._save_data()
-        
-    def create_order(self, user_id, cart_items, payment_id=None):
+        with self._lock:
+            self.carts[user_id] = []
+            self.cart_versions[user_id] = self._next_cart_version(user_id)
+            self._emit("cart_changed", user_id=user_id)
+            # Salvar imediatamente
+            self._save_data()
+            
+    def evict_carts(self, user_ids):
+        """Remove idle carts in a single write"""
+        with self._lock:
+            evicted = [user_id for user_id in user_ids if self.carts.pop(user_id, None) is not None]
+            for user_id in evicted:
+                self.cart_versions.pop(user_id, None)
+            if evicted:
+                self._emit("carts_evicted", user_ids=evicted)
+                self._save_data()
+            return evicted
+        
+    def create_order(self, user_id, cart_items, payment_id=None, idempotency_key=None):
         """Create a new order"""
-        order_id = str(uuid.uuid4().hex[:8])  # Generate unique order ID
-        order = Order(order_id, user_id, cart_items, payment_id=payment_id)
-        self.orders[order_id] = order
-        # Salvar imediatamente
-        self._save_data()
-        return order
+        with self._lock:
+            order_id = str(uuid.uuid4().hex[:8])  # Generate unique order ID
+            order = Order(order_id, user_id, cart_items, payment_id=payment_id, idempotency_key=idempotency_key)
+            self._cache_order(order)
+            if self.shared:
+                self.shared.put_order(order.to_dict())
+            self._emit("order_created", order=order)
+            # Salvar imediatamente
+            self._save_data()
+            return order
+        
+    def find_reusable_order(self, idempotency_key, window):
+        """Get the pending order created for the same cart within the window"""
+        self.sync()
+        order = self.orders.get(self.orders_by_key.get(idempotency_key))
+        if order and order.status == "pendente" and order.age_seconds() <= window:
+            return order
+        return None
+        
+    def find_recent_checkout(self, user_id, window):
+        """Get the user's latest pending order that already has a PIX charge"""
+        recent = [
+            order for order in self.get_user_orders(user_id)
+            if order.status == "pendente" and order.payment_id and order.pix_code
+            and order.idempotency_key and order.age_seconds() <= window
+        ]
+        if not recent:
+            return None
+        return max(recent, key=lambda order: order.created_at)
         
     def get_order(self, order_id):
         """Get order by ID"""
+        self.sync()
         return self.orders.get(order_id)
         
-    def update_order_status(self, order_id, status, payment_id=None):
-        """Update order status and optionally payment_id"""
-        order = self.get_order(order_id)
-        if order:
+    def _change_orders(self, order_ids, change):
+        """Apply change(order) to the orders and persist those it returns True for
+        
+        In the shared store the change runs on the latest version of each
+        order inside a write transaction, so a transition raced by another
+        process is applied only once.
+        """
+        with self._lock:
+            if not self.shared:
+                changed = [order for order in map(self.get_order, order_ids) if order and change(order)]
+                if changed:
+                    # Salvar imediatamente
+                    self._save_data()
+                return changed
+            
+            changed = []
+            def apply(data):
+                order = Order.from_dict(data)
+                if not change(order):
+                    return None
+                self._cache_order(order)
+                changed.append(order)
+                return order.to_dict()
+            
+            try:
+                # Outbox gravado antes do commit, como no modo de arquivos
+                self.shared.update_orders(order_ids, apply, before_commit=self.outbox.save)
+            except Exception as e:
+                logger.error("Erro ao salvar pedidos: %s", e)
+                # Descartar do cache as alterações que não foram gravadas
+                self._synced_seq["orders"] = 0
+                self.sync()
+                return []
+            return changed
+        
+    def update_order_status(self, order_id, status, payment_id=None, pix_code=None):
+        """Update order status and optionally payment_id and PIX code"""
+        def change(order):
+            previous_status = order.status
             order.status = status
             if payment_id:
                 order.payment_id = payment_id
-            # Salvar imediatamente
-            self._save_data()
-            return order
-        return None
+            if pix_code:
+                order.pix_code = pix_code
+            self._emit("order_status", order=order, previous_status=previous_status)
+            return True
+        changed = self._change_orders([order_id], change)
+        return changed[0] if changed else None
+        
+    def expire_orders(self, order_ids, status="expirado"):
+        """Move still-pending orders to the expired status in a single write"""
+        def change(order):
+            if order.status != "pendente":
+                return False
+            order.status = status
+            self._emit("order_status", order=order, previous_status="pendente")
+            return True
+        return self._change_orders(order_ids, change)
+        
+    def set_order_qr_file_id(self, order_id, file_id):
+        """Cache the Telegram file_id of the order's PIX QR Code"""
+        def change(order):
+            if order.qr_file_id == file_id:
+                return False
+            order.qr_file_id = file_id
+            return True
+        self._change_orders([order_id], change)
+        return self.get_order(order_id)
         
     def get_user_orders(self, user_id):
         """Get all orders for a user"""
+        self.sync()
         return [order for order in self.orders.values() if order.user_id == user_id]
+    
+    def all_orders(self):
+        """Snapshot of all orders"""
+        with self._lock:
+            self.sync()
+            return list(self.orders.values())
+
+# Pedidos e usuários sempre no SQLite (também com um único processo, para o painel
+# e a exportação lerem o banco); os JSON antigos só são importados na primeira execução
+shared_store = SharedStore()
+shared_store.import_json(os.path.join("data", "orders.json"), os.path.join("data", "users.json"))
 
 # Inicializar armazenamento de dados
-db = DataStore()
+db = DataStore(shared=shared_store)
+
+# EXPIRAÇÃO DE PEDIDOS E CARRINHOS
+
+# Pedidos PIX não pagos e carrinhos parados expiram para não acumular em memória e no disco
+ORDER_EXPIRY_SECONDS = int(os.getenv("ORDER_EXPIRY_MINUTES", "60")) * 60
+CART_EXPIRY_SECONDS = int(os.getenv("CART_EXPIRY_HOURS", "72")) * 3600
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", "500"))
+EXPIRY_CHECK_INTERVAL = int(os.getenv("EXPIRY_CHECK_INTERVAL", "60"))
+EXPIRY_NOTIFY_CUSTOMER = os.getenv("EXPIRY_NOTIFY_CUSTOMER", "false").lower() == "true"
+# Adiamento quando não é possível confirmar o pagamento antes de expirar
+EXPIRY_RETRY_SECONDS = 300
+
+expiry_scheduler = ExpiryScheduler(adopt_legacy_file(os.path.join("data", "expiry_schedule.json")))
+
+def track_expiry(event, data):
+    """Keep the expiry schedule in sync with store changes"""
+    if event == "order_created":
+        order = data["order"]
+        if order.status == "pendente":
+            expiry_scheduler.schedule(f"order:{order.id}", time.time() + ORDER_EXPIRY_SECONDS)
+    elif event == "order_status":
+        order = data["order"]
+        if order.status != "pendente":
+            expiry_scheduler.cancel(f"order:{order.id}")
+    elif event == "cart_changed":
+        expiry_scheduler.schedule(f"cart:{data['user_id']}", time.time() + CART_EXPIRY_SECONDS)
+    elif event == "carts_evicted":
+        for user_id in data["user_ids"]:
+            expiry_scheduler.cancel(f"cart:{user_id}")
+
+def reconcile_expiry_schedule():
+    """Load the saved schedule and add entries it does not know about"""
+    expiry_scheduler.load()
+    now = time.time()
+    
+    for order in db.all_orders():
+        key = f"order:{order.id}"
+        # Cada worker agenda só os pedidos dos seus usuários
+        if order.status == "pendente" and key not in expiry_scheduler and owns_user(order.user_id):
+            age = order.age_seconds()
+            created = now - age if age != float('inf') else now
+            expiry_scheduler.schedule(key, created + ORDER_EXPIRY_SECONDS)
+    
+    for user_id in db.carts:
+        key = f"cart:{user_id}"
+        if key not in expiry_scheduler:
+            expiry_scheduler.schedule(key, now + CART_EXPIRY_SECONDS)
+    
+    expiry_scheduler.save()
+    logger.info("Agenda de expiração com %s entradas", len(expiry_scheduler))
+
+def expire_stale_entries(context: CallbackContext):
+    """Expire due orders and carts in batches (job queue callback)"""
+    due = expiry_scheduler.pop_due(limit=EXPIRY_BATCH_SIZE)
+    if not due:
+        expiry_scheduler.save()
+        return
+    
+    order_ids = [key.split(":", 1)[1] for key in due if key.startswith("order:")]
+    cart_user_ids = [int(key.split(":", 1)[1]) for key in due if key.startswith("cart:")]
+    
+    to_expire = []
+    for order_id in order_ids:
+        order = db.get_order(order_id)
+        if not order or order.status != "pendente":
+            continue
+        
+        # Confirmar com o provedor antes de expirar um pedido que pode ter sido pago
+        if order.payment_id:
+            try:
+                result = payment_gateway.get_payment(order.payment_id)
+            except PaymentUnavailableError as e:
+                logger.warning("Expiração do pedido %s adiada: %s", order_id, e)
+                expiry_scheduler.schedule(f"order:{order_id}", time.time() + EXPIRY_RETRY_SECONDS)
+                continue
+            
+            payment_status = (result.get("response") or {}).get("status") if result.get("status") == 200 else None
+            if payment_status == "approved":
+                logger.info("Pedido %s estava pago; marcando como pago em vez de expirar", order_id)
+                db.update_order_status(order_id, "pago")
+                continue
+            if payment_status in ("in_process", "authorized"):
+                expiry_scheduler.schedule(f"order:{order_id}", time.time() + EXPIRY_RETRY_SECONDS)
+                continue
+        
+        to_expire.append(order_id)
+    
+    # Uma única gravação por lote
+    expired = db.expire_orders(to_expire)
+    evicted = db.evict_carts(cart_user_ids)
+    expiry_scheduler.save()
+    
+    if expired or evicted:
+        logger.info("Expiração: %s pedidos expirados, %s carrinhos removidos", len(expired), len(evicted))
+
+db.add_listener(track_expiry)
+
+# OUTBOX DE NOTIFICAÇÕES
+
+# Notificações geradas por cada transição de status: (tipo, status esperado na entrega)
+ORDER_STATUS_NOTIFICATIONS = {
+    "pago": ["admin_new_order"],
+    "entregue": ["customer_delivered"],
+    "cancelado": ["customer_cancelled"],
+    "expirado": ["customer_expired"] if EXPIRY_NOTIFY_CUSTOMER else [],
+}
+
+def enqueue_order_notifications(event, data):
+    """Record the notifications of an order transition in the outbox (same write)"""
+    if event != "order_status":
+        return
+    order, previous_status = data["order"], data["previous_status"]
+    
+    if order.status == previous_status:
+        # PIX gerado para o pedido: avisar o admin uma única vez
+        if order.status == "pendente" and order.payment_id and ADMIN_ID:
+            db.outbox.add("admin_new_order", f"admin_new_order:{order.id}:pendente",
+                          {"order_id": order.id, "status": "pendente"})
+        return
+    
+    for kind in ORDER_STATUS_NOTIFICATIONS.get(order.status, []):
+        if kind.startswith("admin_") and not ADMIN_ID:
+            continue
+        db.outbox.add(kind, f"{kind}:{order.id}:{order.status}", {"order_id": order.id, "status": order.status})
+
+def _outbox_order(payload):
+    """Get the order of a notification, or fail permanently if it changed since"""
+    order = db.get_order(payload["order_id"])
+    if not order:
+        raise PermanentDeliveryError(f"pedido {payload['order_id']} não encontrado")
+    if order.status != payload["status"]:
+        raise PermanentDeliveryError(
+            f"pedido {order.id} mudou de {payload['status']} para {order.status}"
+        )
+    return order
+
+def deliver_admin_new_order(payload):
+    order = _outbox_order(payload)
+    user = db.get_user(order.user_id)
+    if not user:
+        raise PermanentDeliveryError(f"cliente do pedido {order.id} não encontrado")
+    return notify_admin_new_order(order, user)
+
+def deliver_customer_message(title, body):
+    """Build an outbox handler that sends a Markdown notice to the order's customer"""
+    def deliver(payload):
+        order = _outbox_order(payload)
+        return outbound.send_message(
+            chat_id=order.user_id,
+            text=f"{title}\n\n" + body.format(order_id=order.id),
+            parse_mode="Markdown",
+            priority=PRIORITY_CUSTOMER
+        )
+    return deliver
+
+OUTBOX_HANDLERS = {
+    "admin_new_order": deliver_admin_new_order,
+    "customer_delivered": deliver_customer_message(
+        "✅ *Pedido Entregue!*",
+        "Seu pedido #{order_id} foi marcado como ENTREGUE.\n\nObrigado por comprar conosco!"
+    ),
+    "customer_cancelled": deliver_customer_message(
+        "❌ *Pedido Cancelado*",
+        "Infelizmente seu pedido #{order_id} foi cancelado.\n\nEntre em contato conosco para mais informações."
+    ),
+    "customer_expired": deliver_customer_message(
+        "⌛ *Pedido Expirado*",
+        "Seu pedido #{order_id} não foi pago a tempo e expirou.\n"
+        "Se ainda quiser os produtos, adicione-os novamente ao carrinho."
+    ),
+}
+
+def drain_outbox(context: CallbackContext):
+    """Deliver pending outbox notifications (job)"""
+    try:
+        db.outbox.drain(OUTBOX_HANDLERS)
+    except Exception as e:
+        logger.error("Erro ao entregar notificações do outbox: %s", e)
+
+db.add_listener(enqueue_order_notifications)
+
+# ESTATÍSTICAS DE VENDAS
+
+# Agregados por dia × produto × status: reconstruídos do histórico na partida e
+# atualizados a cada transição (inclusive as feitas por outros workers)
+from sales_stats import SalesRollup, format_summary as format_sales_summary
+sales_rollup = SalesRollup()
+sales_rollup.rebuild(db.all_orders())
+
+def track_sales(event, data):
+    """Keep the sales rollups in sync with order changes"""
+    if event in ("order_created", "order_status", "order_synced"):
+        sales_rollup.apply(data["order"])
+
+db.add_listener(track_sales)
+
+# ARQUIVO DE PEDIDOS ENCERRADOS
+
+# Pedidos encerrados vão para o arquivo colunar (relatórios: python order_archive.py);
+# cada worker arquiva os pedidos dos seus usuários. Requer numpy.
+import order_archive as order_archive_module
+from order_archive import OrderArchive, ARCHIVE_DIR, ARCHIVE_FLUSH_INTERVAL, CLOSED_STATUSES
+order_archive = OrderArchive(shard_path(ARCHIVE_DIR)) if order_archive_module.np is not None and not IS_INGEST else None
+if order_archive is None and not IS_INGEST:
+    logger.info("Pacote numpy não instalado; arquivo de pedidos encerrados desativado")
+
+def track_archive(event, data):
+    """Queue orders for the archive when they first reach a closed status"""
+    if event == "order_status" and data["order"].status in CLOSED_STATUSES \
+            and data["previous_status"] not in CLOSED_STATUSES:
+        order_archive.add(data["order"])
+
+def flush_order_archive(context=None):
+    """Append newly closed orders to the archive (job; also run on shutdown)"""
+    if order_archive is None:
+        return
+    try:
+        if not order_archive.reconciled:
+            order_archive.reconcile(order for order in db.all_orders() if owns_user(order.user_id))
+        order_archive.flush()
+    except Exception as e:
+        logger.error("Erro ao arquivar pedidos encerrados: %s", e)
+
+if order_archive is not None:
+    db.add_listener(track_archive)
 
 # FUNÇÕES UTILITÁRIAS
 
@@ -436,7 +1056,7 @@ def save_catalog_to_git():
         logger.info("Catálogo salvo com sucesso")
         return True
     except Exception as e:
-        logger.error(f"Erro ao salvar catálogo: {e}")
+        logger.error("Erro ao salvar catálogo: %s", e)
         return False
 
 def get_cart_total(cart_items):
@@ -465,7 +1085,7 @@ def format_cart_message(cart_items):
                 try:
                     item = CartItem.from_dict(item)
                 except Exception as e:
-                    logger.error(f"Erro ao converter item do carrinho: {e}")
+                    logger.error("Erro ao converter item do carrinho: %s", e)
                     continue
                     
             price = item.price
@@ -498,7 +1118,7 @@ def format_cart_message(cart_items):
             total += price
             
         except Exception as e:
-            logger.error(f"Erro ao formatar item do carrinho: {e}")
+            logger.error("Erro ao formatar item do carrinho: %s", e)
             # Tenta formatar item com informações mínimas para não quebrar todo o carrinho
             try:
                 message += f"{i}. Item (erro ao carregar detalhes)\n"
@@ -559,7 +1179,7 @@ def format_order_details(order, include_items=True):
                         try:
                             item = CartItem.from_dict(item)
                         except Exception as e:
-                            logger.error(f"Erro ao converter item do pedido: {e}")
+                            logger.error("Erro ao converter item do pedido: %s", e)
                             # Usar representação simplificada
                             message += f"{i}. Item (erro ao carregar detalhes)\n"
                             continue
@@ -576,7 +1196,7 @@ def format_order_details(order, include_items=True):
                     
                     message += f"{i}. {item.name} - R${item.price:.2f}{details}\n"
                 except Exception as e:
-                    logger.error(f"Erro ao formatar item do pedido: {e}")
+                    logger.error("Erro ao formatar item do pedido: %s", e)
                     # Tenta formatar item com informações mínimas para não quebrar todo o pedido
                     message += f"{i}. Item (erro ao carregar detalhes)\n"
             
@@ -588,7 +1208,7 @@ def format_order_details(order, include_items=True):
         
         return message
     except Exception as e:
-        logger.error(f"Erro ao formatar detalhes do pedido: {e}")
+        logger.error("Erro ao formatar detalhes do pedido: %s", e)
         # Retorna mensagem de erro como fallback
         return "❌ Não foi possível formatar os detalhes do pedido. Por favor, tente novamente."
 
@@ -606,12 +1226,12 @@ def start(update: Update, context: CallbackContext):
     
     # Check if user is already registered
     # Debug log
-    logger.info(f"Iniciando fluxo de registro para usuário {user_id}")
+    logger.info("Iniciando fluxo de registro para usuário %s", user_id)
     
     # Verifica se usuário já está registrado
     user = db.get_user(user_id)
     if user:
-        logger.info(f"Usuário {user_id} já registrado como {user.nome}")
+        logger.info("Usuário %s já registrado como %s", user_id, user.nome)
         update.message.reply_text(
             f"Olá, {user.nome}! O que você gostaria de fazer hoje?",
             reply_markup=MAIN_KEYBOARD
@@ -620,14 +1240,14 @@ def start(update: Update, context: CallbackContext):
     
     # Verificar se há dados na sessão atual que podem ser usados para registrar o usuário
     if 'name' in context.user_data and 'phone' in context.user_data:
-        logger.info(f"Dados de registro encontrados na sessão: {context.user_data['name']}, {context.user_data['phone']}")
+        logger.info("Dados de registro encontrados na sessão: %s, %s", context.user_data['name'], context.user_data['phone'])
         # Registrar usuário com dados da sessão
         user = db.save_user(
             user_id,
             context.user_data['name'],
             context.user_data['phone']
         )
-        logger.info(f"Usuário {user_id} registrado automaticamente com dados da sessão")
+        logger.info("Usuário %s registrado automaticamente com dados da sessão", user_id)
         update.message.reply_text(
             f"Bem-vindo de volta, {user.nome}! Você já está registrado.",
             reply_markup=MAIN_KEYBOARD
@@ -686,7 +1306,7 @@ def handle_phone(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
     
     # Debug log
-    logger.info(f"Registrando usuário {user_id} com nome={user_name}, telefone={phone}")
+    logger.info("Registrando usuário %s com nome=%s, telefone=%s", user_id, user_name, phone)
     
     # Store phone in user_data para persistência entre restarts
     context.user_data['phone'] = phone
@@ -694,16 +1314,16 @@ def handle_phone(update: Update, context: CallbackContext):
     # Verificar se usuário já existe
     existing_user = db.get_user(user_id)
     if existing_user:
-        logger.info(f"Usuário {user_id} já existe, atualizando informações")
+        logger.info("Usuário %s já existe, atualizando informações", user_id)
     
     # Save user info
     user = db.save_user(user_id, user_name, phone)
     
     # Verificar registro
     if user:
-        logger.info(f"Usuário {user_id} registrado com sucesso como {user.nome}, {user.telefone}")
+        logger.info("Usuário %s registrado com sucesso como %s, %s", user_id, user.nome, user.telefone)
     else:
-        logger.error(f"Falha ao registrar usuário {user_id}")
+        logger.error("Falha ao registrar usuário %s", user_id)
     
     update.message.reply_text(
         f"✅ *Registro concluído com sucesso!*\n\n"
@@ -738,7 +1358,7 @@ def menu_inicial(update: Update, context: CallbackContext):
         for key in keys_to_remove:
             context.user_data.pop(key, None)
             
-        logger.info(f"Menu inicial para usuário {user_id}, dados preservados na sessão: {context.user_data}")
+        logger.debug("Menu inicial para usuário %s, dados preservados na sessão: %s", user_id, context.user_data)
         user = db.get_user(user_id)
         
         if not user:
@@ -773,7 +1393,7 @@ def show_category(update: Update, context: CallbackContext):
     """Show products in selected category"""
     try:
         query = update.callback_query
-        query.answer()
+        answer_query(query)
         
         category = query.data.replace("category_", "")
         context.user_data['selected_category'] = category
@@ -815,7 +1435,7 @@ def select_product(update: Update, context: CallbackContext):
     """Handle product selection"""
     try:
         query = update.callback_query
-        query.answer()
+        answer_query(query)
         
         data = query.data
         user_id = query.from_user.id
@@ -837,7 +1457,7 @@ def select_product(update: Update, context: CallbackContext):
             product_index = int(data.replace("product_", ""))
         except ValueError:
             # Tratamento de callback_data inválido
-            logger.error(f"Callback data inválido: {data}")
+            logger.error("Callback data inválido: %s", data)
             query.edit_message_text(
                 "❌ Erro ao processar a seleção. Por favor, tente novamente usando o menu principal.",
                 reply_markup=InlineKeyboardMarkup([[
@@ -849,7 +1469,7 @@ def select_product(update: Update, context: CallbackContext):
         # Get category and product
         category = context.user_data.get('selected_category')
         if not category:
-            logger.warning(f"Categoria não encontrada no user_data para usuário {user_id}")
+            logger.warning("Categoria não encontrada no user_data para usuário %s", user_id)
             query.edit_message_text(
                 "❌ Erro: Sessão expirada ou categoria não encontrada. Por favor, selecione uma categoria novamente.",
                 reply_markup=InlineKeyboardMarkup([[
@@ -859,7 +1479,7 @@ def select_product(update: Update, context: CallbackContext):
             return
             
         if category not in PRODUCT_CATALOG:
-            logger.warning(f"Categoria inválida '{category}' para usuário {user_id}")
+            logger.warning("Categoria inválida '%s' para usuário %s", category, user_id)
             query.edit_message_text(
                 "❌ Erro: Categoria não disponível. Por favor, selecione uma categoria válida.",
                 reply_markup=InlineKeyboardMarkup([[
@@ -871,7 +1491,7 @@ def select_product(update: Update, context: CallbackContext):
         products = PRODUCT_CATALOG.get(category, [])
         
         if not products:
-            logger.warning(f"Categoria '{category}' sem produtos para usuário {user_id}")
+            logger.warning("Categoria '%s' sem produtos para usuário %s", category, user_id)
             query.edit_message_text(
                 "❌ Esta categoria não possui produtos no momento. Por favor, escolha outra categoria.",
                 reply_markup=InlineKeyboardMarkup([[
@@ -881,7 +1501,7 @@ def select_product(update: Update, context: CallbackContext):
             return
         
         if product_index >= len(products) or product_index < 0:
-            logger.warning(f"Índice de produto inválido {product_index} para usuário {user_id}")
+            logger.warning("Índice de produto inválido %s para usuário %s", product_index, user_id)
             query.edit_message_text(
                 "❌ Erro: Produto não encontrado. Por favor, selecione um produto válido.",
                 reply_markup=InlineKeyboardMarkup([[
@@ -1010,7 +1630,7 @@ def handle_quantity(update: Update, context: CallbackContext):
     """Handle credit quantity selection"""
     try:
         query = update.callback_query
-        query.answer()
+        answer_query(query)
         
         data = query.data
         
@@ -1208,7 +1828,7 @@ def continue_shopping(update: Update, context: CallbackContext):
                 )
             return
             
-        query.answer()
+        answer_query(query)
         
         action = query.data
         
@@ -1313,7 +1933,7 @@ def view_cart_callback(update: Update, context: CallbackContext):
     """Show user's shopping cart (triggered by callback button)"""
     try:
         query = update.callback_query
-        query.answer()
+        answer_query(query)
         
         user_id = query.from_user.id
         
@@ -1363,22 +1983,22 @@ def checkout(update: Update, context: CallbackContext):
     try:
         logger.info("Iniciando processo de checkout")
         query = update.callback_query
-        query.answer()
+        answer_query(query)
         
         user_id = query.from_user.id
-        logger.info(f"Processando checkout para usuário {user_id}")
+        logger.info("Processando checkout para usuário %s", user_id)
         
         # Verificar se o usuário está registrado
         user = db.get_user(user_id)
         if not user:
-            logger.warning(f"Usuário {user_id} não está registrado")
+            logger.warning("Usuário %s não está registrado", user_id)
             if 'name' in context.user_data and 'phone' in context.user_data:
-                logger.info(f"Criando usuário com dados da sessão: {context.user_data['name']}, {context.user_data['phone']}")
+                logger.info("Criando usuário com dados da sessão: %s, %s", context.user_data['name'], context.user_data['phone'])
                 try:
                     user = db.save_user(user_id, context.user_data['name'], context.user_data['phone'])
-                    logger.info(f"Usuário criado com sucesso: {user.nome}")
+                    logger.info("Usuário criado com sucesso: %s", user.nome)
                 except Exception as reg_error:
-                    logger.error(f"Erro ao salvar usuário: {reg_error}")
+                    logger.error("Erro ao salvar usuário: %s", reg_error)
             
             if not user:
                 query.edit_message_text(
@@ -1387,24 +2007,28 @@ def checkout(update: Update, context: CallbackContext):
                 )
                 return
         else:
-            logger.info(f"Usuário {user_id} encontrado: {user.nome}")
+            logger.info("Usuário %s encontrado: %s", user_id, user.nome)
         
         # Verificar carrinho
         cart_items = db.get_cart(user_id)
         if not cart_items:
-            logger.warning(f"Carrinho vazio para usuário {user_id}")
+            # Checkout repetido: deixar process_payment reexibir a cobrança já criada
+            if db.find_recent_checkout(user_id, IDEMPOTENCY_WINDOW):
+                return process_payment(update, context)
+            
+            logger.warning("Carrinho vazio para usuário %s", user_id)
             query.edit_message_text(
                 "❌ Seu carrinho está vazio. Adicione produtos antes de finalizar a compra."
             )
             return
         
-        logger.info(f"Carrinho do usuário {user_id} contém {len(cart_items)} itens")
+        logger.info("Carrinho do usuário %s contém %s itens", user_id, len(cart_items))
         
         # Verificar se todos os itens têm os campos necessários preenchidos
         incomplete_items = []
         for item in cart_items:
             product_name = item.name
-            logger.info(f"Verificando campos do produto: {product_name}")
+            logger.info("Verificando campos do produto: %s", product_name)
             
             for category, products in PRODUCT_CATALOG.items():
                 for product in products:
@@ -1413,21 +2037,21 @@ def checkout(update: Update, context: CallbackContext):
                         
                         # Verificar se todos os campos obrigatórios estão preenchidos
                         if not item.details.get('fields'):
-                            logger.warning(f"Produto {product_name} não tem 'fields' definido")
+                            logger.warning("Produto %s não tem 'fields' definido", product_name)
                             incomplete_items.append(product_name)
                             break
                             
                         item_fields = item.details['fields']
-                        logger.info(f"Campos preenchidos: {item_fields}")
+                        logger.debug("Campos preenchidos: %s", item_fields)
                         for field in required_fields:
                             if field not in item_fields:
-                                logger.warning(f"Campo {field} faltando para {product_name}")
+                                logger.warning("Campo %s faltando para %s", field, product_name)
                                 incomplete_items.append(product_name)
                                 break
         
         if incomplete_items:
             product_list = "\n".join([f"- {name}" for name in incomplete_items])
-            logger.warning(f"Produtos incompletos: {incomplete_items}")
+            logger.warning("Produtos incompletos: %s", incomplete_items)
             query.edit_message_text(
                 f"❌ Os seguintes produtos precisam de informações adicionais:\n\n"
                 f"{product_list}\n\n"
@@ -1446,12 +2070,12 @@ def checkout(update: Update, context: CallbackContext):
             logger.info("Chamando função process_payment")
             return process_payment(update, context)
         except Exception as payment_error:
-            logger.error(f"Erro ao processar pagamento: {payment_error}", exc_info=True)
+            logger.error("Erro ao processar pagamento: %s", payment_error, exc_info=True)
             query.edit_message_text(
                 "❌ Ocorreu um erro ao processar o pagamento. Por favor, tente novamente mais tarde."
             )
     except Exception as e:
-        logger.error(f"Erro durante checkout: {e}", exc_info=True)
+        logger.error("Erro durante checkout: %s", e, exc_info=True)
         try:
             update.callback_query.edit_message_text(
                 "❌ Ocorreu um erro ao finalizar a compra. Por favor, tente novamente."
@@ -1472,7 +2096,7 @@ def clear_cart(update: Update, context: CallbackContext):
                 )
             return
             
-        query.answer()
+        answer_query(query)
         
         user_id = query.from_user.id
         
@@ -1508,11 +2132,98 @@ def clear_cart(update: Update, context: CallbackContext):
 
 # HANDLERS DE PAGAMENTO
 
+def show_pix_payment(query, order):
+    """Show the PIX payment screen for an order"""
+    pix_copy_paste = order.pix_code or "Erro ao gerar código PIX. Entre em contato com o suporte."
+    
+    # Send payment message with PIX details
+    message = (
+        f"🧾 *Resumo do Pedido #{order.id}*\n\n"
+        f"{format_cart_message(order.items)}\n\n"
+        f"*PAGAMENTO VIA PIX*\n"
+        f"Copie o código abaixo para pagar via PIX:\n\n"
+        f"`{pix_copy_paste}`\n\n"
+        f"Abra seu aplicativo bancário, escolha a opção PIX > Copia e Cola, e cole o código acima.\n\n"
+        f"Após realizar o pagamento, clique no botão 'Verificar Pagamento' para confirmar."
+    )
+    
+    keyboard = [
+        [InlineKeyboardButton("🔍 Verificar Pagamento", callback_data=f"check_payment_{order.id}")]
+    ]
+    
+    query.edit_message_text(
+        message,
+        parse_mode="Markdown",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+def send_pix_qr(bot, chat_id, order, qr_code_base64=None):
+    """Send the PIX QR Code of an order as a photo
+    
+    Reuses the cached Telegram file_id when available; otherwise uploads the
+    image sent by Mercado Pago (or one rendered locally from the PIX code)
+    and caches the resulting file_id on the order.
+    """
+    caption = (
+        f"📱 *QR Code PIX - Pedido #{order.id}*\n\n"
+        f"Escaneie com o aplicativo do seu banco ou use o código copia e cola:\n\n"
+        f"`{order.pix_code}`"
+    ) if order.pix_code else f"📱 *QR Code PIX - Pedido #{order.id}*"
+    
+    if order.qr_file_id:
+        try:
+            bot.send_photo(chat_id=chat_id, photo=order.qr_file_id, caption=caption, parse_mode="Markdown")
+            return True
+        except Exception as e:
+            # file_id inválido ou expirado: enviar a imagem novamente
+            logger.warning("file_id do QR Code do pedido %s recusado: %s", order.id, e)
+    
+    image = pix_qr_image(qr_code_base64, order.pix_code)
+    if image is None:
+        logger.info("Sem imagem de QR Code para o pedido %s; apenas o código copia e cola foi enviado", order.id)
+        return False
+    
+    try:
+        message = bot.send_photo(chat_id=chat_id, photo=image, caption=caption, parse_mode="Markdown")
+    except Exception as e:
+        logger.error("Erro ao enviar QR Code do pedido %s: %s", order.id, e)
+        return False
+    
+    if message and message.photo:
+        db.set_order_qr_file_id(order.id, message.photo[-1].file_id)
+    return True
+
+def show_pix_qr_callback(update: Update, context: CallbackContext):
+    """Re-send the PIX QR Code of a pending order"""
+    try:
+        query = update.callback_query
+        order_id = query.data.split("_")[2]
+        user_id = query.from_user.id
+        
+        order = db.get_order(order_id)
+        if not order or order.user_id != user_id:
+            answer_query(query, "❌ Pedido não encontrado.", show_alert=True)
+            return
+        
+        if order.status != "pendente" or not order.pix_code:
+            answer_query(query, "Este pedido não possui pagamento PIX pendente.", show_alert=True)
+            return
+        
+        answer_query(query)
+        if not send_pix_qr(context.bot, query.message.chat_id, order):
+            context.bot.send_message(
+                chat_id=query.message.chat_id,
+                text=f"Código PIX copia e cola do pedido #{order.id}:\n\n`{order.pix_code}`",
+                parse_mode="Markdown"
+            )
+    except Exception as e:
+        log_error(e, "Error re-sending PIX QR Code")
+
 def process_payment(update: Update, context: CallbackContext):
     """Process payment using Mercado Pago"""
     try:
         query = update.callback_query
-        query.answer()
+        answer_query(query)
         
         user_id = query.from_user.id
         
@@ -1526,7 +2237,7 @@ def process_payment(update: Update, context: CallbackContext):
             return
         
         # Debug log para verificação
-        logger.info(f"Processando pagamento para user_id={user_id}, verificando registro")
+        logger.info("Processando pagamento para user_id=%s, verificando registro", user_id)
         
         try:
             # Check if user is registered
@@ -1534,27 +2245,27 @@ def process_payment(update: Update, context: CallbackContext):
             
             # Log para debug
             if user:
-                logger.info(f"Usuário {user_id} encontrado no banco de dados: {user.nome}, {user.telefone}")
+                logger.info("Usuário %s encontrado no banco de dados: %s, %s", user_id, user.nome, user.telefone)
             else:
-                logger.info(f"Usuário {user_id} não encontrado no banco de dados, verificando context.user_data")
-                logger.info(f"Context user_data: {context.user_data}")
+                logger.info("Usuário %s não encontrado no banco de dados, verificando context.user_data", user_id)
+                logger.debug("Context user_data: %s", context.user_data)
             
             # Tentar registrar o usuário automaticamente se tiver os dados na sessão
             if not user and 'name' in context.user_data and 'phone' in context.user_data:
-                logger.info(f"Registrando usuário {user_id} com dados da sessão atual: {context.user_data['name']}, {context.user_data['phone']}")
+                logger.info("Registrando usuário %s com dados da sessão atual: %s, %s", user_id, context.user_data['name'], context.user_data['phone'])
                 try:
                     user = db.save_user(
                         user_id,
                         context.user_data['name'],
                         context.user_data['phone']
                     )
-                    logger.info(f"Usuário registrado com sucesso: {user.nome}, {user.telefone}")
+                    logger.info("Usuário registrado com sucesso: %s, %s", user.nome, user.telefone)
                 except Exception as reg_error:
-                    logger.error(f"Erro ao registrar usuário com dados da sessão: {reg_error}")
+                    logger.error("Erro ao registrar usuário com dados da sessão: %s", reg_error)
                 
             # Se mesmo assim o usuário não estiver registrado
             if not user:
-                logger.warning(f"Usuário {user_id} não está registrado e não tem dados de registro na sessão")
+                logger.warning("Usuário %s não está registrado e não tem dados de registro na sessão", user_id)
                 query.edit_message_text(
                     "❌ Você precisa estar registrado para finalizar a compra.\n"
                     "Por favor, use o comando /start para se registrar."
@@ -1565,145 +2276,166 @@ def process_payment(update: Update, context: CallbackContext):
             cart_items = db.get_cart(user_id)
             
             if not cart_items:
-                logger.warning(f"Carrinho vazio para o usuário {user_id}")
+                # Toque duplo ou callback repetido: o carrinho já virou um pedido,
+                # então reexibimos a cobrança PIX existente em vez de recusar
+                recent_order = db.find_recent_checkout(user_id, IDEMPOTENCY_WINDOW)
+                if recent_order:
+                    logger.info("Checkout repetido do usuário %s, reexibindo pedido %s", user_id, recent_order.id)
+                    show_pix_payment(query, recent_order)
+                    return
+                
+                logger.warning("Carrinho vazio para o usuário %s", user_id)
                 query.edit_message_text(
                     "❌ Seu carrinho está vazio. Adicione produtos antes de finalizar a compra."
                 )
                 return
             
-            logger.info(f"Carrinho recuperado para o usuário {user_id}: {len(cart_items)} itens")
+            logger.info("Carrinho recuperado para o usuário %s: %s itens", user_id, len(cart_items))
             
-            # Criar pedido com tratamento de erros
-            try:
-                order = db.create_order(user_id, cart_items)
-                logger.info(f"Pedido {order.id} criado com sucesso para o usuário {user_id}")
-            except Exception as order_error:
-                logger.error(f"Erro ao criar pedido: {order_error}")
+            # Com o provedor fora do ar, falhar rápido sem criar pedidos que não serão pagos
+            if payment_gateway.breaker.state == CIRCUIT_OPEN:
+                logger.warning("Checkout do usuário %s recusado: circuito do Mercado Pago aberto", user_id)
                 query.edit_message_text(
-                    "❌ Ocorreu um erro ao criar seu pedido. Por favor, tente novamente."
+                    payment_error_message(PaymentUnavailableError("create", "circuito aberto",
+                                                                  payment_gateway.status()["retry_after"])),
+                    reply_markup=InlineKeyboardMarkup([
+                        [InlineKeyboardButton("🛒 Ver Carrinho", callback_data="view_cart")]
+                    ])
                 )
                 return
             
-            # Create Mercado Pago payment
-            total_amount = sum(item.price for item in cart_items)
-            logger.info(f"Valor total do pedido: R$ {total_amount:.2f}")
-            
-            # Format product description
-            if len(cart_items) == 1:
-                description = f"Pedido #{order.id} - {cart_items[0].name}"
-            else:
-                description = f"Pedido #{order.id} - Múltiplos itens"
-            
-            # Create payment data for PIX
-            payment_data = {
-                "transaction_amount": float(total_amount),
-                "description": description,
-                "payment_method_id": "pix",
-                "payer": {
-                    "email": f"cliente_{user_id}@exemplo.com",
-                    "first_name": user.nome,
-                    "last_name": "Cliente",
-                    "identification": {
-                        "type": "CPF",
-                        "number": "19119119100"
-                    }
-                },
-                "external_reference": order.id
-            }
-            
-            logger.info(f"Enviando dados de pagamento para o MercadoPago: {payment_data}")
+            # Chave de idempotência: mesmo usuário + mesmo conteúdo + mesma versão do carrinho
+            idempotency_key = cart_fingerprint(user_id, cart_items, db.get_cart_version(user_id))
             
-            # Fazer a requisição com tratamento de erros específico
-            try:
-                payment_response = mp.payment().create(payment_data)
-                logger.info(f"Resposta do MercadoPago: status {payment_response.get('status')}")
-            except Exception as mp_error:
-                logger.error(f"Erro na comunicação com MercadoPago: {mp_error}")
-                query.edit_message_text(
-                    "❌ Não foi possível conectar ao serviço de pagamento. Por favor, tente novamente mais tarde."
-                )
-                return
-            
-            if payment_response.get("status") == 201:
-                try:
-                    payment = payment_response.get("response", {})
-                    payment_id = payment.get("id")
-                    
-                    if not payment_id:
-                        raise ValueError("Payment ID não encontrado na resposta")
-                    
-                    # Update order with payment ID
-                    db.update_order_status(order.id, "pendente", payment_id)
-                    
-                    # Get PIX data from response
+            # Serializar checkouts concorrentes do mesmo carrinho
+            with checkout_locks.hold(idempotency_key):
+                order = db.find_reusable_order(idempotency_key, IDEMPOTENCY_WINDOW)
+                
+                if order and order.payment_id and order.pix_code:
+                    logger.info("Reutilizando pedido %s e cobrança PIX %s para o usuário %s", order.id, order.payment_id, user_id)
+                    show_pix_payment(query, order)
+                    db.clear_cart(user_id)
+                    return
+                
+                if order:
+                    # Pedido criado por uma tentativa anterior que não chegou a gerar o PIX
+                    logger.info("Reutilizando pedido %s sem cobrança para o usuário %s", order.id, user_id)
+                else:
+                    # Criar pedido com tratamento de erros
                     try:
-                        pix_data = payment.get("point_of_interaction", {}).get("transaction_data", {})
-                        # qr_code_base64 = pix_data.get("qr_code_base64", "")
-                        pix_copy_paste = pix_data.get("qr_code", "")
-                        
-                        if not pix_copy_paste:
-                            logger.warning("Código PIX não encontrado na resposta")
-                            pix_copy_paste = "Erro ao gerar código PIX. Entre em contato com o suporte."
-                    except Exception as pix_error:
-                        logger.error(f"Erro ao extrair dados PIX: {pix_error}")
-                        pix_copy_paste = "Erro ao gerar código PIX. Entre em contato com o suporte."
-                    
-                    # Send payment message with PIX details
-                    message = (
-                        f"🧾 *Resumo do Pedido #{order.id}*\n\n"
-                        f"{format_cart_message(cart_items)}\n\n"
-                        f"*PAGAMENTO VIA PIX*\n"
-                        f"Copie o código abaixo para pagar via PIX:\n\n"
-                        f"`{pix_copy_paste}`\n\n"
-                        f"Abra seu aplicativo bancário, escolha a opção PIX > Copia e Cola, e cole o código acima.\n\n"
-                        f"Após realizar o pagamento, clique no botão 'Verificar Pagamento' para confirmar."
+                        order = db.create_order(user_id, cart_items, idempotency_key=idempotency_key)
+                        logger.info("Pedido %s criado com sucesso para o usuário %s", order.id, user_id)
+                    except Exception as order_error:
+                        logger.error("Erro ao criar pedido: %s", order_error)
+                        query.edit_message_text(
+                            "❌ Ocorreu um erro ao criar seu pedido. Por favor, tente novamente."
+                        )
+                        return
+                
+                # Create Mercado Pago payment
+                total_amount = sum(item.price for item in cart_items)
+                logger.info("Valor total do pedido: R$ %.2f", total_amount)
+                
+                # Format product description
+                if len(cart_items) == 1:
+                    description = f"Pedido #{order.id} - {cart_items[0].name}"
+                else:
+                    description = f"Pedido #{order.id} - Múltiplos itens"
+                
+                # Create payment data for PIX
+                payment_data = {
+                    "transaction_amount": float(total_amount),
+                    "description": description,
+                    "payment_method_id": "pix",
+                    "payer": {
+                        "email": f"cliente_{user_id}@exemplo.com",
+                        "first_name": user.nome,
+                        "last_name": "Cliente",
+                        "identification": {
+                            "type": "CPF",
+                            "number": "19119119100"
+                        }
+                    },
+                    "external_reference": order.id,
+                    # A cobrança PIX vence junto com o pedido
+                    "date_of_expiration": (
+                        datetime.now(timezone.utc) + timedelta(seconds=ORDER_EXPIRY_SECONDS)
+                    ).isoformat(timespec="milliseconds")
+                }
+                
+                logger.debug("Enviando dados de pagamento para o MercadoPago: %s", payment_data)
+                
+                # Fazer a requisição com tratamento de erros específico.
+                # O cabeçalho de idempotência faz o Mercado Pago devolver a mesma
+                # cobrança caso esta requisição seja repetida.
+                try:
+                    payment_response = payment_gateway.create_payment(
+                        payment_data, build_request_options(idempotency_key)
                     )
-                    
-                    keyboard = [
-                        [InlineKeyboardButton("🔍 Verificar Pagamento", callback_data=f"check_payment_{order.id}")]
-                    ]
-                    
-                    # First, edit the current message
+                    logger.info("Resposta do MercadoPago: status %s", payment_response.get('status'))
+                except PaymentUnavailableError as mp_error:
+                    logger.error("Erro na comunicação com MercadoPago: %s", mp_error)
                     query.edit_message_text(
-                        message,
-                        parse_mode="Markdown",
-                        reply_markup=InlineKeyboardMarkup(keyboard)
+                        payment_error_message(mp_error),
+                        reply_markup=InlineKeyboardMarkup([
+                            [InlineKeyboardButton("🛒 Ver Carrinho", callback_data="view_cart")]
+                        ])
                     )
-                    
-                    # Clear cart after generating payment
-                    db.clear_cart(user_id)
-                    
-                    logger.info(f"Pagamento PIX criado com sucesso para o pedido {order.id}, usuário {user_id}")
-                    
-                    # Notificar admin (em thread separada para não bloquear o fluxo)
+                    return
+                
+                if payment_response.get("status") in (200, 201):
                     try:
-                        if ADMIN_ID:
-                            context.dispatcher.run_async(
-                                notify_admin_new_order,
-                                context=context,
-                                order=order,
-                                user=user
-                            )
-                    except Exception as admin_error:
-                        logger.error(f"Erro ao notificar admin: {admin_error}")
+                        payment = payment_response.get("response", {})
+                        payment_id = payment.get("id")
+                        
+                        if not payment_id:
+                            raise ValueError("Payment ID não encontrado na resposta")
+                        
+                        # Get PIX data from response
+                        try:
+                            pix_data = payment.get("point_of_interaction", {}).get("transaction_data", {})
+                            qr_code_base64 = pix_data.get("qr_code_base64", "")
+                            pix_copy_paste = pix_data.get("qr_code", "")
+                            
+                            if not pix_copy_paste:
+                                logger.warning("Código PIX não encontrado na resposta")
+                        except Exception as pix_error:
+                            logger.error("Erro ao extrair dados PIX: %s", pix_error)
+                            qr_code_base64 = ""
+                            pix_copy_paste = ""
+                        
+                        # Update order with payment ID and PIX code
+                        db.update_order_status(order.id, "pendente", payment_id, pix_code=pix_copy_paste)
+                        
+                        # First, edit the current message
+                        show_pix_payment(query, order)
+                        
+                        # Then send the QR Code image (its file_id is cached on the order)
+                        send_pix_qr(context.bot, query.message.chat_id, order, qr_code_base64)
+                        
+                        # Clear cart after generating payment
+                        db.clear_cart(user_id)
+                        
+                        logger.info("Pagamento PIX criado com sucesso para o pedido %s, usuário %s", order.id, user_id)
+                        # O aviso ao admin foi registrado no outbox junto com o código PIX
+                        
+                    except Exception as process_error:
+                        logger.error("Erro ao processar resposta do pagamento: %s", process_error)
+                        query.edit_message_text(
+                            "❌ Ocorreu um erro ao finalizar o pagamento. Por favor, contate o suporte com o código do pedido."
+                        )
+                else:
+                    error_message = "Erro desconhecido"
+                    if "response" in payment_response and "message" in payment_response["response"]:
+                        error_message = payment_response["response"]["message"]
                     
-                except Exception as process_error:
-                    logger.error(f"Erro ao processar resposta do pagamento: {process_error}")
+                    logger.error("Erro ao criar pagamento PIX: %s", error_message)
                     query.edit_message_text(
-                        "❌ Ocorreu um erro ao finalizar o pagamento. Por favor, contate o suporte com o código do pedido."
+                        f"❌ Ocorreu um erro ao processar o pagamento PIX: {error_message}\n"
+                        f"Por favor, tente novamente mais tarde."
                     )
-            else:
-                error_message = "Erro desconhecido"
-                if "response" in payment_response and "message" in payment_response["response"]:
-                    error_message = payment_response["response"]["message"]
-                
-                logger.error(f"Erro ao criar pagamento PIX: {error_message}")
-                query.edit_message_text(
-                    f"❌ Ocorreu um erro ao processar o pagamento PIX: {error_message}\n"
-                    f"Por favor, tente novamente mais tarde."
-                )
         except Exception as data_error:
-            logger.error(f"Erro ao recuperar dados para pagamento: {data_error}")
+            logger.error("Erro ao recuperar dados para pagamento: %s", data_error)
             query.edit_message_text(
                 "❌ Ocorreu um erro ao processar suas informações. Por favor, tente novamente."
             )
@@ -1716,7 +2448,7 @@ def process_payment(update: Update, context: CallbackContext):
             user_id = "Unknown"
             
         log_error(e, f"Erro crítico no processamento de pagamento para usuário {user_id}")
-        logger.error(f"Detalhes completos do erro: {str(e)}", exc_info=True)
+        logger.error("Detalhes completos do erro: %s", str(e), exc_info=True)
         
         # Último recurso para notificar o usuário
         try:
@@ -1725,7 +2457,7 @@ def process_payment(update: Update, context: CallbackContext):
                     "❌ Ocorreu um erro ao processar o pagamento. Por favor, tente novamente mais tarde."
                 )
         except Exception as notify_error:
-            logger.error(f"Erro adicional ao notificar usuário: {notify_error}")
+            logger.error("Erro adicional ao notificar usuário: %s", notify_error)
 
 def check_payment_status(update: Update, context: CallbackContext):
     """Check payment status for a specific order"""
@@ -1739,7 +2471,7 @@ def check_payment_status(update: Update, context: CallbackContext):
                 )
             return
             
-        query.answer()
+        answer_query(query)
         
         data = query.data
         order_id = data.split("_")[2]
@@ -1752,14 +2484,14 @@ def check_payment_status(update: Update, context: CallbackContext):
         # Se o usuário não estiver registrado, mas já tiver dados disponíveis na conversa atual,
         # podemos registrá-lo sem reiniciar o fluxo completo de registro
         if not user and 'name' in context.user_data and 'phone' in context.user_data:
-            logger.info(f"Registrando usuário {user_id} com dados da sessão atual durante verificação de pagamento")
-            logger.info(f"Dados na sessão: nome={context.user_data['name']}, telefone={context.user_data['phone']}")
+            logger.info("Registrando usuário %s com dados da sessão atual durante verificação de pagamento", user_id)
+            logger.info("Dados na sessão: nome=%s, telefone=%s", context.user_data['name'], context.user_data['phone'])
             user = db.save_user(
                 user_id,
                 context.user_data['name'],
                 context.user_data['phone']
             )
-            logger.info(f"Usuário registrado durante verificação de pagamento: {user.nome}, {user.telefone}")
+            logger.info("Usuário registrado durante verificação de pagamento: %s, %s", user.nome, user.telefone)
     except Exception as e:
         user_id = "Unknown"
         if update.effective_user:
@@ -1812,7 +2544,7 @@ def check_payment_status(update: Update, context: CallbackContext):
         if not order.payment_id:
             # Check by external reference (order ID)
             search_params = {"external_reference": order_id}
-            payment_result = mp.payment().search(search_params)
+            payment_result = payment_gateway.search_payments(search_params)
             
             if payment_result["status"] == 200:
                 payments = payment_result["response"]["results"]
@@ -1845,7 +2577,7 @@ def check_payment_status(update: Update, context: CallbackContext):
         else:
             # We already have payment ID, check its status
             payment_id = order.payment_id
-            payment_result = mp.payment().get(payment_id)
+            payment_result = payment_gateway.get_payment(payment_id)
             
             if payment_result["status"] == 200:
                 payment = payment_result["response"]
@@ -1868,11 +2600,8 @@ def check_payment_status(update: Update, context: CallbackContext):
         if payment_status == "approved":
             # If order wasn't marked as paid yet
             if order.status != "pago":
-                # Update order status
+                # Update order status (the admin notification goes through the outbox)
                 db.update_order_status(order_id, "pago")
-                
-                # Send admin notification about new paid order
-                notify_admin_new_order(context, order, user)
             
             # Inform user
             query.edit_message_text(
@@ -1912,6 +2641,14 @@ def check_payment_status(update: Update, context: CallbackContext):
                 ])
             )
         
+    except PaymentUnavailableError as e:
+        logger.warning("Verificação do pedido %s indisponível: %s", order_id, e)
+        query.edit_message_text(
+            payment_error_message(e, checking=True),
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("🔍 Verificar Novamente", callback_data=f"check_payment_{order_id}")]
+            ])
+        )
     except Exception as e:
         log_error(e, f"Error checking payment status for order {order_id}")
         query.edit_message_text(
@@ -1992,7 +2729,7 @@ def order_details(update: Update, context: CallbackContext):
     """Show details for a specific order"""
     try:
         query = update.callback_query
-        query.answer()
+        answer_query(query)
         
         data = query.data
         order_id = data.split("_")[2]
@@ -2021,6 +2758,10 @@ def order_details(update: Update, context: CallbackContext):
         # Add payment verification button if pending
         keyboard = []
         if order.status == "pendente" and order.payment_id:
+            if order.pix_code:
+                keyboard.append([
+                    InlineKeyboardButton("📱 Ver QR Code PIX", callback_data=f"show_pix_{order.id}")
+                ])
             keyboard.append([
                 InlineKeyboardButton("🔍 Verificar Pagamento", callback_data=f"check_payment_{order.id}")
             ])
@@ -2052,7 +2793,7 @@ def order_details(update: Update, context: CallbackContext):
 def check_payment_callback(update: Update, context: CallbackContext):
     """Handle check payment callback"""
     query = update.callback_query
-    query.answer()
+    answer_query(query)
     
     data = query.data
     
@@ -2098,12 +2839,8 @@ def check_payment_callback(update: Update, context: CallbackContext):
 
 # HANDLERS ADMIN
 
-def notify_admin_new_order(context: CallbackContext, order, user):
-    """Notify admin about new order"""
-    if not ADMIN_ID:
-        logger.error("Admin ID not configured, can't send notifications")
-        return
-    
+def build_admin_order_notification(order, user):
+    """Build the admin notification text and keyboard for an order"""
     total = sum(item.price for item in order.items)
     
     message = (
@@ -2134,20 +2871,90 @@ def notify_admin_new_order(context: CallbackContext, order, user):
         [InlineKeyboardButton("❌ Cancelar Pedido", callback_data=f"admin_cancel_{order.id}")]
     ]
     
-    try:
-        context.bot.send_message(
+    return message, InlineKeyboardMarkup(keyboard)
+
+def notify_admin_new_order(order, user):
+    """Notify admin about new order
+    
+    Returns the Future of the individual message or, when the order went
+    into the digest, one resolved once the digest showing it is sent.
+    """
+    if not ADMIN_ID:
+        logger.error("Admin ID not configured, can't send notifications")
+        return None
+    
+    def send_individual():
+        message, markup = build_admin_order_notification(order, user)
+        # Enviado pela fila de saída, atrás das mensagens para clientes
+        return outbound.send_message(
             chat_id=ADMIN_ID,
             text=message,
             parse_mode="Markdown",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=markup,
+            priority=PRIORITY_ADMIN
         )
+    
+    # Em rajadas de pedidos, o pedido entra no resumo em vez de gerar uma mensagem
+    return admin_digest.notify(
+        {"id": order.id, "customer": user.nome, "total": sum(item.price for item in order.items),
+         "status": order.status},
+        send_individual
+    )
+
+def flush_admin_digest(context: CallbackContext):
+    """Send or edit the admin order digest (job)"""
+    try:
+        admin_digest.flush()
     except Exception as e:
-        logger.error(f"Error sending admin notification: {e}")
+        logger.error("Erro ao atualizar o resumo de pedidos do admin: %s", e)
+
+def admin_digest_callback(update: Update, context: CallbackContext):
+    """Page through the admin digest or open one of its orders (admin only)"""
+    query = update.callback_query
+    
+    if str(query.from_user.id) != ADMIN_ID:
+        answer_query(query, "❌ Você não tem permissão para realizar esta ação.", show_alert=True)
+        return
+    
+    data = query.data
+    if data.startswith("admin_digest_page_"):
+        result = admin_digest.page(query.message.message_id, int(data.rsplit("_", 1)[1]))
+        if result is None:
+            answer_query(query, "Este resumo não está mais disponível. Use 📋 Pedidos Pendentes.", show_alert=True)
+            return
+        answer_query(query)
+        text, keyboard = result
+        query.edit_message_text(
+            text,
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton(label, callback_data=callback) for label, callback in row]
+                for row in keyboard
+            ])
+        )
+        return
+    
+    # admin_digest_open_<order_id>: detalhes em uma nova mensagem, sem apagar o resumo
+    order_id = data.rsplit("_", 1)[1]
+    order = db.get_order(order_id)
+    user = db.get_user(order.user_id) if order else None
+    if not order or not user:
+        answer_query(query, "❌ Pedido não encontrado.", show_alert=True)
+        return
+    
+    answer_query(query)
+    message, markup = build_admin_order_notification(order, user)
+    message += f"\n📌 Status atual: {order.status}"
+    context.bot.send_message(
+        chat_id=query.message.chat_id,
+        text=message,
+        parse_mode="Markdown",
+        reply_markup=markup
+    )
 
 def mark_as_delivered(update: Update, context: CallbackContext):
     """Mark order as delivered (admin only)"""
     query = update.callback_query
-    query.answer()
+    answer_query(query)
     
     user_id = query.from_user.id
     
@@ -2166,33 +2973,19 @@ def mark_as_delivered(update: Update, context: CallbackContext):
         query.edit_message_text("❌ Pedido não encontrado.")
         return
     
-    # Update order status
+    # Update order status (the customer notification goes through the outbox)
     db.update_order_status(order_id, "entregue")
     
     # Notify admin
     query.edit_message_text(
         f"✅ Pedido #{order_id} marcado como ENTREGUE com sucesso!\n\n"
-        f"O cliente foi notificado."
+        f"O cliente será notificado."
     )
-    
-    # Notify customer
-    try:
-        context.bot.send_message(
-            chat_id=order.user_id,
-            text=(
-                f"✅ *Pedido Entregue!*\n\n"
-                f"Seu pedido #{order_id} foi marcado como ENTREGUE.\n\n"
-                f"Obrigado por comprar conosco!"
-            ),
-            parse_mode="Markdown"
-        )
-    except Exception as e:
-        logger.error(f"Error notifying customer about delivery: {e}")
 
 def cancel_order(update: Update, context: CallbackContext):
     """Cancel order (admin only)"""
     query = update.callback_query
-    query.answer()
+    answer_query(query)
     
     user_id = query.from_user.id
     
@@ -2211,33 +3004,19 @@ def cancel_order(update: Update, context: CallbackContext):
         query.edit_message_text("❌ Pedido não encontrado.")
         return
     
-    # Update order status
+    # Update order status (the customer notification goes through the outbox)
     db.update_order_status(order_id, "cancelado")
     
     # Notify admin
     query.edit_message_text(
         f"❌ Pedido #{order_id} CANCELADO com sucesso!\n\n"
-        f"O cliente foi notificado."
+        f"O cliente será notificado."
     )
-    
-    # Notify customer
-    try:
-        context.bot.send_message(
-            chat_id=order.user_id,
-            text=(
-                f"❌ *Pedido Cancelado*\n\n"
-                f"Infelizmente seu pedido #{order_id} foi cancelado.\n\n"
-                f"Entre em contato conosco para mais informações."
-            ),
-            parse_mode="Markdown"
-        )
-    except Exception as e:
-        logger.error(f"Error notifying customer about cancellation: {e}")
 
 def admin_view_order(update: Update, context: CallbackContext):
     """Admin handler to view and manage a specific order"""
     query = update.callback_query
-    query.answer()
+    answer_query(query)
     
     user_id = query.from_user.id
     
@@ -2295,7 +3074,7 @@ def list_pending_orders(update: Update, context: CallbackContext):
     # Verify admin permissions
     if str(user_id) != ADMIN_ID:
         if is_callback:
-            update.callback_query.answer("❌ Você não tem permissão para realizar esta ação.")
+            answer_query(update.callback_query, "❌ Você não tem permissão para realizar esta ação.")
             return
         else:
             update.message.reply_text("❌ Você não tem permissão para realizar esta ação.")
@@ -2303,10 +3082,10 @@ def list_pending_orders(update: Update, context: CallbackContext):
     
     # Se for callback, responder imediatamente
     if is_callback:
-        update.callback_query.answer()
+        answer_query(update.callback_query)
     
     # Get all orders
-    all_orders = db.orders.values()
+    all_orders = db.all_orders()
     pending_orders = [order for order in all_orders if order.status == "pendente" or order.status == "pago"]
     
     # Mensagem para quando não há pedidos pendentes
@@ -2397,7 +3176,7 @@ def admin_auth_handler(update: Update, context: CallbackContext):
     
     # Verificar se o ID digitado corresponde ao ADMIN_ID configurado
     if entered_id == ADMIN_ID:
-        logger.info(f"Usuário {user_id} autenticado como administrador")
+        logger.info("Usuário %s autenticado como administrador", user_id)
         update.message.reply_text(
             "✅ *Autenticação bem-sucedida!*\n\n"
             "Você foi autenticado como administrador do sistema.\n"
@@ -2409,7 +3188,7 @@ def admin_auth_handler(update: Update, context: CallbackContext):
         admin_products(update, context)
         return ConversationHandler.END
     else:
-        logger.warning(f"Tentativa de autenticação falha para usuário {user_id}")
+        logger.warning("Tentativa de autenticação falha para usuário %s", user_id)
         update.message.reply_text(
             "❌ *Autenticação falhou*\n\n"
             "O ID informado não corresponde ao ID de administrador configurado.\n"
@@ -2424,7 +3203,7 @@ def admin_products(update: Update, context: CallbackContext):
     
     if not is_admin(user_id):
         if update.callback_query:
-            update.callback_query.answer("❌ Você não tem permissão para acessar esta área administrativa.")
+            answer_query(update.callback_query, "❌ Você não tem permissão para acessar esta área administrativa.")
             return ConversationHandler.END
         else:
             update.message.reply_text("❌ Você não tem permissão para acessar esta área administrativa.")
@@ -2444,7 +3223,7 @@ def admin_products(update: Update, context: CallbackContext):
     
     # Determinar se é uma mensagem ou um callback
     if update.callback_query:
-        update.callback_query.answer()
+        answer_query(update.callback_query)
         update.callback_query.edit_message_text(
             text=admin_message,
             parse_mode="Markdown",
@@ -2462,7 +3241,7 @@ def admin_products(update: Update, context: CallbackContext):
 def admin_select_category(update: Update, context: CallbackContext):
     """Handle admin category selection"""
     query = update.callback_query
-    query.answer()
+    answer_query(query)
     
     user_id = query.from_user.id
     if not is_admin(user_id):
@@ -2515,7 +3294,7 @@ def admin_select_category(update: Update, context: CallbackContext):
 def admin_select_product(update: Update, context: CallbackContext):
     """Handle admin product selection"""
     query = update.callback_query
-    query.answer()
+    answer_query(query)
     
     user_id = query.from_user.id
     if not is_admin(user_id):
@@ -2603,7 +3382,7 @@ def admin_select_product(update: Update, context: CallbackContext):
 def admin_edit_product_field(update: Update, context: CallbackContext):
     """Handle product field selection for editing"""
     query = update.callback_query
-    query.answer()
+    answer_query(query)
     
     user_id = query.from_user.id
     if not is_admin(user_id):
@@ -2707,7 +3486,7 @@ def admin_edit_product_field(update: Update, context: CallbackContext):
 def admin_edit_discount(update: Update, context: CallbackContext):
     """Handle discount setting via inline buttons"""
     query = update.callback_query
-    query.answer()
+    answer_query(query)
     
     user_id = query.from_user.id
     if not is_admin(user_id):
@@ -2737,10 +3516,10 @@ def admin_edit_discount(update: Update, context: CallbackContext):
             # Apenas exportamos o catálogo para JSON
             with open('data/catalog.json', 'w', encoding='utf-8') as f:
                 json.dump(PRODUCT_CATALOG, f, ensure_ascii=False, indent=4)
-            logger.info(f"Catálogo salvo após atualizar desconto do produto '{product['name']}'")
+            logger.info("Catálogo salvo após atualizar desconto do produto '%s'", product['name'])
             save_success = True
         except Exception as e:
-            logger.error(f"Erro ao salvar catálogo após atualizar desconto: {e}")
+            logger.error("Erro ao salvar catálogo após atualizar desconto: %s", e)
             save_success = False
         
         # Mostrar mensagem de confirmação
@@ -2817,10 +3596,10 @@ def admin_handle_edit_value(update: Update, context: CallbackContext):
         # Salvar o catálogo localmente
         try:
             save_catalog_to_git()
-            logger.info(f"Catálogo salvo após edição do produto '{product_name}', campo '{field}'")
+            logger.info("Catálogo salvo após edição do produto '%s', campo '%s'", product_name, field)
             save_success = True
         except Exception as e:
-            logger.error(f"Erro ao salvar catálogo: {e}")
+            logger.error("Erro ao salvar catálogo: %s", e)
             save_success = False
         
         # Send confirmation and show product menu again
@@ -2849,14 +3628,14 @@ def admin_handle_edit_value(update: Update, context: CallbackContext):
         return CATEGORY_SELECTION
         
     except Exception as e:
-        logger.error(f"Erro ao editar produto: {e}")
+        logger.error("Erro ao editar produto: %s", e)
         update.message.reply_text(f"❌ Ocorreu um erro: {str(e)}. Por favor, tente novamente.")
         return EDIT_PRODUCT_VALUE
 
 def admin_confirm_delete_product(update: Update, context: CallbackContext):
     """Confirm and process product/category deletion"""
     query = update.callback_query
-    query.answer()
+    answer_query(query)
     
     user_id = query.from_user.id
     if not is_admin(user_id):
@@ -2882,10 +3661,10 @@ def admin_confirm_delete_product(update: Update, context: CallbackContext):
             # Salvar o catálogo localmente
             try:
                 save_catalog_to_git()
-                logger.info(f"Catálogo salvo após exclusão da categoria '{category_name}'")
+                logger.info("Catálogo salvo após exclusão da categoria '%s'", category_name)
                 save_success = True
             except Exception as e:
-                logger.error(f"Erro ao salvar catálogo após exclusão da categoria: {e}")
+                logger.error("Erro ao salvar catálogo após exclusão da categoria: %s", e)
                 save_success = False
             
             # Mostrar mensagem de confirmação
@@ -2943,10 +3722,10 @@ def admin_confirm_delete_product(update: Update, context: CallbackContext):
         # Salvar o catálogo localmente
         try:
             save_catalog_to_git()
-            logger.info(f"Catálogo salvo após exclusão do produto '{product_name}'")
+            logger.info("Catálogo salvo após exclusão do produto '%s'", product_name)
             save_success = True
         except Exception as e:
-            logger.error(f"Erro ao salvar catálogo após exclusão: {e}")
+            logger.error("Erro ao salvar catálogo após exclusão: %s", e)
             save_success = False
         
         # Mostrar mensagem de confirmação
@@ -3011,10 +3790,10 @@ def admin_add_product_name(update: Update, context: CallbackContext):
         # Salvar o catálogo localmente
         try:
             save_catalog_to_git()
-            logger.info(f"Catálogo salvo após adicionar categoria '{category_name}'")
+            logger.info("Catálogo salvo após adicionar categoria '%s'", category_name)
             save_success = True
         except Exception as e:
-            logger.error(f"Erro ao salvar catálogo após adicionar categoria: {e}")
+            logger.error("Erro ao salvar catálogo após adicionar categoria: %s", e)
             save_success = False
         
         update.message.reply_text(
@@ -3051,11 +3830,11 @@ def admin_add_product_name(update: Update, context: CallbackContext):
         
         user_id = update.effective_user.id
         # Store in temporary storage
-        product_temp_data[user_id] = {'name': product_name}
+        context.user_data['product_temp'] = {'name': product_name}
         
         # Log para debug
         from utils import log_error
-        log_error(f"Produto temp iniciado: {product_temp_data[user_id]}", f"Usuário {user_id}")
+        log_error(f"Produto temp iniciado: {context.user_data['product_temp']}", f"Usuário {user_id}")
         
         update.message.reply_text(
             "💰 *Preço do Produto*\n\n"
@@ -3091,17 +3870,17 @@ def admin_add_product_price(update: Update, context: CallbackContext):
         
         # Store price in temp data
         user_id = update.effective_user.id
-        if user_id not in product_temp_data:
+        if 'product_temp' not in context.user_data:
             # Log para debug
             from utils import log_error
             log_error("Produto temp não encontrado ao tentar adicionar preço", f"Usuário {user_id}")
-            product_temp_data[user_id] = {}
+            context.user_data['product_temp'] = {}
         
-        product_temp_data[user_id]['price'] = price
+        context.user_data['product_temp']['price'] = price
         
         # Log para debug
         from utils import log_error
-        log_error(f"Preço adicionado ao produto temp: {product_temp_data[user_id]}", f"Usuário {user_id}")
+        log_error(f"Preço adicionado ao produto temp: {context.user_data['product_temp']}", f"Usuário {user_id}")
         
         # Ask for product type: app (with fields), credit (with discount), or fixed price (no discount)
         update.message.reply_text(
@@ -3127,13 +3906,12 @@ def admin_add_product_price(update: Update, context: CallbackContext):
 def admin_add_product_type(update: Update, context: CallbackContext):
     """Handle product type selection"""
     query = update.callback_query
-    query.answer()
+    answer_query(query)
     
     data = query.data
-    user_id = query.from_user.id
     category = context.user_data.get('admin_category')
     
-    if user_id not in product_temp_data:
+    if 'product_temp' not in context.user_data:
         query.edit_message_text("❌ Erro nos dados do produto. Por favor, comece novamente.")
         return ConversationHandler.END
     
@@ -3144,7 +3922,7 @@ def admin_add_product_type(update: Update, context: CallbackContext):
             "Por favor, informe os campos necessários, separados por vírgula.\n"
             "Exemplo: MAC, Email, Senha"
         )
-        product_temp_data[user_id]['type'] = 'app'
+        context.user_data['product_temp']['type'] = 'app'
         return ADD_PRODUCT_FIELDS
     
     # Handle credit product (has discount option)
@@ -3154,8 +3932,8 @@ def admin_add_product_type(update: Update, context: CallbackContext):
         
         # Finalize product creation
         new_product = {
-            'name': product_temp_data[user_id]['name'],
-            'price': product_temp_data[user_id]['price'],
+            'name': context.user_data['product_temp']['name'],
+            'price': context.user_data['product_temp']['price'],
             'discount': True if is_credit else False  # Only apply discount for credit products
         }
         
@@ -3171,15 +3949,14 @@ def admin_add_product_type(update: Update, context: CallbackContext):
         # Salvar o catálogo localmente
         try:
             save_catalog_to_git()
-            logger.info(f"Catálogo salvo após adicionar produto de {product_type} '{new_product['name']}'")
+            logger.info("Catálogo salvo após adicionar produto de %s '%s'", product_type, new_product['name'])
             save_success = True
         except Exception as e:
-            logger.error(f"Erro ao salvar catálogo após adicionar produto: {e}")
+            logger.error("Erro ao salvar catálogo após adicionar produto: %s", e)
             save_success = False
         
         # Clear temp data
-        if user_id in product_temp_data:
-            del product_temp_data[user_id]
+        context.user_data.pop('product_temp', None)
         
         # Mostrar mensagem de confirmação com informação sobre desconto
         discount_info = "com desconto aplicável" if is_credit else "sem desconto aplicável"
@@ -3207,12 +3984,11 @@ def admin_add_product_fields(update: Update, context: CallbackContext):
     # Check if this is a callback for cancel
     if update.callback_query:
         query = update.callback_query
-        query.answer()
+        answer_query(query)
         
         if query.data == "admin_cancel_add":
             # Clear temp data
-            if user_id in product_temp_data:
-                del product_temp_data[user_id]
+            context.user_data.pop('product_temp', None)
                 
             query.edit_message_text("❌ Adição de produto cancelada.")
             
@@ -3246,7 +4022,7 @@ def admin_add_product_fields(update: Update, context: CallbackContext):
     fields_text = update.message.text.strip()
     fields = [f.strip() for f in fields_text.split(',') if f.strip()]
     
-    if user_id not in product_temp_data:
+    if 'product_temp' not in context.user_data:
         # Não temos dados temporários - precisamos informar o usuário
         update.message.reply_text(
             "❌ Erro: não encontramos dados do produto em andamento. Por favor, inicie o processo novamente usando o comando de administração.",
@@ -3255,8 +4031,8 @@ def admin_add_product_fields(update: Update, context: CallbackContext):
         return ConversationHandler.END
         
     # Verificar se temos tipo definido (app ou credit)
-    if 'type' not in product_temp_data[user_id]:
-        product_temp_data[user_id]['type'] = 'app'  # Define padrão como app se não estiver definido
+    if 'type' not in context.user_data['product_temp']:
+        context.user_data['product_temp']['type'] = 'app'  # Define padrão como app se não estiver definido
     
     if not fields:
         update.message.reply_text(
@@ -3267,8 +4043,8 @@ def admin_add_product_fields(update: Update, context: CallbackContext):
     
     # Create new app product
     new_product = {
-        'name': product_temp_data[user_id]['name'],
-        'price': product_temp_data[user_id]['price'],
+        'name': context.user_data['product_temp']['name'],
+        'price': context.user_data['product_temp']['price'],
         'fields': fields
     }
     
@@ -3284,15 +4060,14 @@ def admin_add_product_fields(update: Update, context: CallbackContext):
     # Salvar o catálogo localmente
     try:
         save_catalog_to_git()
-        logger.info(f"Catálogo salvo após adicionar produto de aplicativo '{new_product['name']}'")
+        logger.info("Catálogo salvo após adicionar produto de aplicativo '%s'", new_product['name'])
         save_success = True
     except Exception as e:
-        logger.error(f"Erro ao salvar catálogo após adicionar produto: {e}")
+        logger.error("Erro ao salvar catálogo após adicionar produto: %s", e)
         save_success = False
     
     # Clear temp data
-    if user_id in product_temp_data:
-        del product_temp_data[user_id]
+    context.user_data.pop('product_temp', None)
     
     update.message.reply_text(
         f"✅ *Produto Adicionado!*\n\n"
@@ -3322,8 +4097,7 @@ def admin_cancel(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
     
     # Clear temp data
-    if user_id in product_temp_data:
-        del product_temp_data[user_id]
+    context.user_data.pop('product_temp', None)
     
     context.user_data.pop('admin_category', None)
     context.user_data.pop('admin_product_index', None)
@@ -3333,7 +4107,7 @@ def admin_cancel(update: Update, context: CallbackContext):
     # Handle callback or message
     if update.callback_query:
         query = update.callback_query
-        query.answer()
+        answer_query(query)
         query.edit_message_text(
             "❌ Operação administrativa cancelada."
         )
@@ -3371,12 +4145,11 @@ def admin_cancel(update: Update, context: CallbackContext):
 def admin_cancel_callback(update: Update, context: CallbackContext):
     """Handle cancellation via callback query"""
     query = update.callback_query
-    query.answer()
+    answer_query(query)
     user_id = query.from_user.id
     
     # Clear temp data
-    if user_id in product_temp_data:
-        del product_temp_data[user_id]
+    context.user_data.pop('product_temp', None)
     
     context.user_data.pop('admin_category', None)
     context.user_data.pop('admin_product_index', None)
@@ -3477,7 +4250,7 @@ def github_sync_command(update: Update, context: CallbackContext):
                      "Verifique os logs para mais detalhes."
             )
     except Exception as e:
-        logger.error(f"Erro ao sincronizar com GitHub: {e}")
+        logger.error("Erro ao sincronizar com GitHub: %s", e)
         context.bot.edit_message_text(
             chat_id=msg.chat_id,
             message_id=msg.message_id,
@@ -3558,7 +4331,7 @@ def github_info_command(update: Update, context: CallbackContext):
                      "Verifique se o token e o nome do repositório estão corretos."
             )
     except Exception as e:
-        logger.error(f"Erro ao obter informações do GitHub: {e}")
+        logger.error("Erro ao obter informações do GitHub: %s", e)
         context.bot.edit_message_text(
             chat_id=msg.chat_id,
             message_id=msg.message_id,
@@ -3667,7 +4440,7 @@ def github_sync_callback(update: Update, context: CallbackContext):
     no menu de GitHub.
     """
     query = update.callback_query
-    query.answer()  # Responde ao callback para remover o "loading"
+    answer_query(query)  # Responde ao callback para remover o "loading"
     user_id = update.effective_user.id
     
     # Verificar se é admin
@@ -3729,7 +4502,7 @@ def github_sync_callback(update: Update, context: CallbackContext):
                 parse_mode="HTML"
             )
     except Exception as e:
-        logger.error(f"Erro ao sincronizar com GitHub: {e}")
+        logger.error("Erro ao sincronizar com GitHub: %s", e)
         query.edit_message_text(
             f"❌ Erro ao sincronizar catálogo: {str(e)}",
             parse_mode="HTML"
@@ -3742,7 +4515,7 @@ def github_info_callback(update: Update, context: CallbackContext):
     no menu de GitHub.
     """
     query = update.callback_query
-    query.answer()  # Responde ao callback para remover o "loading"
+    answer_query(query)  # Responde ao callback para remover o "loading"
     user_id = update.effective_user.id
     
     # Verificar se é admin
@@ -3807,7 +4580,7 @@ def github_info_callback(update: Update, context: CallbackContext):
                 parse_mode="HTML"
             )
     except Exception as e:
-        logger.error(f"Erro ao obter informações do GitHub: {e}")
+        logger.error("Erro ao obter informações do GitHub: %s", e)
         query.edit_message_text(
             text=f"❌ Erro ao acessar repositório: {str(e)}",
             parse_mode="HTML"
@@ -3820,7 +4593,7 @@ def github_setup_callback(update: Update, context: CallbackContext):
     no menu de GitHub.
     """
     query = update.callback_query
-    query.answer()  # Responde ao callback para remover o "loading"
+    answer_query(query)  # Responde ao callback para remover o "loading"
     user_id = update.effective_user.id
     
     # Verificar se é admin
@@ -3879,7 +4652,7 @@ def github_config_start_callback(update: Update, context: CallbackContext):
     no menu de GitHub.
     """
     query = update.callback_query
-    query.answer()  # Responde ao callback para remover o "loading"
+    answer_query(query)  # Responde ao callback para remover o "loading"
     user_id = update.effective_user.id
     
     # Verificar se é admin
@@ -3914,7 +4687,7 @@ def github_config_start_callback(update: Update, context: CallbackContext):
 def github_config_token_callback(update: Update, context: CallbackContext):
     """Solicita o token do GitHub ao usuário."""
     query = update.callback_query
-    query.answer()
+    answer_query(query)
     user_id = update.effective_user.id
     
     # Verificar se é admin
@@ -3984,9 +4757,9 @@ def github_token_input_handler(update: Update, context: CallbackContext):
     # Agendar a remoção da mensagem para garantir que seja processada
     try:
         context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-        logger.info(f"Mensagem com token removida por segurança")
+        logger.info("Mensagem com token removida por segurança")
     except Exception as e:
-        logger.error(f"Erro ao deletar mensagem com token: {e}")
+        logger.error("Erro ao deletar mensagem com token: %s", e)
         # Tentar substituir a mensagem como alternativa
         try:
             context.bot.edit_message_text(
@@ -3996,7 +4769,7 @@ def github_token_input_handler(update: Update, context: CallbackContext):
             )
             logger.info("Mensagem com token substituída por segurança")
         except Exception as ex:
-            logger.error(f"Também não foi possível editar a mensagem: {ex}")
+            logger.error("Também não foi possível editar a mensagem: %s", ex)
     
     return GITHUB_OWNER_INPUT
     
@@ -4100,7 +4873,7 @@ def github_branch_input_handler(update: Update, context: CallbackContext):
         safe_repo = github_temp_data.get('repo')
         safe_branch = github_temp_data.get('branch', 'main')
         
-        logger.info(f"Configuração do GitHub concluída com sucesso para {safe_owner}/{safe_repo}:{safe_branch}")
+        logger.info("Configuração do GitHub concluída com sucesso para %s/%s:%s", safe_owner, safe_repo, safe_branch)
         
         # Confirmar a configuração com o teclado admin
         update.message.reply_text(
@@ -4114,7 +4887,7 @@ def github_branch_input_handler(update: Update, context: CallbackContext):
             reply_markup=ADMIN_KEYBOARD
         )
     except Exception as e:
-        logger.error(f"Erro ao concluir configuração do GitHub: {e}")
+        logger.error("Erro ao concluir configuração do GitHub: %s", e)
         update.message.reply_text(
             "⚠️ <b>Configuração Concluída com Avisos</b>\n\n"
             "As credenciais foram salvas, mas ocorreu um erro ao exibir os detalhes.\n"
@@ -4134,7 +4907,7 @@ def github_config_cancel(update: Update, context: CallbackContext):
     
     # Limpar dados temporários
     github_temp_data.clear()
-    logger.info(f"Configuração do GitHub cancelada pelo usuário {user_id}")
+    logger.info("Configuração do GitHub cancelada pelo usuário %s", user_id)
     
     # Verificar se é um objeto Message (comando /cancel ou botão de texto) ou callback_query
     if update.message:
@@ -4155,7 +4928,7 @@ def github_config_cancel(update: Update, context: CallbackContext):
                 reply_markup=ADMIN_KEYBOARD
             )
     elif update.callback_query:
-        update.callback_query.answer()
+        answer_query(update.callback_query)
         update.callback_query.edit_message_text(
             "❌ <b>Configuração Cancelada</b>\n\n"
             "O processo de configuração do GitHub foi cancelado.",
@@ -4174,7 +4947,7 @@ def github_config_cancel(update: Update, context: CallbackContext):
 def github_back_to_menu_callback(update: Update, context: CallbackContext):
     """Retorna ao menu principal do GitHub."""
     query = update.callback_query
-    query.answer()
+    answer_query(query)
     
     # Chamar o manipulador do menu do GitHub
     github_menu_handler(update, context)
@@ -4200,6 +4973,9 @@ def help_command(update: Update, context: CallbackContext):
             "👑 <b>Comandos de Administrador</b>\n\n"
             "/admin - Gerenciar produtos e categorias\n"
             "/pending - Ver pedidos pendentes\n"
+            "/broadcast - Enviar mensagem para todos os usuários\n"
+            "/stats - Ver estatísticas de vendas\n"
+            "/profile - Medir o desempenho do bot por alguns segundos\n"
             "/github_sync - Sincronizar catálogo com GitHub\n"
             "/github_info - Ver informações do repositório\n"
             "/github_setup - Configurar integração com GitHub\n"
@@ -4211,6 +4987,245 @@ def help_command(update: Update, context: CallbackContext):
         reply_markup=MAIN_KEYBOARD
     )
 
+def skip_duplicate_update(update: Update, context: CallbackContext):
+    """Stop updates that were already processed (runs before every other handler)"""
+    if update_tracker.is_duplicate(update.update_id):
+        updates_counter.inc(source="polling", outcome="duplicate")
+        raise DispatcherHandlerStop()
+
+def mark_update_processed(update: Update, context: CallbackContext):
+    """Record the update as processed (runs after every other handler)"""
+    update_tracker.mark(update.update_id)
+    updates_counter.inc(source="polling", outcome="processed")
+
+def save_update_offset(context: CallbackContext):
+    """Persist the last processed update_id (job)"""
+    update_tracker.save()
+
+tracked_check_payment_status = payment_checks.wrap(check_payment_status)
+
+def hand_over(updater, leader, request):
+    """Stop polling, persist everything and hand the bot over to the new process (handoff thread)"""
+    try:
+        # Parar de buscar updates; o long polling em andamento é encerrado pelo
+        # getUpdates do novo processo e o que ele trouxer é buscado de novo por lá
+        updater.running = False
+        deadline = time.monotonic() + HANDOFF_DRAIN_SECONDS
+        while updater.update_queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.02)
+        updater.job_queue.stop()
+        broadcaster.stop()
+        payment_checks.wait_idle(max(0.0, deadline - time.monotonic()))
+        # Parar a fila de saída antes de gravar o outbox: o que ela confirmar até
+        # aqui fica como entregue, e o que sobrar na fila não sai mais por este
+        # processo, só pelo novo, que reenvia as notificações ainda pendentes
+        outbound.stop(timeout=max(0.5, deadline - time.monotonic()))
+        
+        updater.dispatcher.update_persistence()
+        session_store.flush()
+        db.flush()
+        expiry_scheduler.save()
+        flush_order_archive()
+        update_tracker.save(force=True)
+        
+        state = handoff.publish(leader.holder, request["holder"], {
+            "last_update_id": update_tracker.last_update_id,
+            "payment_checks": payment_checks.snapshot(),
+        })
+        leader.release()
+        return state
+    finally:
+        # Encerrar o idle(); o desligamento continua em main()
+        updater.is_idle = False
+
+def refresh_after_standby(dispatcher):
+    """Apply what the previous leader wrote after this process loaded its snapshot"""
+    changed = db.refresh()
+    broadcaster.reload()
+    session_store.reload(dispatcher)
+    if order_archive is not None:
+        order_archive.reload()
+    logger.info("Dados atualizados após a espera: %s arquivo(s) da loja relidos", len(changed))
+
+def resume_payment_checks(dispatcher, updates):
+    """Re-run the payment checks the previous process handed over unfinished"""
+    for data in updates:
+        update = Update.de_json(data, dispatcher.bot)
+        context = CallbackContext.from_update(update, dispatcher)
+        dispatcher.run_async(tracked_check_payment_status, update, context, update=update)
+
+class ShardDispatcher(Dispatcher):
+    """Dispatcher of a worker process: keeps the run_async handlers each update starts"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started_promises = None
+    
+    def run_async(self, func, *args, update=None, **kwargs):
+        promise = super().run_async(func, *args, update=update, **kwargs)
+        if update is not None and self.started_promises is not None:
+            self.started_promises.append(promise)
+        return promise
+    
+    def process_routed_update(self, data):
+        """Process an update from the ingest process.
+        
+        Returns:
+            list: Promises of the run_async handlers it started (it is only
+                confirmed to the ingest process once they finish)
+        """
+        self.started_promises = []
+        try:
+            self.process_update(Update.de_json(data, self.bot))
+            return self.started_promises
+        finally:
+            self.started_promises = None
+
+def build_updater():
+    """Create the Updater (in a worker process, around a ShardDispatcher)"""
+    if not IS_WORKER:
+        return Updater(TOKEN, use_context=True, persistence=session_store)
+    # Mesma montagem que o Updater faz sozinho, trocando a classe do dispatcher
+    workers = 4
+    bot = ExtBot(TOKEN, request=Request(con_pool_size=workers + 4))
+    job_queue = JobQueue()
+    dispatcher = ShardDispatcher(bot, Queue(), job_queue=job_queue, workers=workers,
+                                 persistence=session_store, use_context=True)
+    job_queue.set_dispatcher(dispatcher)
+    return Updater(dispatcher=dispatcher, workers=None)
+
+def serve_shard(updater, updates, acks):
+    """Process the updates the ingest process routes to this worker until it stops it"""
+    dp = updater.dispatcher
+    stop_event = threading.Event()
+    # SIGTERM só neste worker: parar sem esvaziar a fila; o que não for
+    # confirmado a ingestão reenvia ao substituto
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    updater.job_queue.start()
+    # A thread do dispatcher só fica com as threads dos handlers run_async;
+    # os updates são processados abaixo
+    ready = threading.Event()
+    threading.Thread(target=dp.start, kwargs={"ready": ready}, name=f"dispatcher-w{WORKER_INDEX}", daemon=True).start()
+    ready.wait()
+    logger.info("Worker %s/%s pronto para receber updates", WORKER_INDEX + 1, BOT_WORKERS)
+    
+    # Processado aqui mesmo (em ordem, como faria a thread do dispatcher) para
+    # a confirmação só sair depois dos handlers, inclusive os run_async
+    serve_updates(updates, dp.process_routed_update, stop_event, acks)
+    
+    updater.job_queue.stop()
+    broadcaster.stop()
+    # Espera os handlers run_async em andamento antes de gravar as sessões
+    dp.stop()
+    dp.update_persistence()
+    expiry_scheduler.save()
+    flush_order_archive()
+
+def shard_worker_main(updates, acks):
+    """Entry point of a worker process in multi-process mode (started by the ingest process)"""
+    main(shard_updates=updates, shard_acks=acks)
+
+def check_shard_workers(context: CallbackContext):
+    """Restart worker processes that exited unexpectedly (ingest job)"""
+    context.job.context.check_workers()
+
+def run_ingest():
+    """Poll Telegram and route each update to the worker process that owns its user"""
+    updater = Updater(TOKEN, use_context=True)
+    dp = updater.dispatcher
+    router = ShardRouter(shard_worker_main)
+    
+    # Deduplicação e offset ficam na ingestão; o resto do processamento, nos
+    # workers. O offset gravado para antes do primeiro update não confirmado
+    dp.add_handler(TypeHandler(Update, skip_duplicate_update), group=-100)
+    dp.add_handler(TypeHandler(Update, router.route))
+    dp.add_handler(TypeHandler(Update, mark_update_processed), group=100)
+    dp.add_error_handler(error_handler)
+    instrument_dispatcher(dp)
+    watchdog.start()
+    install_signal_handler(deliver_profile)
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    
+    # Só uma ingestão faz polling. Sem passagem de bastão neste modo: o standby
+    # assume quando o lease é liberado no desligamento ou expira
+    leader = LeaderLease(create_lease_store())
+    leader.wait_for_leadership()
+    leader.start(on_lost=lambda: os.kill(os.getpid(), signal.SIGTERM))
+    
+    # Workers só depois do lease: os de um standby disputariam os mesmos arquivos
+    router.start()
+    updater.job_queue.run_repeating(check_shard_workers, interval=WORKER_CHECK_INTERVAL, context=router)
+    
+    update_tracker.pending_source = router.pending
+    update_tracker.load()
+    # Updates que a execução anterior encaminhou e nenhum worker confirmou
+    for data in update_tracker.pending_updates:
+        router.route(Update.de_json(data, updater.bot))
+    if update_tracker.pending_updates:
+        logger.warning("%s updates não confirmados da execução anterior reenviados aos workers",
+                       len(update_tracker.pending_updates))
+        update_tracker.pending_updates = []
+    updater.last_update_id = catch_up(updater.bot, dp, update_tracker, allowed_updates=ALLOWED_UPDATES)
+    updater.job_queue.run_repeating(save_update_offset, interval=UPDATE_OFFSET_SAVE_INTERVAL)
+    
+    logger.info("Starting bot polling (%s workers)...", BOT_WORKERS)
+    updater.start_polling(timeout=30, drop_pending_updates=False, poll_interval=1.0,
+                          allowed_updates=ALLOWED_UPDATES)
+    updater.idle(stop_signals=(signal.SIGINT, signal.SIGTERM, signal.SIGABRT))
+    
+    # Os workers terminam o que já receberam; o que ficar sem confirmação
+    # é gravado junto com o offset e reenviado na próxima execução
+    router.stop()
+    update_tracker.save(force=True)
+    leader.release()
+
+def save_sessions(context: CallbackContext):
+    """Append changed user_data and conversation states to the session journal (job)"""
+    session_store.flush()
+
+def evict_idle_sessions(context: CallbackContext):
+    """Drop expired sessions and, above the memory cap, the least recently used ones (job)"""
+    session_store.evict(context.dispatcher)
+    session_store.flush()
+
+def session_keyboard(user_id):
+    return ADMIN_KEYBOARD if str(user_id) == ADMIN_ID else MAIN_KEYBOARD
+
+def conversation_timeout(update: Update, context: CallbackContext):
+    """Tell the user a stalled conversation expired (ConversationHandler.TIMEOUT state)"""
+    if not update.effective_user:
+        return
+    user_id = update.effective_user.id
+    session_store.pop_expired(user_id)
+    for key in SESSION_FLOW_KEYS:
+        context.user_data.pop(key, None)
+    context.dispatcher.update_persistence(update)
+    outbound.send_message(
+        chat_id=update.effective_chat.id if update.effective_chat else user_id,
+        text=SESSION_EXPIRED_TEXT,
+        reply_markup=session_keyboard(user_id),
+        priority=PRIORITY_CUSTOMER
+    )
+
+def notify_expired_session(update: Update, context: CallbackContext):
+    """Explain, once, that a conversation was dropped by session eviction"""
+    if not update.effective_user:
+        return
+    if update.callback_query and not SESSION_CALLBACKS.match(update.callback_query.data or ""):
+        # Menu, pedidos, pagamento e ações do admin não dependem da sessão:
+        # seguem normalmente e o aviso fica para quando fizer diferença
+        return
+    if not session_store.pop_expired(update.effective_user.id):
+        return
+    user_id = update.effective_user.id
+    if update.callback_query:
+        # Botões do fluxo interrompido dependem de dados que não existem mais
+        answer_query(update.callback_query, SESSION_EXPIRED_TEXT.replace("\n\n", " "), show_alert=True)
+        raise DispatcherHandlerStop()
+    if update.message and not (update.message.text or "").startswith('/'):
+        update.message.reply_text(SESSION_EXPIRED_TEXT, reply_markup=session_keyboard(user_id))
+
 def error_handler(update, context):
     """Log errors raised by handlers"""
     try:
@@ -4220,38 +5235,190 @@ def error_handler(update, context):
             
         log_error(context.error, f"User {user_id}")
     except Exception as e:
-        logger.error(f"ERROR - Error details: {e}")
+        logger.error("ERROR - Error details: %s", e)
+
+# ESTATÍSTICAS
+
+def stats_command(update: Update, context: CallbackContext):
+    """Show sales totals from the rollups (admin only)
+
+    Uso: /stats [dias] (padrão: 7).
+    """
+    if str(update.effective_user.id) != ADMIN_ID:
+        update.message.reply_text(
+            "⛔ Você não tem permissão para usar este comando.",
+            reply_markup=MAIN_KEYBOARD
+        )
+        return
+    
+    try:
+        days = int(context.args[0]) if context.args else 7
+    except ValueError:
+        days = 0
+    if not 1 <= days <= 366:
+        update.message.reply_text("Uso: /stats [dias] (1 a 366)", reply_markup=ADMIN_KEYBOARD)
+        return
+    
+    # Atualizar com as transições de outros workers antes de responder
+    db.sync()
+    update.message.reply_text(format_sales_summary(sales_rollup, days=days), reply_markup=ADMIN_KEYBOARD)
+
+# PROFILING
+
+PROFILES_DIR = os.path.join("data", "profiles")
+
+def deliver_profile(result, chat_id=None):
+    """Save a profile to data/profiles and send it to the admin as documents"""
+    name = f"profile-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+    files = ((f"{name}.txt", result.report().encode("utf-8")),
+             (f"{name}.folded", result.collapsed().encode("utf-8")))
+    try:
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        for filename, content in files:
+            with open(os.path.join(PROFILES_DIR, filename), "wb") as f:
+                f.write(content)
+        logger.info("Profiling salvo em %s.*", os.path.join(PROFILES_DIR, name))
+    except OSError as e:
+        logger.error("Erro ao salvar o profiling: %s", e)
+    
+    chat_id = chat_id or ADMIN_ID
+    if not chat_id or outbound.bot is None:
+        # Processo sem envio ao Telegram (ingestão): só os arquivos
+        return
+    top = "\n".join(f"{own} {label}" for label, own, _ in result.top_functions(5))
+    captions = (f"🔬 Profiling de {result.seconds:g}s (processo {os.getpid()})\n\n{top}"[:1024],
+                "Pilhas para flame graph (flamegraph.pl ou speedscope)")
+    for (filename, content), caption in zip(files, captions):
+        # Bytes, não um arquivo aberto: a fila pode reenviar o documento
+        outbound.submit("send_document", chat_id, PRIORITY_ADMIN,
+                        document=content, filename=filename, caption=caption)
+
+def profile_command(update: Update, context: CallbackContext):
+    """Profile this process for some seconds and send the report (admin only)
+
+    Uso: /profile [segundos] (padrão: 30).
+    """
+    if str(update.effective_user.id) != ADMIN_ID:
+        update.message.reply_text(
+            "⛔ Você não tem permissão para usar este comando.",
+            reply_markup=MAIN_KEYBOARD
+        )
+        return
+    
+    try:
+        seconds = int(context.args[0]) if context.args else 30
+    except ValueError:
+        seconds = 0
+    if not 1 <= seconds <= PROFILE_MAX_SECONDS:
+        update.message.reply_text(f"Uso: /profile [segundos] (1 a {PROFILE_MAX_SECONDS})", reply_markup=ADMIN_KEYBOARD)
+        return
+    
+    chat_id = update.effective_chat.id
+    # A coleta roda em uma thread própria: o worker do dispatcher fica livre
+    if not profile_in_background(seconds, lambda result: deliver_profile(result, chat_id)):
+        update.message.reply_text("⏳ Já há um profiling em andamento.", reply_markup=ADMIN_KEYBOARD)
+        return
+    update.message.reply_text(
+        f"🔬 Profiling de {seconds}s iniciado no processo {os.getpid()}; o relatório chega ao final.",
+        reply_markup=ADMIN_KEYBOARD
+    )
+
+# BROADCAST
+
+def broadcast_command(update: Update, context: CallbackContext):
+    """Create or control a broadcast to all registered users (admin only)
+
+    Uso: /broadcast <mensagem>, /broadcast status, /broadcast pausar,
+    /broadcast retomar ou /broadcast cancelar.
+    """
+    user_id = update.effective_user.id
+    
+    if str(user_id) != ADMIN_ID:
+        update.message.reply_text(
+            "⛔ Você não tem permissão para usar este comando.",
+            reply_markup=MAIN_KEYBOARD
+        )
+        return
+    
+    # Preservar quebras de linha da mensagem original
+    text = update.message.text.partition(" ")[2].strip()
+    action = text.lower()
+    
+    if not text or action == "status":
+        update.message.reply_text(
+            format_broadcast_status(broadcaster.status()) + "\n\n"
+            "Uso: /broadcast <mensagem>\n"
+            "/broadcast status | pausar | retomar | cancelar",
+            reply_markup=ADMIN_KEYBOARD
+        )
+        return
+    
+    controls = {
+        "pausar": (broadcaster.pause, "⏸️ Broadcast pausado."),
+        "retomar": (broadcaster.resume, "▶️ Broadcast retomado."),
+        "cancelar": (broadcaster.cancel, "❌ Broadcast cancelado."),
+    }
+    if action in controls:
+        control, done_message = controls[action]
+        update.message.reply_text(
+            done_message if control() else "Não há broadcast nesse estado.",
+            reply_markup=ADMIN_KEYBOARD
+        )
+        return
+    
+    current = broadcaster.status()
+    if current and current["status"] in ("running", "paused"):
+        update.message.reply_text(
+            "⚠️ Já existe um broadcast em andamento.\n\n" + format_broadcast_status(current),
+            reply_markup=ADMIN_KEYBOARD
+        )
+        return
+    
+    # Pedir confirmação antes de enviar para todos
+    context.user_data['broadcast_draft'] = text
+    keyboard = [
+        [InlineKeyboardButton(f"✅ Enviar para {db.user_count()} usuários", callback_data="broadcast_confirm")],
+        [InlineKeyboardButton("❌ Descartar", callback_data="broadcast_discard")]
+    ]
+    # Sem parse_mode: a mensagem é enviada como texto simples
+    update.message.reply_text(
+        f"📣 Prévia do broadcast:\n\n{text}",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+def broadcast_callback(update: Update, context: CallbackContext):
+    """Confirm or discard a broadcast draft (admin only)"""
+    query = update.callback_query
+    answer_query(query)
+    
+    user_id = query.from_user.id
+    if str(user_id) != ADMIN_ID:
+        query.edit_message_text("❌ Você não tem permissão para realizar esta ação.")
+        return
+    
+    draft = context.user_data.pop('broadcast_draft', None)
+    if query.data == "broadcast_discard":
+        query.edit_message_text("❌ Broadcast descartado.")
+        return
+    if not draft:
+        query.edit_message_text("⚠️ Rascunho não encontrado. Envie /broadcast <mensagem> novamente.")
+        return
+    
+    try:
+        state = broadcaster.create(draft, db.iter_user_ids(), created_by=user_id)
+    except RuntimeError as e:
+        query.edit_message_text(f"⚠️ {e}.")
+        return
+    
+    query.edit_message_text(
+        "🚀 Broadcast iniciado! Você será avisado ao final.\n\n" + format_broadcast_status(state)
+    )
 
 # MAIN BOT FUNCTION
 
-def main():
-    """Run the bot"""
+def main(shard_updates=None, shard_acks=None):
+    """Run the bot (or, with shard_updates, one worker of the multi-process mode)"""
     try:
-        # Verificar e resolver conflitos de instâncias do bot em execução
-        # (para evitar o erro "terminated by other getUpdates request")
-        try:
-            # Verificar processos existentes com o mesmo TOKEN
-            import psutil
-            current_pid = os.getpid()
-            for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
-                if proc.info['pid'] == current_pid:
-                    continue
-                
-                cmdline = proc.info.get('cmdline', [])
-                if cmdline and len(cmdline) > 1:
-                    # Verificar se é uma instância Python executando este script
-                    if (('python' in proc.info['name'].lower() or 'python3' in proc.info['name'].lower()) 
-                            and any(x.endswith('bot_completo.py') for x in cmdline)):
-                        logger.warning(f"Encontrada outra instância do bot (PID: {proc.info['pid']}). Terminando...")
-                        try:
-                            proc.terminate()
-                            proc.wait(timeout=5)
-                            logger.info(f"Instância anterior (PID: {proc.info['pid']}) encerrada.")
-                        except Exception as e:
-                            logger.error(f"Erro ao encerrar instância anterior: {e}")
-        except Exception as e:
-            logger.warning(f"Não foi possível verificar outras instâncias: {e}")
-            
         # Verifica se estamos no Heroku
         is_heroku = bool(os.environ.get('DYNO'))
         
@@ -4259,39 +5426,29 @@ def main():
         data_dir = "data"
         os.makedirs(data_dir, exist_ok=True)
         
-        # Verificar arquivos de persistência
-        users_file = os.path.join(data_dir, "users.json")
-        orders_file = os.path.join(data_dir, "orders.json")
+        # Verificar arquivos de persistência (usuários e pedidos ficam em data/store.db)
         carts_file = os.path.join(data_dir, "carts.json")
         
         # Criar arquivos vazios se não existirem
-        if not os.path.exists(users_file):
-            with open(users_file, 'w', encoding='utf-8') as f:
-                json.dump({}, f)
-            logger.info(f"Arquivo {users_file} criado")
-                
-        if not os.path.exists(orders_file):
-            with open(orders_file, 'w', encoding='utf-8') as f:
-                json.dump({}, f)
-            logger.info(f"Arquivo {orders_file} criado")
-                
         if not os.path.exists(carts_file):
             with open(carts_file, 'w', encoding='utf-8') as f:
                 json.dump({}, f)
-            logger.info(f"Arquivo {carts_file} criado")
+            logger.info("Arquivo %s criado", carts_file)
     except Exception as e:
-        logger.error(f"Erro durante a inicialização dos arquivos de dados: {e}")
+        logger.error("Erro durante a inicialização dos arquivos de dados: %s", e)
     
     # Tentativa de usar o sistema de persistência anterior como fallback
+    # (uma vez só no modo multiprocesso: pela ingestão, não por cada worker)
     try:
-        # Importa e inicializa o módulo de persistência de dados
-        from persistent_data import start_backup_service
-        
-        # Inicia o serviço de backup automático
-        data_manager = start_backup_service()
-        logger.info("Serviço de persistência de dados legado iniciado como backup")
+        if not IS_WORKER:
+            # Importa e inicializa o módulo de persistência de dados
+            from persistent_data import start_backup_service
+            
+            # Inicia o serviço de backup automático
+            data_manager = start_backup_service()
+            logger.info("Serviço de persistência de dados legado iniciado como backup")
     except Exception as e:
-        logger.info(f"Usando sistema de persistência JSON integrado: {e}")
+        logger.info("Usando sistema de persistência JSON integrado: %s", e)
     
     # Detecção de ambiente: Heroku, Google Cloud ou outro
     is_heroku = 'DYNO' in os.environ
@@ -4309,7 +5466,7 @@ def main():
             app_name = os.environ.get('HEROKU_APP_NAME')
             if app_name:
                 keep_alive_url = f"https://{app_name}.herokuapp.com"
-                logger.info(f"URL inferida: {keep_alive_url}")
+                logger.info("URL inferida: %s", keep_alive_url)
             else:
                 logger.warning("Não foi possível determinar a URL. Keep-alive desativado.")
     elif is_gcp:
@@ -4320,13 +5477,32 @@ def main():
         logger.info("Ambiente local ou outro serviço detectado")
         keep_alive_url = None
     
+    if IS_INGEST:
+        try:
+            run_ingest()
+        except Exception as e:
+            logger.error("Erro crítico na ingestão de updates: %s", e)
+            sys.exit(1)
+        return
+    
     try:
         # Create the Updater and pass it your bot's token
-        updater = Updater(TOKEN, use_context=True)
+        # user_data e estados das conversas sobrevivem a reinícios
+        updater = build_updater()
         
         # Get the dispatcher to register handlers
         dp = updater.dispatcher
         
+        # Deduplicação e registro do offset de cada update (primeiro e último grupos);
+        # no modo multiprocesso isso é feito pela ingestão
+        if not IS_WORKER:
+            dp.add_handler(TypeHandler(Update, skip_duplicate_update), group=-100)
+            dp.add_handler(TypeHandler(Update, mark_update_processed), group=100)
+        
+        # Aviso de sessão expirada antes dos handlers normais
+        dp.add_handler(TypeHandler(Update, notify_expired_session), group=-99)
+        timeout_state = {ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout)]}
+        
         # Registration conversation handler
         registration_handler = ConversationHandler(
             entry_points=[CommandHandler('start', start)],
@@ -4336,8 +5512,12 @@ def main():
                     MessageHandler(Filters.contact, handle_phone),
                     MessageHandler(Filters.text & ~Filters.command, handle_phone)
                 ],
+                **timeout_state
             },
-            fallbacks=[CommandHandler('cancel', cancel)]
+            fallbacks=[CommandHandler('cancel', cancel)],
+            conversation_timeout=SESSION_CONVERSATION_TIMEOUT,
+            name='registration',
+            persistent=True
         )
         dp.add_handler(registration_handler)
         
@@ -4374,8 +5554,12 @@ def main():
                     CallbackQueryHandler(admin_edit_discount, pattern=r'^admin_set_discount_'),
                     MessageHandler(Filters.text & ~Filters.command, admin_handle_edit_value)
                 ],
+                **timeout_state
             },
-            fallbacks=[CommandHandler('cancel', admin_cancel)]
+            fallbacks=[CommandHandler('cancel', admin_cancel)],
+            conversation_timeout=SESSION_CONVERSATION_TIMEOUT,
+            name='admin_products',
+            persistent=True
         )
         dp.add_handler(admin_product_conv)
         
@@ -4396,14 +5580,16 @@ def main():
         dp.add_handler(MessageHandler(Filters.regex(r'^🛒 Ver Carrinho$'), view_cart))
         dp.add_handler(CallbackQueryHandler(view_cart_callback, pattern=r'^view_cart$'))
         dp.add_handler(CallbackQueryHandler(clear_cart, pattern=r'^clear_cart$'))
-        dp.add_handler(CallbackQueryHandler(checkout, pattern=r'^checkout$'))
+        # Checkout e verificação de pagamento rodam fora da thread do dispatcher:
+        # lentidão do Mercado Pago não bloqueia navegação e carrinho
+        dp.add_handler(CallbackQueryHandler(checkout, pattern=r'^checkout$', run_async=True))
         
         # Handler para adicionar ao carrinho
         def add_cart_handler(update, context):
             # Função interna para adicionar ao carrinho
             try:
                 query = update.callback_query
-                query.answer()
+                answer_query(query)
                 user_id = query.from_user.id
                 
                 # Verificar se o produto está na sessão
@@ -4435,10 +5621,10 @@ def main():
                     reply_markup=InlineKeyboardMarkup(keyboard)
                 )
                 
-                logger.info(f"Produto '{product['name']}' adicionado ao carrinho do usuário {user_id}")
+                logger.info("Produto '%s' adicionado ao carrinho do usuário %s", product['name'], user_id)
                 
             except Exception as e:
-                logger.error(f"Erro ao adicionar ao carrinho: {e}")
+                logger.error("Erro ao adicionar ao carrinho: %s", e)
                 try:
                     update.callback_query.edit_message_text(
                         "❌ Ocorreu um erro ao adicionar o produto ao carrinho. Por favor, tente novamente.",
@@ -4447,7 +5633,7 @@ def main():
                         ]])
                     )
                 except Exception as nested_e:
-                    logger.error(f"Erro secundário: {nested_e}")
+                    logger.error("Erro secundário: %s", nested_e)
         
         # Registrar o handler
         dp.add_handler(CallbackQueryHandler(add_cart_handler, pattern=r'^add_to_cart$'))
@@ -4456,7 +5642,7 @@ def main():
         def add_to_cart_fixed_handler(update, context):
             try:
                 query = update.callback_query
-                query.answer()
+                answer_query(query)
                 user_id = query.from_user.id
                 
                 # Verificar se o produto está na sessão
@@ -4496,10 +5682,10 @@ def main():
                     reply_markup=InlineKeyboardMarkup(keyboard)
                 )
                 
-                logger.info(f"Produto de preço fixo '{product['name']}' adicionado ao carrinho do usuário {user_id}")
+                logger.info("Produto de preço fixo '%s' adicionado ao carrinho do usuário %s", product['name'], user_id)
                 
             except Exception as e:
-                logger.error(f"Erro ao adicionar produto de preço fixo ao carrinho: {e}")
+                logger.error("Erro ao adicionar produto de preço fixo ao carrinho: %s", e)
                 try:
                     update.callback_query.edit_message_text(
                         "❌ Ocorreu um erro ao adicionar o produto ao carrinho. Por favor, tente novamente.",
@@ -4508,17 +5694,18 @@ def main():
                         ]])
                     )
                 except Exception as nested_e:
-                    logger.error(f"Erro secundário: {nested_e}")
+                    logger.error("Erro secundário: %s", nested_e)
                     
         # Registrar o handler para produtos de preço fixo
         dp.add_handler(CallbackQueryHandler(add_to_cart_fixed_handler, pattern=r'^add_to_cart_fixed$'))
         
         # Payment handlers
-        dp.add_handler(CallbackQueryHandler(check_payment_status, pattern=r'^check_payment_'))
+        dp.add_handler(CallbackQueryHandler(tracked_check_payment_status, pattern=r'^check_payment_', run_async=True))
         
         # Order handlers
         dp.add_handler(MessageHandler(Filters.regex(r'^📋 Meus Pedidos$'), list_orders))
         dp.add_handler(CallbackQueryHandler(order_details, pattern=r'^order_details_'))
+        dp.add_handler(CallbackQueryHandler(show_pix_qr_callback, pattern=r'^show_pix_'))
         dp.add_handler(CallbackQueryHandler(check_payment_callback, pattern=r'^back_to_orders$'))
         
         # Handler para o botão Admin no teclado de administrador
@@ -4532,8 +5719,12 @@ def main():
             ],
             states={
                 ADMIN_AUTH: [MessageHandler(Filters.text & ~Filters.command, admin_auth_handler)],
+                **timeout_state
             },
-            fallbacks=[CommandHandler('cancel', cancel)]
+            fallbacks=[CommandHandler('cancel', cancel)],
+            conversation_timeout=SESSION_CONVERSATION_TIMEOUT,
+            name='admin_auth',
+            persistent=True
         )
         dp.add_handler(admin_auth_conv)
         
@@ -4543,6 +5734,11 @@ def main():
         dp.add_handler(CallbackQueryHandler(list_pending_orders, pattern=r'^admin_back_to_pending$'))
         dp.add_handler(CallbackQueryHandler(mark_as_delivered, pattern=r'^admin_deliver_'))
         dp.add_handler(CallbackQueryHandler(cancel_order, pattern=r'^admin_cancel_'))
+        dp.add_handler(CallbackQueryHandler(admin_digest_callback, pattern=r'^admin_digest_'))
+        dp.add_handler(CommandHandler('broadcast', broadcast_command))
+        dp.add_handler(CommandHandler('stats', stats_command))
+        dp.add_handler(CommandHandler('profile', profile_command))
+        dp.add_handler(CallbackQueryHandler(broadcast_callback, pattern=r'^broadcast_(confirm|discard)$'))
         
         # General commands
         dp.add_handler(CommandHandler('help', help_command))
@@ -4553,47 +5749,138 @@ def main():
         # Error handler
         dp.add_error_handler(error_handler)
         
+        # Métricas por handler (depois de todos registrados) e vigilância de
+        # updates lentos; cada worker na sua porta
+        instrument_dispatcher(dp)
+        watchdog.start()
+        # kill -USR2 <pid>: profiling deste processo, enviado ao admin
+        install_signal_handler(deliver_profile)
+        if METRICS_PORT:
+            start_metrics_server(METRICS_PORT + (WORKER_INDEX + 1 if IS_WORKER else 0))
+        
+        # Aguardar o lease de líder (standby com handlers e dados já carregados);
+        # havendo um líder, pedir a passagem de bastão a ele. Workers não
+        # disputam o lease: quem o detém é o processo de ingestão
+        leader = LeaderLease(create_lease_store())
+        waited_for = []
+        
+        def request_handoff(current):
+            waited_for.append(current)
+            handoff.request(leader.holder)
+        
+        handoff_state = None
+        if not IS_WORKER:
+            # Consulta frequente para assumir logo que o líder liberar o lease
+            leader.wait_for_leadership(on_waiting=request_handoff, poll_interval=0.2)
+            handoff_state = handoff.take_state(leader.holder) if waited_for else None
+            if waited_for:
+                refresh_after_standby(dp)
+            # Se o lease se perder, parar como em um SIGTERM para não disputar o polling
+            leader.start(on_lost=lambda: os.kill(os.getpid(), signal.SIGTERM))
+            handoff.watch(leader.holder, on_request=lambda request: hand_over(updater, leader, request))
+        
+        # Agenda de expiração gravada só por quem a usa: o líder, já com os dados
+        # atualizados após a espera, ou o worker, que tem o arquivo do seu shard.
+        # Um standby que a gravasse ao importar sobrescreveria a do líder
+        reconcile_expiry_schedule()
+        
+        # Expiração em lote de pedidos não pagos e carrinhos abandonados
+        updater.job_queue.run_repeating(
+            expire_stale_entries,
+            interval=EXPIRY_CHECK_INTERVAL,
+            first=EXPIRY_CHECK_INTERVAL
+        )
+        
+        # Fila de saída (avisos a clientes e notificações do admin)
+        outbound.start(updater.bot)
+        
+        # Verificações de pagamento que o processo anterior não terminou
+        if handoff_state:
+            resume_payment_checks(dp, handoff_state.get("payment_checks", []))
+        
+        # Entrega das notificações do outbox (inclusive as pendentes de antes do reinício)
+        updater.job_queue.run_repeating(drain_outbox, interval=OUTBOX_INTERVAL, first=1)
+        
+        # Retomar um broadcast interrompido por reinício
+        broadcaster.start()
+        
+        # Gravação incremental das sessões e descarte das inativas ou acima do limite de memória
+        updater.job_queue.run_repeating(save_sessions, interval=SESSION_FLUSH_INTERVAL, first=SESSION_FLUSH_INTERVAL)
+        updater.job_queue.run_repeating(evict_idle_sessions, interval=SESSION_EVICT_INTERVAL, first=SESSION_EVICT_INTERVAL)
+        
+        # Resumo de pedidos do admin durante rajadas
+        updater.job_queue.run_repeating(
+            flush_admin_digest,
+            interval=ADMIN_DIGEST_INTERVAL,
+            first=ADMIN_DIGEST_INTERVAL
+        )
+        
+        # Arquivo de pedidos encerrados (a primeira execução inclui o histórico que faltar)
+        if order_archive is not None:
+            updater.job_queue.run_repeating(flush_order_archive, interval=ARCHIVE_FLUSH_INTERVAL, first=10)
+        
         # Configura um keep-alive para o Heroku
-        if keep_alive_url:
-            logger.info(f"Configurando keep-alive para Heroku: {keep_alive_url}")
+        if keep_alive_url and not IS_WORKER:
+            logger.info("Configurando keep-alive para Heroku: %s", keep_alive_url)
             
             def keep_alive_ping():
                 import requests
                 try:
                     response = requests.get(keep_alive_url)
-                    logger.info(f"Keep-alive ping: {response.status_code}")
+                    logger.info("Keep-alive ping: %s", response.status_code)
                 except Exception as e:
-                    logger.error(f"Keep-alive error: {e}")
+                    logger.error("Keep-alive error: %s", e)
             
             # Adiciona o job à scheduler para rodar a cada 20 minutos (evitar sleep)
             job_queue = updater.job_queue
             job_queue.run_repeating(lambda ctx: keep_alive_ping(), interval=1200)
         
+        # Worker: os updates chegam pela fila da ingestão em vez do polling
+        if IS_WORKER:
+            serve_shard(updater, shard_updates, shard_acks)
+            session_store.flush()
+            outbound.stop()
+            return
+        
         # Start the Bot - configurar com parâmetros mais seguros para maior estabilidade
         logger.info("Starting bot polling...")
         
-        # Limpar mensagens pendentes para evitar conflitos e mensagens antigas
-        try:
-            # Usar getUpdates com offset -1 e limit 1 para simplesmente descartar atualizações pendentes
-            updater.bot.get_updates(offset=-1, limit=1, timeout=1)
-            logger.info("Mensagens pendentes descartadas com sucesso")
-        except Exception as e:
-            logger.warning(f"Erro ao limpar mensagens pendentes: {e}")
+        # Processar o backlog acumulado durante o reinício (em vez de descartá-lo),
+        # continuando do último update gravado
+        update_tracker.load()
+        if handoff_state:
+            update_tracker.adopt(handoff_state["last_update_id"])
+        updater.last_update_id = catch_up(updater.bot, dp, update_tracker, allowed_updates=ALLOWED_UPDATES)
+        updater.job_queue.run_repeating(save_update_offset, interval=UPDATE_OFFSET_SAVE_INTERVAL)
         
         # Parâmetros otimizados para Heroku e estabilidade 24/7
         # Configurações compatíveis com python-telegram-bot v13.15
         updater.start_polling(
             timeout=30,  # Este é o único timeout usado na versão 13.15
-            drop_pending_updates=True, 
+            drop_pending_updates=False,
             poll_interval=1.0,
-            allowed_updates=['message', 'callback_query', 'chat_member']
+            allowed_updates=ALLOWED_UPDATES
         )
         
         # Run the bot until the user presses Ctrl-C or the process receives SIGINT/SIGTERM
         updater.idle(stop_signals=(signal.SIGINT, signal.SIGTERM, signal.SIGABRT))
         
+        # Após uma passagem de bastão o idle() termina sem sinal: parar o que falta
+        handoff.stop()
+        updater.stop()
+        session_store.flush()
+        if not handoff.completed:
+            flush_order_archive()
+        
+        # Entregar o que ainda estiver na fila de saída antes de sair
+        outbound.stop()
+        if not handoff.completed:
+            update_tracker.save()
+            # Liberar o lease só depois de gravar o offset: o standby continua de onde paramos
+            leader.release()
+        
     except Exception as e:
-        logger.error(f"Erro crítico ao iniciar o bot: {e}")
+        logger.error("Erro crítico ao iniciar o bot: %s", e)
         sys.exit(1)
 
 if __name__ == '__main__':
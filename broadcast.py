@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de envio em massa (broadcast) para os usuários cadastrados.
+Ao criar um broadcast, os IDs dos destinatários são gravados em um arquivo
+(um por linha) e o envio percorre esse arquivo em lotes, pela fila de saída
+com prioridade baixa, sem carregar os objetos de usuário. O progresso (posição
+no arquivo e contadores) é gravado a cada lote, então um reinício retoma o
+envio de onde parou. Usuários que bloquearam o bot são registrados e ignorados
+nos próximos broadcasts.
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+from metrics import registry
+from outbound_queue import PRIORITY_BULK
+
+logger = logging.getLogger('broadcast')
+
+BROADCAST_STATE_FILE = os.path.join("data", "broadcast.json")
+BROADCAST_IDS_FILE = os.path.join("data", "broadcast_ids.txt")
+BLOCKED_USERS_FILE = os.path.join("data", "blocked_users.txt")
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "200"))
+# Mensagens do broadcast aguardando na fila de saída ao mesmo tempo
+BROADCAST_MAX_IN_FLIGHT = 50
+
+# Erros do Telegram que indicam que o usuário não pode mais receber mensagens
+BLOCKED_ERRORS = ("blocked by the user", "user is deactivated", "chat not found", "bot was kicked")
+
+broadcast_messages_counter = registry.counter(
+    "broadcast_messages_total",
+    "Mensagens de broadcast por resultado",
+    labels=("outcome",)
+)
+
+RUNNING = "running"
+PAUSED = "paused"
+DONE = "done"
+CANCELLED = "cancelled"
+
+class BroadcastEngine:
+    """Envio em massa retomável com registro de usuários bloqueados."""
+
+    def __init__(self, outbound, state_file=BROADCAST_STATE_FILE, ids_file=BROADCAST_IDS_FILE,
+                 blocked_file=BLOCKED_USERS_FILE, chunk_size=BROADCAST_CHUNK_SIZE,
+                 max_in_flight=BROADCAST_MAX_IN_FLIGHT, on_finish=None):
+        """Inicializa o motor de broadcast.
+
+        Args:
+            outbound (OutboundQueue): Fila de saída (aplica os limites da Bot API)
+            state_file (str): Arquivo JSON com o estado e o progresso do broadcast
+            ids_file (str): Arquivo com os IDs dos destinatários, um por linha
+            blocked_file (str): Arquivo com os IDs dos usuários que bloquearam o bot
+            chunk_size (int): Destinatários por lote (o progresso é gravado a cada lote)
+            max_in_flight (int): Mensagens pendentes na fila de saída ao mesmo tempo
+            on_finish (callable): Chamado com o estado final quando o broadcast termina
+        """
+        self.outbound = outbound
+        self.state_file = state_file
+        self.ids_file = ids_file
+        self.blocked_file = blocked_file
+        self.chunk_size = max(1, chunk_size)
+        self.max_in_flight = max(1, max_in_flight)
+        self.on_finish = on_finish
+
+        self._lock = threading.Lock()
+        self._state = self._load_state()
+        self._blocked = self._load_blocked()
+        self._thread = None
+        self._halt = threading.Event()
+
+    # API pública
+
+    def create(self, text, user_ids, parse_mode=None, created_by=None):
+        """Cria um broadcast e inicia o envio.
+
+        Args:
+            text (str): Texto da mensagem
+            user_ids (iterable): IDs dos destinatários (consumidos em streaming)
+            parse_mode (str): Modo de formatação do Telegram, se houver
+            created_by: ID do admin que criou o broadcast
+
+        Returns:
+            dict: Estado do novo broadcast
+        """
+        with self._lock:
+            if self._state and self._state["status"] in (RUNNING, PAUSED):
+                raise RuntimeError("Já existe um broadcast em andamento")
+
+            os.makedirs(os.path.dirname(self.ids_file) or ".", exist_ok=True)
+            total = skipped = 0
+            tmp_file = f"{self.ids_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                for user_id in user_ids:
+                    if str(user_id) in self._blocked:
+                        skipped += 1
+                        continue
+                    f.write(f"{user_id}\n")
+                    total += 1
+            os.replace(tmp_file, self.ids_file)
+
+            self._state = {
+                "id": uuid.uuid4().hex[:8],
+                "text": text,
+                "parse_mode": parse_mode,
+                "created_by": created_by,
+                "created_at": datetime.now().isoformat(),
+                "status": RUNNING,
+                "total": total,
+                "offset": 0,
+                "processed": 0,
+                "sent": 0,
+                "failed": 0,
+                "blocked": 0,
+                "skipped_blocked": skipped,
+            }
+            self._save_state()
+            logger.info("Broadcast %s criado para %s usuários (%s bloqueados ignorados)", self._state['id'], total, skipped)
+            state = dict(self._state)
+
+        self.start()
+        return state
+
+    def status(self):
+        """Retorna uma cópia do estado do broadcast atual ou do último, ou None."""
+        with self._lock:
+            return dict(self._state) if self._state else None
+
+    def pause(self):
+        return self._set_status(PAUSED, (RUNNING,))
+
+    def resume(self):
+        resumed = self._set_status(RUNNING, (PAUSED,))
+        if resumed:
+            self.start()
+        return resumed
+
+    def cancel(self):
+        return self._set_status(CANCELLED, (RUNNING, PAUSED))
+
+    def stop(self, timeout=10):
+        """Interrompe o envio neste processo sem mudar o status gravado.
+
+        Usado na passagem de bastão: o progresso fica gravado e o próximo
+        processo retoma o broadcast com reload() e start().
+        """
+        self._halt.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+
+    def reload(self):
+        """Relê o estado e os bloqueados gravados por outro processo."""
+        with self._lock:
+            self._state = self._load_state()
+            self._blocked = self._load_blocked()
+        self._halt.clear()
+
+    def is_blocked(self, user_id):
+        return str(user_id) in self._blocked
+
+    def start(self):
+        """Inicia (ou retoma após um reinício) o envio em uma thread."""
+        with self._lock:
+            if not self._state or self._state["status"] != RUNNING:
+                return False
+            if self._thread and self._thread.is_alive():
+                return True
+            self._thread = threading.Thread(target=self._run, name="broadcast", daemon=True)
+            self._thread.start()
+        if self._state["offset"]:
+            logger.info(
+                "Retomando broadcast %s: "
+                "%s/%s já processados",
+                self._state['id'], self._state['processed'], self._state['total']
+            )
+        return True
+
+    # Implementação
+
+    def _set_status(self, status, allowed):
+        with self._lock:
+            if not self._state or self._state["status"] not in allowed:
+                return False
+            self._state["status"] = status
+            self._save_state()
+        logger.info("Broadcast %s: %s", self._state['id'], status)
+        return True
+
+    def _run(self):
+        try:
+            with open(self.ids_file, 'rb') as f:
+                f.seek(self._state["offset"])
+                while True:
+                    with self._lock:
+                        if self._state["status"] != RUNNING or self._halt.is_set():
+                            return
+                    chunk = []
+                    for _ in range(self.chunk_size):
+                        line = f.readline()
+                        if not line:
+                            break
+                        chunk.append((line.decode().strip(), f.tell()))
+                    if not chunk:
+                        break
+                    offset, processed, results = self._send_chunk(chunk)
+                    with self._lock:
+                        for key, value in results.items():
+                            self._state[key] += value
+                        if processed:
+                            self._state["offset"] = offset
+                            self._state["processed"] += processed
+                        self._save_state()
+                    if processed < len(chunk):
+                        return  # pausado, cancelado ou interrompido no meio do lote
+        except Exception as e:
+            logger.error("Erro no broadcast %s: %s", self._state.get('id'), e)
+            return
+
+        with self._lock:
+            self._state["status"] = DONE
+            self._state["finished_at"] = datetime.now().isoformat()
+            self._save_state()
+            state = dict(self._state)
+        logger.info(
+            "Broadcast %s concluído: %s enviados, "
+            "%s bloqueados, %s falhas",
+            state['id'], state['sent'], state['blocked'], state['failed']
+        )
+        if self.on_finish:
+            try:
+                self.on_finish(state)
+            except Exception as e:
+                logger.error("Erro ao avisar a conclusão do broadcast: %s", e)
+
+    def _send_chunk(self, chunk):
+        """Envia um lote de (user_id, posição após a linha).
+
+        Returns:
+            tuple: (posição após o último destinatário processado, quantidade
+                processada, contadores do lote); a quantidade fica menor que o
+                lote quando o broadcast é pausado ou cancelado no meio
+        """
+        in_flight = deque()
+        results = {"sent": 0, "failed": 0, "blocked": 0}
+        new_blocked = []
+        offset = processed = 0
+
+        def collect(user_id, future):
+            try:
+                future.result()
+            except Exception as e:
+                error = str(e).lower()
+                if any(reason in error for reason in BLOCKED_ERRORS):
+                    results["blocked"] += 1
+                    new_blocked.append(user_id)
+                    broadcast_messages_counter.inc(outcome="blocked")
+                else:
+                    results["failed"] += 1
+                    broadcast_messages_counter.inc(outcome="failed")
+            else:
+                results["sent"] += 1
+                broadcast_messages_counter.inc(outcome="sent")
+
+        for user_id, line_end in chunk:
+            if self._state["status"] != RUNNING or self._halt.is_set():
+                break
+            offset, processed = line_end, processed + 1
+            if not user_id or user_id in self._blocked:
+                continue
+            kwargs = {"parse_mode": self._state["parse_mode"]} if self._state["parse_mode"] else {}
+            future = self.outbound.send_message(
+                chat_id=int(user_id), text=self._state["text"], priority=PRIORITY_BULK, **kwargs
+            )
+            in_flight.append((user_id, future))
+            while len(in_flight) >= self.max_in_flight:
+                collect(*in_flight.popleft())
+
+        while in_flight:
+            collect(*in_flight.popleft())
+
+        if new_blocked:
+            with self._lock:
+                self._record_blocked(new_blocked)
+        return offset, processed, results
+
+    def _record_blocked(self, user_ids):
+        self._blocked.update(user_ids)
+        try:
+            with open(self.blocked_file, 'a', encoding='utf-8') as f:
+                f.writelines(f"{user_id}\n" for user_id in user_ids)
+        except Exception as e:
+            logger.error("Erro ao registrar usuários bloqueados: %s", e)
+
+    def _load_blocked(self):
+        if not os.path.exists(self.blocked_file):
+            return set()
+        try:
+            with open(self.blocked_file, 'r', encoding='utf-8') as f:
+                return {line.strip() for line in f if line.strip()}
+        except Exception as e:
+            logger.error("Erro ao carregar usuários bloqueados: %s", e)
+            return set()
+
+    def _load_state(self):
+        if not os.path.exists(self.state_file):
+            return None
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error("Erro ao carregar o estado do broadcast: %s", e)
+            return None
+
+    def _save_state(self):
+        try:
+            os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+            self._state["updated_at"] = time.time()
+            tmp_file = f"{self.state_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self._state, f, ensure_ascii=False)
+            os.replace(tmp_file, self.state_file)
+        except Exception as e:
+            logger.error("Erro ao salvar o estado do broadcast: %s", e)
+
+def format_status(state):
+    """Texto de status de um broadcast para o admin."""
+    if not state:
+        return "📣 Nenhum broadcast registrado."
+    labels = {RUNNING: "▶️ Em andamento", PAUSED: "⏸️ Pausado", DONE: "✅ Concluído", CANCELLED: "❌ Cancelado"}
+    total = state["total"] or 1
+    return (
+        f"📣 Broadcast {state['id']} - {labels.get(state['status'], state['status'])}\n\n"
+        f"Progresso: {state['processed']}/{state['total']} ({state['processed'] * 100 // total}%)\n"
+        f"✅ Enviados: {state['sent']}\n"
+        f"🚫 Bloquearam o bot: {state['blocked']} (+{state['skipped_blocked']} ignorados)\n"
+        f"⚠️ Falhas: {state['failed']}"
+    )
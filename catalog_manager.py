@@ -11,12 +11,10 @@ import json
 import logging
 import os
 from datetime import datetime
+from log_setup import setup_logging
 
 # Configuração do logger
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+setup_logging()
 logger = logging.getLogger('catalog_manager')
 
 # Diretório padrão para armazenamento do catálogo
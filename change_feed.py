@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de feed de alterações para o painel administrativo.
+Cada alteração de pedido ou usuário recebe um número de sequência crescente
+e fica em um buffer circular. O painel carrega um retrato (snapshot) uma vez
+e depois recebe só as alterações posteriores ao cursor que veio junto com o
+retrato, retomando do último cursor após uma reconexão. Cursores de outra
+execução (epoch diferente) ou antigos demais para o buffer indicam que o
+cliente precisa carregar o retrato de novo.
+"""
+
+import os
+import uuid
+import threading
+from itertools import islice
+from collections import deque
+
+CHANGE_FEED_CAPACITY = int(os.getenv("CHANGE_FEED_CAPACITY", "10000"))
+
+class ChangeFeed:
+    """Alterações recentes em ordem de sequência, com espera por novidades."""
+
+    def __init__(self, capacity=CHANGE_FEED_CAPACITY):
+        """Inicializa o feed.
+
+        Args:
+            capacity (int): Alterações mantidas para clientes que reconectam
+        """
+        self.epoch = uuid.uuid4().hex[:8]
+        self._events = deque(maxlen=max(1, capacity))
+        self._seq = 0
+        self._changed = threading.Condition()
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def cursor(self, seq=None):
+        """Cursor opaco (epoch-seq) para a sequência informada ou a atual."""
+        return f"{self.epoch}-{self._seq if seq is None else seq}"
+
+    def parse_cursor(self, cursor):
+        """Sequência de um cursor desta execução, ou None se for inválido ou de outra."""
+        epoch, _, seq = (cursor or "").partition("-")
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self._seq:
+            return None
+        return int(seq)
+
+    def publish(self, kind, key, data):
+        """Registra uma alteração.
+
+        Args:
+            kind (str): Tipo do registro ("order" ou "user")
+            key: ID do registro
+            data (dict): Registro completo após a alteração
+
+        Returns:
+            int: Sequência atribuída
+        """
+        with self._changed:
+            self._seq += 1
+            self._events.append({"seq": self._seq, "kind": kind, "id": key, "data": data})
+            self._changed.notify_all()
+            return self._seq
+
+    def since(self, seq):
+        """Alterações posteriores à sequência, ou None se parte delas já saiu do buffer."""
+        with self._changed:
+            if self._events and seq < self._events[0]["seq"] - 1:
+                return None
+            # As sequências são contíguas: o índice sai direto da diferença, e
+            # só as alterações novas são copiadas (não o buffer inteiro)
+            start = len(self._events) - (self._seq - seq)
+            return list(islice(self._events, max(0, start), None))
+
+    def wait(self, seq, timeout):
+        """Espera alterações posteriores à sequência (até timeout segundos); ver since()."""
+        with self._changed:
+            self._changed.wait_for(lambda: self._seq > seq, timeout=timeout)
+            return self.since(seq)
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de circuit breaker para dependências externas.
+Acompanha em janelas deslizantes a taxa de erros e de chamadas lentas de um
+serviço (por exemplo, o Mercado Pago). Quando o serviço degrada, o circuito
+abre e as chamadas falham imediatamente, em vez de prender os workers do bot
+esperando timeouts; depois de um intervalo, algumas chamadas de teste
+(half-open) decidem se o circuito volta a fechar.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+from metrics import registry
+
+logger = logging.getLogger('circuit_breaker')
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+# Valor numérico de cada estado para as métricas
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+breaker_state_gauge = registry.gauge(
+    "circuit_breaker_state",
+    "Estado do circuit breaker (0=fechado, 1=meio-aberto, 2=aberto)",
+    labels=("name",)
+)
+breaker_calls_counter = registry.counter(
+    "circuit_breaker_calls_total",
+    "Chamadas registradas pelo circuit breaker por resultado",
+    labels=("name", "outcome")
+)
+breaker_rejections_counter = registry.counter(
+    "circuit_breaker_rejections_total",
+    "Chamadas rejeitadas porque o circuito estava aberto",
+    labels=("name",)
+)
+breaker_transitions_counter = registry.counter(
+    "circuit_breaker_transitions_total",
+    "Mudanças de estado do circuit breaker",
+    labels=("name", "state")
+)
+
+class CircuitOpenError(Exception):
+    """Erro lançado quando o circuito está aberto e a chamada é rejeitada."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuito '{name}' aberto; nova tentativa em {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Circuit breaker com janelas deslizantes de erro e latência."""
+
+    def __init__(self, name, window_seconds=60, min_calls=5, failure_rate=0.5,
+                 slow_call_seconds=5.0, slow_call_rate=0.8, open_seconds=30,
+                 max_open_seconds=300, half_open_max_calls=1, state_file=None):
+        """Inicializa o circuit breaker.
+
+        Args:
+            name (str): Nome do serviço protegido (usado em logs e métricas)
+            window_seconds (int): Duração da janela deslizante de observação
+            min_calls (int): Mínimo de chamadas na janela antes de avaliar as taxas
+            failure_rate (float): Fração de falhas que abre o circuito
+            slow_call_seconds (float): Duração a partir da qual uma chamada é lenta
+            slow_call_rate (float): Fração de chamadas lentas que abre o circuito
+            open_seconds (int): Tempo inicial com o circuito aberto
+            max_open_seconds (int): Limite do tempo aberto após falhas repetidas no teste
+            half_open_max_calls (int): Chamadas de teste permitidas no estado meio-aberto
+            state_file (str): Arquivo JSON onde o estado é publicado para o health check
+        """
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.state_file = state_file
+
+        self._lock = threading.Lock()
+        self._calls = deque()  # (timestamp, sucesso, lenta)
+        self._failures = 0
+        self._slow = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._current_open_seconds = open_seconds
+        self._half_open_in_flight = 0
+        self._last_error = None
+
+        breaker_state_gauge.set(STATE_VALUES[CLOSED], name=name)
+        self._publish_state()
+
+    @property
+    def state(self):
+        """Estado atual do circuito, considerando a expiração do tempo aberto."""
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            return self._state
+
+    def before_call(self):
+        """Reserva uma chamada, ou lança CircuitOpenError se o circuito estiver aberto."""
+        with self._lock:
+            now = time.monotonic()
+            self._maybe_half_open(now)
+
+            if self._state == OPEN:
+                retry_after = self._opened_at + self._current_open_seconds - now
+                breaker_rejections_counter.inc(name=self.name)
+                raise CircuitOpenError(self.name, max(retry_after, 0))
+
+            if self._state == HALF_OPEN:
+                if self._half_open_in_flight >= self.half_open_max_calls:
+                    breaker_rejections_counter.inc(name=self.name)
+                    raise CircuitOpenError(self.name, 1)
+                self._half_open_in_flight += 1
+
+    def record_success(self, duration):
+        """Registra uma chamada concluída com sucesso."""
+        self._record(True, duration, None)
+
+    def record_failure(self, duration, error=None):
+        """Registra uma chamada que falhou."""
+        self._record(False, duration, error)
+
+    def call(self, func, *args, **kwargs):
+        """Executa `func` protegida pelo circuito.
+
+        Qualquer exceção conta como falha e é propagada ao chamador.
+        """
+        self.before_call()
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(time.monotonic() - start, e)
+            raise
+        self.record_success(time.monotonic() - start)
+        return result
+
+    def snapshot(self):
+        """Retorna um dicionário com o estado e as taxas da janela atual."""
+        with self._lock:
+            now = time.monotonic()
+            self._maybe_half_open(now)
+            self._prune(now)
+            total = len(self._calls)
+            retry_after = 0
+            if self._state == OPEN:
+                retry_after = max(self._opened_at + self._current_open_seconds - now, 0)
+            return {
+                "name": self.name,
+                "state": self._state,
+                "calls_in_window": total,
+                "failure_rate": round(self._failures / total, 3) if total else 0.0,
+                "slow_call_rate": round(self._slow / total, 3) if total else 0.0,
+                "retry_after": round(retry_after, 1),
+                "last_error": self._last_error,
+            }
+
+    def _record(self, success, duration, error):
+        slow = duration >= self.slow_call_seconds
+        breaker_calls_counter.inc(
+            name=self.name,
+            outcome="success" if success and not slow else "slow" if success else "failure"
+        )
+
+        with self._lock:
+            now = time.monotonic()
+            if error is not None:
+                self._last_error = str(error)[:200]
+
+            if self._state == HALF_OPEN:
+                self._half_open_in_flight = max(self._half_open_in_flight - 1, 0)
+                if success and not slow:
+                    # Teste bem-sucedido: fechar o circuito com uma janela limpa
+                    self._calls.clear()
+                    self._failures = self._slow = 0
+                    self._current_open_seconds = self.open_seconds
+                    self._transition(CLOSED)
+                else:
+                    # Teste falhou: reabrir por mais tempo (backoff exponencial)
+                    self._current_open_seconds = min(self._current_open_seconds * 2, self.max_open_seconds)
+                    self._open(now)
+                return
+
+            if self._state == OPEN:
+                # Chamada iniciada antes da abertura do circuito; apenas ignorar
+                return
+
+            self._calls.append((now, success, slow))
+            if not success:
+                self._failures += 1
+            if slow:
+                self._slow += 1
+            self._prune(now)
+
+            total = len(self._calls)
+            if total >= self.min_calls and (
+                self._failures / total >= self.failure_rate
+                or self._slow / total >= self.slow_call_rate
+            ):
+                self._open(now)
+
+    def _prune(self, now):
+        limit = now - self.window_seconds
+        while self._calls and self._calls[0][0] < limit:
+            _, success, slow = self._calls.popleft()
+            if not success:
+                self._failures -= 1
+            if slow:
+                self._slow -= 1
+
+    def _open(self, now):
+        self._opened_at = now
+        self._half_open_in_flight = 0
+        self._transition(OPEN)
+
+    def _maybe_half_open(self, now):
+        if self._state == OPEN and now - self._opened_at >= self._current_open_seconds:
+            self._half_open_in_flight = 0
+            self._transition(HALF_OPEN)
+
+    def _transition(self, state):
+        if state == self._state:
+            return
+        previous, self._state = self._state, state
+        breaker_state_gauge.set(STATE_VALUES[state], name=self.name)
+        breaker_transitions_counter.inc(name=self.name, state=state)
+
+        if state == OPEN:
+            logger.warning(
+                "Circuito '%s' ABERTO por %.0fs "
+                "(último erro: %s)",
+                self.name, self._current_open_seconds, self._last_error
+            )
+        else:
+            logger.info("Circuito '%s': %s -> %s", self.name, previous, state)
+        self._publish_state()
+
+    def _publish_state(self):
+        """Grava o estado atual em arquivo para processos externos (health check).
+
+        A passagem de aberto para meio-aberto só acontece na próxima chamada;
+        sem tráfego o arquivo continuaria dizendo "open". Por isso o instante
+        de reabertura (retry_at, relógio de parede) vai junto, e quem lê
+        considera o circuito meio-aberto depois dele.
+        """
+        if not self.state_file:
+            return
+        retry_at = None
+        if self._state == OPEN:
+            retry_at = time.time() + self._opened_at + self._current_open_seconds - time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+            tmp_file = f"{self.state_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "name": self.name,
+                    "state": self._state,
+                    "open_seconds": self._current_open_seconds,
+                    "retry_at": round(retry_at, 3) if retry_at is not None else None,
+                    "last_error": self._last_error,
+                    "updated_at": datetime.now().isoformat(),
+                    "pid": os.getpid(),
+                }, f, ensure_ascii=False)
+            os.replace(tmp_file, self.state_file)
+        except Exception as e:
+            logger.warning("Não foi possível gravar o estado do circuito '%s': %s", self.name, e)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de consultas paginadas do painel administrativo.
+Interpreta os parâmetros das APIs (/api/orders e /api/users), aplica os
+filtros e devolve uma página por cursor: o cursor codifica a chave de
+ordenação do último item entregue, então as páginas seguintes continuam
+estáveis mesmo com pedidos novos chegando. Só os itens da página são
+ordenados (heapq) e só eles recebem os dados do cliente e a projeção de campos.
+"""
+
+import json
+import heapq
+import base64
+import binascii
+from datetime import datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+ORDER_FIELDS = ("id", "user_id", "status", "payment_id", "created_at", "items", "user")
+USER_FIELDS = ("id", "nome", "telefone")
+STATS_DIMENSIONS = ("day", "product", "status")
+
+class QueryError(ValueError):
+    """Parâmetro de consulta inválido (resposta 400)."""
+
+def encode_cursor(key):
+    """Cursor opaco a partir da chave de ordenação do último item da página."""
+    raw = json.dumps(list(key), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor, types):
+    """Chave de ordenação de um cursor, conferindo o tipo de cada parte."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = tuple(json.loads(raw))
+    except (binascii.Error, ValueError, TypeError):
+        raise QueryError("cursor inválido")
+    if len(key) != len(types) or not all(isinstance(part, kind) for part, kind in zip(key, types)):
+        raise QueryError("cursor inválido")
+    return key
+
+def parse_limit(value):
+    if value in (None, ""):
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise QueryError("limit deve ser um número")
+    if limit < 1:
+        raise QueryError("limit deve ser maior que zero")
+    return min(limit, MAX_PAGE_SIZE)
+
+def parse_fields(value, allowed):
+    """Campos pedidos em fields=a,b,c (None = todos)."""
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise QueryError(f"campos desconhecidos: {', '.join(unknown)}")
+    return fields
+
+def parse_date(value, end_of_day=False):
+    """Data (AAAA-MM-DD) ou data e hora (AAAA-MM-DDTHH:MM:SS) no formato de created_at."""
+    if not value:
+        return None
+    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if fmt == "%Y-%m-%d" and end_of_day:
+            parsed = parsed.replace(hour=23, minute=59, second=59)
+        return parsed.strftime("%Y-%m-%d %H:%M:%S")
+    raise QueryError(f"data inválida: {value}")
+
+def parse_order_query(args):
+    """Filtros de /api/orders a partir dos parâmetros da URL.
+
+    Args:
+        args (dict): status=pago,entregue, user_id, since, until, cursor, limit e fields
+
+    Returns:
+        dict: Consulta normalizada
+    """
+    user_id = args.get("user_id")
+    if user_id:
+        try:
+            user_id = int(user_id)
+        except ValueError:
+            raise QueryError("user_id deve ser um número")
+    statuses = args.get("status")
+    return {
+        "statuses": {status.strip() for status in statuses.split(",") if status.strip()} if statuses else None,
+        "user_id": user_id or None,
+        "since": parse_date(args.get("since")),
+        "until": parse_date(args.get("until"), end_of_day=True),
+        "after": decode_cursor(args.get("cursor"), (str, str)),
+        "limit": parse_limit(args.get("limit")),
+        "fields": parse_fields(args.get("fields"), ORDER_FIELDS),
+    }
+
+def parse_user_query(args):
+    """Filtros de /api/users: q (nome ou telefone contém), cursor, limit e fields."""
+    return {
+        "search": (args.get("q") or "").strip().lower() or None,
+        "after": decode_cursor(args.get("cursor"), (int,)),
+        "limit": parse_limit(args.get("limit")),
+        "fields": parse_fields(args.get("fields"), USER_FIELDS),
+    }
+
+def parse_stats_query(args):
+    """Filtros de /api/stats: since/until (dias), status, product e group_by (separados por vírgula)."""
+    group_by = parse_fields(args.get("group_by"), STATS_DIMENSIONS)
+    statuses = args.get("status")
+    products = args.getlist("product") if hasattr(args, "getlist") else [args.get("product")]
+    return {
+        "since": (parse_date(args.get("since")) or "")[:10] or None,
+        "until": (parse_date(args.get("until")) or "")[:10] or None,
+        "statuses": [status.strip() for status in statuses.split(",") if status.strip()] if statuses else None,
+        "products": [product for product in products if product] or None,
+        "group_by": tuple(group_by) if group_by is not None else STATS_DIMENSIONS,
+    }
+
+def _get(record, name):
+    """Campo de um registro, seja dict ou objeto (Order, User)."""
+    if isinstance(record, dict):
+        return record.get(name)
+    return getattr(record, name, None)
+
+def order_sort_key(order):
+    """Mais recentes primeiro; o ID desempata pedidos do mesmo segundo."""
+    return (_get(order, "created_at") or "", str(_get(order, "id")))
+
+def order_matches(order, query):
+    if query["statuses"] and _get(order, "status") not in query["statuses"]:
+        return False
+    if query["user_id"] and _get(order, "user_id") != query["user_id"]:
+        return False
+    created_at = _get(order, "created_at") or ""
+    if query["since"] and created_at < query["since"]:
+        return False
+    if query["until"] and created_at > query["until"]:
+        return False
+    return True
+
+def page_orders(orders, query):
+    """Uma página de pedidos, do mais recente para o mais antigo.
+
+    Returns:
+        tuple: (pedidos da página, cursor da próxima página ou None)
+    """
+    after = query["after"]
+    candidates = (
+        order for order in orders
+        if order_matches(order, query) and (after is None or order_sort_key(order) < after)
+    )
+    page = heapq.nlargest(query["limit"] + 1, candidates, key=order_sort_key)
+    return _split_page(page, query["limit"], order_sort_key)
+
+def page_users(users, query):
+    """Uma página de usuários em ordem de ID."""
+    after = query["after"]
+    search = query["search"]
+
+    def key(user):
+        return (int(_get(user, "id")),)
+
+    candidates = (
+        user for user in users
+        if (after is None or key(user) > after)
+        and (not search or search in f"{_get(user, 'nome') or ''} {_get(user, 'telefone') or ''}".lower())
+    )
+    page = heapq.nsmallest(query["limit"] + 1, candidates, key=key)
+    return _split_page(page, query["limit"], key)
+
+def _split_page(page, limit, key):
+    if len(page) <= limit:
+        return page, None
+    page = page[:limit]
+    return page, encode_cursor(key(page[-1]))
+
+def project(record, fields):
+    """Mantém só os campos pedidos (todos se fields for None)."""
+    if fields is None:
+        return record
+    return {field: record[field] for field in fields if field in record}
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de leitura dos dados do bot pelo painel administrativo.
+O painel não mantém uma cópia própria da loja: lê os pedidos e usuários
+por uma conexão somente leitura ao SQLite em que o bot os grava
+(data/store.db), com um ou vários processos. Os arquivos JSON das versões
+anteriores do bot só são lidos enquanto o banco ainda não existe (antes da
+primeira execução do bot, que os importa).
+
+Cada fonte publica as alterações que percebe no feed de alterações
+(change_feed), que alimenta o ETag das APIs e o /api/changes.
+"""
+
+import os
+import json
+import logging
+import threading
+
+from change_feed import ChangeFeed
+from sales_stats import SalesRollup
+from shared_store import SharedStore, SHARED_STORE_FILE
+
+logger = logging.getLogger('dashboard_source')
+
+# Intervalo entre as verificações de alterações feitas pelo bot (segundos)
+DASHBOARD_POLL_INTERVAL = float(os.getenv("DASHBOARD_POLL_INTERVAL", "1"))
+
+ORDERS_FILE = os.path.join("data", "orders.json")
+USERS_FILE = os.path.join("data", "users.json")
+
+class SharedStoreSource:
+    """Dados lidos do SQLite compartilhado por uma conexão somente leitura."""
+
+    def __init__(self, path=SHARED_STORE_FILE):
+        self.store = SharedStore(path, readonly=True)
+        self.changes = ChangeFeed()
+        self._lock = threading.Lock()
+        # Só alterações posteriores à abertura; o retrato inicial vem das APIs
+        self._seq = {table: self.store.last_seq(table) for table in ("orders", "users")}
+
+    def refresh(self):
+        """Publica no feed as linhas gravadas desde a última verificação."""
+        with self._lock:
+            orders, self._seq["orders"] = self.store.changes("orders", self._seq["orders"])
+            for data in orders:
+                self.changes.publish("order", data["id"], data)
+            users, self._seq["users"] = self.store.changes("users", self._seq["users"])
+            for data in users:
+                self.changes.publish("user", int(data["id"]), data)
+
+    def iter_orders(self, statuses=None, user_id=None):
+        # Status e usuário filtrados no SQLite (colunas indexadas)
+        return self.store.iter_orders(statuses=statuses, user_id=user_id)
+
+    def iter_users(self):
+        return self.store.iter_users()
+
+    def get_user(self, user_id):
+        return self.store.get_user(user_id)
+
+class JsonFilesSource:
+    """Dados dos arquivos JSON de um bot que ainda não criou o banco, relidos só quando mudam no disco."""
+
+    def __init__(self, orders_file=ORDERS_FILE, users_file=USERS_FILE):
+        self.changes = ChangeFeed()
+        self._lock = threading.Lock()
+        self._files = {"order": orders_file, "user": users_file}
+        self._stamps = {}  # tipo -> (mtime, tamanho) do arquivo carregado
+        self._records = {"order": {}, "user": {}}
+        self.refresh()
+
+    def _load(self, kind):
+        path = self._files[kind]
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamps.get(kind):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # Arquivo no meio de uma gravação do bot: tentar na próxima verificação
+            return None
+        self._stamps[kind] = stamp
+        records = {}
+        for key, record in data.items():
+            record = dict(record)
+            if kind == "user":
+                record["id"] = int(record.get("id", key))
+            records[record["id"]] = record
+        return records
+
+    def refresh(self):
+        """Relê os arquivos alterados e publica no feed os registros que mudaram."""
+        with self._lock:
+            first_load = not self._stamps
+            for kind in ("order", "user"):
+                records = self._load(kind)
+                if records is None:
+                    continue
+                previous = self._records[kind]
+                self._records[kind] = records
+                if first_load:
+                    continue
+                for key, record in records.items():
+                    if previous.get(key) != record:
+                        self.changes.publish(kind, key, record)
+
+    def iter_orders(self, statuses=None, user_id=None):
+        return list(self._records["order"].values())
+
+    def iter_users(self):
+        return sorted(self._records["user"].values(), key=lambda user: user["id"])
+
+    def get_user(self, user_id):
+        return self._records["user"].get(user_id)
+
+def open_source():
+    """Fonte de dados do painel para este processo (ver a docstring do módulo)."""
+    if os.path.exists(SHARED_STORE_FILE):
+        logger.info("Painel lendo %s (somente leitura)", SHARED_STORE_FILE)
+        return SharedStoreSource()
+    logger.info("Painel lendo os arquivos JSON do bot até %s ser criado", SHARED_STORE_FILE)
+    return JsonFilesSource()
+
+class DashboardData:
+    """Fonte aberta no primeiro uso e verificada em segundo plano.
+
+    A fonte é escolhida no primeiro acesso. Se o banco aparecer depois
+    (primeira execução do bot com os JSON antigos), a fonte passa a ser
+    ele; o feed novo faz os painéis abertos recarregarem.
+    """
+
+    def __init__(self, poll_interval=DASHBOARD_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._source = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sales = None  # (fonte, SalesRollup, última sequência aplicada)
+        self._sales_lock = threading.Lock()
+
+    @property
+    def source(self):
+        with self._lock:
+            if self._source is None:
+                self._source = open_source()
+                # Thread iniciada no primeiro pedido, já no processo que atende
+                # (servidores que fazem fork importam o app antes)
+                threading.Thread(target=self._poll, name="dashboard-poll", daemon=True).start()
+            elif isinstance(self._source, JsonFilesSource) and os.path.exists(SHARED_STORE_FILE):
+                self._source = open_source()
+            return self._source
+
+    def sales(self):
+        """Agregados de vendas: reconstruídos uma vez por fonte e depois seguindo o feed.
+
+        Returns:
+            SalesRollup: Agregados atualizados até a alteração mais recente
+        """
+        source = self.source
+        source.refresh()
+        with self._sales_lock:
+            events = None
+            if self._sales and self._sales[0] is source:
+                _, rollup, seq = self._sales
+                events = source.changes.since(seq)
+            if events is None:
+                # Sequência lida antes: alterações durante a reconstrução são
+                # reaplicadas depois, sem efeito se já estiverem contadas
+                seq = source.changes.seq
+                rollup = SalesRollup()
+                rollup.rebuild(source.iter_orders())
+                events = source.changes.since(seq) or []
+            for event in events:
+                if event["kind"] == "order":
+                    rollup.apply(event["data"])
+            self._sales = (source, rollup, events[-1]["seq"] if events else seq)
+            return rollup
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.source.refresh()
+            except Exception as e:
+                logger.error("Erro ao verificar alterações do painel: %s", e)
+
+    def stop(self):
+        self._stop.set()
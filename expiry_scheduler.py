@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de agendamento de expirações.
+Mantém prazos (deadlines) de entradas identificadas por chave, como pedidos
+PIX não pagos e carrinhos abandonados, em um heap de mínimo. Agendar,
+reagendar e cancelar custam O(log n) (o cancelamento é preguiçoso), e buscar
+as entradas vencidas custa O(k log n) para k entradas, então o agendador se
+mantém barato mesmo com centenas de milhares de chaves. O estado é gravado
+em JSON para sobreviver a reinícios.
+"""
+
+import os
+import json
+import time
+import heapq
+import logging
+import threading
+
+logger = logging.getLogger('expiry_scheduler')
+
+class ExpiryScheduler:
+    """Agenda de prazos com heap e cancelamento preguiçoso."""
+
+    def __init__(self, state_file=None):
+        """Inicializa o agendador.
+
+        Args:
+            state_file (str): Arquivo JSON onde a agenda é persistida
+        """
+        self.state_file = state_file
+        self._heap = []        # (deadline, chave)
+        self._deadlines = {}   # chave -> deadline vigente (fonte da verdade)
+        self._lock = threading.Lock()
+        self._dirty = False
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def schedule(self, key, deadline):
+        """Agenda (ou reagenda) a expiração de uma chave.
+
+        Args:
+            key (str): Identificador da entrada (ex.: "order:ab12cd34")
+            deadline (float): Instante de expiração (timestamp Unix)
+        """
+        with self._lock:
+            self._deadlines[key] = deadline
+            heapq.heappush(self._heap, (deadline, key))
+            self._dirty = True
+            self._maybe_compact()
+
+    def cancel(self, key):
+        """Remove uma chave da agenda; a entrada do heap é descartada depois."""
+        with self._lock:
+            if self._deadlines.pop(key, None) is not None:
+                self._dirty = True
+
+    def deadline(self, key):
+        """Retorna o prazo atual de uma chave, ou None."""
+        return self._deadlines.get(key)
+
+    def pop_due(self, now=None, limit=500):
+        """Remove e retorna as chaves vencidas, até `limit` por chamada.
+
+        Args:
+            now (float): Instante de referência (padrão: agora)
+            limit (int): Tamanho máximo do lote
+
+        Returns:
+            list: Chaves cujo prazo vigente já passou, em ordem de vencimento
+        """
+        now = time.time() if now is None else now
+        due = []
+        with self._lock:
+            while self._heap and len(due) < limit:
+                deadline, key = self._heap[0]
+                if deadline > now:
+                    break
+                heapq.heappop(self._heap)
+                # Entradas canceladas ou reagendadas ficam obsoletas no heap
+                if self._deadlines.get(key) != deadline:
+                    continue
+                del self._deadlines[key]
+                due.append(key)
+            if due:
+                self._dirty = True
+        return due
+
+    def _maybe_compact(self):
+        """Reconstrói o heap quando as entradas obsoletas dominam."""
+        if len(self._heap) > 2 * len(self._deadlines) + 1024:
+            self._heap = [(deadline, key) for key, deadline in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def save(self, force=False):
+        """Grava a agenda em disco se houver alterações.
+
+        Returns:
+            bool: True se o arquivo foi gravado
+        """
+        if not self.state_file:
+            return False
+        with self._lock:
+            if not (self._dirty or force):
+                return False
+            snapshot = dict(self._deadlines)
+            self._dirty = False
+
+        try:
+            os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+            tmp_file = f"{self.state_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, separators=(',', ':'))
+            os.replace(tmp_file, self.state_file)
+            return True
+        except Exception as e:
+            logger.error("Erro ao salvar agenda de expiração: %s", e)
+            with self._lock:
+                self._dirty = True
+            return False
+
+    def load(self):
+        """Carrega a agenda gravada anteriormente, se existir."""
+        if not self.state_file or not os.path.exists(self.state_file):
+            return 0
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except Exception as e:
+            logger.error("Erro ao carregar agenda de expiração: %s", e)
+            return 0
+
+        with self._lock:
+            self._deadlines = {key: float(deadline) for key, deadline in snapshot.items()}
+            self._heap = [(deadline, key) for key, deadline in self._deadlines.items()]
+            heapq.heapify(self._heap)
+            self._dirty = False
+        logger.info("Agenda de expiração carregada com %s entradas", len(self._deadlines))
+        return len(self._deadlines)
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Servidor falso do Mercado Pago para testes de integração e de carga.
+Implementa os endpoints de pagamento usados pelo bot (criar, consultar e
+buscar pagamentos) com latência, taxa de erros e tempo de aprovação
+configuráveis, sem credenciais reais e sem acesso à internet.
+
+Uso:
+    # Iniciar o servidor
+    python fake_mercadopago.py serve --port 8765 --latency 0.05 --error-rate 0.01 --approve-after 10
+
+    # Apontar o bot (ou test_pix.py) para ele
+    export MERCADO_PAGO_BASE_URL=http://127.0.0.1:8765
+
+    # Teste de carga do funil de checkout (criação do PIX + verificações)
+    python fake_mercadopago.py load --orders 5000 --concurrency 32
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from log_setup import setup_logging
+
+setup_logging()
+logger = logging.getLogger('fake_mercadopago')
+
+# PNG 1x1 usado como QR Code falso
+FAKE_QR_PNG_BASE64 = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+class FakePaymentBackend:
+    """Estado em memória dos pagamentos do servidor falso."""
+
+    def __init__(self, latency=0.0, latency_jitter=0.0, error_rate=0.0,
+                 approve_after=5.0, reject_rate=0.0):
+        """Inicializa o backend.
+
+        Args:
+            latency (float): Latência base de cada resposta (segundos)
+            latency_jitter (float): Variação aleatória somada à latência (segundos)
+            error_rate (float): Fração de requisições respondidas com HTTP 500/503
+            approve_after (float): Segundos até um pagamento pendente ser aprovado (<0 nunca)
+            reject_rate (float): Fração de pagamentos que terminam rejeitados
+        """
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.approve_after = approve_after
+        self.reject_rate = reject_rate
+
+        self._lock = threading.Lock()
+        self._payments = {}         # id -> pagamento
+        self._by_reference = {}     # external_reference -> [ids]
+        self._by_idempotency = {}   # chave -> id
+        self._next_id = 100000000000
+        self.stats = {"create": 0, "get": 0, "search": 0, "errors": 0, "idempotent_hits": 0}
+
+    def simulate_network(self):
+        """Aplica a latência configurada e decide se a requisição deve falhar.
+
+        Returns:
+            int | None: Status HTTP de erro a ser devolvido, ou None
+        """
+        delay = self.latency + random.uniform(0, self.latency_jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            with self._lock:
+                self.stats["errors"] += 1
+            return random.choice((500, 503))
+        return None
+
+    def create(self, data, idempotency_key=None):
+        with self._lock:
+            self.stats["create"] += 1
+            if idempotency_key and idempotency_key in self._by_idempotency:
+                self.stats["idempotent_hits"] += 1
+                return 201, self._view(self._payments[self._by_idempotency[idempotency_key]])
+
+            if not data.get("transaction_amount") or data.get("payment_method_id") != "pix":
+                return 400, {"message": "invalid payment data", "error": "bad_request", "status": 400}
+
+            self._next_id += 1
+            payment_id = self._next_id
+            now = time.time()
+            decided_at = now + self.approve_after if self.approve_after >= 0 else None
+            final_status = "rejected" if random.random() < self.reject_rate else "approved"
+            qr_code = f"00020126580014br.gov.bcb.pix0136{uuid.uuid4()}5204000053039865802BR6304FAKE"
+
+            payment = {
+                "id": payment_id,
+                "status": "pending",
+                "status_detail": "pending_waiting_transfer",
+                "transaction_amount": float(data["transaction_amount"]),
+                "description": data.get("description"),
+                "payment_method_id": "pix",
+                "external_reference": data.get("external_reference"),
+                "payer": data.get("payer", {}),
+                "date_created": _iso(now),
+                "date_of_expiration": data.get("date_of_expiration") or _iso(now + 86400),
+                "point_of_interaction": {
+                    "type": "PIX",
+                    "transaction_data": {
+                        "qr_code": qr_code,
+                        "qr_code_base64": FAKE_QR_PNG_BASE64,
+                    },
+                },
+                "_decided_at": decided_at,
+                "_final_status": final_status,
+            }
+            self._payments[payment_id] = payment
+            reference = payment["external_reference"]
+            if reference:
+                self._by_reference.setdefault(reference, []).append(payment_id)
+            if idempotency_key:
+                self._by_idempotency[idempotency_key] = payment_id
+            return 201, self._view(payment)
+
+    def get(self, payment_id):
+        with self._lock:
+            self.stats["get"] += 1
+            payment = self._payments.get(payment_id)
+            if not payment:
+                return 404, {"message": "Payment not found", "error": "not_found", "status": 404}
+            return 200, self._view(payment)
+
+    def search(self, filters):
+        with self._lock:
+            self.stats["search"] += 1
+            reference = filters.get("external_reference")
+            if reference:
+                ids = self._by_reference.get(reference, [])
+            else:
+                ids = list(self._payments)
+            results = [self._view(self._payments[payment_id]) for payment_id in reversed(ids)]
+            return 200, {
+                "paging": {"total": len(results), "limit": 30, "offset": 0},
+                "results": results[:30],
+            }
+
+    def approve(self, payment_id, status="approved"):
+        """Força a decisão de um pagamento (endpoint de controle do teste)."""
+        with self._lock:
+            payment = self._payments.get(payment_id)
+            if not payment:
+                return 404, {"message": "Payment not found"}
+            payment["_decided_at"] = time.time()
+            payment["_final_status"] = status
+            return 200, self._view(payment)
+
+    def _view(self, payment):
+        """Calcula o status atual de forma preguiçosa e remove campos internos."""
+        decided_at = payment["_decided_at"]
+        if payment["status"] == "pending" and decided_at is not None and time.time() >= decided_at:
+            payment["status"] = payment["_final_status"]
+            payment["status_detail"] = "accredited" if payment["status"] == "approved" else "cc_rejected_other_reason"
+            if payment["status"] == "approved":
+                payment["date_approved"] = _iso(time.time())
+        return {key: value for key, value in payment.items() if not key.startswith("_")}
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone(timedelta(hours=-3))).isoformat(timespec="milliseconds")
+
+class FakeMercadoPagoHandler(BaseHTTPRequestHandler):
+    """Handler HTTP com as rotas /v1/payments usadas pelo SDK."""
+
+    backend = None  # FakePaymentBackend, definido em make_server
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _authorized(self):
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self._send(401, {"message": "unauthorized", "error": "unauthorized", "status": 401})
+            return False
+        return True
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+
+        if path.startswith("/__fake__/payments/"):
+            # Controle do teste: POST /__fake__/payments/<id>/<approved|rejected>
+            parts = path.strip("/").split("/")
+            if len(parts) == 4 and parts[2].isdigit():
+                return self._send(*self.backend.approve(int(parts[2]), parts[3]))
+            return self._send(404, {"message": "not found"})
+
+        if path != "/v1/payments":
+            return self._send(404, {"message": "not found"})
+        if not self._authorized():
+            return
+        error = self.backend.simulate_network()
+        if error:
+            return self._send(error, {"message": "fake upstream error", "status": error})
+        try:
+            data = json.loads(raw or b"{}")
+        except ValueError:
+            return self._send(400, {"message": "invalid json", "status": 400})
+        self._send(*self.backend.create(data, self.headers.get("X-Idempotency-Key")))
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        path = parsed.path
+
+        if path == "/__fake__/stats":
+            return self._send(200, self.backend.stats)
+        if not path.startswith("/v1/payments"):
+            return self._send(404, {"message": "not found"})
+        if not self._authorized():
+            return
+        error = self.backend.simulate_network()
+        if error:
+            return self._send(error, {"message": "fake upstream error", "status": error})
+
+        if path == "/v1/payments/search":
+            filters = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+            return self._send(*self.backend.search(filters))
+
+        payment_id = path.rsplit("/", 1)[-1]
+        if not payment_id.isdigit():
+            return self._send(404, {"message": "not found"})
+        self._send(*self.backend.get(int(payment_id)))
+
+class FakeMercadoPagoServer(ThreadingHTTPServer):
+    """Servidor HTTP com fila de conexões maior, para testes de carga."""
+
+    daemon_threads = True
+    request_queue_size = 256
+
+def make_server(host="127.0.0.1", port=8765, **backend_options):
+    """Cria o servidor HTTP falso (sem iniciá-lo).
+
+    Returns:
+        ThreadingHTTPServer: Servidor com o atributo `backend`
+    """
+    backend = FakePaymentBackend(**backend_options)
+    handler = type("BoundFakeMercadoPagoHandler", (FakeMercadoPagoHandler,), {"backend": backend})
+    server = FakeMercadoPagoServer((host, port), handler)
+    server.backend = backend
+    return server
+
+def start_in_background(host="127.0.0.1", port=0, **backend_options):
+    """Inicia o servidor em uma thread e retorna (servidor, url_base)."""
+    server = make_server(host, port, **backend_options)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def run_load(base_url, orders=1000, concurrency=16, poll_interval=0.5, max_checks=20):
+    """Executa o funil de checkout contra a URL informada.
+
+    Para cada pedido: cria a cobrança PIX pelo PaymentGateway (com chave de
+    idempotência, como no bot) e consulta o status até a aprovação.
+
+    Returns:
+        dict: Resumo com vazão e percentis de latência
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from payment_gateway import PaymentGateway, PaymentUnavailableError, create_sdk
+    from payment_idempotency import build_request_options
+
+    gateway = PaymentGateway(create_sdk("TEST-fake-token", base_url=base_url))
+    create_latencies = []
+    results = {"approved": 0, "rejected": 0, "pending": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def checkout(index):
+        order_id = uuid.uuid4().hex[:8]
+        payment_data = {
+            "transaction_amount": 65.0,
+            "description": f"Pedido #{order_id} - Teste de carga",
+            "payment_method_id": "pix",
+            "payer": {"email": f"cliente_{index}@exemplo.com", "first_name": "Carga", "last_name": "Cliente"},
+            "external_reference": order_id,
+        }
+        start = time.monotonic()
+        try:
+            response = gateway.create_payment(payment_data, build_request_options(order_id))
+        except PaymentUnavailableError:
+            outcome = "failed"
+        else:
+            with lock:
+                create_latencies.append(time.monotonic() - start)
+            payment_id = (response.get("response") or {}).get("id")
+            outcome = "failed" if not payment_id else "pending"
+            for _ in range(max_checks if payment_id else 0):
+                try:
+                    status = gateway.get_payment(payment_id)["response"]["status"]
+                except (PaymentUnavailableError, KeyError, TypeError):
+                    status = "pending"
+                if status in ("approved", "rejected"):
+                    outcome = status
+                    break
+                time.sleep(poll_interval)
+        with lock:
+            results[outcome] += 1
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(checkout, range(orders)))
+    elapsed = time.monotonic() - started
+
+    create_latencies.sort()
+
+    def percentile(p):
+        if not create_latencies:
+            return 0.0
+        return create_latencies[min(len(create_latencies) - 1, int(p * len(create_latencies)))]
+
+    return {
+        "orders": orders,
+        "elapsed_seconds": round(elapsed, 2),
+        "orders_per_minute": round(orders / elapsed * 60, 1) if elapsed else 0,
+        "create_p50_ms": round(percentile(0.50) * 1000, 1),
+        "create_p95_ms": round(percentile(0.95) * 1000, 1),
+        "create_p99_ms": round(percentile(0.99) * 1000, 1),
+        "breaker": gateway.status()["state"],
+        **results,
+    }
+
+def main():
+    """Função principal"""
+    parser = argparse.ArgumentParser(description="Servidor falso do Mercado Pago")
+    subparsers = parser.add_subparsers(dest="command")
+
+    serve = subparsers.add_parser("serve", help="Inicia o servidor falso")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=int(os.getenv("FAKE_MP_PORT", "8765")))
+
+    load = subparsers.add_parser("load", help="Teste de carga do funil de checkout")
+    load.add_argument("--url", help="URL de um servidor já em execução (padrão: inicia um local)")
+    load.add_argument("--orders", type=int, default=1000)
+    load.add_argument("--concurrency", type=int, default=16)
+    load.add_argument("--poll-interval", type=float, default=0.5)
+
+    for sub in (serve, load):
+        sub.add_argument("--latency", type=float, default=0.05, help="Latência base em segundos")
+        sub.add_argument("--latency-jitter", type=float, default=0.05, help="Variação de latência em segundos")
+        sub.add_argument("--error-rate", type=float, default=0.0, help="Fração de respostas HTTP 5xx")
+        sub.add_argument("--approve-after", type=float, default=2.0, help="Segundos até aprovar (-1 = nunca)")
+        sub.add_argument("--reject-rate", type=float, default=0.0, help="Fração de pagamentos rejeitados")
+
+    args = parser.parse_args()
+    if args.command is None:
+        args = parser.parse_args(["serve"])
+    backend_options = {
+        "latency": args.latency,
+        "latency_jitter": args.latency_jitter,
+        "error_rate": args.error_rate,
+        "approve_after": args.approve_after,
+        "reject_rate": args.reject_rate,
+    }
+
+    if args.command == "load":
+        server = None
+        base_url = args.url
+        if not base_url:
+            server, base_url = start_in_background(**backend_options)
+            logger.info("Servidor falso iniciado em %s", base_url)
+        summary = run_load(base_url, args.orders, args.concurrency, args.poll_interval)
+        print(json.dumps(summary, indent=2))
+        if server:
+            logger.info("Estatísticas do servidor: %s", server.backend.stats)
+            server.shutdown()
+        return True
+
+    host, port = args.host, args.port
+    server = make_server(host, port, **backend_options)
+    logger.info("Servidor falso do Mercado Pago em http://%s:%s (MERCADO_PAGO_BASE_URL)", host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Servidor interrompido pelo usuário")
+    finally:
+        server.server_close()
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -11,12 +11,10 @@ import os
 import subprocess
 import logging
 from datetime import datetime
+from log_setup import setup_logging
 
 # Configuração do logger
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+setup_logging()
 logger = logging.getLogger('git_manager')
 
 def run_git_command(command, cwd=None):
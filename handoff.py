@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de passagem de bastão entre processos do bot (reinício sem interrupção).
+O processo novo sobe em espera, carrega os dados e sinaliza que está pronto
+gravando um pedido de passagem. O líder atual para de buscar updates, termina
+o que já recebeu, grava todos os dados e entrega ao novo o último update
+processado e as verificações de pagamento ainda em andamento; só então
+libera o lease de líder e o novo processo começa o polling.
+"""
+
+import os
+import json
+import time
+import logging
+import functools
+import threading
+
+from metrics import registry
+
+logger = logging.getLogger('handoff')
+
+HANDOFF_REQUEST_FILE = os.path.join("data", "handoff_request.json")
+HANDOFF_STATE_FILE = os.path.join("data", "handoff_state.json")
+# Pedidos de passagem mais antigos que isso são ignorados (segundos)
+HANDOFF_TIMEOUT = float(os.getenv("HANDOFF_TIMEOUT", "30"))
+# Tempo que o processo antigo espera o trabalho em andamento terminar antes de entregá-lo
+HANDOFF_DRAIN_SECONDS = float(os.getenv("HANDOFF_DRAIN_SECONDS", "2"))
+
+handoff_counter = registry.counter(
+    "handoffs_total",
+    "Passagens de bastão por papel deste processo (giver ou taker)",
+    labels=("role",)
+)
+handoff_duration_gauge = registry.gauge(
+    "handoff_duration_seconds",
+    "Duração da última passagem de bastão (do pedido à liberação do lease)"
+)
+
+class InflightWork:
+    """Registro dos updates cujo processamento ainda não terminou."""
+
+    def __init__(self, name):
+        """Inicializa o registro.
+
+        Args:
+            name (str): Nome usado nos logs (ex.: "payment_checks")
+        """
+        self.name = name
+        self._items = {}  # update_id -> update serializado
+        self._idle = threading.Condition()
+
+    def wrap(self, handler):
+        """Envolve um handler para registrar cada update enquanto ele é processado."""
+        @functools.wraps(handler)
+        def tracked(update, context):
+            with self._idle:
+                self._items[update.update_id] = update.to_dict()
+            try:
+                return handler(update, context)
+            finally:
+                with self._idle:
+                    self._items.pop(update.update_id, None)
+                    self._idle.notify_all()
+        return tracked
+
+    def snapshot(self):
+        """Lista dos updates (em JSON) ainda em andamento."""
+        with self._idle:
+            return list(self._items.values())
+
+    def wait_idle(self, timeout):
+        """Espera o trabalho em andamento terminar; retorna True se terminou."""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._items, timeout=timeout)
+
+class HandoffChannel:
+    """Troca do pedido de passagem e do estado entregue, por arquivos em data/."""
+
+    def __init__(self, request_file=HANDOFF_REQUEST_FILE, state_file=HANDOFF_STATE_FILE,
+                 timeout=HANDOFF_TIMEOUT):
+        """Inicializa o canal.
+
+        Args:
+            request_file (str): Arquivo onde o processo novo sinaliza que está pronto
+            state_file (str): Arquivo onde o processo antigo entrega o estado
+            timeout (float): Validade de um pedido de passagem em segundos
+        """
+        self.request_file = request_file
+        self.state_file = state_file
+        self.timeout = timeout
+        self.completed = False  # True no processo antigo depois de entregar o bastão
+        self._thread = None
+        self._stop = threading.Event()
+
+    # Processo novo
+
+    def request(self, holder):
+        """Sinaliza que este processo está pronto para assumir o polling."""
+        _write_json(self.request_file, {"holder": holder, "requested_at": time.time()})
+        logger.info("Pronto para assumir: passagem de bastão solicitada por %s", holder)
+
+    def take_state(self, holder):
+        """Retorna (e consome) o estado entregue a este processo, ou None."""
+        state = _read_json(self.state_file)
+        for path in (self.state_file, self.request_file):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if not state or state.get("to") != holder:
+            return None
+        handoff_counter.inc(role="taker")
+        logger.info(
+            "Bastão recebido de %s: último update %s, "
+            "%s verificações de pagamento em andamento",
+            state.get('from'), state.get('last_update_id'), len(state.get('payment_checks', []))
+        )
+        return state
+
+    # Processo antigo (líder)
+
+    def watch(self, holder, on_request, interval=0.2):
+        """Observa pedidos de passagem de outros processos em uma thread.
+
+        Args:
+            holder (str): Identificador deste processo (pedidos dele mesmo são ignorados)
+            on_request (callable): Chamado uma vez com o pedido; deve retornar o estado a entregar
+        """
+        def run():
+            while not self._stop.wait(interval):
+                request = _read_json(self.request_file)
+                if not request or request.get("holder") == holder:
+                    continue
+                if time.time() - request.get("requested_at", 0) > self.timeout:
+                    continue
+                started = time.monotonic()
+                logger.info("Passagem de bastão solicitada por %s", request['holder'])
+                try:
+                    state = on_request(request)
+                except Exception as e:
+                    logger.error("Erro na passagem de bastão: %s", e)
+                    return
+                handoff_counter.inc(role="giver")
+                handoff_duration_gauge.set(time.monotonic() - started)
+                logger.info("Bastão entregue a %s em %.2fs", state['to'], time.monotonic() - started)
+                return
+
+        self._thread = threading.Thread(target=run, name="handoff", daemon=True)
+        self._thread.start()
+
+    def publish(self, holder, to, state):
+        """Entrega o estado ao processo novo (antes de liberar o lease)."""
+        state = dict(state, **{"from": holder, "to": to, "published_at": time.time()})
+        _write_json(self.state_file, state)
+        self.completed = True
+        return state
+
+    def stop(self):
+        self._stop.set()
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_file = f"{path}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_file, path)
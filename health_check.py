@@ -13,13 +13,12 @@ import logging
 import subprocess
 import requests
 import signal
+import json
 from datetime import datetime
+from log_setup import setup_logging
 
 # Configuração de logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+setup_logging()
 logger = logging.getLogger('health_check')
 
 class BotHealthChecker:
@@ -72,6 +71,42 @@ class BotHealthChecker:
             logger.error(f"Erro ao verificar API do Telegram: {e}")
             return False
     
+    def check_payment_provider(self):
+        """Verifica o estado do circuit breaker do Mercado Pago publicado pelo bot.
+        
+        Um provedor de pagamentos degradado não derruba o bot (navegação e
+        carrinho continuam funcionando), então o resultado é apenas informativo
+        e não provoca reinício.
+        
+        Returns:
+            str: Estado do circuito ('closed', 'half_open', 'open') ou 'unknown'
+        """
+        state_file = os.path.join("data", "payment_breaker.json")
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                status = json.load(f)
+        except FileNotFoundError:
+            return "unknown"
+        except Exception as e:
+            logger.warning("Não foi possível ler o estado do provedor de pagamentos: %s", e)
+            return "unknown"
+        
+        state = status.get("state", "unknown")
+        if state == "open" and status.get("retry_at") and time.time() >= status["retry_at"]:
+            # O tempo aberto já passou: a próxima chamada ao provedor é o teste
+            state = "half_open"
+        if state == "open":
+            logger.warning(
+                "Pagamentos DEGRADADOS: circuito do Mercado Pago aberto desde %s "
+                "(último erro: %s)",
+                status.get('updated_at'), status.get('last_error')
+            )
+        elif state == "half_open":
+            logger.info("Pagamentos em recuperação: circuito do Mercado Pago em teste (meio-aberto)")
+        else:
+            logger.info("Provedor de pagamentos OK")
+        return state
+    
     def check_bot_process(self):
         """Verifica se o processo do bot está rodando."""
         if not self.bot_process:
@@ -133,6 +168,7 @@ class BotHealthChecker:
                 # Verifica status do processo
                 bot_running = self.check_bot_process()
                 api_accessible = self.check_telegram_api()
+                self.check_payment_provider()
                 
                 # Decide se precisa reiniciar
                 if not bot_running or not api_accessible:
@@ -11,12 +11,10 @@ import sys
 import logging
 import subprocess
 from dotenv import load_dotenv
+from log_setup import setup_logging
 
 # Configuração de logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+setup_logging()
 logger = logging.getLogger('heroku_init')
 
 def check_environment():
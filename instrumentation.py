@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de instrumentação dos handlers e das chamadas externas do bot.
+Envolve o callback de cada handler registrado no dispatcher (inclusive os
+de dentro das conversas) para medir latência, erros e execuções em
+andamento por handler, e mede as chamadas à Bot API do Telegram. O custo é
+de alguns microssegundos por update (um relógio e três métricas com trava).
+As execuções em andamento também são acompanhadas pela vigilância de
+updates lentos (update_watchdog).
+As métricas são expostas em texto no formato do Prometheus em /metrics por
+um servidor HTTP mínimo (METRICS_PORT).
+"""
+
+import os
+import time
+import logging
+import functools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram.ext import DispatcherHandlerStop
+
+from metrics import registry
+from update_watchdog import watchdog
+
+logger = logging.getLogger('instrumentation')
+
+# Porta do endpoint /metrics do bot (vazio = desativado); cada worker usa a porta + índice + 1
+METRICS_PORT = int(os.getenv("METRICS_PORT")) if os.getenv("METRICS_PORT") else None
+
+handler_duration_histogram = registry.histogram(
+    "handler_duration_seconds",
+    "Duração da execução de cada handler",
+    labels=("handler",)
+)
+handler_errors_counter = registry.counter(
+    "handler_errors_total",
+    "Exceções lançadas por handler",
+    labels=("handler",)
+)
+handler_in_flight_gauge = registry.gauge(
+    "handler_in_flight",
+    "Execuções de cada handler em andamento",
+    labels=("handler",)
+)
+bot_api_duration_histogram = registry.histogram(
+    "telegram_api_duration_seconds",
+    "Duração das chamadas à Bot API do Telegram por método",
+    labels=("method",)
+)
+bot_api_errors_counter = registry.counter(
+    "telegram_api_errors_total",
+    "Chamadas à Bot API do Telegram que falharam, por método",
+    labels=("method",)
+)
+store_flush_histogram = registry.histogram(
+    "store_flush_duration_seconds",
+    "Duração das gravações em disco por armazenamento",
+    labels=("store",)
+)
+
+def handler_name(callback):
+    return getattr(callback, "__qualname__", None) or getattr(callback, "__name__", None) or repr(callback)
+
+def instrument_callback(callback, name=None):
+    """Callback que registra as métricas do handler e repassa o resultado."""
+    if getattr(callback, "_instrumented", False):
+        return callback
+    name = name or handler_name(callback)
+
+    @functools.wraps(callback)
+    def instrumented(*args, **kwargs):
+        handler_in_flight_gauge.inc(handler=name)
+        token = watchdog.begin(name, args[0] if args else None)
+        start = time.perf_counter()
+        try:
+            return callback(*args, **kwargs)
+        except DispatcherHandlerStop:
+            # Interrupção intencional (update repetido, sessão expirada), não um erro
+            raise
+        except Exception:
+            handler_errors_counter.inc(handler=name)
+            raise
+        finally:
+            handler_duration_histogram.observe(time.perf_counter() - start, handler=name)
+            watchdog.end(token)
+            handler_in_flight_gauge.dec(handler=name)
+
+    instrumented._instrumented = True
+    return instrumented
+
+def instrument_handler(handler):
+    """Instrumenta um handler; em uma ConversationHandler, todos os de dentro."""
+    nested = getattr(handler, "entry_points", None)
+    if nested is not None:
+        for inner in list(handler.entry_points) + list(handler.fallbacks):
+            instrument_handler(inner)
+        for state_handlers in handler.states.values():
+            for inner in state_handlers:
+                instrument_handler(inner)
+        return
+    if callable(getattr(handler, "callback", None)):
+        handler.callback = instrument_callback(handler.callback)
+
+def instrument_dispatcher(dispatcher):
+    """Instrumenta todos os handlers já registrados (chamar depois de registrá-los).
+
+    Returns:
+        int: Número de grupos de handlers percorridos
+    """
+    for handlers in dispatcher.handlers.values():
+        for handler in handlers:
+            instrument_handler(handler)
+    return len(dispatcher.handlers)
+
+_bot_api_lock = threading.Lock()
+
+def instrument_bot_api(bot_class=None):
+    """Mede as chamadas à Bot API (Bot._post, por onde passam todos os métodos)."""
+    if bot_class is None:
+        from telegram import Bot as bot_class
+    with _bot_api_lock:
+        post = bot_class._post
+        if getattr(post, "_instrumented", False):
+            return
+
+        @functools.wraps(post)
+        def instrumented_post(self, endpoint, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return post(self, endpoint, *args, **kwargs)
+            except Exception:
+                bot_api_errors_counter.inc(method=endpoint)
+                raise
+            finally:
+                bot_api_duration_histogram.observe(time.perf_counter() - start, method=endpoint)
+
+        instrumented_post._instrumented = True
+        bot_class._post = instrumented_post
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Responde GET /metrics com o texto do registro de métricas."""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Coletas a cada poucos segundos não devem poluir o log
+        logger.debug(format, *args)
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Inicia o servidor de /metrics em uma thread daemon.
+
+    Returns:
+        ThreadingHTTPServer: Servidor iniciado, ou None se a porta não pôde ser aberta
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    except OSError as e:
+        logger.error("Não foi possível abrir a porta %s para /metrics: %s", port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Métricas disponíveis em http://%s:%s/metrics", host, port)
+    return server
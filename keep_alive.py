@@ -8,12 +8,10 @@ import time
 import logging
 import requests
 import threading
+from log_setup import setup_logging
 
 # Configuração de logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+setup_logging()
 logger = logging.getLogger('keep_alive')
 
 class KeepAlive:
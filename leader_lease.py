@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de eleição de líder por lease (concessão com prazo).
+Só o processo que detém o lease faz polling no Telegram e roda os jobs; os
+demais ficam em espera (standby) com os handlers já montados e assumem
+poucos segundos depois que o lease expira ou é liberado. O lease é renovado
+periodicamente pelo líder e guardado em um armazenamento plugável: um
+arquivo com trava local (padrão, para processos na mesma máquina) ou Redis
+(LEADER_LEASE_URL=redis://..., para processos em máquinas diferentes).
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from metrics import registry
+
+logger = logging.getLogger('leader_lease')
+
+LEADER_LEASE_FILE = os.path.join("data", "leader.lease")
+LEADER_LEASE_URL = os.getenv("LEADER_LEASE_URL", "")
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "15"))
+
+leader_gauge = registry.gauge(
+    "leader_is_leader",
+    "1 se este processo detém o lease de líder"
+)
+leader_transitions_counter = registry.counter(
+    "leader_transitions_total",
+    "Mudanças de liderança deste processo por evento",
+    labels=("event",)
+)
+
+class LeaseStore:
+    """Interface dos armazenamentos de lease.
+
+    Os métodos recebem o identificador do processo e devem ser atômicos em
+    relação aos outros processos que usam o mesmo armazenamento.
+    """
+
+    def try_acquire(self, holder, ttl):
+        """Obtém ou renova o lease se ele estiver livre, expirado ou já for do holder.
+
+        Returns:
+            dict | None: Registro do lease (holder, expires_at, token) ou None
+        """
+        raise NotImplementedError
+
+    def release(self, holder):
+        """Libera o lease se ele pertencer ao holder."""
+        raise NotImplementedError
+
+    def current(self):
+        """Registro do lease atual, ou None."""
+        raise NotImplementedError
+
+class FileLeaseStore(LeaseStore):
+    """Lease em um arquivo JSON protegido por trava de arquivo (flock)."""
+
+    def __init__(self, path=LEADER_LEASE_FILE):
+        """Inicializa o armazenamento.
+
+        Args:
+            path (str): Arquivo do lease (a trava usa o mesmo arquivo com sufixo .lock)
+        """
+        self.path = path
+        self.lock_path = f"{path}.lock"
+
+    def try_acquire(self, holder, ttl):
+        with self._locked():
+            now = time.time()
+            lease = self._read()
+            if lease and lease["holder"] != holder and lease["expires_at"] > now:
+                return None
+            token = lease["token"] if lease and lease["holder"] == holder else (lease or {}).get("token", 0) + 1
+            lease = {"holder": holder, "expires_at": now + ttl, "token": token}
+            self._write(lease)
+            return lease
+
+    def release(self, holder):
+        with self._locked():
+            lease = self._read()
+            if lease and lease["holder"] == holder:
+                lease["expires_at"] = 0
+                self._write(lease)
+
+    def current(self):
+        with self._locked():
+            return self._read()
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, lease):
+        tmp_file = f"{self.path}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(lease, f)
+        os.replace(tmp_file, self.path)
+
+    def _locked(self):
+        return _FileLock(self.lock_path)
+
+class _FileLock:
+    """Trava exclusiva entre processos sobre um arquivo."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, 'a+')
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+
+class RedisLeaseStore(LeaseStore):
+    """Lease em uma chave Redis com expiração (para processos em máquinas diferentes)."""
+
+    # Obtém/renova atomicamente: só sobrescreve se a chave não existir ou for do holder
+    ACQUIRE_SCRIPT = """
+    local current = redis.call('GET', KEYS[1])
+    if current and cjson.decode(current)['holder'] ~= ARGV[1] then
+        return nil
+    end
+    local token
+    if current then
+        token = cjson.decode(current)['token']
+    else
+        token = redis.call('INCR', KEYS[2])
+    end
+    local lease = cjson.encode({holder=ARGV[1], expires_at=tonumber(ARGV[3]), token=token})
+    redis.call('SET', KEYS[1], lease, 'PX', ARGV[2])
+    return lease
+    """
+    RELEASE_SCRIPT = """
+    local current = redis.call('GET', KEYS[1])
+    if current and cjson.decode(current)['holder'] == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url, key="bot:leader"):
+        """Inicializa o armazenamento.
+
+        Args:
+            url (str): URL do Redis (redis://host:porta/db)
+            key (str): Chave do lease
+        """
+        import redis  # dependência opcional, só necessária com LEADER_LEASE_URL
+        self.client = redis.Redis.from_url(url)
+        self.key = key
+        self._acquire = self.client.register_script(self.ACQUIRE_SCRIPT)
+        self._release = self.client.register_script(self.RELEASE_SCRIPT)
+
+    def try_acquire(self, holder, ttl):
+        lease = self._acquire(keys=[self.key, f"{self.key}:token"],
+                              args=[holder, int(ttl * 1000), time.time() + ttl])
+        return json.loads(lease) if lease else None
+
+    def release(self, holder):
+        self._release(keys=[self.key], args=[holder])
+
+    def current(self):
+        lease = self.client.get(self.key)
+        return json.loads(lease) if lease else None
+
+def create_lease_store(url=LEADER_LEASE_URL):
+    """Cria o armazenamento de lease configurado (Redis se houver URL, senão arquivo)."""
+    if url.startswith(("redis://", "rediss://")):
+        return RedisLeaseStore(url)
+    return FileLeaseStore(url or LEADER_LEASE_FILE)
+
+class LeaderLease:
+    """Garante que só um processo seja o líder (o que faz polling) por vez."""
+
+    def __init__(self, store, ttl=LEADER_LEASE_TTL, holder=None):
+        """Inicializa o lease.
+
+        Args:
+            store (LeaseStore): Armazenamento compartilhado do lease
+            ttl (float): Validade do lease em segundos; o líder renova a cada ttl/3
+            holder (str): Identificador deste processo (padrão: host:pid:aleatório)
+        """
+        self.store = store
+        self.ttl = max(3.0, ttl)
+        self.renew_interval = self.ttl / 3
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.token = None
+
+        self._valid_until = 0.0     # prazo local (monotônico) do lease obtido
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def is_leader(self):
+        """True enquanto o lease estiver válido (com margem de uma renovação)."""
+        return self.token is not None and time.monotonic() < self._valid_until - self.renew_interval
+
+    def try_acquire(self):
+        """Tenta obter ou renovar o lease uma vez; retorna True se este processo é o líder."""
+        started = time.monotonic()
+        try:
+            lease = self.store.try_acquire(self.holder, self.ttl)
+        except Exception as e:
+            logger.warning("Erro ao acessar o lease de líder: %s", e)
+            return self.is_leader
+        if lease is None:
+            return False
+        if self.token is None:
+            leader_transitions_counter.inc(event="acquired")
+            leader_gauge.set(1)
+            logger.info("Lease de líder obtido por %s (token %s)", self.holder, lease['token'])
+        self.token = lease["token"]
+        self._valid_until = started + self.ttl
+        return True
+
+    def wait_for_leadership(self, on_waiting=None, poll_interval=None):
+        """Bloqueia até este processo se tornar o líder (modo standby).
+
+        Args:
+            on_waiting (callable): Chamado uma vez com o registro do líder atual
+            poll_interval (float): Intervalo entre tentativas (padrão: até 1s)
+        """
+        notified = False
+        while not self._stop.is_set():
+            if self.try_acquire():
+                return True
+            if not notified:
+                notified = True
+                current = self._current()
+                logger.info("Em espera: o líder atual é %s", current.get('holder') if current else '?')
+                if on_waiting:
+                    on_waiting(current)
+            self._stop.wait(poll_interval or min(1.0, self.renew_interval))
+        return False
+
+    def start(self, on_lost):
+        """Renova o lease em segundo plano; on_lost é chamado se a liderança for perdida."""
+        def renew():
+            while not self._stop.wait(self.renew_interval):
+                # Falhas temporárias do armazenamento são toleradas enquanto o lease vale
+                if self.try_acquire():
+                    continue
+                self.token = None
+                leader_gauge.set(0)
+                leader_transitions_counter.inc(event="lost")
+                logger.error("Lease de líder perdido por %s; parando o polling", self.holder)
+                on_lost()
+                return
+
+        self._thread = threading.Thread(target=renew, name="leader-lease", daemon=True)
+        self._thread.start()
+
+    def release(self):
+        """Para a renovação e libera o lease para um standby assumir imediatamente."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.renew_interval + 1)
+        if self.token is None:
+            return
+        try:
+            self.store.release(self.holder)
+        except Exception as e:
+            logger.warning("Erro ao liberar o lease de líder: %s", e)
+        self.token = None
+        leader_gauge.set(0)
+        leader_transitions_counter.inc(event="released")
+        logger.info("Lease de líder liberado por %s", self.holder)
+
+    def _current(self):
+        try:
+            return self.store.current()
+        except Exception:
+            return None
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de configuração centralizada do logging.
+Os handlers dos módulos só colocam o registro em uma fila (QueueHandler);
+uma thread de fundo (QueueListener) formata e escreve na saída, então a
+escrita não ocupa as threads que atendem os updates. A saída é uma linha
+JSON por registro (LOG_FORMAT=text mantém o formato antigo).
+
+A formatação da mensagem também fica para a thread de fundo quando os
+argumentos são imutáveis (logger.info("Pedido %s", order_id)); argumentos
+mutáveis, como dicts da sessão, são formatados na hora, para o log mostrar
+o valor do momento da chamada. Linhas INFO/DEBUG de loggers muito
+verbosos podem ser amostradas por logger (LOG_SAMPLING=bot=0.1).
+"""
+
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Nível mínimo registrado
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json (uma linha JSON por registro) ou text (formato antigo)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Fração das linhas INFO/DEBUG mantidas por logger, ex.: "bot=0.1,add_to_cart=0.5"
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Tipos que podem ser formatados depois, na thread de fundo
+IMMUTABLE_TYPES = (str, int, float, bool, type(None), bytes)
+
+_lock = threading.Lock()
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON por registro, com os campos extras passados em extra=."""
+
+    # Atributos próprios de todo LogRecord; os demais vieram de extra=
+    RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in self.RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler que adia a formatação para a thread de fundo quando é seguro."""
+
+    def prepare(self, record):
+        # Um único dict como argumento vira o próprio record.args (formato %(chave)s)
+        if record.args and (isinstance(record.args, dict)
+                            or not all(isinstance(arg, IMMUTABLE_TYPES) for arg in record.args)):
+            # O objeto pode mudar antes da thread de fundo chegar nele
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            # A pilha é formatada aqui enquanto os quadros ainda são os do erro
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class SamplingFilter(logging.Filter):
+    """Mantém só uma fração das linhas INFO/DEBUG dos loggers configurados.
+
+    Avisos e erros passam sempre. Um logger sem fração própria usa a do
+    logger pai mais próximo ("bot" vale também para "bot.payments").
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+        self._cache = {}
+
+    def rate(self, name):
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            parts = name.split(".")
+            for size in range(len(parts), 0, -1):
+                prefix = ".".join(parts[:size])
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        rate = self.rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+def parse_sampling(spec):
+    """Frações de amostragem a partir de "logger=fração,logger=fração".
+
+    Returns:
+        dict: Nome do logger -> fração entre 0 e 1
+    """
+    rates = {}
+    for part in spec.split(","):
+        if "=" not in part:
+            continue
+        name, rate = part.split("=", 1)
+        try:
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+def setup_logging(level=None, log_format=None, sampling=None, stream=None):
+    """Configura o logging do processo uma única vez (chamadas seguintes não fazem nada).
+
+    Args:
+        level (str): Nível mínimo (padrão: LOG_LEVEL)
+        log_format (str): json ou text (padrão: LOG_FORMAT)
+        sampling (str): Frações por logger (padrão: LOG_SAMPLING)
+        stream: Destino das linhas (padrão: saída de erro)
+
+    Returns:
+        QueueListener: Escritor em segundo plano
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return _listener
+        output = logging.StreamHandler(stream or sys.stderr)
+        if (log_format or LOG_FORMAT) == "text":
+            output.setFormatter(logging.Formatter(TEXT_FORMAT))
+        else:
+            output.setFormatter(JsonFormatter())
+
+        # Fila sem limite: quem loga nunca espera pela escrita
+        records = queue.SimpleQueue()
+        handler = LazyQueueHandler(records)
+        rates = parse_sampling(LOG_SAMPLING if sampling is None else sampling)
+        if rates:
+            handler.addFilter(SamplingFilter(rates))
+
+        root = logging.getLogger()
+        for previous in list(root.handlers):
+            root.removeHandler(previous)
+        root.addHandler(handler)
+        root.setLevel(level or LOG_LEVEL)
+
+        _listener = QueueListener(records, output, respect_handler_level=True)
+        _listener.start()
+        # Escreve o que ainda estiver na fila antes de o processo terminar
+        atexit.register(stop_logging)
+        return _listener
+
+def stop_logging():
+    """Escreve os registros ainda na fila e encerra o escritor em segundo plano."""
+    with _lock:
+        if _listener is not None and _listener._thread is not None:
+            _listener.stop()
@@ -3,9 +3,10 @@ import os
 import sys
 import threading
 from app import app  # Importação do Flask app necessária para o workflow "Start application"
+from log_setup import setup_logging
 
 # Set up logging
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 def main():
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de métricas do bot.
+Mantém contadores, medidores (gauges) e histogramas em memória, com rótulos,
+e gera a representação em texto no formato de exposição do Prometheus.
+"""
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Limites (segundos) dos buckets de latência: de 1 ms a 30 s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Counter:
+    """Contador monotônico com rótulos opcionais."""
+
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """Incrementa o contador para a combinação de rótulos informada."""
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Retorna o valor atual para a combinação de rótulos."""
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        return self._values.get(key, 0)
+
+    def samples(self):
+        """Retorna a lista de (sufixo, rótulos, valor) para exposição."""
+        with self._lock:
+            items = list(self._values.items())
+        return [('', dict(zip(self.labels, key)), value) for key, value in items]
+
+class Gauge(Counter):
+    """Medidor que pode subir, descer ou ser definido diretamente."""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        """Define o valor para a combinação de rótulos informada."""
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount=1, **labels):
+        """Decrementa o medidor."""
+        self.inc(-amount, **labels)
+
+class Histogram:
+    """Histograma com buckets fixos (contagens acumuladas só na exposição)."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # rótulos -> [contagem por bucket (+Inf no fim), soma]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """Registra uma observação (ex.: duração em segundos)."""
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Mede a duração do bloco, inclusive quando ele termina com exceção."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        """Retorna o número de observações para a combinação de rótulos."""
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        entry = self._values.get(key)
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        """Retorna a lista de (sufixo, rótulos, valor) para exposição."""
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in items:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append(('_bucket', {**labels, 'le': _format(float(bound))}, cumulative))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, cumulative))
+        return samples
+
+class MetricsRegistry:
+    """Registro central das métricas expostas pelo processo."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, description, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, description, labels, **kwargs)
+            return metric
+
+    def counter(self, name, description, labels=()):
+        """Obtém (ou cria) um contador."""
+        return self._register(Counter, name, description, labels)
+
+    def gauge(self, name, description, labels=()):
+        """Obtém (ou cria) um medidor."""
+        return self._register(Gauge, name, description, labels)
+
+    def histogram(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        """Obtém (ou cria) um histograma."""
+        return self._register(Histogram, name, description, labels, buckets=buckets)
+
+    def render(self):
+        """Gera o texto no formato de exposição do Prometheus."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in sorted(metrics, key=lambda m: m.name):
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                if labels:
+                    label_text = ",".join(
+                        f'{k}="{_escape(v)}"' for k, v in labels.items()
+                    )
+                    lines.append(f"{metric.name}{suffix}{{{label_text}}} {_format(value)}")
+                else:
+                    lines.append(f"{metric.name}{suffix} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+# Registro global usado pelos módulos do bot
+registry = MetricsRegistry()
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de arquivo colunar de pedidos encerrados.
+Pedidos entregues, cancelados ou expirados são acrescentados (nunca
+reescritos) a segmentos em data/archive/, um arquivo .npy por coluna com
+uma linha por produto de cada pedido: instante, pedido, usuário, valor em
+centavos, produto, créditos e status. As consultas de relatório abrem as
+colunas mapeadas em memória e filtram e agrupam com NumPy, sem criar objetos
+Order, então percorrer milhões de linhas leva milissegundos. Nomes de
+produtos e status ficam em um dicionário (inteiros nas colunas). Requer o
+pacote opcional numpy.
+
+Uso para relatórios:
+    python order_archive.py --since 2025-01-01 --group-by month,product
+"""
+
+import os
+import sys
+import json
+import glob
+import zlib
+import shutil
+import logging
+import argparse
+import calendar
+import threading
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger('order_archive')
+
+ARCHIVE_DIR = os.path.join("data", "archive")
+# Intervalo entre as gravações dos pedidos encerrados pendentes (segundos)
+ARCHIVE_FLUSH_INTERVAL = int(os.getenv("ARCHIVE_FLUSH_INTERVAL", "300"))
+# Segmentos menores que isso são juntados quando passam de ARCHIVE_COMPACT_SEGMENTS
+ARCHIVE_SEGMENT_ROWS = 1_000_000
+ARCHIVE_COMPACT_SEGMENTS = 16
+
+# Status finais: o pedido é arquivado na primeira vez que chega a um deles
+CLOSED_STATUSES = ("entregue", "cancelado", "expirado")
+
+COLUMNS = {
+    "ts": "int64",         # created_at em segundos (hora local lida como UTC)
+    "order": "int64",      # ID do pedido (hexadecimal) como inteiro
+    "user": "int64",
+    "amount_cents": "int64",
+    "product": "int32",    # índice no dicionário de produtos
+    "credits": "int32",
+    "status": "int8",      # índice no dicionário de status
+}
+GROUP_DIMENSIONS = ("day", "month", "product", "status", "user")
+
+def order_code(order_id):
+    """ID do pedido como inteiro (os IDs são hexadecimais; outros usam crc32)."""
+    try:
+        return int(order_id, 16)
+    except (TypeError, ValueError):
+        return zlib.crc32(str(order_id).encode())
+
+def parse_timestamp(created_at):
+    try:
+        return calendar.timegm(datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S").timetuple())
+    except (TypeError, ValueError):
+        return 0
+
+def _get(record, name):
+    if isinstance(record, dict):
+        return record.get(name)
+    return getattr(record, name, None)
+
+def _write_json(path, data):
+    tmp_file = f"{path}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_file, path)
+
+class OrderArchive:
+    """Segmentos colunares de um diretório de arquivo (um único processo grava)."""
+
+    def __init__(self, path=ARCHIVE_DIR):
+        """Inicializa o arquivo, lendo o manifesto e o dicionário se existirem.
+
+        Args:
+            path (str): Diretório do arquivo
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = {}  # order_id -> pedido encerrado aguardando gravação
+        self.reconciled = False
+        self._load_state()
+
+    def reload(self):
+        """Relê o manifesto e o dicionário gravados por outro processo (ex.: o líder anterior)."""
+        with self._lock:
+            self._load_state()
+
+    def _load_state(self):
+        self.manifest = self._read("manifest.json", {"segments": [], "next_segment": 1})
+        self.dictionary = self._read("dictionary.json", {"products": [], "statuses": list(CLOSED_STATUSES)})
+        self._product_ids = {name: index for index, name in enumerate(self.dictionary["products"])}
+
+    def _read(self, name, default):
+        try:
+            with open(os.path.join(self.path, name), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return default
+
+    def __len__(self):
+        return sum(segment["rows"] for segment in self.manifest["segments"])
+
+    def add(self, order):
+        """Marca um pedido recém-encerrado para a próxima gravação."""
+        with self._lock:
+            self._pending[_get(order, "id")] = order
+
+    def reconcile(self, orders):
+        """Marca para gravação os pedidos encerrados que ainda não estão no arquivo.
+
+        Cobre o histórico anterior ao arquivo e pedidos encerrados que ficaram
+        só na memória em uma queda. Feito uma vez, na partida.
+
+        Args:
+            orders (iterable): Todos os pedidos deste processo
+
+        Returns:
+            int: Pedidos marcados
+        """
+        with self._lock:
+            self._load_state()
+            missing = self._missing(orders)
+            self._pending.update(missing)
+            self.reconciled = True
+            return len(missing)
+
+    def flush(self):
+        """Grava os pedidos pendentes em um segmento novo.
+
+        Returns:
+            int: Pedidos gravados
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            try:
+                # Outro processo pode ter gravado desde a última leitura (passagem
+                # de bastão): os IDs de produto e o próximo segmento vêm do disco
+                self._load_state()
+                self._append(list(pending.values()))
+                self._maybe_compact()
+            except Exception as e:
+                logger.error("Erro ao gravar o arquivo de pedidos: %s", e)
+                pending.update(self._pending)
+                self._pending = pending
+                return 0
+            return len(pending)
+
+    def _missing(self, orders):
+        closed = {_get(order, "id"): order for order in orders if _get(order, "status") in CLOSED_STATUSES}
+        if not closed:
+            return {}
+        archived = [segment["order"] for segment in self.segments(columns=("order",))]
+        if not archived:
+            return closed
+        codes = np.array([order_code(order_id) for order_id in closed], dtype=np.int64)
+        known = np.isin(codes, np.concatenate(archived))
+        return {order_id: order for (order_id, order), seen in zip(closed.items(), known) if not seen}
+
+    def _rows(self, orders):
+        """Colunas de um lote de pedidos: uma linha por produto de cada pedido."""
+        columns = {name: [] for name in COLUMNS}
+        statuses = self.dictionary["statuses"]
+        for order in orders:
+            status = _get(order, "status")
+            if status not in statuses:
+                statuses.append(status)
+            lines = {}
+            for item in _get(order, "items") or []:
+                name = _get(item, "name") or "?"
+                details = _get(item, "details") or {}
+                line = lines.setdefault(name, [0, 0])
+                line[0] += round(float(_get(item, "price") or 0) * 100)
+                line[1] += int(details.get("credits") or 0)
+            for name, (cents, credits) in lines.items():
+                if name not in self._product_ids:
+                    self._product_ids[name] = len(self.dictionary["products"])
+                    self.dictionary["products"].append(name)
+                columns["ts"].append(parse_timestamp(_get(order, "created_at")))
+                columns["order"].append(order_code(_get(order, "id")))
+                columns["user"].append(int(_get(order, "user_id") or 0))
+                columns["amount_cents"].append(cents)
+                columns["product"].append(self._product_ids[name])
+                columns["credits"].append(credits)
+                columns["status"].append(statuses.index(status))
+        return {name: np.array(values, dtype=COLUMNS[name]) for name, values in columns.items()}
+
+    def _append(self, orders):
+        columns = self._rows(orders)
+        if len(columns["ts"]):
+            self._write_segment(columns)
+
+    def _write_segment(self, columns, replaces=()):
+        """Grava um segmento e o publica no manifesto (substituindo outros, se indicado)."""
+        os.makedirs(self.path, exist_ok=True)
+        rows = len(columns["ts"])
+        # Pula segmentos deixados por uma gravação interrompida antes do manifesto
+        while os.path.exists(os.path.join(self.path, f"seg-{self.manifest['next_segment']:06d}")):
+            self.manifest["next_segment"] += 1
+        name = f"seg-{self.manifest['next_segment']:06d}"
+        tmp_dir = os.path.join(self.path, f"{name}.tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for column, values in columns.items():
+            np.save(os.path.join(tmp_dir, f"{column}.npy"), values)
+        os.replace(tmp_dir, os.path.join(self.path, name))
+        # O dicionário antes do manifesto: um segmento publicado nunca aponta
+        # para um produto que ainda não foi gravado
+        _write_json(os.path.join(self.path, "dictionary.json"), self.dictionary)
+        segments = [segment for segment in self.manifest["segments"] if segment["name"] not in replaces]
+        segments.append({
+            "name": name,
+            "rows": rows,
+            "min_ts": int(columns["ts"].min()) if rows else 0,
+            "max_ts": int(columns["ts"].max()) if rows else 0,
+        })
+        self.manifest = {"segments": segments, "next_segment": self.manifest["next_segment"] + 1}
+        _write_json(os.path.join(self.path, "manifest.json"), self.manifest)
+        for old in replaces:
+            shutil.rmtree(os.path.join(self.path, old), ignore_errors=True)
+
+    def _maybe_compact(self):
+        """Junta os segmentos pequenos em um só quando eles se acumulam."""
+        small = [segment["name"] for segment in self.manifest["segments"] if segment["rows"] < ARCHIVE_SEGMENT_ROWS]
+        if len(small) < ARCHIVE_COMPACT_SEGMENTS:
+            return
+        parts = [columns for segment, columns in zip(self.manifest["segments"], self.segments())
+                 if segment["name"] in small]
+        merged = {name: np.concatenate([part[name] for part in parts]) for name in COLUMNS}
+        self._write_segment(merged, replaces=small)
+        logger.info("Arquivo de pedidos: %s segmentos juntados (%s linhas)", len(small), len(merged['ts']))
+
+    def segments(self, columns=tuple(COLUMNS), since=None, until=None):
+        """Colunas de cada segmento, mapeadas em memória.
+
+        Args:
+            columns (tuple): Colunas a abrir
+            since (int): Pula segmentos que terminam antes deste instante
+            until (int): Pula segmentos que começam depois deste instante
+        """
+        for segment in self.manifest["segments"]:
+            if (since is not None and segment["max_ts"] < since) or (until is not None and segment["min_ts"] > until):
+                continue
+            directory = os.path.join(self.path, segment["name"])
+            yield {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in columns}
+
+def find_archives(base=ARCHIVE_DIR):
+    """Arquivos do processo único e de cada worker (data/archive, data/archive.w0, ...)."""
+    return [OrderArchive(path) for path in [base] + sorted(glob.glob(f"{base}.w*")) if os.path.isdir(path)]
+
+def query(archives, since=None, until=None, statuses=None, products=None, user_id=None, group_by=("month",)):
+    """Soma receita, linhas, pedidos e créditos por grupo, direto nas colunas.
+
+    Args:
+        archives (list): OrderArchive a consultar
+        since (str): Primeiro dia (AAAA-MM-DD), inclusive
+        until (str): Último dia (AAAA-MM-DD), inclusive
+        statuses (iterable): Só estes status
+        products (iterable): Só estes produtos (nomes)
+        user_id (int): Só pedidos deste usuário
+        group_by (tuple): Dimensões de GROUP_DIMENSIONS
+
+    Returns:
+        dict: rows (uma por grupo, maior receita primeiro) e totals
+    """
+    unknown = [dimension for dimension in group_by if dimension not in GROUP_DIMENSIONS]
+    if unknown:
+        raise ValueError(f"dimensões desconhecidas: {', '.join(unknown)}")
+    start = parse_timestamp(f"{since} 00:00:00") if since else None
+    end = parse_timestamp(f"{until} 23:59:59") if until else None
+
+    # Produtos e status em códigos comuns a todos os arquivos (cada um tem o seu dicionário)
+    names = {"product": {}, "status": {}}
+    keys, amounts, credits, orders = [], [], [], []
+    for archive in archives:
+        dictionary = archive.dictionary
+        remap = {
+            dimension: np.array([names[dimension].setdefault(name, len(names[dimension]))
+                                 for name in dictionary[key]] or [0], dtype=np.int64)
+            for dimension, key in (("product", "products"), ("status", "statuses"))
+        }
+        status_ids = [dictionary["statuses"].index(s) for s in statuses or () if s in dictionary["statuses"]]
+        product_ids = [archive._product_ids[p] for p in products or () if p in archive._product_ids]
+        for columns in archive.segments(since=start, until=end):
+            mask = np.ones(len(columns["ts"]), dtype=bool)
+            if start is not None:
+                mask &= columns["ts"] >= start
+            if end is not None:
+                mask &= columns["ts"] <= end
+            if statuses:
+                mask &= np.isin(columns["status"], status_ids)
+            if products:
+                mask &= np.isin(columns["product"], product_ids)
+            if user_id is not None:
+                mask &= columns["user"] == user_id
+            if not mask.any():
+                continue
+            keys.append(_group_keys(columns, mask, group_by, remap))
+            amounts.append(columns["amount_cents"][mask])
+            credits.append(columns["credits"][mask])
+            orders.append(columns["order"][mask])
+
+    if not keys:
+        return {"rows": [], "totals": {"revenue": 0.0, "items": 0, "orders": 0, "credits": 0}}
+    keys = np.concatenate(keys)
+    amounts, credits, orders = np.concatenate(amounts), np.concatenate(credits), np.concatenate(orders)
+    groups, inverse = _unique_rows(keys)
+    revenue = np.bincount(inverse, weights=amounts, minlength=len(groups))
+    items = np.bincount(inverse, minlength=len(groups))
+    credit_sums = np.bincount(inverse, weights=credits, minlength=len(groups))
+    # Pedidos distintos por grupo: pares (grupo, pedido) únicos
+    pairs, _ = _unique_rows(np.stack([inverse.astype(np.int64), orders], axis=1))
+    order_counts = np.bincount(pairs[:, 0], minlength=len(groups))
+
+    labels = {dimension: list(codes) for dimension, codes in names.items()}
+    rows = []
+    for index, group in enumerate(groups.tolist()):
+        row = {dimension: _label(dimension, code, labels) for dimension, code in zip(group_by, group)}
+        row.update(revenue=round(float(revenue[index]) / 100, 2), items=int(items[index]),
+                   orders=int(order_counts[index]), credits=int(credit_sums[index]))
+        rows.append(row)
+    rows.sort(key=lambda row: -row["revenue"])
+    return {"rows": rows, "totals": {
+        "revenue": round(int(amounts.sum()) / 100, 2),
+        "items": int(len(amounts)),
+        "orders": _count_distinct(orders),
+        "credits": int(credits.sum()),
+    }}
+
+def _count_distinct(values):
+    ordered = np.sort(values)
+    return int(len(ordered) and 1 + np.count_nonzero(ordered[1:] != ordered[:-1]))
+
+def _unique_rows(keys):
+    """Linhas distintas de uma matriz de inteiros e o índice de cada linha entre elas.
+
+    Quando os valores cabem, cada linha vira um único int64 (base mista) e o
+    np.unique é feito sobre um vetor, bem mais rápido que np.unique(axis=0).
+    """
+    if keys.shape[1] == 0:
+        return np.zeros((1, 0), dtype=np.int64), np.zeros(len(keys), dtype=np.int64)
+    low = keys.min(axis=0)
+    spans = keys.max(axis=0) - low + 1
+    if float(np.prod(spans.astype(np.float64))) >= 2 ** 62:
+        groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+        return groups, inverse.reshape(-1)
+    codes = np.zeros(len(keys), dtype=np.int64)
+    for column in range(keys.shape[1]):
+        codes = codes * spans[column] + (keys[:, column] - low[column])
+    unique_codes, inverse = np.unique(codes, return_inverse=True)
+    groups = np.empty((len(unique_codes), keys.shape[1]), dtype=np.int64)
+    for column in reversed(range(keys.shape[1])):
+        groups[:, column] = unique_codes % spans[column] + low[column]
+        unique_codes = unique_codes // spans[column]
+    return groups, inverse.reshape(-1)
+
+def _group_keys(columns, mask, group_by, remap):
+    """Chaves de grupo das linhas selecionadas: uma coluna inteira por dimensão."""
+    keys = np.zeros((int(mask.sum()), len(group_by)), dtype=np.int64)
+    for index, dimension in enumerate(group_by):
+        if dimension == "day":
+            keys[:, index] = columns["ts"][mask] // 86400
+        elif dimension == "month":
+            keys[:, index] = columns["ts"][mask].astype("datetime64[s]").astype("datetime64[M]").astype(np.int64)
+        elif dimension in remap:
+            keys[:, index] = remap[dimension][columns[dimension][mask]]
+        else:
+            keys[:, index] = columns["user"][mask]
+    return keys
+
+def _label(dimension, code, labels):
+    if dimension == "day":
+        return str(np.datetime64(code, "D"))
+    if dimension == "month":
+        return str(np.datetime64(code, "M"))
+    if dimension in labels:
+        return labels[dimension][code]
+    return code
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Relatórios do arquivo de pedidos encerrados")
+    parser.add_argument("--archive", default=ARCHIVE_DIR, help="Diretório do arquivo")
+    parser.add_argument("--since", help="Primeiro dia (AAAA-MM-DD)")
+    parser.add_argument("--until", help="Último dia (AAAA-MM-DD)")
+    parser.add_argument("--status", help="Status separados por vírgula")
+    parser.add_argument("--product", action="append", help="Produto (pode repetir)")
+    parser.add_argument("--user", type=int, help="ID do usuário")
+    parser.add_argument("--group-by", default="month", help=f"Dimensões: {', '.join(GROUP_DIMENSIONS)}")
+    args = parser.parse_args(argv)
+    if np is None:
+        sys.exit("O arquivo de pedidos requer o pacote numpy")
+
+    group_by = tuple(dimension for dimension in args.group_by.split(",") if dimension)
+    result = query(find_archives(args.archive), since=args.since, until=args.until,
+                   statuses=args.status.split(",") if args.status else None,
+                   products=args.product, user_id=args.user, group_by=group_by)
+    for row in result["rows"]:
+        labels = " | ".join(str(row[dimension]) for dimension in group_by)
+        print(f"{labels}: R${row['revenue']:.2f} - {row['orders']} pedidos, {row['credits']} créditos")
+    totals = result["totals"]
+    print(f"Total: R${totals['revenue']:.2f} - {totals['orders']} pedidos, {totals['credits']} créditos")
+
+if __name__ == "__main__":
+    main()
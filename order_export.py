@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de exportação de pedidos para a contabilidade (CSV ou NDJSON).
+Os pedidos passam um a um por geradores (filtro, formatação, compressão
+gzip opcional) e saem em blocos, então a memória usada não depende do
+tamanho do histórico. A leitura usa a mesma fonte do painel
+(dashboard_source): com o SQLite compartilhado os pedidos vêm de um cursor
+somente leitura, que não trava as gravações do bot.
+
+Uso:
+    python order_export.py --format csv --since 2025-01-01 --until 2025-01-31 --status pago,entregue -o jan.csv.gz
+"""
+
+import io
+import sys
+import csv
+import json
+import zlib
+import argparse
+
+from dashboard_query import QueryError, order_matches, parse_date
+
+EXPORT_FORMATS = ("csv", "ndjson")
+# Colunas do CSV: uma linha por item de cada pedido
+CSV_COLUMNS = ("order_id", "created_at", "status", "user_id", "payment_id",
+               "product", "credits", "amount")
+# Tamanho aproximado dos blocos entregues pelos geradores (bytes)
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+def parse_export_query(args):
+    """Filtros da exportação a partir dos parâmetros da URL ou da linha de comando.
+
+    Args:
+        args (dict): format (csv ou ndjson), status=pago,entregue, user_id, since, until e gzip
+
+    Returns:
+        dict: Consulta normalizada (as chaves de filtro são as de order_matches)
+    """
+    export_format = (args.get("format") or "csv").lower()
+    if export_format not in EXPORT_FORMATS:
+        raise QueryError(f"formato desconhecido: {export_format}")
+    user_id = args.get("user_id")
+    if user_id:
+        try:
+            user_id = int(user_id)
+        except ValueError:
+            raise QueryError("user_id deve ser um número")
+    statuses = args.get("status")
+    return {
+        "format": export_format,
+        "statuses": {status.strip() for status in statuses.split(",") if status.strip()} if statuses else None,
+        "user_id": user_id or None,
+        "since": parse_date(args.get("since")),
+        "until": parse_date(args.get("until"), end_of_day=True),
+        "gzip": str(args.get("gzip") or "").lower() in ("1", "true", "sim"),
+    }
+
+def filter_orders(orders, query):
+    """Pedidos (dicts) que passam nos filtros, na ordem em que chegam."""
+    for order in orders:
+        order = order if isinstance(order, dict) else order.to_dict()
+        if order_matches(order, query):
+            yield order
+
+def iter_csv(orders):
+    """Texto CSV em blocos, com cabeçalho, uma linha por item."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for order in orders:
+        for item in order.get("items") or [{}]:
+            details = item.get("details") or {}
+            writer.writerow((
+                order.get("id"), order.get("created_at"), order.get("status"), order.get("user_id"),
+                order.get("payment_id") or "", item.get("name", ""), details.get("credits", ""),
+                f"{float(item.get('price') or 0):.2f}",
+            ))
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def iter_ndjson(orders):
+    """Um pedido JSON por linha, em blocos."""
+    chunk = []
+    size = 0
+    for order in orders:
+        line = json.dumps(order, ensure_ascii=False, separators=(",", ":")) + "\n"
+        chunk.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk, size = [], 0
+    yield "".join(chunk)
+
+def encode_stream(chunks, compress=False):
+    """Blocos de texto como bytes UTF-8, comprimidos em gzip se pedido."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # 31: formato gzip
+    for chunk in chunks:
+        data = chunk.encode("utf-8")
+        if compressor:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
+
+def export_orders(orders, query):
+    """Exportação completa: filtro, formato e compressão.
+
+    Args:
+        orders (iterable): Pedidos (dicts ou Order), de preferência de um cursor
+        query (dict): Resultado de parse_export_query
+
+    Returns:
+        generator: Blocos de bytes
+    """
+    formatter = iter_csv if query["format"] == "csv" else iter_ndjson
+    return encode_stream(formatter(filter_orders(orders, query)), compress=query["gzip"])
+
+def export_filename(query):
+    name = "pedidos"
+    if query["since"] or query["until"]:
+        name += f"_{(query['since'] or '')[:10]}_{(query['until'] or '')[:10]}"
+    return f"{name}.{query['format']}" + (".gz" if query["gzip"] else "")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta pedidos em CSV ou NDJSON")
+    parser.add_argument("--format", default="csv", choices=EXPORT_FORMATS)
+    parser.add_argument("--since", help="Primeiro dia (AAAA-MM-DD)")
+    parser.add_argument("--until", help="Último dia (AAAA-MM-DD)")
+    parser.add_argument("--status", help="Status separados por vírgula")
+    parser.add_argument("--user-id", help="ID do usuário")
+    parser.add_argument("--gzip", action="store_true", help="Comprimir a saída (gzip)")
+    parser.add_argument("-o", "--output", help="Arquivo de saída (padrão: saída padrão)")
+    args = parser.parse_args(argv)
+
+    # Importado aqui: a fonte só é aberta por quem exporta
+    from dashboard_source import open_source
+
+    try:
+        query = parse_export_query({
+            "format": args.format, "since": args.since, "until": args.until, "status": args.status,
+            "user_id": args.user_id, "gzip": "1" if args.gzip or (args.output or "").endswith(".gz") else "",
+        })
+    except QueryError as e:
+        parser.error(str(e))
+    source = open_source()
+    chunks = export_orders(source.iter_orders(statuses=query["statuses"], user_id=query["user_id"]), query)
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de fila de saída para a Bot API do Telegram.
+Todas as mensagens enviadas fora do fluxo de resposta imediata (avisos ao
+cliente, notificações do admin, envios em massa) passam por uma fila com
+prioridade, limitada por token buckets global e por chat. Respostas de
+erro 429 (RetryAfter) pausam a fila pelo tempo pedido pelo Telegram, falhas
+de rede são repetidas com backoff e textos curtos consecutivos para o mesmo
+chat são agrupados em uma única mensagem.
+A escolha da próxima mensagem é feita sob uma trava; o envio, por um pequeno
+grupo de threads, para que a vazão seja limitada pelo bucket global e não
+pelo tempo de resposta de cada chamada. Cada chat tem no máximo um envio em
+andamento, o que mantém a ordem das mensagens dentro dele.
+"""
+
+import os
+import time
+import heapq
+import random
+import logging
+import threading
+import itertools
+from collections import deque
+from concurrent.futures import Future
+
+from metrics import registry
+
+logger = logging.getLogger('outbound_queue')
+
+# Prioridades (menor valor = enviado antes)
+PRIORITY_CUSTOMER = 0
+PRIORITY_ADMIN = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = {PRIORITY_CUSTOMER: "customer", PRIORITY_ADMIN: "admin", PRIORITY_BULK: "bulk"}
+
+# Limites da Bot API: ~30 mensagens/s no total, ~1/s por chat e 20/min em grupos
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "25"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_GROUP_RATE = 20 / 60.0
+OUTBOUND_MAX_ATTEMPTS = int(os.getenv("OUTBOUND_MAX_ATTEMPTS", "5"))
+# Threads de envio (chamadas à Bot API em paralelo, para chats diferentes)
+OUTBOUND_SENDERS = max(1, int(os.getenv("OUTBOUND_SENDERS", "4")))
+TELEGRAM_MAX_TEXT = 4096
+
+outbound_sent_counter = registry.counter(
+    "outbound_messages_total",
+    "Chamadas à Bot API feitas pela fila de saída por prioridade e resultado",
+    labels=("priority", "outcome")
+)
+outbound_depth_gauge = registry.gauge(
+    "outbound_queue_depth",
+    "Mensagens aguardando na fila de saída"
+)
+outbound_retry_after_counter = registry.counter(
+    "outbound_retry_after_total",
+    "Respostas 429 (RetryAfter) recebidas do Telegram"
+)
+
+class TokenBucket:
+    """Token bucket simples (não thread-safe; usado sob o lock da fila)."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Segundos até haver uma ficha disponível."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, now, seconds):
+        """Bloqueia o bucket (ex.: após um RetryAfter)."""
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+
+    def idle(self, now):
+        """True quando o bucket está cheio e pode ser descartado."""
+        self._refill(now)
+        return self.tokens >= self.burst and now >= self.blocked_until
+
+class OutboundMessage:
+    """Chamada pendente à Bot API."""
+
+    __slots__ = ("method", "chat_id", "priority", "kwargs", "futures", "attempts", "not_before")
+
+    def __init__(self, method, chat_id, priority, kwargs):
+        self.method = method
+        self.chat_id = chat_id
+        self.priority = priority
+        self.kwargs = kwargs
+        self.futures = [Future()]
+        self.attempts = 0
+        self.not_before = 0.0
+
+    @property
+    def batchable(self):
+        """Textos simples (sem teclado nem opções extras) podem ser agrupados."""
+        return (
+            self.method == "send_message"
+            and set(self.kwargs) <= {"text", "parse_mode"}
+        )
+
+    def merge(self, other):
+        """Acrescenta o texto de outra mensagem agrupável a esta."""
+        self.kwargs["text"] = f"{self.kwargs['text']}\n\n{other.kwargs['text']}"
+        self.futures.extend(other.futures)
+
+class OutboundQueue:
+    """Fila de saída com prioridade e limites de taxa para a Bot API."""
+
+    def __init__(self, bot=None, global_rate=OUTBOUND_GLOBAL_RATE, chat_rate=OUTBOUND_CHAT_RATE,
+                 group_rate=OUTBOUND_GROUP_RATE, max_attempts=OUTBOUND_MAX_ATTEMPTS,
+                 senders=OUTBOUND_SENDERS):
+        """Inicializa a fila.
+
+        Args:
+            bot (telegram.Bot): Bot usado nos envios (pode ser definido em start)
+            global_rate (float): Mensagens por segundo no total
+            chat_rate (float): Mensagens por segundo para um mesmo chat privado
+            group_rate (float): Mensagens por segundo para um mesmo grupo
+            max_attempts (int): Tentativas por mensagem em falhas de rede
+            senders (int): Threads de envio
+        """
+        self.bot = bot
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_attempts = max(1, max_attempts)
+        self.senders = max(1, senders)
+
+        self._lock = threading.Condition()
+        self._seq = itertools.count()
+        self._chats = {}       # chat_id -> deque de OutboundMessage (por prioridade, FIFO em cada uma)
+        self._sending = set()  # chats com um envio em andamento
+        self._ready = []       # heap (prioridade, seq, chat_id)
+        self._delayed = []     # heap (pronto_em, prioridade, seq, chat_id)
+        self._pending_edits = {}  # (chat_id, message_id) -> OutboundMessage
+        self._buckets = {}
+        self._global = TokenBucket(global_rate, max(1, int(global_rate)))
+        self._depth = 0
+        self._running = False
+        self._threads = []
+
+    # API pública
+
+    def send_message(self, chat_id, text, priority=PRIORITY_CUSTOMER, **kwargs):
+        """Enfileira um `send_message`.
+
+        Returns:
+            concurrent.futures.Future: Resolvido com a mensagem enviada
+        """
+        return self.submit("send_message", chat_id, priority, text=text, **kwargs)
+
+    def edit_message_text(self, chat_id, message_id, text, priority=PRIORITY_ADMIN, **kwargs):
+        """Enfileira um `edit_message_text`.
+
+        Edições ainda pendentes da mesma mensagem são substituídas pela mais
+        recente, pois só o último conteúdo importa.
+        """
+        with self._lock:
+            pending = self._pending_edits.get((chat_id, message_id))
+            if pending is not None:
+                pending.kwargs.update(text=text, **kwargs)
+                return pending.futures[0]
+            return self.submit("edit_message_text", chat_id, priority,
+                               message_id=message_id, text=text, **kwargs)
+
+    def submit(self, method, chat_id, priority=PRIORITY_CUSTOMER, **kwargs):
+        """Enfileira uma chamada qualquer da Bot API que tenha `chat_id`.
+
+        Args:
+            method (str): Nome do método de `telegram.Bot` (ex.: "send_photo")
+            chat_id (int): Chat de destino
+            priority (int): PRIORITY_CUSTOMER, PRIORITY_ADMIN ou PRIORITY_BULK
+
+        Returns:
+            concurrent.futures.Future: Resolvido com o retorno da Bot API
+        """
+        message = OutboundMessage(method, chat_id, priority, kwargs)
+        with self._lock:
+            self._insert(message)
+            if method == "edit_message_text":
+                self._pending_edits[(chat_id, kwargs.get("message_id"))] = message
+            heapq.heappush(self._ready, (priority, next(self._seq), chat_id))
+            self._depth += 1
+            outbound_depth_gauge.set(self._depth)
+            self._lock.notify()
+        return message.futures[0]
+
+    def depth(self):
+        """Número de mensagens aguardando envio."""
+        return self._depth
+
+    def start(self, bot=None):
+        """Inicia as threads de envio."""
+        if bot is not None:
+            self.bot = bot
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._threads = [
+            threading.Thread(target=self._run, name=f"outbound-queue-{index}", daemon=True)
+            for index in range(self.senders)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(
+            "Fila de saída iniciada (%.0f msg/s global, "
+            "%g msg/s por chat, %s threads de envio)",
+            self.global_rate, self.chat_rate, self.senders
+        )
+
+    def stop(self, timeout=10.0):
+        """Tenta esvaziar a fila por até `timeout` segundos e para as threads."""
+        with self._lock:
+            if not self._running:
+                return  # já parada (ex.: na passagem de bastão)
+        deadline = time.monotonic() + timeout
+        while self._depth and time.monotonic() < deadline:
+            time.sleep(0.05)
+        with self._lock:
+            self._running = False
+            self._lock.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=max(0.1, deadline - time.monotonic()))
+        if self._depth:
+            logger.warning("Fila de saída encerrada com %s mensagens não enviadas", self._depth)
+
+    # Implementação
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            rate = self.group_rate if str(chat_id).startswith("-") else self.chat_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, 3 if rate >= 1 else 1)
+        return bucket
+
+    def _insert(self, message, front=False):
+        """Coloca a mensagem na fila do chat, depois das de prioridade mais alta.
+
+        Com front=True (mensagem devolvida para nova tentativa), fica antes
+        das de mesma prioridade.
+        """
+        queue = self._chats.setdefault(message.chat_id, deque())
+        if not queue or (queue[-1].priority <= message.priority and not front):
+            queue.append(message)
+            return
+        for index, queued in enumerate(queue):
+            if queued.priority > message.priority or (front and queued.priority == message.priority):
+                queue.insert(index, message)
+                return
+        queue.append(message)
+
+    def _next_message(self):
+        """Retorna a próxima mensagem que pode ser enviada agora, ou o tempo de espera.
+
+        O chat da mensagem retornada fica com um envio em andamento até
+        _deliver() terminar.
+        """
+        now = time.monotonic()
+
+        # Chats que estavam esperando o próprio limite voltam à fila de prontos
+        while self._delayed and self._delayed[0][0] <= now:
+            _, priority, seq, chat_id = heapq.heappop(self._delayed)
+            heapq.heappush(self._ready, (priority, seq, chat_id))
+
+        global_wait = self._global.wait_time(now)
+        if global_wait > 0:
+            return None, global_wait
+
+        while self._ready:
+            priority, seq, chat_id = heapq.heappop(self._ready)
+            queue = self._chats.get(chat_id)
+            if not queue:
+                continue  # entrada obsoleta (mensagem agrupada ou já enviada)
+            if chat_id in self._sending:
+                continue  # volta à fila de prontos quando o envio em andamento terminar
+
+            head = queue[0]
+            wait = max(self._chat_bucket(chat_id).wait_time(now), head.not_before - now)
+            if wait > 0:
+                heapq.heappush(self._delayed, (now + wait, priority, seq, chat_id))
+                continue
+
+            message = queue.popleft()
+            self._depth -= 1
+            if message.method == "edit_message_text":
+                self._pending_edits.pop((chat_id, message.kwargs.get("message_id")), None)
+
+            # Agrupar textos simples consecutivos para o mesmo chat
+            if message.batchable:
+                while queue and queue[0].batchable \
+                        and queue[0].kwargs.get("parse_mode") == message.kwargs.get("parse_mode") \
+                        and len(message.kwargs["text"]) + len(queue[0].kwargs["text"]) + 2 <= TELEGRAM_MAX_TEXT:
+                    message.merge(queue.popleft())
+                    self._depth -= 1
+
+            if not queue:
+                del self._chats[chat_id]
+            self._chat_bucket(chat_id).consume(now)
+            self._global.consume(now)
+            self._sending.add(chat_id)
+            outbound_depth_gauge.set(self._depth)
+            return message, 0.0
+
+        waits = [self._delayed[0][0] - now] if self._delayed else []
+        return None, min(waits) if waits else None
+
+    def _requeue(self, message, delay):
+        """Devolve uma mensagem à fila do seu chat, à frente das de mesma prioridade."""
+        with self._lock:
+            message.not_before = time.monotonic() + delay
+            self._insert(message, front=True)
+            if message.method == "edit_message_text":
+                self._pending_edits[(message.chat_id, message.kwargs.get("message_id"))] = message
+            heapq.heappush(self._ready, (message.priority, next(self._seq), message.chat_id))
+            self._depth += 1
+            outbound_depth_gauge.set(self._depth)
+            self._lock.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while True:
+                    if not self._running:
+                        return
+                    message, wait = self._next_message() if self.bot is not None else (None, None)
+                    if message is not None:
+                        break
+                    self._lock.wait(wait)
+            self._deliver(message)
+            self._cleanup_buckets()
+
+    def _deliver(self, message):
+        """Faz a chamada à Bot API (fora da trava) e libera o chat."""
+        chat_id = message.chat_id
+        try:
+            self._call(message)
+        finally:
+            with self._lock:
+                self._sending.discard(chat_id)
+                if self._chats.get(chat_id):
+                    heapq.heappush(self._ready, (self._chats[chat_id][0].priority, next(self._seq), chat_id))
+                    self._lock.notify()
+
+    def _call(self, message):
+        from telegram.error import RetryAfter, TimedOut, NetworkError, ChatMigrated, BadRequest
+
+        priority = PRIORITY_NAMES.get(message.priority, str(message.priority))
+        message.attempts += 1
+        try:
+            result = getattr(self.bot, message.method)(chat_id=message.chat_id, **message.kwargs)
+        except RetryAfter as e:
+            outbound_retry_after_counter.inc()
+            outbound_sent_counter.inc(priority=priority, outcome="retry_after")
+            retry_after = float(getattr(e, "retry_after", 1) or 1)
+            logger.warning("Telegram pediu para aguardar %.0fs (chat %s)", retry_after, message.chat_id)
+            with self._lock:
+                self._global.block(time.monotonic(), retry_after)
+            # RetryAfter não conta como tentativa: a mensagem não foi processada
+            message.attempts -= 1
+            self._requeue(message, retry_after)
+            return
+        except ChatMigrated as e:
+            logger.info("Chat %s migrou para %s; reenviando", message.chat_id, e.new_chat_id)
+            message.chat_id = e.new_chat_id
+            self._requeue(message, 0)
+            return
+        except BadRequest as e:
+            # Subclasse de NetworkError no python-telegram-bot, mas não adianta repetir
+            self._fail(message, priority, e)
+            return
+        except (TimedOut, NetworkError) as e:
+            if message.attempts < self.max_attempts:
+                outbound_sent_counter.inc(priority=priority, outcome="retry")
+                delay = min(30.0, 2 ** message.attempts) * random.uniform(0.5, 1.0)
+                logger.warning(
+                    "Falha de rede ao enviar para %s "
+                    "(tentativa %s): %s; nova tentativa em %.1fs",
+                    message.chat_id, message.attempts, e, delay
+                )
+                self._requeue(message, delay)
+                return
+            self._fail(message, priority, e)
+            return
+        except Exception as e:
+            # BadRequest, Unauthorized (bot bloqueado) etc.: não adianta repetir
+            self._fail(message, priority, e)
+            return
+
+        outbound_sent_counter.inc(priority=priority, outcome="sent")
+        for future in message.futures:
+            future.set_result(result)
+
+    def _fail(self, message, priority, error):
+        outbound_sent_counter.inc(priority=priority, outcome="failed")
+        if type(error).__name__ == "Unauthorized":
+            # Usuário bloqueou o bot: esperado em envios em massa
+            logger.info("Chat %s indisponível para '%s': %s", message.chat_id, message.method, error)
+        else:
+            logger.error("Erro ao enviar '%s' para %s: %s", message.method, message.chat_id, error)
+        for future in message.futures:
+            future.set_exception(error)
+
+    def _cleanup_buckets(self):
+        """Descarta buckets de chats ociosos para não crescer sem limite."""
+        if len(self._buckets) < 10000:
+            return
+        with self._lock:
+            now = time.monotonic()
+            for chat_id in [cid for cid, bucket in self._buckets.items()
+                            if cid not in self._chats and bucket.idle(now)]:
+                del self._buckets[chat_id]
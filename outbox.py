@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de outbox persistente para notificações.
+As mudanças de estado dos pedidos registram as notificações correspondentes
+(para o cliente e para o admin) no outbox, que é gravado junto com os dados
+da loja. Um job periódico entrega as notificações pela fila de saída, com
+retentativas e backoff, e só as remove depois da confirmação de envio. Assim
+um reinício no meio do caminho não perde avisos e uma mesma transição nunca
+gera a mesma notificação duas vezes (deduplicação por chave).
+"""
+
+import os
+import json
+import time
+import uuid
+import random
+import logging
+import threading
+
+from metrics import registry
+
+logger = logging.getLogger('outbox')
+
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+OUTBOX_INTERVAL = float(os.getenv("OUTBOX_INTERVAL", "2"))
+# Por quanto tempo uma chave já entregue continua bloqueando duplicatas
+OUTBOX_DEDUPE_SECONDS = 24 * 3600
+
+outbox_counter = registry.counter(
+    "outbox_notifications_total",
+    "Notificações do outbox por tipo e resultado",
+    labels=("kind", "outcome")
+)
+outbox_pending_gauge = registry.gauge(
+    "outbox_pending",
+    "Notificações aguardando entrega no outbox"
+)
+
+class PermanentDeliveryError(Exception):
+    """Falha que não adianta repetir (ex.: pedido removido, usuário bloqueou o bot)."""
+
+class Outbox:
+    """Notificações pendentes com deduplicação, persistidas em JSON."""
+
+    def __init__(self, state_file, max_attempts=OUTBOX_MAX_ATTEMPTS, base_delay=15.0,
+                 max_delay=3600.0, dedupe_seconds=OUTBOX_DEDUPE_SECONDS):
+        """Inicializa o outbox.
+
+        Args:
+            state_file (str): Arquivo JSON com as notificações pendentes
+            max_attempts (int): Tentativas antes de desistir de uma notificação
+            base_delay (float): Atraso base do backoff exponencial (segundos)
+            max_delay (float): Atraso máximo entre tentativas (segundos)
+            dedupe_seconds (float): Janela de deduplicação após a entrega
+        """
+        self.state_file = state_file
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.dedupe_seconds = dedupe_seconds
+
+        self._lock = threading.RLock()
+        self._entries = {}     # id -> notificação pendente
+        self._keys = {}        # chave -> id pendente
+        self._delivered = {}   # chave -> instante da entrega
+        self._in_flight = set()
+        self._dirty = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, kind, key, payload):
+        """Registra uma notificação, a menos que a mesma chave já exista.
+
+        Args:
+            kind (str): Tipo da notificação (define o handler de entrega)
+            key (str): Chave de deduplicação (ex.: "customer_delivered:ab12cd34")
+            payload (dict): Dados usados pelo handler
+
+        Returns:
+            bool: True se a notificação foi registrada
+        """
+        with self._lock:
+            if key in self._keys or key in self._delivered:
+                outbox_counter.inc(kind=kind, outcome="duplicate")
+                return False
+            entry_id = uuid.uuid4().hex[:12]
+            self._entries[entry_id] = {
+                "id": entry_id,
+                "kind": kind,
+                "key": key,
+                "payload": payload,
+                "created_at": time.time(),
+                "attempts": 0,
+                "next_attempt": 0.0,
+                "last_error": None,
+            }
+            self._keys[key] = entry_id
+            self._dirty = True
+            outbox_pending_gauge.set(len(self._entries))
+            return True
+
+    def drain(self, handlers, limit=100):
+        """Entrega as notificações vencidas.
+
+        Cada handler recebe o payload e retorna um Future (entrega confirmada
+        quando ele for resolvido) ou None (entrega imediata); exceções contam
+        como falha e PermanentDeliveryError descarta a notificação.
+
+        Args:
+            handlers (dict): Tipo -> callable(payload)
+            limit (int): Máximo de notificações iniciadas por chamada
+
+        Returns:
+            int: Número de notificações iniciadas
+        """
+        now = time.time()
+        with self._lock:
+            self._prune_delivered(now)
+            due = [
+                entry for entry in self._entries.values()
+                if entry["id"] not in self._in_flight and entry["next_attempt"] <= now
+            ]
+            due.sort(key=lambda entry: entry["created_at"])
+            due = due[:limit]
+            self._in_flight.update(entry["id"] for entry in due)
+
+        for entry in due:
+            handler = handlers.get(entry["kind"])
+            try:
+                if handler is None:
+                    raise PermanentDeliveryError(f"tipo de notificação desconhecido: {entry['kind']}")
+                future = handler(entry["payload"])
+            except Exception as e:
+                self._complete(entry["id"], e)
+                continue
+            if future is None:
+                self._complete(entry["id"])
+            else:
+                future.add_done_callback(
+                    lambda f, entry_id=entry["id"]: self._complete(entry_id, f.exception())
+                )
+
+        self.save()
+        return len(due)
+
+    def _complete(self, entry_id, error=None):
+        with self._lock:
+            self._in_flight.discard(entry_id)
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                return
+            self._dirty = True
+
+            if error is None:
+                self._remove(entry)
+                self._delivered[entry["key"]] = time.time()
+                outbox_counter.inc(kind=entry["kind"], outcome="delivered")
+                return
+
+            entry["attempts"] += 1
+            entry["last_error"] = str(error)[:200]
+            permanent = isinstance(error, PermanentDeliveryError) or type(error).__name__ in ("Unauthorized", "BadRequest")
+            if permanent or entry["attempts"] >= self.max_attempts:
+                self._remove(entry)
+                outbox_counter.inc(kind=entry["kind"], outcome="dropped")
+                log = logger.info if isinstance(error, PermanentDeliveryError) else logger.error
+                log("Notificação '%s' descartada após %s tentativa(s): %s", entry['key'], entry['attempts'], error)
+                return
+
+            delay = min(self.max_delay, self.base_delay * (2 ** (entry["attempts"] - 1)))
+            entry["next_attempt"] = time.time() + random.uniform(delay / 2, delay)
+            outbox_counter.inc(kind=entry["kind"], outcome="retry")
+            logger.warning(
+                "Falha ao entregar '%s' (tentativa %s): %s; "
+                "nova tentativa em %.0fs",
+                entry['key'], entry['attempts'], error, delay
+            )
+
+    def _remove(self, entry):
+        self._entries.pop(entry["id"], None)
+        self._keys.pop(entry["key"], None)
+        outbox_pending_gauge.set(len(self._entries))
+
+    def _prune_delivered(self, now):
+        limit = now - self.dedupe_seconds
+        for key in [key for key, delivered_at in self._delivered.items() if delivered_at < limit]:
+            del self._delivered[key]
+
+    def save(self, force=False):
+        """Grava o outbox em disco se houver alterações.
+
+        Returns:
+            bool: True se o arquivo foi gravado
+        """
+        with self._lock:
+            if not (self._dirty or force):
+                return False
+            snapshot = {"entries": list(self._entries.values()), "delivered": dict(self._delivered)}
+            self._dirty = False
+
+        try:
+            os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+            tmp_file = f"{self.state_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_file, self.state_file)
+            return True
+        except Exception as e:
+            logger.error("Erro ao salvar o outbox: %s", e)
+            with self._lock:
+                self._dirty = True
+            return False
+
+    def load(self):
+        """Carrega as notificações pendentes gravadas anteriormente."""
+        if not os.path.exists(self.state_file):
+            return 0
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except Exception as e:
+            logger.error("Erro ao carregar o outbox: %s", e)
+            return 0
+
+        with self._lock:
+            self._entries = {entry["id"]: entry for entry in snapshot.get("entries", [])}
+            self._keys = {entry["key"]: entry["id"] for entry in self._entries.values()}
+            self._delivered = {key: float(value) for key, value in snapshot.get("delivered", {}).items()}
+            self._in_flight.clear()
+            self._dirty = False
+            outbox_pending_gauge.set(len(self._entries))
+        if self._entries:
+            logger.info("Outbox carregado com %s notificações pendentes", len(self._entries))
+        return len(self._entries)
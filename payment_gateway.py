@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de acesso ao Mercado Pago com circuit breaker e retentativas adaptativas.
+Todas as chamadas ao cliente `mp` passam por aqui: as falhas transitórias são
+repetidas de forma limitada (com backoff e orçamento de retentativas), o
+circuit breaker evita que os workers fiquem presos quando o provedor está
+lento ou fora do ar, e as mensagens exibidas ao usuário ficam centralizadas.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from metrics import registry
+
+logger = logging.getLogger('payment_gateway')
+
+# Configuração via variáveis de ambiente
+PAYMENT_TIMEOUT = float(os.getenv("MP_TIMEOUT_SECONDS", "10"))
+PAYMENT_MAX_ATTEMPTS = int(os.getenv("MP_MAX_ATTEMPTS", "3"))
+PAYMENT_BREAKER_FILE = os.path.join("data", "payment_breaker.json")
+# URL base alternativa da API (ex.: servidor falso de fake_mercadopago.py)
+PAYMENT_BASE_URL = os.getenv("MERCADO_PAGO_BASE_URL")
+MERCADO_PAGO_API_URL = "https://api.mercadopago.com"
+
+# Mensagens exibidas ao usuário quando o provedor está indisponível
+PAYMENT_UNAVAILABLE_MESSAGE = (
+    "⚠️ Nosso sistema de pagamentos está instável no momento.\n"
+    "Seu carrinho foi mantido. Por favor, tente novamente em alguns minutos."
+)
+PAYMENT_CHECK_UNAVAILABLE_MESSAGE = (
+    "⚠️ Não conseguimos consultar o Mercado Pago agora.\n"
+    "Se você já pagou, fique tranquilo: seu pagamento será reconhecido. "
+    "Tente verificar novamente em alguns minutos."
+)
+
+# Status HTTP considerados falhas transitórias do provedor
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+
+payment_calls_counter = registry.counter(
+    "payment_provider_calls_total",
+    "Chamadas ao Mercado Pago por operação e resultado",
+    labels=("operation", "outcome")
+)
+payment_duration_histogram = registry.histogram(
+    "payment_provider_duration_seconds",
+    "Duração de cada tentativa de chamada ao Mercado Pago por operação",
+    labels=("operation",)
+)
+payment_retries_counter = registry.counter(
+    "payment_provider_retries_total",
+    "Retentativas de chamadas ao Mercado Pago",
+    labels=("operation",)
+)
+
+class PaymentUnavailableError(Exception):
+    """O provedor de pagamentos não respondeu de forma utilizável."""
+
+    def __init__(self, operation, reason, retry_after=None):
+        super().__init__(f"{operation}: {reason}")
+        self.operation = operation
+        self.reason = reason
+        self.retry_after = retry_after
+
+class RetryBudget:
+    """Orçamento de retentativas proporcional ao volume de chamadas.
+
+    Cada chamada deposita `ratio` fichas e cada retentativa consome uma, de
+    modo que as retentativas nunca passam de ~ratio do tráfego normal. Sob
+    falha generalizada o orçamento se esgota e as retentativas param
+    sozinhas, em vez de multiplicar a carga sobre o provedor.
+    """
+
+    def __init__(self, ratio=0.2, min_tokens=3, max_tokens=20):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = float(min_tokens)
+        self._min_tokens = min_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self._tokens + self.ratio, self.max_tokens)
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+class PaymentGateway:
+    """Fachada do cliente Mercado Pago protegida por circuit breaker."""
+
+    def __init__(self, sdk, breaker=None, max_attempts=PAYMENT_MAX_ATTEMPTS,
+                 base_delay=0.3, max_delay=2.0, timeout=PAYMENT_TIMEOUT):
+        """Inicializa o gateway.
+
+        Args:
+            sdk: Instância de `mercadopago.SDK`
+            breaker (CircuitBreaker): Circuit breaker compartilhado
+            max_attempts (int): Número máximo de tentativas por chamada
+            base_delay (float): Atraso base do backoff exponencial (segundos)
+            max_delay (float): Atraso máximo entre tentativas (segundos)
+            timeout (float): Timeout de cada requisição ao provedor (segundos)
+        """
+        self.sdk = sdk
+        self.breaker = breaker or CircuitBreaker(
+            "mercadopago",
+            slow_call_seconds=timeout * 0.8,
+            state_file=PAYMENT_BREAKER_FILE
+        )
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.retry_budget = RetryBudget()
+
+    # Operações
+
+    def create_payment(self, payment_data, request_options=None):
+        """Cria um pagamento.
+
+        Só é repetida quando há chave de idempotência nas opções, para que
+        uma retentativa nunca gere uma segunda cobrança.
+        """
+        retryable = bool(request_options is not None and request_options.custom_headers)
+        return self._call(
+            "create",
+            lambda options: self.sdk.payment().create(payment_data, options),
+            request_options,
+            retryable=retryable
+        )
+
+    def get_payment(self, payment_id):
+        """Consulta um pagamento pelo ID."""
+        return self._call(
+            "get",
+            lambda options: self.sdk.payment().get(payment_id, options),
+        )
+
+    def search_payments(self, filters):
+        """Busca pagamentos por filtros (ex.: external_reference)."""
+        return self._call(
+            "search",
+            lambda options: self.sdk.payment().search(filters, options),
+        )
+
+    def status(self):
+        """Resumo do estado do provedor para health check e métricas."""
+        return self.breaker.snapshot()
+
+    # Implementação
+
+    def _request_options(self, request_options):
+        """Aplica timeout curto e desativa as retentativas internas do SDK."""
+        if request_options is None:
+            try:
+                from mercadopago.config import RequestOptions
+                request_options = RequestOptions()
+            except Exception:
+                return None
+        request_options.connection_timeout = self.timeout
+        request_options.max_retries = 0
+        return request_options
+
+    def _call(self, operation, func, request_options=None, retryable=True):
+        options = self._request_options(request_options)
+        self.retry_budget.deposit()
+        last_reason = None
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError as e:
+                payment_calls_counter.inc(operation=operation, outcome="rejected")
+                raise PaymentUnavailableError(operation, "circuito aberto", e.retry_after)
+
+            start = time.monotonic()
+            try:
+                response = func(options)
+            except Exception as e:
+                payment_duration_histogram.observe(time.monotonic() - start, operation=operation)
+                self.breaker.record_failure(time.monotonic() - start, e)
+                payment_calls_counter.inc(operation=operation, outcome="error")
+                last_reason = str(e)
+                logger.warning("Falha na chamada '%s' ao Mercado Pago (tentativa %s): %s", operation, attempt, e)
+            else:
+                duration = time.monotonic() - start
+                payment_duration_histogram.observe(duration, operation=operation)
+                status = response.get("status") if isinstance(response, dict) else None
+                if status in TRANSIENT_STATUS:
+                    self.breaker.record_failure(duration, f"HTTP {status}")
+                    payment_calls_counter.inc(operation=operation, outcome="transient")
+                    last_reason = f"HTTP {status}"
+                    logger.warning("Mercado Pago respondeu HTTP %s em '%s' (tentativa %s)", status, operation, attempt)
+                else:
+                    # Erros 4xx são do pedido, não do provedor: não abrem o circuito
+                    self.breaker.record_success(duration)
+                    payment_calls_counter.inc(operation=operation, outcome="ok")
+                    return response
+
+            if not retryable or attempt == self.max_attempts or not self.retry_budget.withdraw():
+                break
+
+            payment_retries_counter.inc(operation=operation)
+            # Backoff exponencial com jitter completo
+            delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+            time.sleep(random.uniform(0, delay))
+
+        raise PaymentUnavailableError(operation, last_reason or "falha desconhecida")
+
+def create_sdk(access_token, base_url=PAYMENT_BASE_URL):
+    """Cria o cliente `mercadopago.SDK`, opcionalmente apontado para outra URL
+
+    Args:
+        access_token (str): Token de acesso do Mercado Pago
+        base_url (str): URL base que substitui https://api.mercadopago.com
+            (padrão: variável MERCADO_PAGO_BASE_URL)
+
+    Returns:
+        mercadopago.SDK: Cliente configurado
+    """
+    import mercadopago
+
+    if not base_url:
+        return mercadopago.SDK(access_token)
+
+    from mercadopago.http import HttpClient
+
+    class RebasedHttpClient(HttpClient):
+        """Cliente HTTP do SDK que reescreve a URL base das requisições."""
+
+        def request(self, method, url, *args, **kwargs):
+            if url.startswith(MERCADO_PAGO_API_URL):
+                url = base_url.rstrip("/") + url[len(MERCADO_PAGO_API_URL):]
+            return super().request(method, url, *args, **kwargs)
+
+    logger.warning("Mercado Pago apontado para %s (MERCADO_PAGO_BASE_URL)", base_url)
+    return mercadopago.SDK(access_token, http_client=RebasedHttpClient())
+
+def payment_error_message(error, checking=False):
+    """Retorna a mensagem para o usuário correspondente a uma falha do provedor.
+
+    Args:
+        error (Exception): Erro capturado ao falar com o Mercado Pago
+        checking (bool): True na verificação de status, False na criação do PIX
+
+    Returns:
+        str: Texto pronto para ser enviado ao usuário
+    """
+    message = PAYMENT_CHECK_UNAVAILABLE_MESSAGE if checking else PAYMENT_UNAVAILABLE_MESSAGE
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after:
+        minutes = max(1, int(round(retry_after / 60.0)))
+        message += f"\n\n⏱️ Tente novamente em cerca de {minutes} min."
+    return message
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de idempotência para a criação de pagamentos PIX.
+Calcula uma impressão digital (fingerprint) do carrinho e serializa tentativas
+concorrentes de checkout do mesmo carrinho, para que um toque duplo em
+"Finalizar Compra" ou um callback reenviado não gere dois pedidos e duas
+cobranças no Mercado Pago.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger('payment_idempotency')
+
+# Janela (em segundos) em que um pedido pendente pode ser reaproveitado
+IDEMPOTENCY_WINDOW = int(os.getenv("PAYMENT_IDEMPOTENCY_WINDOW", "900"))
+
+# Cabeçalho aceito pela API do Mercado Pago para deduplicar requisições
+IDEMPOTENCY_HEADER = "X-Idempotency-Key"
+
+
+def cart_fingerprint(user_id, cart_items, cart_version=0):
+    """Calcula a impressão digital de um carrinho
+
+    A impressão digital combina o usuário, a versão do carrinho e o conteúdo
+    de cada item (nome, preço em centavos e detalhes), de forma que o mesmo
+    carrinho sempre gere a mesma chave e qualquer alteração gere outra.
+
+    Args:
+        user_id (int): ID do usuário no Telegram
+        cart_items (list): Itens do carrinho (CartItem ou dict)
+        cart_version (int): Versão do carrinho mantida (e gravada) pelo DataStore
+
+    Returns:
+        str: Hash SHA-256 em hexadecimal
+    """
+    items = []
+    for item in cart_items:
+        if isinstance(item, dict):
+            name, price, details = item.get('name'), item.get('price', 0), item.get('details', {})
+        else:
+            name, price, details = item.name, item.price, item.details
+        items.append([name, int(round(float(price) * 100)), details or {}])
+
+    payload = json.dumps(
+        [str(user_id), int(cart_version), items],
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(',', ':'),
+        default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def build_request_options(idempotency_key):
+    """Cria as opções de requisição do SDK com o cabeçalho de idempotência
+
+    Args:
+        idempotency_key (str): Chave enviada ao Mercado Pago
+
+    Returns:
+        RequestOptions | None: Opções prontas para `mp.payment().create`, ou
+        None se a versão instalada do SDK não suportar cabeçalhos customizados
+    """
+    try:
+        from mercadopago.config import RequestOptions
+        return RequestOptions(custom_headers={IDEMPOTENCY_HEADER: idempotency_key})
+    except Exception as e:
+        logger.warning("SDK do Mercado Pago sem suporte a cabeçalhos customizados: %s", e)
+        return None
+
+
+class CheckoutLocks:
+    """Locks por chave para serializar checkouts do mesmo carrinho.
+
+    Os locks são criados sob demanda e descartados quando ninguém mais os
+    utiliza, então o número de entradas fica limitado aos checkouts em
+    andamento.
+    """
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks = {}  # chave -> [lock, número de interessados]
+
+    @contextmanager
+    def hold(self, key):
+        """Mantém o lock da chave durante o bloco `with`."""
+        with self._guard:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+
+        entry[0].acquire()
+        try:
+            yield
+        finally:
+            entry[0].release()
+            with self._guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._locks.pop(key, None)
+
+
+# Instância global usada pelo fluxo de pagamento
+checkout_locks = CheckoutLocks()
@@ -13,12 +13,10 @@ import logging
 import threading
 import time
 from datetime import datetime
+from log_setup import setup_logging
 
 # Configuração de logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+setup_logging()
 logger = logging.getLogger('persistent_data')
 
 class PersistentDataManager:
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de imagens de QR Code PIX.
+Converte o `qr_code_base64` devolvido pelo Mercado Pago em um arquivo pronto
+para envio pelo Telegram e, quando o provedor não envia a imagem, gera o QR
+Code localmente a partir do código copia e cola (requer o pacote opcional
+`qrcode`).
+"""
+
+import io
+import base64
+import binascii
+import logging
+
+logger = logging.getLogger('pix_qr')
+
+try:
+    import qrcode
+except ImportError:
+    qrcode = None
+    logger.info("Pacote qrcode não instalado; QR Codes PIX só serão enviados quando o provedor fornecer a imagem")
+
+
+def decode_qr_base64(qr_code_base64):
+    """Decodifica a imagem do QR Code enviada pelo provedor
+
+    A decodificação é feita uma única vez e o resultado é envolvido em um
+    BytesIO, que compartilha o buffer dos bytes decodificados em vez de
+    copiá-lo.
+
+    Args:
+        qr_code_base64 (str): Imagem PNG em base64 (com ou sem prefixo data URI)
+
+    Returns:
+        io.BytesIO | None: Arquivo em memória, ou None se os dados forem inválidos
+    """
+    if not qr_code_base64:
+        return None
+
+    if qr_code_base64.startswith("data:"):
+        qr_code_base64 = qr_code_base64.partition(",")[2]
+
+    try:
+        raw = base64.b64decode(qr_code_base64, validate=True)
+    except (binascii.Error, ValueError) as e:
+        logger.warning("QR Code em base64 inválido: %s", e)
+        return None
+
+    image = io.BytesIO(raw)
+    image.name = "pix.png"
+    return image
+
+
+def render_qr_png(pix_code):
+    """Gera localmente a imagem PNG do QR Code para um código PIX
+
+    Args:
+        pix_code (str): Código PIX copia e cola
+
+    Returns:
+        io.BytesIO | None: Imagem PNG, ou None se o pacote qrcode não estiver disponível
+    """
+    if not pix_code or qrcode is None:
+        return None
+
+    try:
+        image = io.BytesIO()
+        qrcode.make(pix_code).save(image, format="PNG")
+    except Exception as e:
+        # Sem Pillow, usar o gerador PNG puro do próprio pacote
+        try:
+            from qrcode.image.pure import PyPNGImage
+            image = io.BytesIO()
+            qrcode.make(pix_code, image_factory=PyPNGImage).save(image)
+        except Exception:
+            logger.warning("Não foi possível gerar o QR Code localmente: %s", e)
+            return None
+
+    image.seek(0)
+    image.name = "pix.png"
+    return image
+
+
+def pix_qr_image(qr_code_base64=None, pix_code=None):
+    """Retorna a imagem do QR Code, preferindo a do provedor
+
+    Args:
+        qr_code_base64 (str): Imagem enviada pelo Mercado Pago, se houver
+        pix_code (str): Código copia e cola, usado no fallback local
+
+    Returns:
+        io.BytesIO | None: Imagem pronta para `send_photo`
+    """
+    return decode_qr_base64(qr_code_base64) or render_qr_png(pix_code)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de profiling sob demanda do bot em produção.
+Uma thread amostra a pilha de todas as outras threads (sys._current_frames)
+em intervalos curtos durante N segundos, enquanto o tracemalloc registra as
+alocações; no fim sai um relatório com as funções que mais aparecem nas
+amostras e as linhas que mais alocaram memória, e as pilhas no formato
+"collapsed" (uma linha "a;b;c N" por pilha), aceito por flamegraph.pl e
+speedscope. Fora de uma coleta nada roda: nem a thread nem o tracemalloc.
+
+A coleta pode ser pedida pelo comando /profile do administrador ou pelo
+sinal SIGUSR2 (kill -USR2 <pid>), útil nos workers de cada shard.
+"""
+
+import os
+import sys
+import signal
+import time
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger('profiler')
+
+# Intervalo entre amostras (segundos)
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+# Duração máxima de uma coleta (segundos)
+PROFILE_MAX_SECONDS = 300
+# Duração da coleta iniciada pelo sinal SIGUSR2 (segundos)
+PROFILE_SIGNAL_SECONDS = float(os.getenv("PROFILE_SIGNAL_SECONDS", "30"))
+# Quadros guardados por alocação no tracemalloc
+TRACEMALLOC_FRAMES = 10
+# Linhas de cada tabela do relatório
+REPORT_TOP = 25
+
+# Quadros em que uma thread está só esperando trabalho (arquivo, função)
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("handlers.py", "dequeue"),  # escritor do log (log_setup)
+    ("selectors.py", "select"),
+    ("socketserver.py", "serve_forever"),
+}
+
+_lock = threading.Lock()
+
+def frame_label(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+def _stack(frame):
+    """Rótulos da pilha, da raiz até o quadro atual."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+class ProfileResult:
+    """Resultado de uma coleta: amostras por pilha e diferença de alocações."""
+
+    def __init__(self, seconds, samples, stacks, allocations):
+        self.seconds = seconds
+        self.samples = samples          # número de rodadas de amostragem
+        self.stacks = stacks            # Counter: (thread, rótulos...) -> amostras
+        self.allocations = allocations  # StatisticDiff do tracemalloc, maior primeiro
+
+    def top_functions(self, limit=REPORT_TOP):
+        """Funções por amostras em que estavam no topo (próprio) e na pilha (acumulado).
+
+        Returns:
+            list: Tuplas (função, próprio, acumulado), maior próprio primeiro
+        """
+        own = Counter()
+        cumulative = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack[1:]
+            own[frames[-1]] += count
+            for label in set(frames):
+                cumulative[label] += count
+        return [(label, count, cumulative[label]) for label, count in own.most_common(limit)]
+
+    def collapsed(self):
+        """Pilhas no formato collapsed: "thread;f1;f2 amostras", uma por linha."""
+        return "".join(
+            f"{';'.join(stack)} {count}\n"
+            for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1])
+        )
+
+    def report(self, limit=REPORT_TOP):
+        """Relatório em texto com as funções e as alocações de maior peso."""
+        total = sum(self.stacks.values()) or 1
+        lines = [
+            f"Profiling de {self.seconds:g}s em {datetime.now():%Y-%m-%d %H:%M:%S}",
+            f"{self.samples} rodadas de amostragem, {sum(self.stacks.values())} amostras de threads ativas",
+            "",
+            "Funções (% das amostras: próprio / acumulado)",
+        ]
+        for label, own, cumulative in self.top_functions(limit):
+            lines.append(f"{100 * own / total:6.2f}% {100 * cumulative / total:6.2f}%  {label}")
+        lines += ["", "Alocações (diferença no período)"]
+        if not self.allocations:
+            lines.append("nenhuma")
+        for stat in self.allocations[:limit]:
+            frame = stat.traceback[0]
+            lines.append(
+                f"{stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8d} blocos  "
+                f"{os.path.basename(frame.filename)}:{frame.lineno}"
+            )
+        return "\n".join(lines) + "\n"
+
+def profile(seconds, interval=PROFILE_SAMPLE_INTERVAL):
+    """Amostra todas as threads por `seconds` segundos, na thread que chamar.
+
+    Args:
+        seconds (float): Duração da coleta (até PROFILE_MAX_SECONDS)
+        interval (float): Intervalo entre amostras
+
+    Returns:
+        ProfileResult: Resultado, ou None se já houver uma coleta em andamento
+    """
+    if not _lock.acquire(blocking=False):
+        return None
+    try:
+        seconds = min(max(float(seconds), 0.1), PROFILE_MAX_SECONDS)
+        own_ident = threading.get_ident()
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        before = tracemalloc.take_snapshot()
+
+        stacks = Counter()
+        samples = 0
+        names = {}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                if ident not in names:
+                    names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                name = names.get(ident, str(ident))
+                stacks[(name, *_stack(frame))] += 1
+            samples += 1
+            time.sleep(interval)
+
+        after = tracemalloc.take_snapshot()
+        if started_tracing:
+            tracemalloc.stop()
+        # As alocações do próprio tracemalloc e da amostragem não interessam
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        allocations = [
+            stat for stat in after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+            if stat.size_diff
+        ]
+        allocations.sort(key=lambda stat: -abs(stat.size_diff))
+        return ProfileResult(seconds, samples, stacks, allocations)
+    finally:
+        _lock.release()
+
+def profile_in_background(seconds, on_done):
+    """Roda profile() em uma thread e entrega o resultado a on_done(result).
+
+    Returns:
+        bool: False se já houver uma coleta em andamento
+    """
+    if _lock.locked():
+        return False
+
+    def run():
+        try:
+            result = profile(seconds)
+        except Exception as e:
+            logger.error("Erro no profiling: %s", e)
+            return
+        if result is not None:
+            on_done(result)
+
+    threading.Thread(target=run, name="profiler", daemon=True).start()
+    return True
+
+def install_signal_handler(on_done, seconds=PROFILE_SIGNAL_SECONDS):
+    """Inicia uma coleta a cada SIGUSR2 (chamar na thread principal).
+
+    Returns:
+        bool: False se a plataforma não tiver SIGUSR2
+    """
+    if not hasattr(signal, "SIGUSR2"):
+        return False
+
+    def handle(signum, frame):
+        # O tratador só dispara a thread; a coleta não roda dentro dele
+        if profile_in_background(seconds, on_done):
+            logger.info("Profiling de %gs iniciado pelo sinal SIGUSR2", seconds)
+
+    signal.signal(signal.SIGUSR2, handle)
+    return True
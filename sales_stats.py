@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de estatísticas de vendas com agregados incrementais.
+Mantém, por dia × produto × status, a receita, o número de pedidos, os
+créditos vendidos e o desconto concedido. Cada transição de pedido move as
+quantias do pedido do bucket do status anterior para o do novo, então as
+consultas (ex.: "receita de hoje por produto") percorrem só os buckets, nunca
+os pedidos. Os agregados podem ser reconstruídos do histórico em uma única
+passada vetorizada (NumPy, se instalado).
+"""
+
+import logging
+import threading
+from datetime import datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger('sales_stats')
+
+# Medidas de cada bucket, nesta ordem
+MEASURES = ("revenue", "orders", "credits", "discount")
+DIMENSIONS = ("day", "product", "status")
+# Status que contam como venda realizada
+SALE_STATUSES = ("pago", "entregue")
+
+def _get(order, name, default=None):
+    if isinstance(order, dict):
+        return order.get(name, default)
+    return getattr(order, name, default)
+
+def _item_fields(item):
+    if isinstance(item, dict):
+        return item.get("name") or "?", float(item.get("price") or 0), item.get("details") or {}
+    return item.name or "?", float(item.price or 0), item.details or {}
+
+def order_lines(order):
+    """Contribuição de um pedido por produto, sem o status.
+
+    Returns:
+        list: Tuplas (dia, produto, receita, pedidos, créditos, desconto); um
+            pedido conta uma vez em cada produto que contém, e mais uma linha
+            com produto None conta o pedido uma única vez para os totais
+    """
+    day = (_get(order, "created_at") or "")[:10] or "?"
+    lines = {}
+    for item in _get(order, "items") or []:
+        name, price, details = _item_fields(item)
+        credits = details.get("credits") or 0
+        discount = 0.0
+        if credits and details.get("original_price") is not None:
+            # Preço cheio dos créditos menos o preço cobrado
+            discount = max(0.0, float(details["original_price"]) * credits - price)
+        line = lines.setdefault(name, [0.0, 1, 0, 0.0])
+        line[0] += price
+        line[2] += credits
+        line[3] += discount
+    return [(day, None, 0.0, 1, 0, 0.0)] + [(day, name, *line) for name, line in lines.items()]
+
+class SalesRollup:
+    """Agregados de vendas por dia × produto × status."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}  # (dia, produto, status) -> [receita, pedidos, créditos, desconto]
+        self._status = {}   # order_id -> status já contabilizado
+
+    def apply(self, order):
+        """Contabiliza um pedido novo ou a mudança de status de um pedido conhecido.
+
+        Idempotente: aplicar de novo a mesma versão do pedido não altera nada,
+        então o mesmo pedido pode chegar por mais de um caminho.
+        """
+        order_id = _get(order, "id")
+        status = _get(order, "status")
+        with self._lock:
+            previous = self._status.get(order_id)
+            if previous == status:
+                return False
+            lines = order_lines(order)
+            if previous is not None:
+                self._add(lines, previous, -1)
+            self._add(lines, status, 1)
+            self._status[order_id] = status
+            return True
+
+    def _add(self, lines, status, sign):
+        for day, product, *values in lines:
+            key = (day, product, status)
+            bucket = self._buckets.setdefault(key, [0.0, 0, 0, 0.0])
+            for index, value in enumerate(values):
+                bucket[index] += sign * value
+            if bucket[1] <= 0:
+                del self._buckets[key]
+
+    def rebuild(self, orders):
+        """Recalcula todos os agregados a partir do histórico de pedidos.
+
+        Returns:
+            int: Número de buckets
+        """
+        statuses = {}
+        rows = []  # (dia, produto, status, receita, pedidos, créditos, desconto)
+        for order in orders:
+            status = _get(order, "status")
+            statuses[_get(order, "id")] = status
+            rows.extend((day, product, status, *values) for day, product, *values in order_lines(order))
+        buckets = _aggregate_numpy(rows) if np is not None else _aggregate(rows)
+        with self._lock:
+            self._buckets = buckets
+            self._status = statuses
+        logger.info("Agregados de vendas reconstruídos: %s pedidos, %s buckets", len(statuses), len(buckets))
+        return len(buckets)
+
+    def query(self, since=None, until=None, statuses=None, products=None, group_by=DIMENSIONS):
+        """Soma as medidas dos buckets que passam nos filtros.
+
+        Args:
+            since (str): Primeiro dia (AAAA-MM-DD), inclusive
+            until (str): Último dia (AAAA-MM-DD), inclusive
+            statuses (iterable): Só estes status (None = todos)
+            products (iterable): Só estes produtos (None = todos)
+            group_by (tuple): Dimensões mantidas ("day", "product", "status")
+
+        Returns:
+            dict: rows (uma por grupo, maior receita primeiro) e totals
+        """
+        statuses = set(statuses) if statuses else None
+        products = set(products) if products else None
+        indexes = [DIMENSIONS.index(dimension) for dimension in group_by]
+        # Sem separar por produto, os pedidos vêm das linhas de produto None
+        # (um pedido com dois produtos conta uma vez)
+        by_order = "product" not in group_by and not products
+        groups = {}
+        totals = [0.0, 0, 0, 0.0]
+        with self._lock:
+            for key, values in self._buckets.items():
+                day, product, status = key
+                if ((since and day < since) or (until and day > until)
+                        or (statuses and status not in statuses) or (products and product not in products)):
+                    continue
+                if product is None:
+                    # O total de pedidos conta cada pedido uma vez, como nos grupos
+                    totals[1] += values[1] if not products else 0
+                    if not by_order:
+                        continue
+                elif by_order:
+                    values = (values[0], 0, values[2], values[3])
+                group = groups.setdefault(tuple(key[index] for index in indexes), [0.0, 0, 0, 0.0])
+                for index, value in enumerate(values):
+                    group[index] += value
+                    if index != 1 or products:
+                        totals[index] += value
+        rows = [
+            {**dict(zip(group_by, key)), **_measures(values)}
+            for key, values in groups.items()
+        ]
+        rows.sort(key=lambda row: (-row["revenue"], [str(row[dimension]) for dimension in group_by]))
+        return {"rows": rows, "totals": _measures(totals)}
+
+    def bucket_count(self):
+        return len(self._buckets)
+
+def _measures(values):
+    revenue, orders, credits, discount = values
+    return {"revenue": round(revenue, 2), "orders": int(orders), "credits": int(credits),
+            "discount": round(discount, 2)}
+
+def _aggregate(rows):
+    buckets = {}
+    for day, product, status, *values in rows:
+        bucket = buckets.setdefault((day, product, status), [0.0, 0, 0, 0.0])
+        for index, value in enumerate(values):
+            bucket[index] += value
+    return buckets
+
+def _aggregate_numpy(rows):
+    """Soma as linhas por bucket com np.bincount (uma passada por medida, sem laço por bucket)."""
+    if not rows:
+        return {}
+    keys = {}  # bucket -> código sequencial
+    codes = np.fromiter((keys.setdefault(row[:3], len(keys)) for row in rows), dtype=np.int64, count=len(rows))
+    values = np.array([row[3:] for row in rows], dtype=np.float64)
+    sums = np.stack([np.bincount(codes, weights=values[:, column], minlength=len(keys))
+                     for column in range(len(MEASURES))], axis=1)
+    return {
+        key: [float(revenue), int(round(orders)), int(round(credits)), float(discount)]
+        for key, (revenue, orders, credits, discount) in zip(keys, sums.tolist())
+    }
+
+def format_summary(rollup, days=7, today=None):
+    """Texto do comando /stats: vendas de hoje, por dia e produtos mais vendidos.
+
+    Args:
+        rollup (SalesRollup): Agregados de vendas
+        days (int): Número de dias do período, terminando hoje
+        today (datetime): Data de referência (padrão: agora)
+    """
+    today = today or datetime.now()
+    until = today.strftime("%Y-%m-%d")
+    since = (today - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+
+    today_totals = rollup.query(since=until, until=until, statuses=SALE_STATUSES, group_by=())["totals"]
+    by_day = rollup.query(since=since, until=until, statuses=SALE_STATUSES, group_by=("day",))
+    by_product = rollup.query(since=since, until=until, statuses=SALE_STATUSES, group_by=("product",))
+    pending = rollup.query(since=since, until=until, statuses=("pendente",), group_by=())["totals"]
+
+    lines = [
+        "📊 Vendas",
+        "",
+        f"Hoje: R${today_totals['revenue']:.2f} em {today_totals['orders']} pedidos",
+        "",
+        f"Últimos {days} dias: R${by_day['totals']['revenue']:.2f} em {by_day['totals']['orders']} pedidos",
+        f"Créditos vendidos: {by_day['totals']['credits']}",
+        f"Descontos concedidos: R${by_day['totals']['discount']:.2f}",
+        f"Pendentes: {pending['orders']} (R${pending['revenue']:.2f})",
+    ]
+    if by_day["rows"]:
+        lines += ["", "Por dia:"]
+        for row in sorted(by_day["rows"], key=lambda row: row["day"], reverse=True):
+            lines.append(f"{row['day']}: R${row['revenue']:.2f} ({row['orders']})")
+    if by_product["rows"]:
+        lines += ["", "Produtos:"]
+        for row in by_product["rows"][:10]:
+            lines.append(f"{row['product']}: R${row['revenue']:.2f} ({row['orders']})")
+    return "\n".join(lines)
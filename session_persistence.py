@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de persistência das sessões dos usuários (user_data e conversas).
+Guarda o `context.user_data` e o estado dos ConversationHandlers em um
+journal JSON-lines (data/sessions.jsonl): a cada gravação só os usuários e
+conversas que mudaram desde a anterior são acrescentados ao arquivo, em vez
+de um dump completo. Na inicialização o journal é reaplicado e, quando as
+linhas obsoletas passam a dominar, reescrito de forma compacta. Sessões sem
+atividade há mais que o TTL são descartadas do disco e da memória e, acima
+do limite de sessões ou de memória, as menos usadas recentemente (LRU) são
+descartadas primeiro.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import defaultdict, OrderedDict
+
+from telegram.ext import BasePersistence
+
+from metrics import registry
+from instrumentation import store_flush_histogram
+
+logger = logging.getLogger('session_persistence')
+
+SESSIONS_FILE = os.path.join("data", "sessions.jsonl")
+SESSION_TTL_HOURS = float(os.getenv("SESSION_TTL_HOURS", "24"))
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "5"))
+SESSION_MAX_USERS = int(os.getenv("SESSION_MAX_USERS", "50000"))
+SESSION_MAX_MEMORY_MB = float(os.getenv("SESSION_MAX_MEMORY_MB", "64"))
+# Conversas paradas por mais que isso são encerradas pelo ConversationHandler (segundos)
+SESSION_CONVERSATION_TIMEOUT = int(os.getenv("SESSION_CONVERSATION_TIMEOUT", "900"))
+# Usuários descartados no meio de uma conversa lembrados para o aviso de sessão expirada
+SESSION_EXPIRED_NOTICES = 10000
+# O journal é compactado quando tem mais linhas que este múltiplo das sessões vivas
+SESSION_COMPACT_RATIO = 2
+SESSION_COMPACT_MIN_LINES = 1000
+
+sessions_gauge = registry.gauge(
+    "sessions_stored",
+    "Sessões de usuário mantidas em memória"
+)
+session_bytes_gauge = registry.gauge(
+    "session_bytes",
+    "Tamanho aproximado (JSON) do user_data mantido em memória"
+)
+sessions_evicted_counter = registry.counter(
+    "sessions_evicted_total",
+    "Sessões descartadas por motivo (ttl ou capacity)",
+    labels=("reason",)
+)
+session_writes_counter = registry.counter(
+    "session_journal_writes_total",
+    "Registros gravados no journal de sessões por tipo",
+    labels=("kind",)
+)
+
+class JournalPersistence(BasePersistence):
+    """Persistência incremental de user_data e conversas para o Updater."""
+
+    def __init__(self, filename=SESSIONS_FILE, ttl_seconds=SESSION_TTL_HOURS * 3600,
+                 max_sessions=SESSION_MAX_USERS, max_bytes=SESSION_MAX_MEMORY_MB * 1024 * 1024,
+                 compact_ratio=SESSION_COMPACT_RATIO, compact_min_lines=SESSION_COMPACT_MIN_LINES):
+        """Inicializa a persistência.
+
+        Args:
+            filename (str): Arquivo JSON-lines do journal
+            ttl_seconds (float): Inatividade após a qual a sessão é descartada (0 desativa)
+            max_sessions (int): Máximo de sessões em memória (0 desativa)
+            max_bytes (float): Máximo aproximado de bytes de user_data em memória (0 desativa)
+            compact_ratio (float): Linhas por sessão viva que disparam a compactação
+            compact_min_lines (int): Tamanho mínimo do journal para compactar
+        """
+        super().__init__(store_user_data=True, store_chat_data=False,
+                         store_bot_data=False, store_callback_data=False)
+        self.filename = filename
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.compact_ratio = compact_ratio
+        self.compact_min_lines = compact_min_lines
+
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._user_data = {}        # user_id -> JSON do último user_data gravado
+        self._last_seen = OrderedDict()  # user_id -> última atividade, do mais antigo ao mais recente
+        self._bytes = 0
+        self._conversations = {}    # nome -> {chave (tupla): estado}
+        self._user_conversations = defaultdict(set)  # user_id -> {(nome, chave)}
+        self._expired = OrderedDict()  # user_id -> conversa interrompida pelo descarte
+        self._pending_users = {}    # user_id -> JSON a gravar (None = remover)
+        self._pending_conversations = {}  # (nome, chave) -> estado a gravar
+        self._journal_lines = 0
+        self._journal_position = 0  # bytes do journal já aplicados
+        self._journal_inode = None
+
+    # Interface do BasePersistence
+
+    def get_user_data(self):
+        self._load()
+        with self._lock:
+            data = defaultdict(dict)
+            for user_id, serialized in self._user_data.items():
+                data[user_id] = json.loads(serialized)
+            return data
+
+    def get_chat_data(self):
+        return defaultdict(dict)
+
+    def get_bot_data(self):
+        return {}
+
+    def get_conversations(self, name):
+        """Retorna o dicionário de estados da conversa; o ConversationHandler passa a usá-lo."""
+        self._load()
+        with self._lock:
+            return self._conversations.setdefault(name, {})
+
+    def update_conversation(self, name, key, new_state):
+        with self._lock:
+            conversation = self._conversations.setdefault(name, {})
+            if new_state is None:
+                conversation.pop(key, None)
+                self._user_conversations[key[-1]].discard((name, key))
+            else:
+                conversation[key] = new_state
+                self._user_conversations[key[-1]].add((name, key))
+            self._pending_conversations[(name, key)] = new_state
+            self._touch(key[-1], time.time())
+
+    def update_user_data(self, user_id, data):
+        serialized = json.dumps(data, ensure_ascii=False, sort_keys=True, default=str)
+        with self._lock:
+            self._touch(user_id, time.time())
+            previous = self._user_data.get(user_id)
+            if previous == serialized:
+                return
+            if not data and previous is None:
+                self._pending_users.pop(user_id, None)
+                return
+            self._bytes += len(serialized) - len(previous or "")
+            self._user_data[user_id] = serialized
+            self._pending_users[user_id] = serialized
+
+    def update_chat_data(self, chat_id, data):
+        pass
+
+    def update_bot_data(self, data):
+        pass
+
+    def refresh_user_data(self, user_id, user_data):
+        with self._lock:
+            self._touch(user_id, time.time())
+
+    def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    def refresh_bot_data(self, bot_data):
+        pass
+
+    def flush(self):
+        """Grava as alterações pendentes (também chamado pelo Updater ao parar)."""
+        return self.save()
+
+    # Gravação incremental
+
+    def save(self):
+        """Acrescenta ao journal os usuários e conversas alterados.
+
+        Returns:
+            int: Número de registros gravados
+        """
+        with self._lock:
+            if not (self._pending_users or self._pending_conversations):
+                return 0
+            now = time.time()
+            records = []
+            for user_id, serialized in self._pending_users.items():
+                records.append(self._user_record(user_id, serialized, now))
+            for (name, key), state in self._pending_conversations.items():
+                records.append(self._conversation_record(name, key, state, now))
+            pending_users, self._pending_users = self._pending_users, {}
+            pending_conversations, self._pending_conversations = self._pending_conversations, {}
+
+            try:
+                os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+                with store_flush_histogram.time(store="sessions"), open(self.filename, 'ab') as f:
+                    f.writelines(_encode(record) for record in records)
+                    self._journal_position = f.tell()
+                    self._journal_inode = os.fstat(f.fileno()).st_ino
+            except Exception as e:
+                logger.error("Erro ao gravar o journal de sessões: %s", e)
+                # Manter as alterações para a próxima tentativa (sem sobrescrever as mais novas)
+                for user_id, serialized in pending_users.items():
+                    self._pending_users.setdefault(user_id, serialized)
+                for item, state in pending_conversations.items():
+                    self._pending_conversations.setdefault(item, state)
+                return 0
+
+            self._journal_lines += len(records)
+            session_writes_counter.inc(len(pending_users), kind="user_data")
+            session_writes_counter.inc(len(pending_conversations), kind="conversation")
+            if self._should_compact():
+                self._compact()
+            return len(records)
+
+    def evict(self, dispatcher=None, now=None):
+        """Descarta as sessões expiradas (TTL) e, acima dos limites, as menos usadas.
+
+        Args:
+            dispatcher (Dispatcher): Se informado, remove também o user_data em memória
+            now (float): Instante de referência (epoch), por padrão o atual
+
+        Returns:
+            int: Número de usuários descartados
+        """
+        limit = (now or time.time()) - self.ttl_seconds
+        evicted = {"ttl": 0, "capacity": 0}
+        with self._lock:
+            while self._last_seen:
+                user_id, seen = next(iter(self._last_seen.items()))
+                if self.ttl_seconds > 0 and seen < limit:
+                    reason = "ttl"
+                elif (self.max_sessions and len(self._last_seen) > self.max_sessions) \
+                        or (self.max_bytes and self._bytes > self.max_bytes):
+                    reason = "capacity"
+                else:
+                    break
+                self._drop_user(user_id)
+                if dispatcher is not None:
+                    dispatcher.user_data.pop(user_id, None)
+                evicted[reason] += 1
+            self._update_gauges()
+
+        for reason, count in evicted.items():
+            if count:
+                sessions_evicted_counter.inc(count, reason=reason)
+        total = evicted["ttl"] + evicted["capacity"]
+        if total:
+            logger.info(
+                "%s sessões descartadas (%s inativas, "
+                "%s por limite de memória)",
+                total, evicted['ttl'], evicted['capacity']
+            )
+        return total
+
+    def pop_expired(self, user_id):
+        """True (uma única vez) se a conversa do usuário foi interrompida pelo descarte."""
+        with self._lock:
+            return self._expired.pop(user_id, None) is not None
+
+    # Implementação
+
+    def _touch(self, user_id, now):
+        self._last_seen[user_id] = now
+        self._last_seen.move_to_end(user_id)
+
+    def _drop_user(self, user_id):
+        self._last_seen.pop(user_id, None)
+        serialized = self._user_data.pop(user_id, None)
+        if serialized is not None:
+            self._bytes -= len(serialized)
+            self._pending_users[user_id] = None
+        else:
+            self._pending_users.pop(user_id, None)
+        conversations = self._user_conversations.pop(user_id, ())
+        for name, key in conversations:
+            if self._conversations.get(name, {}).pop(key, None) is not None:
+                self._pending_conversations[(name, key)] = None
+        if conversations:
+            self._expired[user_id] = True
+            while len(self._expired) > SESSION_EXPIRED_NOTICES:
+                self._expired.popitem(last=False)
+
+    def _update_gauges(self):
+        sessions_gauge.set(len(self._last_seen))
+        session_bytes_gauge.set(self._bytes)
+
+    def _user_record(self, user_id, serialized, now):
+        if serialized is None:
+            return {"u": user_id, "d": None}
+        return {"u": user_id, "d": json.loads(serialized), "t": self._last_seen.get(user_id, now)}
+
+    def _conversation_record(self, name, key, state, now):
+        # A chave padrão é (chat_id, user_id): o último elemento identifica o usuário
+        return {"c": name, "k": list(key), "s": state, "t": self._last_seen.get(key[-1], now)}
+
+    def _live_records(self):
+        return len(self._user_data) + sum(len(conversation) for conversation in self._conversations.values())
+
+    def _should_compact(self):
+        return (self._journal_lines >= self.compact_min_lines
+                and self._journal_lines > self.compact_ratio * max(1, self._live_records()))
+
+    def _compact(self):
+        """Reescreve o journal só com as sessões vivas (troca atômica do arquivo)."""
+        now = time.time()
+        tmp_file = f"{self.filename}.tmp"
+        try:
+            lines = 0
+            with open(tmp_file, 'wb') as f:
+                for user_id, serialized in self._user_data.items():
+                    f.write(_encode(self._user_record(user_id, serialized, now)))
+                    lines += 1
+                for name, conversation in self._conversations.items():
+                    for key, state in conversation.items():
+                        f.write(_encode(self._conversation_record(name, key, state, now)))
+                        lines += 1
+                position, inode = f.tell(), os.fstat(f.fileno()).st_ino
+            os.replace(tmp_file, self.filename)
+            self._journal_position, self._journal_inode = position, inode
+        except Exception as e:
+            logger.error("Erro ao compactar o journal de sessões: %s", e)
+            return
+        logger.info("Journal de sessões compactado: %s -> %s linhas", self._journal_lines, lines)
+        self._journal_lines = lines
+
+    def _load(self):
+        """Reaplica o journal gravado (uma única vez)."""
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not os.path.exists(self.filename):
+                return
+
+            lines, _ = self._replay()
+            self._journal_lines = lines
+
+            expired = self.evict()
+            self._pending_users.clear()
+            self._pending_conversations.clear()
+            self._expired.clear()
+            if lines:
+                logger.info(
+                    "Sessões carregadas: %s usuários, "
+                    "%s conversas ativas "
+                    "(%s descartadas)",
+                    len(self._user_data), self._live_records() - len(self._user_data), expired
+                )
+            self._update_gauges()
+            if self._should_compact() or expired:
+                self._compact()
+
+    def reload(self, dispatcher=None):
+        """Aplica o que outro processo gravou no journal desde a carga (passagem de bastão).
+
+        Args:
+            dispatcher (Dispatcher): Se informado, atualiza também o user_data em memória
+
+        Returns:
+            int: Número de registros aplicados
+        """
+        with self._lock:
+            self._load()
+            try:
+                stat = os.stat(self.filename)
+            except OSError:
+                return 0
+            if stat.st_ino == self._journal_inode and stat.st_size >= self._journal_position:
+                lines, touched = self._replay(self._journal_position)
+                self._journal_lines += lines
+            else:
+                # Journal compactado pelo outro processo: recarregar do início
+                touched = set(self._last_seen)
+                self._reset()
+                lines, replayed = self._replay()
+                touched |= replayed
+                self._journal_lines = lines
+
+            if dispatcher is not None:
+                for user_id in touched:
+                    serialized = self._user_data.get(user_id)
+                    if serialized is None:
+                        dispatcher.user_data.pop(user_id, None)
+                    else:
+                        dispatcher.user_data[user_id] = json.loads(serialized)
+            self._update_gauges()
+
+        if lines:
+            logger.info("Sessões atualizadas com %s registros gravados por outro processo", lines)
+        return lines
+
+    def _reset(self):
+        self._user_data.clear()
+        self._last_seen.clear()
+        self._bytes = 0
+        for conversation in self._conversations.values():
+            conversation.clear()  # os ConversationHandlers mantêm referência a estes dicionários
+        self._user_conversations.clear()
+
+    def _replay(self, start=0):
+        """Aplica os registros do journal a partir de uma posição.
+
+        Returns:
+            tuple: (registros aplicados, usuários afetados)
+        """
+        lines, touched = 0, set()
+        try:
+            with open(self.filename, 'rb') as f:
+                f.seek(start)
+                position = start
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # gravação em andamento; será lida na próxima vez
+                    position += len(line)
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # linha corrompida por uma gravação interrompida
+                    lines += 1
+                    user_id = self._apply(record)
+                    if user_id is not None:
+                        touched.add(user_id)
+                self._journal_position = position
+                self._journal_inode = os.fstat(f.fileno()).st_ino
+        except Exception as e:
+            logger.error("Erro ao carregar o journal de sessões: %s", e)
+        self._last_seen = OrderedDict(sorted(self._last_seen.items(), key=lambda item: item[1]))
+        return lines, touched
+
+    def _apply(self, record):
+        """Aplica um registro do journal; retorna o usuário afetado."""
+        if "u" in record:
+            user_id = record["u"]
+            serialized = self._user_data.pop(user_id, None)
+            self._bytes -= len(serialized or "")
+            if record.get("d") is None:
+                self._last_seen.pop(user_id, None)
+            else:
+                serialized = json.dumps(record["d"], ensure_ascii=False, sort_keys=True)
+                self._user_data[user_id] = serialized
+                self._bytes += len(serialized)
+                self._last_seen[user_id] = record.get("t", time.time())
+            return user_id
+        elif "c" in record:
+            key = tuple(record["k"])
+            conversation = self._conversations.setdefault(record["c"], {})
+            if record.get("s") is None:
+                conversation.pop(key, None)
+                self._user_conversations[key[-1]].discard((record["c"], key))
+            else:
+                conversation[key] = record["s"]
+                self._user_conversations[key[-1]].add((record["c"], key))
+                self._last_seen[key[-1]] = max(self._last_seen.get(key[-1], 0), record.get("t", time.time()))
+            return key[-1]
+
+def _encode(record):
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo do modo multiprocesso (BOT_WORKERS > 1).
+Um único processo de ingestão busca os updates no Telegram e os distribui
+para N processos worker pelo hash do usuário: todos os updates de um mesmo
+usuário vão sempre para o mesmo worker e são processados em ordem. Cada
+worker é dono dos carrinhos, sessões, outbox e agenda de expiração dos seus
+usuários (arquivos com sufixo .w<índice> em data/); pedidos e usuários ficam
+no armazenamento compartilhado (shared_store). Cada worker confirma (ack) os
+updates que terminou de processar; a ingestão guarda os encaminhados ainda
+sem confirmação, reenvia-os ao substituto de um worker que caiu e os grava
+junto com o offset (update_offset), que nunca passa do menor deles.
+"""
+
+import os
+import time
+import queue
+import shutil
+import signal
+import logging
+import zlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+
+from metrics import registry
+
+logger = logging.getLogger('sharding')
+
+# Número de processos worker; 1 mantém o modo de processo único
+BOT_WORKERS = max(1, int(os.getenv("BOT_WORKERS", "1")))
+# Definido pela ingestão no ambiente de cada worker que ela inicia
+WORKER_INDEX = int(os.environ["BOT_WORKER_INDEX"]) if os.getenv("BOT_WORKER_INDEX") else None
+# Updates aguardando em cada worker antes de a ingestão esperar (contrapressão)
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+# Intervalo da verificação de workers encerrados inesperadamente (segundos)
+WORKER_CHECK_INTERVAL = 5
+# Tempo para um worker terminar a fila e os handlers em andamento no desligamento (segundos)
+WORKER_STOP_TIMEOUT = float(os.getenv("WORKER_STOP_TIMEOUT", "30"))
+
+IS_WORKER = WORKER_INDEX is not None
+IS_INGEST = BOT_WORKERS > 1 and not IS_WORKER
+
+shard_updates_counter = registry.counter(
+    "shard_updates_total",
+    "Updates encaminhados pela ingestão por worker",
+    labels=("shard",)
+)
+shard_queue_gauge = registry.gauge(
+    "shard_queue_depth",
+    "Updates aguardando na fila de cada worker",
+    labels=("shard",)
+)
+shard_restarts_counter = registry.counter(
+    "shard_worker_restarts_total",
+    "Workers reiniciados após encerrarem inesperadamente",
+    labels=("shard",)
+)
+
+def shard_of(user_key, workers=BOT_WORKERS):
+    """Índice do worker dono de um usuário (estável entre processos e reinícios)."""
+    if user_key is None or workers <= 1:
+        return 0
+    # hash() do Python muda a cada processo; crc32 é igual em todos
+    return zlib.crc32(str(user_key).encode()) % workers
+
+def owns_user(user_id):
+    """True se este processo é o dono do usuário (sempre True fora dos workers)."""
+    return not IS_WORKER or shard_of(user_id) == WORKER_INDEX
+
+def shard_path(path):
+    """Caminho do arquivo deste worker (data/carts.json -> data/carts.w2.json)."""
+    if not IS_WORKER:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.w{WORKER_INDEX}{ext}"
+
+def worker_share(rate):
+    """Parte de um limite global (ex.: mensagens/s) que cabe a cada processo."""
+    return rate / BOT_WORKERS if IS_WORKER else rate
+
+def adopt_legacy_file(path, owner=0):
+    """Copia o arquivo do modo de processo único para o worker indicado.
+
+    Na primeira execução em modo multiprocesso, o estado gravado antes
+    (outbox, agenda, broadcast) é assumido por um único worker.
+
+    Returns:
+        str: Caminho do arquivo deste worker
+    """
+    own_path = shard_path(path)
+    if own_path != path and WORKER_INDEX == owner and not os.path.exists(own_path) and os.path.exists(path):
+        shutil.copyfile(path, own_path)
+        logger.info("Arquivo %s assumido pelo worker %s", path, WORKER_INDEX)
+    return own_path
+
+class ShardRouter:
+    """Processos worker e as filas pelas quais a ingestão lhes entrega updates."""
+
+    def __init__(self, target, workers=BOT_WORKERS, queue_size=WORKER_QUEUE_SIZE):
+        """Inicializa o roteador.
+
+        Args:
+            target (callable): Função de entrada do worker; recebe a fila de
+                updates e a fila onde confirma os update_id processados
+            workers (int): Número de processos worker
+            queue_size (int): Capacidade da fila de cada worker
+        """
+        self.target = target
+        self.workers = workers
+        # spawn: o worker importa o bot do zero em vez de herdar threads e
+        # conexões do processo de ingestão (fork não é seguro com threads)
+        self._context = multiprocessing.get_context("spawn")
+        self._queue_size = queue_size
+        self._queues = [self._context.Queue(maxsize=queue_size) for _ in range(workers)]
+        # Uma fila de confirmação por worker: um worker morto à força não trava a dos outros
+        self._acks = [self._context.Queue() for _ in range(workers)]
+        self._lock = threading.Lock()
+        self._unacked = [OrderedDict() for _ in range(workers)]  # update_id -> update (dict)
+        self._processes = [None] * workers
+        self._stopping = False
+
+    def start(self):
+        for index in range(self.workers):
+            self._start_worker(index)
+        logger.info("%s workers iniciados", self.workers)
+
+    def _start_worker(self, index):
+        # O ambiente é copiado na criação do processo: o worker já importa o
+        # bot sabendo o próprio índice
+        os.environ["BOT_WORKER_INDEX"] = str(index)
+        try:
+            process = self._context.Process(
+                target=self.target, args=(self._queues[index], self._acks[index]), name=f"bot-worker-{index}"
+            )
+            process.start()
+        finally:
+            del os.environ["BOT_WORKER_INDEX"]
+        self._processes[index] = process
+
+    def route(self, update, context=None):
+        """Entrega o update ao worker do usuário (handler do dispatcher da ingestão)."""
+        user = update.effective_user or update.effective_chat
+        index = shard_of(user.id if user else None, self.workers)
+        data = update.to_dict()
+        while True:
+            with self._lock:
+                self._unacked[index][data["update_id"]] = data
+                worker_queue = self._queues[index]
+            try:
+                worker_queue.put(data, timeout=1)
+                break
+            except queue.Full:
+                # Worker ocupado ou caído; se a fila foi trocada nesse meio-tempo,
+                # o update já foi reenviado na fila nova
+                if worker_queue is not self._queues[index]:
+                    break
+        shard_updates_counter.inc(shard=index)
+
+    def collect_acks(self):
+        """Esquece os updates que os workers confirmaram como processados."""
+        for index in range(self.workers):
+            self._collect_acks(index)
+
+    def _collect_acks(self, index):
+        acks = self._acks[index]
+        with self._lock:
+            while True:
+                try:
+                    self._unacked[index].pop(acks.get_nowait(), None)
+                except (queue.Empty, OSError, EOFError, ValueError):
+                    return
+
+    def pending(self):
+        """Updates encaminhados e ainda não confirmados, em ordem de update_id.
+
+        Returns:
+            list: Updates (dicts) a reenviar se os workers não chegarem a eles
+        """
+        self.collect_acks()
+        with self._lock:
+            updates = [data for unacked in self._unacked for data in unacked.values()]
+        return sorted(updates, key=lambda data: data["update_id"])
+
+    def check_workers(self):
+        """Reinicia workers encerrados inesperadamente.
+
+        O substituto recebe filas novas (um worker morto à força pode ter
+        deixado a trava de leitura presa) e, em ordem, os updates que o
+        anterior recebeu e não confirmou: os que estavam na fila e o que
+        estava sendo processado quando ele caiu.
+        """
+        for index, process in enumerate(self._processes):
+            try:
+                shard_queue_gauge.set(self._queues[index].qsize(), shard=index)
+            except NotImplementedError:  # macOS
+                pass
+            if self._stopping or process is None or process.is_alive():
+                continue
+            logger.error("Worker %s encerrado (código %s); reiniciando", index, process.exitcode)
+            shard_restarts_counter.inc(shard=index)
+            self._collect_acks(index)
+            with self._lock:
+                redeliver = list(self._unacked[index].values())
+                self._replace_queues(index, len(redeliver))
+                # A fila nova está vazia e cabe todos: put() não bloqueia aqui
+                for data in redeliver:
+                    self._queues[index].put(data)
+            self._start_worker(index)
+            if redeliver:
+                logger.warning("%s updates não confirmados reenviados ao worker %s", len(redeliver), index)
+
+    def _replace_queues(self, index, redeliver=0):
+        old_queues = (self._queues[index], self._acks[index])
+        # Espaço para os reenviados sem bloquear a verificação até o worker subir
+        self._queues[index] = self._context.Queue(maxsize=max(self._queue_size, redeliver + 1))
+        self._acks[index] = self._context.Queue()
+        for old_queue in old_queues:
+            # Não esperar a thread de envio da fila abandonada ao sair do processo
+            old_queue.cancel_join_thread()
+            old_queue.close()
+
+    def stop(self, timeout=WORKER_STOP_TIMEOUT):
+        """Pede aos workers que terminem a fila atual e espera por eles."""
+        self._stopping = True
+        for index, worker_queue in enumerate(self._queues):
+            try:
+                worker_queue.put(None, timeout=timeout)
+            except queue.Full:
+                logger.warning("Fila do worker %s cheia; sinal de parada não entregue", index)
+        deadline = time.monotonic() + timeout
+        for index, process in enumerate(self._processes):
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Worker %s não terminou em %.0fs; encerrando", index, timeout)
+                process.terminate()
+                process.join(5)
+        # O que sobrar sem confirmação é gravado junto com o offset (pending())
+        self.collect_acks()
+
+def serve_updates(updates, handle, stop_event, acks=None):
+    """Laço do worker: entrega cada update recebido da ingestão a handle().
+
+    handle() pode retornar promessas (com o evento done) do processamento
+    que continuou em outras threads; o update_id é confirmado na fila acks
+    quando handle() retorna e essas promessas terminam.
+
+    Termina com o sinal de parada da ingestão (None), quando stop_event é
+    definido ou quando o processo de ingestão deixa de existir; antes de
+    sair, espera até WORKER_STOP_TIMEOUT pelas promessas em andamento.
+    """
+    parent_pid = os.getppid()
+    # Ctrl+C chega a todo o grupo de processos; quem coordena a parada é a ingestão
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    running = []  # (update_id, promessas) ainda não confirmados
+    try:
+        while not stop_event.is_set():
+            running = _ack_finished(running, acks)
+            try:
+                data = updates.get(timeout=0.5)
+            except queue.Empty:
+                if os.getppid() != parent_pid:
+                    logger.error("Processo de ingestão encerrado; parando o worker")
+                    return
+                continue
+            if data is None:
+                return
+            promises = ()
+            try:
+                promises = handle(data) or ()
+            finally:
+                # Um erro no processamento também conta: reenviar repetiria o erro
+                running.append((data["update_id"], list(promises)))
+    finally:
+        deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+        for _, promises in running:
+            for promise in promises:
+                promise.done.wait(max(0.0, deadline - time.monotonic()))
+        _ack_finished(running, acks)
+
+def _ack_finished(running, acks):
+    """Confirma os updates cujas promessas terminaram; retorna os restantes."""
+    remaining = []
+    for update_id, promises in running:
+        if all(promise.done.is_set() for promise in promises):
+            if acks is not None:
+                acks.put(update_id)
+        else:
+            remaining.append((update_id, promises))
+    return remaining
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de armazenamento compartilhado de pedidos e usuários em SQLite.
+Usado no modo multiprocesso, em que vários workers leem e alteram os mesmos
+pedidos. O banco fica em modo WAL (leitores não bloqueiam o escritor) e cada
+alteração é feita em uma transação BEGIN IMMEDIATE sobre a versão mais
+recente da linha, de modo que dois processos nunca aplicam a mesma transição
+de status duas vezes. Toda gravação recebe um número de sequência crescente,
+usado pelos processos para buscar só o que mudou desde a última leitura.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+from metrics import registry
+
+logger = logging.getLogger('shared_store')
+
+SHARED_STORE_FILE = os.path.join("data", "store.db")
+# Tempo máximo de espera pela trava de escrita de outro processo (segundos)
+SHARED_STORE_BUSY_TIMEOUT = float(os.getenv("SHARED_STORE_BUSY_TIMEOUT", "10"))
+
+TABLES = ("orders", "users")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    idempotency_key TEXT,
+    data TEXT NOT NULL,
+    seq INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_seq ON orders (seq);
+CREATE INDEX IF NOT EXISTS orders_user ON orders (user_id);
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    seq INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_seq ON users (seq);
+"""
+
+shared_store_writes_counter = registry.counter(
+    "shared_store_writes_total",
+    "Linhas gravadas no armazenamento compartilhado por tabela",
+    labels=("table",)
+)
+shared_store_busy_counter = registry.counter(
+    "shared_store_busy_total",
+    "Transações que esperaram a trava de escrita de outro processo"
+)
+
+class SharedStore:
+    """Pedidos e usuários em um banco SQLite compartilhado entre processos."""
+
+    def __init__(self, path=SHARED_STORE_FILE, busy_timeout=SHARED_STORE_BUSY_TIMEOUT, readonly=False):
+        """Inicializa o armazenamento e cria as tabelas se necessário.
+
+        Args:
+            path (str): Arquivo do banco SQLite
+            busy_timeout (float): Espera máxima pela trava de escrita (segundos)
+            readonly (bool): Só leitura (ex.: painel); o banco já deve existir
+        """
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.readonly = readonly
+        self._local = threading.local()  # uma conexão por thread
+        if not readonly:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: as transações são abertas explicitamente
+            if self.readonly:
+                conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True,
+                                       timeout=self.busy_timeout, isolation_level=None)
+                conn.execute("PRAGMA query_only=ON")
+            else:
+                conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        """Transação de escrita exclusiva entre processos."""
+        conn = self._connection()
+        started = time.monotonic()
+        conn.execute("BEGIN IMMEDIATE")
+        if time.monotonic() - started > 0.05:
+            shared_store_busy_counter.inc()
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _next_seq(self, conn, table):
+        return conn.execute(f"SELECT COALESCE(MAX(seq), 0) + 1 FROM {table}").fetchone()[0]
+
+    def put_order(self, data):
+        """Grava (insere ou substitui) um pedido."""
+        with self._write() as conn:
+            self._put_order(conn, data, self._next_seq(conn, "orders"))
+
+    def _put_order(self, conn, data, seq):
+        conn.execute(
+            "INSERT OR REPLACE INTO orders (id, user_id, status, idempotency_key, data, seq) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (data["id"], data["user_id"], data["status"], data.get("idempotency_key"),
+             json.dumps(data, ensure_ascii=False), seq)
+        )
+        shared_store_writes_counter.inc(table="orders")
+
+    def update_orders(self, order_ids, mutate, before_commit=None):
+        """Altera pedidos a partir da versão mais recente de cada um, em uma transação.
+
+        Args:
+            order_ids (list): IDs dos pedidos
+            mutate (callable): Recebe o dict do pedido e retorna o dict alterado,
+                ou None para deixá-lo como está
+            before_commit (callable): Chamado antes do commit se algo mudou
+                (ex.: gravar as notificações da transição antes dela)
+
+        Returns:
+            list: Dicts dos pedidos alterados
+        """
+        changed = []
+        with self._write() as conn:
+            seq = self._next_seq(conn, "orders")
+            for order_id in order_ids:
+                row = conn.execute("SELECT data FROM orders WHERE id = ?", (order_id,)).fetchone()
+                if row is None:
+                    continue
+                data = mutate(json.loads(row[0]))
+                if data is None:
+                    continue
+                self._put_order(conn, data, seq)
+                seq += 1
+                changed.append(data)
+            if changed and before_commit:
+                before_commit()
+        return changed
+
+    def update_order(self, order_id, mutate):
+        """Altera um pedido (ver update_orders); retorna o dict alterado ou None."""
+        changed = self.update_orders([order_id], mutate)
+        return changed[0] if changed else None
+
+    def put_user(self, data):
+        """Grava (insere ou substitui) um usuário."""
+        with self._write() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO users (id, data, seq) VALUES (?, ?, ?)",
+                (data["id"], json.dumps(data, ensure_ascii=False), self._next_seq(conn, "users"))
+            )
+        shared_store_writes_counter.inc(table="users")
+
+    def changes(self, table, since=0):
+        """Linhas gravadas depois da sequência informada.
+
+        Returns:
+            tuple: (lista de dicts, maior sequência lida)
+        """
+        if table not in TABLES:
+            raise ValueError(f"tabela desconhecida: {table}")
+        rows = self._connection().execute(
+            f"SELECT data, seq FROM {table} WHERE seq > ? ORDER BY seq", (since,)
+        ).fetchall()
+        return [json.loads(data) for data, _ in rows], (rows[-1][1] if rows else since)
+
+    def last_seq(self, table):
+        """Sequência da gravação mais recente na tabela."""
+        if table not in TABLES:
+            raise ValueError(f"tabela desconhecida: {table}")
+        return self._connection().execute(f"SELECT COALESCE(MAX(seq), 0) FROM {table}").fetchone()[0]
+
+    def iter_orders(self, statuses=None, user_id=None):
+        """Pedidos como dicts, lidos do banco aos poucos (sem carregar todos na memória).
+
+        Args:
+            statuses (set): Só pedidos com estes status
+            user_id (int): Só pedidos deste usuário
+        """
+        sql, params = "SELECT data FROM orders", []
+        conditions = []
+        if statuses:
+            conditions.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if user_id is not None:
+            conditions.append("user_id = ?")
+            params.append(user_id)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        for (data,) in self._connection().execute(sql, params):
+            yield json.loads(data)
+
+    def iter_users(self):
+        """Usuários como dicts, em ordem de ID."""
+        for (data,) in self._connection().execute("SELECT data FROM users ORDER BY id"):
+            yield json.loads(data)
+
+    def get_user(self, user_id):
+        row = self._connection().execute("SELECT data FROM users WHERE id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def count(self, table):
+        if table not in TABLES:
+            raise ValueError(f"tabela desconhecida: {table}")
+        return self._connection().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def import_json(self, orders_file, users_file):
+        """Importa os arquivos JSON da loja se o banco ainda estiver vazio.
+
+        Returns:
+            bool: True se os dados foram importados
+        """
+        with self._write() as conn:
+            if conn.execute("SELECT EXISTS (SELECT 1 FROM orders) OR EXISTS (SELECT 1 FROM users)").fetchone()[0]:
+                return False
+            orders = _read_json(orders_file)
+            users = _read_json(users_file)
+            for seq, data in enumerate(orders.values(), start=1):
+                self._put_order(conn, data, seq)
+            for seq, (key, data) in enumerate(users.items(), start=1):
+                # Arquivos antigos não guardam o ID dentro do registro
+                data = dict(data, id=int(data.get("id", key)))
+                conn.execute(
+                    "INSERT OR REPLACE INTO users (id, data, seq) VALUES (?, ?, ?)",
+                    (data["id"], json.dumps(data, ensure_ascii=False), seq)
+                )
+        if orders or users:
+            logger.info("Importados %s pedidos e %s usuários para %s", len(orders), len(users), self.path)
+        return bool(orders or users)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
@@ -0,0 +1,105 @@
+"""Testes do resumo de pedidos do admin e da entrega pelo outbox."""
+
+import itertools
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+from admin_digest import AdminDigestNotifier
+from outbox import Outbox
+
+
+class FakeOutbound:
+    """Fila de saída que só registra os envios; os Futures são resolvidos pelo teste."""
+
+    def __init__(self):
+        self.sent = []
+        self._ids = itertools.count(100)
+
+    def send_message(self, chat_id, text, **kwargs):
+        future = Future()
+        self.sent.append(("send", text, future))
+        return future
+
+    def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        future = Future()
+        self.sent.append(("edit", text, future))
+        return future
+
+    def confirm_all(self):
+        for _, _, future in self.sent:
+            if not future.done():
+                future.set_result(SimpleNamespace(message_id=next(self._ids)))
+
+
+def order(order_id, status="pago", total=10.0):
+    return {"id": order_id, "customer": "Cliente", "total": total, "status": status}
+
+
+def admin_handlers(digest, outbound):
+    """Handlers do outbox como no bot: cada pedido pago vai para o notificador."""
+    def deliver(payload):
+        return digest.notify(order(payload["order_id"]),
+                             lambda: outbound.send_message(1, f"pedido {payload['order_id']}"))
+    return {"admin_new_order": deliver}
+
+
+def test_pending_and_paid_notifications_count_once():
+    digest = AdminDigestNotifier(FakeOutbound(), chat_id=1, threshold=1)
+    digest.notify(order("a"), lambda: Future())
+    for order_id in ("b", "c"):
+        digest.notify(order(order_id, status="pendente"), lambda: None)
+    digest.notify(order("b"), lambda: None)
+
+    current = digest._current
+    assert list(current.entries) == ["c", "b"]
+    assert current.total == 10.0
+    text, _ = digest.render(current)
+    assert "Pagos desde" in text and ": 1" in text
+    assert "Aguardando pagamento: 1" in text
+
+
+def test_digest_entry_stays_in_outbox_until_digest_is_sent(tmp_path):
+    outbound = FakeOutbound()
+    digest = AdminDigestNotifier(outbound, chat_id=1, threshold=1)
+    outbox = Outbox(str(tmp_path / "outbox.json"))
+    handlers = admin_handlers(digest, outbound)
+
+    # O primeiro pedido vai individualmente; o segundo entra no resumo
+    outbox.add("admin_new_order", "admin_new_order:a:pago", {"order_id": "a"})
+    outbox.add("admin_new_order", "admin_new_order:b:pago", {"order_id": "b"})
+    outbox.drain(handlers)
+    outbound.confirm_all()
+
+    # Resumo ainda não enviado: a notificação do pedido b continua no outbox
+    assert [entry["key"] for entry in outbox._entries.values()] == ["admin_new_order:b:pago"]
+    assert "admin_new_order:b:pago" not in outbox._delivered
+
+    # Um reinício agora (depois da próxima gravação) recarrega a notificação em vez de perdê-la
+    outbox.save()
+    restarted = Outbox(outbox.state_file)
+    assert restarted.load() == 1
+
+    digest.flush()
+    assert outbox._entries
+    outbound.confirm_all()
+    assert not outbox._entries
+    assert "admin_new_order:b:pago" in outbox._delivered
+
+
+def test_failed_digest_send_keeps_notification_for_retry(tmp_path):
+    outbound = FakeOutbound()
+    digest = AdminDigestNotifier(outbound, chat_id=1, threshold=1)
+    outbox = Outbox(str(tmp_path / "outbox.json"))
+    handlers = admin_handlers(digest, outbound)
+
+    outbox.add("admin_new_order", "admin_new_order:a:pago", {"order_id": "a"})
+    outbox.add("admin_new_order", "admin_new_order:b:pago", {"order_id": "b"})
+    outbox.drain(handlers)
+    outbound.confirm_all()
+    digest.flush()
+    outbound.sent[-1][2].set_exception(RuntimeError("rede"))
+
+    entry, = outbox._entries.values()
+    assert entry["key"] == "admin_new_order:b:pago"
+    assert entry["attempts"] == 1
+    assert "admin_new_order:b:pago" not in outbox._delivered
@@ -0,0 +1,86 @@
+"""Testes do envio em massa: retomada pelo offset e usuários bloqueados."""
+
+from concurrent.futures import Future
+
+from broadcast import BroadcastEngine, CANCELLED, DONE, RUNNING
+
+
+class FakeOutbound:
+    """Fila de saída que resolve cada envio na hora."""
+
+    def __init__(self, blocked=(), on_send=None):
+        self.sent = []
+        self.blocked = set(blocked)
+        self.on_send = on_send
+
+    def send_message(self, chat_id, text, priority, **kwargs):
+        future = Future()
+        if chat_id in self.blocked:
+            future.set_exception(Exception("Forbidden: bot was blocked by the user"))
+        else:
+            self.sent.append(chat_id)
+            future.set_result(len(self.sent))
+        if self.on_send:
+            self.on_send(len(self.sent))
+        return future
+
+
+def engine_files(tmp_path):
+    return {"state_file": str(tmp_path / "broadcast.json"), "ids_file": str(tmp_path / "broadcast_ids.txt"),
+            "blocked_file": str(tmp_path / "blocked_users.txt")}
+
+
+def wait(engine):
+    engine._thread.join(5)
+    return engine.status()
+
+
+def test_restarted_process_resumes_from_the_saved_offset(tmp_path):
+    files = engine_files(tmp_path)
+    engines = []
+
+    def stop_after_five(count):
+        if count == 5:
+            engines[0]._halt.set()  # processo encerrado no meio do envio
+
+    first = BroadcastEngine(FakeOutbound(on_send=stop_after_five), chunk_size=3, **files)
+    engines.append(first)
+    first.create("Promoção", range(1, 11))
+    state = wait(first)
+    assert state["status"] == RUNNING
+    assert first.outbound.sent == [1, 2, 3, 4, 5]
+    assert state["processed"] == 5
+
+    # Novo processo: mesmo estado gravado, envio continua do próximo destinatário
+    second = BroadcastEngine(FakeOutbound(), chunk_size=3, **files)
+    assert second.start()
+    state = wait(second)
+    assert second.outbound.sent == [6, 7, 8, 9, 10]
+    assert (state["status"], state["processed"], state["sent"]) == (DONE, 10, 10)
+
+
+def test_blocked_users_are_recorded_and_skipped_next_time(tmp_path):
+    files = engine_files(tmp_path)
+    finished = []
+    engine = BroadcastEngine(FakeOutbound(blocked={2, 4}), chunk_size=2, on_finish=finished.append, **files)
+    engine.create("Novidade", [1, 2, 3, 4, 5])
+    state = wait(engine)
+    assert (state["sent"], state["blocked"]) == (3, 2)
+    assert finished and finished[0]["status"] == DONE
+
+    restarted = BroadcastEngine(FakeOutbound(), **files)
+    assert restarted.is_blocked(2) and restarted.is_blocked(4)
+    state = restarted.create("Outra", [1, 2, 3, 4, 5])
+    assert (state["total"], state["skipped_blocked"]) == (3, 2)
+    assert wait(restarted)["status"] == DONE
+    assert restarted.outbound.sent == [1, 3, 5]
+
+
+def test_cancelled_broadcast_is_not_resumed(tmp_path):
+    files = engine_files(tmp_path)
+    engine = BroadcastEngine(FakeOutbound(), **files)
+    engine._state = {"id": "x", "status": RUNNING, "total": 0, "offset": 0, "processed": 0,
+                     "sent": 0, "failed": 0, "blocked": 0, "text": "", "parse_mode": None}
+    assert engine.cancel()
+    assert BroadcastEngine(FakeOutbound(), **files).status()["status"] == CANCELLED
+    assert not BroadcastEngine(FakeOutbound(), **files).start()
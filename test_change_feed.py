@@ -0,0 +1,37 @@
+"""Testes do feed de alterações do painel."""
+
+import threading
+
+from change_feed import ChangeFeed
+
+
+def test_since_returns_only_newer_changes():
+    feed = ChangeFeed(capacity=10)
+    for number in range(5):
+        feed.publish("order", f"p{number}", {"n": number})
+
+    assert [event["id"] for event in feed.since(3)] == ["p3", "p4"]
+    assert feed.since(5) == []
+    assert [event["seq"] for event in feed.since(0)] == [1, 2, 3, 4, 5]
+
+
+def test_cursor_too_old_or_from_another_run_requires_a_snapshot():
+    feed = ChangeFeed(capacity=3)
+    for number in range(6):
+        feed.publish("user", number, {})
+
+    assert feed.since(1) is None
+    assert [event["seq"] for event in feed.since(3)] == [4, 5, 6]
+    assert feed.parse_cursor(feed.cursor(4)) == 4
+    assert feed.parse_cursor(ChangeFeed().cursor(4)) is None
+    assert feed.parse_cursor(feed.cursor(7)) is None
+
+
+def test_wait_wakes_up_on_publish():
+    feed = ChangeFeed()
+    timer = threading.Timer(0.05, feed.publish, ("order", "a", {}))
+    timer.start()
+    events = feed.wait(0, timeout=5)
+    timer.join()
+    assert [event["id"] for event in events] == ["a"]
+    assert feed.wait(1, timeout=0.01) == []
@@ -0,0 +1,71 @@
+"""Testes do circuit breaker: abertura, meio-aberto e backoff do tempo aberto."""
+
+import pytest
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, HALF_OPEN, OPEN
+
+
+def expire(breaker):
+    """Faz o tempo aberto atual passar sem esperar de verdade."""
+    breaker._opened_at -= breaker._current_open_seconds
+
+
+def failing():
+    raise RuntimeError("timeout")
+
+
+def test_opens_after_failure_rate_and_rejects_calls():
+    breaker = CircuitBreaker("teste", min_calls=2, failure_rate=0.5, open_seconds=10)
+    assert breaker.call(lambda: "ok") == "ok"
+    with pytest.raises(RuntimeError):
+        breaker.call(failing)
+
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError) as rejected:
+        breaker.call(lambda: "ok")
+    assert 9 < rejected.value.retry_after <= 10
+    assert breaker.snapshot()["last_error"] == "timeout"
+
+
+def test_half_open_allows_one_probe_and_backs_off_on_failure():
+    breaker = CircuitBreaker("teste", min_calls=1, open_seconds=10, max_open_seconds=25)
+    with pytest.raises(RuntimeError):
+        breaker.call(failing)
+    expire(breaker)
+    assert breaker.state == HALF_OPEN
+
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # Teste falhou: aberto de novo pelo dobro do tempo, até o limite
+    breaker.record_failure(0.1, RuntimeError("timeout"))
+    assert breaker.state == OPEN
+    assert breaker._current_open_seconds == 20
+    expire(breaker)
+    with pytest.raises(RuntimeError):
+        breaker.call(failing)
+    assert breaker._current_open_seconds == 25
+
+
+def test_successful_probe_closes_and_resets_the_open_time():
+    breaker = CircuitBreaker("teste", min_calls=1, open_seconds=10)
+    with pytest.raises(RuntimeError):
+        breaker.call(failing)
+    expire(breaker)
+    breaker.before_call()
+    breaker.record_failure(0.1)
+    expire(breaker)
+
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == CLOSED
+    assert breaker._current_open_seconds == 10
+    assert breaker.snapshot()["calls_in_window"] == 0
+
+
+def test_slow_calls_also_open_the_circuit():
+    breaker = CircuitBreaker("teste", min_calls=2, slow_call_seconds=1.0, slow_call_rate=1.0)
+    breaker.record_success(2.0)
+    assert breaker.state == CLOSED
+    breaker.record_success(3.0)
+    assert breaker.state == OPEN
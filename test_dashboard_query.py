@@ -0,0 +1,52 @@
+"""Testes da validação dos parâmetros das APIs paginadas do painel."""
+
+import pytest
+
+from dashboard_query import (MAX_PAGE_SIZE, DEFAULT_PAGE_SIZE, QueryError, encode_cursor,
+                             parse_order_query, parse_stats_query, parse_user_query)
+
+
+def test_order_query_is_normalized():
+    query = parse_order_query({
+        "status": "pago, entregue,",
+        "user_id": "42",
+        "since": "2026-10-01",
+        "until": "2026-10-02",
+        "limit": "100000",
+        "fields": "id,status",
+        "cursor": encode_cursor(("2026-10-01 10:00:00", "ab12")),
+    })
+    assert query == {
+        "statuses": {"pago", "entregue"},
+        "user_id": 42,
+        "since": "2026-10-01 00:00:00",
+        "until": "2026-10-02 23:59:59",
+        "after": ("2026-10-01 10:00:00", "ab12"),
+        "limit": MAX_PAGE_SIZE,
+        "fields": ["id", "status"],
+    }
+
+
+def test_empty_queries_use_the_defaults():
+    assert parse_user_query({}) == {"search": None, "after": None, "limit": DEFAULT_PAGE_SIZE, "fields": None}
+    assert parse_stats_query({})["group_by"] == ("day", "product", "status")
+
+
+@pytest.mark.parametrize("args", [
+    {"user_id": "abc"},
+    {"limit": "0"},
+    {"limit": "dez"},
+    {"fields": "id,senha"},
+    {"since": "01/10/2026"},
+    {"cursor": "não-é-base64"},
+    {"cursor": encode_cursor((1, 2))},  # tipos errados para pedidos
+])
+def test_invalid_order_parameters_are_rejected(args):
+    with pytest.raises(QueryError):
+        parse_order_query(args)
+
+
+def test_user_cursor_must_hold_a_user_id():
+    assert parse_user_query({"cursor": encode_cursor((7,))})["after"] == (7,)
+    with pytest.raises(QueryError):
+        parse_user_query({"cursor": encode_cursor(("7",))})
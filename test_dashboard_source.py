@@ -0,0 +1,55 @@
+"""Testes das fontes de dados do painel."""
+
+import json
+import os
+
+import pytest
+
+from dashboard_source import DashboardData, JsonFilesSource, SharedStoreSource, open_source
+from shared_store import SharedStore
+
+
+def order(order_id, status="pendente", user_id=1):
+    return {"id": order_id, "user_id": user_id, "status": status, "items": []}
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    return tmp_path / "data"
+
+
+def test_dashboard_reads_the_bot_store(data_dir):
+    store = SharedStore(str(data_dir / "store.db"))
+    store.put_order(order("a"))
+    store.put_user({"id": 1, "nome": "Ana", "telefone": "11"})
+
+    source = open_source()
+    assert isinstance(source, SharedStoreSource)
+    assert [data["id"] for data in source.iter_orders()] == ["a"]
+    assert source.get_user(1)["nome"] == "Ana"
+
+    # Alterações gravadas pelo bot chegam ao feed na verificação seguinte
+    store.update_order("a", lambda data: dict(data, status="pago"))
+    source.refresh()
+    assert [(event["id"], event["data"]["status"]) for event in source.changes.since(0)] == [("a", "pago")]
+
+
+def test_json_files_are_read_only_until_the_store_is_created(data_dir):
+    (data_dir / "orders.json").write_text(json.dumps({"a": order("a")}))
+    (data_dir / "users.json").write_text(json.dumps({"1": {"nome": "Ana", "telefone": "11"}}))
+    dashboard = DashboardData()
+    dashboard.stop()
+
+    assert isinstance(dashboard.source, JsonFilesSource)
+    assert [data["id"] for data in dashboard.source.iter_orders()] == ["a"]
+
+    # Primeira execução do bot: os JSON são importados para o banco
+    store = SharedStore(str(data_dir / "store.db"))
+    assert store.import_json(str(data_dir / "orders.json"), str(data_dir / "users.json"))
+    store.put_order(order("b"))
+
+    assert isinstance(dashboard.source, SharedStoreSource)
+    assert sorted(data["id"] for data in dashboard.source.iter_orders()) == ["a", "b"]
+    assert dashboard.source.get_user(1)["nome"] == "Ana"
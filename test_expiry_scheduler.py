@@ -0,0 +1,50 @@
+"""Testes da agenda de expirações."""
+
+from expiry_scheduler import ExpiryScheduler
+
+
+def test_due_keys_come_in_deadline_order_in_batches():
+    scheduler = ExpiryScheduler()
+    for index, deadline in enumerate([30, 10, 20, 50, 40]):
+        scheduler.schedule(f"order:{index}", deadline)
+
+    assert scheduler.pop_due(now=35, limit=2) == ["order:1", "order:2"]
+    assert scheduler.pop_due(now=35) == ["order:0"]
+    assert scheduler.pop_due(now=35) == []
+    assert len(scheduler) == 2
+
+
+def test_rescheduled_and_cancelled_keys_are_not_returned_early():
+    scheduler = ExpiryScheduler()
+    scheduler.schedule("cart:1", 10)
+    scheduler.schedule("cart:2", 10)
+    scheduler.schedule("cart:1", 100)  # atividade no carrinho adia o prazo
+    scheduler.cancel("cart:2")         # pedido pago
+
+    assert scheduler.pop_due(now=50) == []
+    assert scheduler.deadline("cart:1") == 100
+    assert "cart:2" not in scheduler
+    assert scheduler.pop_due(now=100) == ["cart:1"]
+
+
+def test_stale_heap_entries_are_compacted():
+    scheduler = ExpiryScheduler()
+    for deadline in range(3000):
+        scheduler.schedule("order:1", deadline)
+    assert len(scheduler._heap) < 2000
+    assert scheduler.pop_due(now=2998) == []
+    assert scheduler.pop_due(now=2999) == ["order:1"]
+
+
+def test_schedule_survives_a_restart(tmp_path):
+    state_file = str(tmp_path / "expiry_schedule.json")
+    scheduler = ExpiryScheduler(state_file)
+    scheduler.schedule("order:1", 10)
+    scheduler.schedule("order:2", 20)
+    scheduler.cancel("order:2")
+    assert scheduler.save()
+    assert not scheduler.save()
+
+    restarted = ExpiryScheduler(state_file)
+    assert restarted.load() == 1
+    assert restarted.pop_due(now=30) == ["order:1"]
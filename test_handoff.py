@@ -0,0 +1,86 @@
+"""Testes da passagem de bastão entre processos."""
+
+import threading
+import time
+
+from handoff import HandoffChannel, InflightWork, _write_json
+
+
+class FakeUpdate:
+    def __init__(self, update_id):
+        self.update_id = update_id
+
+    def to_dict(self):
+        return {"update_id": self.update_id}
+
+
+def channel(tmp_path, timeout=30):
+    return HandoffChannel(str(tmp_path / "handoff_request.json"), str(tmp_path / "handoff_state.json"), timeout)
+
+
+def test_new_process_receives_the_state_published_by_the_leader(tmp_path):
+    leader, newcomer = channel(tmp_path), channel(tmp_path)
+    published = threading.Event()
+
+    def on_request(request):
+        state = leader.publish("old", request["holder"], {"last_update_id": 42, "payment_checks": [{"update_id": 41}]})
+        published.set()
+        return state
+
+    leader.watch("old", on_request, interval=0.01)
+    newcomer.request("new")
+    assert published.wait(2)
+    leader.stop()
+    assert leader.completed
+
+    state = newcomer.take_state("new")
+    assert (state["from"], state["last_update_id"]) == ("old", 42)
+    assert state["payment_checks"] == [{"update_id": 41}]
+    # Consumido: um reinício posterior não reaplica o mesmo estado
+    assert newcomer.take_state("new") is None
+
+
+def test_state_for_another_process_is_not_taken(tmp_path):
+    leader, newcomer = channel(tmp_path), channel(tmp_path)
+    leader.publish("old", "someone-else", {"last_update_id": 1})
+    assert newcomer.take_state("new") is None
+
+
+def test_own_and_expired_requests_are_ignored(tmp_path):
+    leader = channel(tmp_path)
+    calls = []
+    leader.request("old")  # pedido do próprio processo
+    leader.watch("old", calls.append, interval=0.01)
+    time.sleep(0.1)
+    assert calls == []
+    leader.stop()
+
+    # Pedido de um processo que não chegou a assumir
+    _write_json(leader.request_file, {"holder": "new", "requested_at": time.time() - 60})
+    other = channel(tmp_path)
+    other.watch("old", calls.append, interval=0.01)
+    time.sleep(0.1)
+    other.stop()
+    assert calls == []
+
+
+def test_inflight_work_is_tracked_until_the_handler_returns():
+    work = InflightWork("payment_checks")
+    started, release = threading.Event(), threading.Event()
+
+    def handler(update, context):
+        started.set()
+        release.wait(2)
+        return "ok"
+
+    tracked = work.wrap(handler)
+    thread = threading.Thread(target=tracked, args=(FakeUpdate(7), None))
+    thread.start()
+    assert started.wait(2)
+    assert work.snapshot() == [{"update_id": 7}]
+    assert not work.wait_idle(0.05)
+
+    release.set()
+    assert work.wait_idle(2)
+    thread.join()
+    assert work.snapshot() == []
@@ -0,0 +1,33 @@
+"""Testes da instrumentação dos handlers."""
+
+import pytest
+from telegram.ext import DispatcherHandlerStop
+
+from instrumentation import handler_errors_counter, instrument_callback
+
+
+def errors(name):
+    return handler_errors_counter.value(handler=name)
+
+
+def test_errors_are_counted_but_handler_stop_is_not():
+    def stop(update, context):
+        raise DispatcherHandlerStop()
+
+    def broken(update, context):
+        raise RuntimeError("falhou")
+
+    stop_name, broken_name = "teste_stop", "teste_broken"
+    with pytest.raises(DispatcherHandlerStop):
+        instrument_callback(stop, stop_name)(None, None)
+    with pytest.raises(RuntimeError):
+        instrument_callback(broken, broken_name)(None, None)
+
+    assert errors(stop_name) == 0
+    assert errors(broken_name) == 1
+
+
+def test_result_is_passed_through_and_wrapping_is_idempotent():
+    wrapped = instrument_callback(lambda update, context: "fim", "teste_ok")
+    assert instrument_callback(wrapped) is wrapped
+    assert wrapped(None, None) == "fim"
@@ -0,0 +1,68 @@
+"""Testes da eleição de líder por lease."""
+
+import leader_lease
+from leader_lease import FileLeaseStore, LeaderLease
+
+
+class Clock:
+    """Relógio de parede controlado pelo teste."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_only_one_holder_until_the_lease_expires(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(leader_lease.time, "time", clock)
+    store = FileLeaseStore(str(tmp_path / "leader.lease"))
+
+    first = store.try_acquire("a", ttl=15)
+    assert first["holder"] == "a"
+    assert store.try_acquire("b", ttl=15) is None
+
+    # Renovação mantém o token; o lease vale mais 15s a partir dela
+    clock.now += 10
+    assert store.try_acquire("a", ttl=15)["token"] == first["token"]
+    clock.now += 10
+    assert store.try_acquire("b", ttl=15) is None
+
+    # Sem renovação, o lease expira e outro processo assume com um token maior
+    clock.now += 6
+    second = store.try_acquire("b", ttl=15)
+    assert second["holder"] == "b"
+    assert second["token"] == first["token"] + 1
+    assert store.current()["holder"] == "b"
+
+
+def test_released_lease_is_taken_over_at_once(tmp_path):
+    store = FileLeaseStore(str(tmp_path / "leader.lease"))
+    leader = LeaderLease(store, ttl=15, holder="a")
+    standby = LeaderLease(store, ttl=15, holder="b")
+
+    assert leader.try_acquire() and leader.is_leader
+    assert not standby.try_acquire()
+
+    leader.release()
+    assert not leader.is_leader
+    assert standby.wait_for_leadership(poll_interval=0.01)
+    assert standby.is_leader
+    assert store.current()["holder"] == "b"
+
+
+def test_renewal_stops_and_reports_when_the_lease_is_lost(tmp_path):
+    store = FileLeaseStore(str(tmp_path / "leader.lease"))
+    leader = LeaderLease(store, ttl=3, holder="a")
+    assert leader.try_acquire()
+
+    # Outro processo tomou o lease (ex.: este ficou parado além do prazo)
+    store._write({"holder": "b", "expires_at": leader_lease.time.time() + 60, "token": leader.token + 1})
+    lost = []
+    leader.renew_interval = 0.01
+    leader.start(on_lost=lambda: lost.append(True))
+    leader._thread.join(2)
+
+    assert lost == [True]
+    assert leader.token is None and not leader.is_leader
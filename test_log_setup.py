@@ -0,0 +1,8 @@
+"""Testes da configuração do logging."""
+
+from log_setup import parse_sampling
+
+
+def test_log_sampling_spec():
+    assert parse_sampling("bot=0.1, add_to_cart=2,ruim,outro=x") == {"bot": 0.1, "add_to_cart": 1.0}
+    assert parse_sampling("") == {}
@@ -0,0 +1,110 @@
+"""Testes do arquivo colunar de pedidos encerrados."""
+
+import random
+from collections import defaultdict
+
+import pytest
+
+order_archive = pytest.importorskip("order_archive")
+pytest.importorskip("numpy")
+
+from order_archive import OrderArchive, query
+
+PRODUCTS = ["FAST", "GOLD", "EI TV", "Z TECH"]
+
+
+def order(number, status="entregue", day=1, user_id=1, items=(("FAST", 10),)):
+    return {
+        "id": f"{number:08x}",
+        "status": status,
+        "user_id": user_id,
+        "created_at": f"2026-{(day - 1) // 28 + 1:02d}-{(day - 1) % 28 + 1:02d} 12:00:00",
+        "items": [{"name": name, "price": 1.35 * credits, "details": {"credits": credits}}
+                  for name, credits in items],
+    }
+
+
+def random_orders(count, seed=7):
+    rng = random.Random(seed)
+    return [
+        order(number, status=rng.choice(["entregue", "cancelado", "expirado"]), day=rng.randint(1, 80),
+              user_id=rng.randint(1, 5),
+              items=[(name, rng.randint(1, 50)) for name in rng.sample(PRODUCTS, rng.randint(1, 3))])
+        for number in range(1, count + 1)
+    ]
+
+
+def scan(orders, statuses=None, since=None, group_by="product"):
+    """Mesmo relatório calculado direto nos pedidos, sem o arquivo."""
+    revenue = defaultdict(float)
+    order_ids = defaultdict(set)
+    for entry in orders:
+        if statuses and entry["status"] not in statuses:
+            continue
+        if since and entry["created_at"][:10] < since:
+            continue
+        for item in entry["items"]:
+            key = item["name"] if group_by == "product" else entry["created_at"][:7]
+            revenue[key] += round(item["price"] * 100) / 100
+            order_ids[key].add(entry["id"])
+    return {key: (round(value, 2), len(order_ids[key])) for key, value in revenue.items()}
+
+
+def test_query_matches_a_scan_of_the_orders(tmp_path, monkeypatch):
+    monkeypatch.setattr(order_archive, "ARCHIVE_COMPACT_SEGMENTS", 3)
+    orders = random_orders(300)
+    archive = OrderArchive(str(tmp_path / "archive"))
+    for start in range(0, len(orders), 50):
+        for entry in orders[start:start + 50]:
+            archive.add(entry)
+        assert archive.flush() == len(orders[start:start + 50])
+
+    # Segmentos pequenos foram juntados
+    assert len(archive.manifest["segments"]) < 6
+    assert len(archive) == sum(len(entry["items"]) for entry in orders)
+
+    for statuses, since, group_by in [(None, None, "product"), (["entregue"], "2026-02-01", "product"),
+                                      (["cancelado", "expirado"], None, "month")]:
+        result = query([OrderArchive(archive.path)], statuses=statuses, since=since, group_by=(group_by,))
+        got = {row[group_by]: (row["revenue"], row["orders"]) for row in result["rows"]}
+        assert got == pytest.approx(scan(orders, statuses, since, group_by))
+
+
+def test_reconcile_marks_only_orders_missing_from_the_archive(tmp_path):
+    archive = OrderArchive(str(tmp_path / "archive"))
+    archived, missing, open_order = order(1), order(2, status="cancelado"), order(3, status="pago")
+    archive.add(archived)
+    archive.flush()
+
+    assert archive.reconcile([archived, missing, open_order]) == 1
+    assert archive.flush() == 1
+    assert query([archive], group_by=("status",))["totals"]["orders"] == 2
+
+
+def test_new_leader_continues_the_archive_written_by_the_previous_one(tmp_path):
+    path = str(tmp_path / "archive")
+    old_leader = OrderArchive(path)
+    standby = OrderArchive(path)  # carregado antes da passagem de bastão
+
+    old_leader.add(order(1, items=(("GOLD", 5),)))
+    old_leader.flush()
+
+    standby.reload()
+    standby.add(order(2, items=(("FAST", 10),)))
+    assert standby.flush() == 1
+
+    result = query([OrderArchive(path)], group_by=("product",))
+    assert {row["product"]: row["orders"] for row in result["rows"]} == {"GOLD": 1, "FAST": 1}
+
+
+def test_flush_rereads_the_manifest_even_without_reload(tmp_path):
+    path = str(tmp_path / "archive")
+    first, second = OrderArchive(path), OrderArchive(path)
+    first.add(order(1, items=(("GOLD", 5),)))
+    first.flush()
+
+    second.add(order(2, items=(("FAST", 10),)))
+    assert second.flush() == 1
+    assert not second._pending
+    result = query([OrderArchive(path)], group_by=("product",))
+    assert sorted(row["product"] for row in result["rows"]) == ["FAST", "GOLD"]
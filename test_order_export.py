@@ -0,0 +1,33 @@
+"""Testes da exportação de pedidos em CSV e NDJSON."""
+
+import csv
+import gzip
+import io
+
+import pytest
+
+from dashboard_query import QueryError
+from order_export import export_orders, parse_export_query
+
+
+def test_export_query():
+    query = parse_export_query({"format": "NDJSON", "gzip": "sim", "status": "pago"})
+    assert query["format"] == "ndjson" and query["gzip"] and query["statuses"] == {"pago"}
+    assert parse_export_query({})["format"] == "csv"
+    with pytest.raises(QueryError):
+        parse_export_query({"format": "xlsx"})
+
+
+def test_export_filters_and_compresses():
+    orders = [
+        {"id": "a", "status": "pago", "created_at": "2026-10-01 10:00:00", "user_id": 1,
+         "items": [{"name": "FAST", "price": 135, "details": {"credits": 10}},
+                   {"name": "GOLD", "price": 27, "details": {"credits": 2}}]},
+        {"id": "b", "status": "pendente", "created_at": "2026-10-02 10:00:00", "user_id": 2, "items": []},
+    ]
+    query = parse_export_query({"status": "pago", "gzip": "1"})
+    data = gzip.decompress(b"".join(export_orders(orders, query))).decode("utf-8")
+    rows = list(csv.reader(io.StringIO(data)))
+
+    assert rows[0][0] == "order_id"
+    assert [(row[0], row[5], row[7]) for row in rows[1:]] == [("a", "FAST", "135.00"), ("a", "GOLD", "27.00")]
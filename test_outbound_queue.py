@@ -0,0 +1,174 @@
+"""Testes da fila de saída: limites de taxa, prioridade, agrupamento, RetryAfter e envio em paralelo."""
+
+import time
+import threading
+
+from telegram.error import RetryAfter
+
+from outbound_queue import OutboundQueue, TokenBucket, PRIORITY_ADMIN, PRIORITY_BULK, PRIORITY_CUSTOMER
+
+
+class FakeBot:
+    """Bot que registra as chamadas e pode falhar nas primeiras."""
+
+    def __init__(self, errors=()):
+        self.calls = []
+        self.errors = list(errors)
+
+    def send_message(self, chat_id, **kwargs):
+        self.calls.append((chat_id, kwargs["text"]))
+        if self.errors:
+            raise self.errors.pop(0)
+        return len(self.calls)
+
+
+class SlowBot:
+    """Bot em que cada chamada demora, como uma ida e volta à Bot API."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, **kwargs):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+            self.calls.append((chat_id, kwargs["text"]))
+        return len(self.calls)
+
+
+def next_message(queue):
+    with queue._lock:
+        return queue._next_message()
+
+
+def test_token_bucket_burst_rate_and_block():
+    bucket = TokenBucket(rate=2.0, burst=2)
+    now = time.monotonic()
+    bucket.consume(now)
+    bucket.consume(now)
+    assert bucket.wait_time(now) == 0.5
+    assert bucket.wait_time(now + 0.5) == 0.0
+
+    bucket.block(now + 0.5, 3.0)
+    assert bucket.wait_time(now + 1.0) == 2.5
+    assert not bucket.idle(now + 1.0)
+
+
+def test_customer_messages_go_before_bulk():
+    queue = OutboundQueue()
+    queue.send_message(1, "promoção", priority=PRIORITY_BULK)
+    queue.send_message(2, "pagamento confirmado", priority=PRIORITY_CUSTOMER)
+
+    message, _ = next_message(queue)
+    assert (message.chat_id, message.kwargs["text"]) == (2, "pagamento confirmado")
+
+
+def test_customer_message_jumps_ahead_in_its_own_chat():
+    queue = OutboundQueue()
+    queue.submit("send_photo", 1, PRIORITY_BULK, photo="promo.jpg")
+    queue.submit("send_photo", 1, PRIORITY_ADMIN, photo="relatorio.jpg")
+    queue.submit("send_photo", 1, PRIORITY_CUSTOMER, photo="pix.png")
+    queue.submit("send_photo", 1, PRIORITY_CUSTOMER, photo="comprovante.png")
+
+    message, _ = next_message(queue)
+    assert message.kwargs["photo"] == "pix.png"
+    assert [queued.kwargs["photo"] for queued in queue._chats[1]] == ["comprovante.png", "relatorio.jpg", "promo.jpg"]
+
+
+def test_chat_with_a_send_in_progress_waits_for_it():
+    queue = OutboundQueue(bot=FakeBot(), chat_rate=100)
+    queue.submit("send_photo", 1, photo="a.jpg")
+    queue.submit("send_photo", 1, photo="b.jpg")
+    queue.submit("send_photo", 2, photo="c.jpg")
+
+    first, _ = next_message(queue)
+    second, _ = next_message(queue)
+    assert (first.chat_id, second.chat_id) == (1, 2)
+    assert next_message(queue)[0] is None
+
+    queue._deliver(first)
+    third, _ = next_message(queue)
+    assert third.kwargs["photo"] == "b.jpg"
+
+
+def test_senders_deliver_in_parallel_and_keep_each_chat_in_order():
+    bot = SlowBot(delay=0.1)
+    queue = OutboundQueue(bot=bot, global_rate=1000, chat_rate=1000, senders=4)
+    futures = [queue.submit("send_message", chat_id, text=f"{chat_id}-{index}", reply_markup=None)
+               for index in range(3) for chat_id in range(8)]
+    started = time.monotonic()
+    queue.start()
+    for future in futures:
+        future.result(5)
+    elapsed = time.monotonic() - started
+    queue.stop()
+
+    # 24 chamadas de 0,1s: uma thread só levaria 2,4s
+    assert elapsed < 1.5
+    assert 1 < bot.max_active <= 4
+    for chat_id in range(8):
+        assert [text for chat, text in bot.calls if chat == chat_id] == [f"{chat_id}-{index}" for index in range(3)]
+
+
+def test_short_texts_for_the_same_chat_are_merged():
+    queue = OutboundQueue(bot=FakeBot())
+    first = queue.send_message(1, "primeiro")
+    second = queue.send_message(1, "segundo")
+    assert queue.depth() == 2
+
+    message, _ = next_message(queue)
+    assert message.kwargs["text"] == "primeiro\n\nsegundo"
+    assert queue.depth() == 0
+
+    queue._deliver(message)
+    assert first.result(0) == second.result(0) == 1
+
+
+def test_pending_edits_of_a_message_are_replaced_by_the_latest():
+    queue = OutboundQueue()
+    first = queue.edit_message_text(1, 10, "versão 1")
+    second = queue.edit_message_text(1, 10, "versão 2")
+
+    assert first is second
+    assert queue.depth() == 1
+    message, _ = next_message(queue)
+    assert message.kwargs["text"] == "versão 2"
+
+
+def test_retry_after_pauses_the_queue_without_counting_an_attempt():
+    bot = FakeBot(errors=[RetryAfter(3)])
+    queue = OutboundQueue(bot=bot)
+    future = queue.send_message(1, "pedido pago")
+
+    message, _ = next_message(queue)
+    queue._deliver(message)
+    assert not future.done()
+    assert message.attempts == 0
+    assert queue.depth() == 1
+
+    # Fila pausada pelo tempo pedido pelo Telegram
+    _, wait = next_message(queue)
+    assert 2.5 < wait <= 3.0
+
+    # Passado o tempo de espera, a mesma mensagem é enviada
+    queue._global = TokenBucket(queue.global_rate, 1)
+    message.not_before = 0.0
+    message, _ = next_message(queue)
+    queue._deliver(message)
+    assert future.result(0) == 2
+    assert bot.calls == [(1, "pedido pago"), (1, "pedido pago")]
+
+
+def test_stop_returns_at_once_when_already_stopped():
+    queue = OutboundQueue()
+    queue.send_message(1, "nunca enviada")
+    started = time.monotonic()
+    queue.stop(timeout=5.0)
+    assert time.monotonic() - started < 1.0
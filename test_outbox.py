@@ -0,0 +1,105 @@
+"""Testes do outbox: deduplicação, retentativas com backoff e persistência."""
+
+import time
+from concurrent.futures import Future
+
+from outbox import Outbox, PermanentDeliveryError
+
+
+def new_outbox(tmp_path, **kwargs):
+    return Outbox(str(tmp_path / "outbox.json"), **kwargs)
+
+
+def test_same_key_is_registered_once_even_after_delivery(tmp_path):
+    outbox = new_outbox(tmp_path)
+    assert outbox.add("customer_paid", "customer_paid:a", {"order_id": "a"})
+    assert not outbox.add("customer_paid", "customer_paid:a", {"order_id": "a"})
+
+    delivered = []
+    outbox.drain({"customer_paid": lambda payload: delivered.append(payload["order_id"])})
+
+    assert delivered == ["a"]
+    assert len(outbox) == 0
+    assert not outbox.add("customer_paid", "customer_paid:a", {"order_id": "a"})
+
+
+def test_failed_delivery_is_retried_with_backoff(tmp_path):
+    outbox = new_outbox(tmp_path, base_delay=60.0)
+    outbox.add("customer_paid", "customer_paid:a", {"order_id": "a"})
+
+    def fail(payload):
+        raise RuntimeError("rede")
+
+    before = time.time()
+    assert outbox.drain({"customer_paid": fail}) == 1
+    entry, = outbox._entries.values()
+    assert entry["attempts"] == 1
+    assert entry["last_error"] == "rede"
+    # Atraso com jitter entre metade e o valor cheio do backoff
+    assert before + 30.0 <= entry["next_attempt"] <= time.time() + 60.0
+
+    # Ainda não venceu: uma nova passada não tenta de novo
+    assert outbox.drain({"customer_paid": fail}) == 0
+
+    entry["next_attempt"] = 0.0
+    assert outbox.drain({"customer_paid": lambda payload: None}) == 1
+    assert len(outbox) == 0
+
+
+def test_permanent_failure_and_max_attempts_drop_the_notification(tmp_path):
+    outbox = new_outbox(tmp_path, max_attempts=2, base_delay=0.0)
+    outbox.add("customer_paid", "customer_paid:a", {"order_id": "a"})
+    outbox.add("admin_new_order", "admin_new_order:b", {"order_id": "b"})
+
+    def gone(payload):
+        raise PermanentDeliveryError("pedido removido")
+
+    def fail(payload):
+        raise RuntimeError("rede")
+
+    handlers = {"customer_paid": gone, "admin_new_order": fail}
+    outbox.drain(handlers)
+    assert [entry["key"] for entry in outbox._entries.values()] == ["admin_new_order:b"]
+
+    outbox.drain(handlers)
+    assert len(outbox) == 0
+    # Descartada não é entregue: a chave pode ser registrada de novo
+    assert outbox.add("customer_paid", "customer_paid:a", {"order_id": "a"})
+
+
+def test_entry_waits_for_the_send_future_and_is_not_sent_twice(tmp_path):
+    outbox = new_outbox(tmp_path)
+    outbox.add("customer_paid", "customer_paid:a", {"order_id": "a"})
+    sends = []
+
+    def send(payload):
+        future = Future()
+        sends.append(future)
+        return future
+
+    outbox.drain({"customer_paid": send})
+    # Em andamento: a próxima passada do job não inicia outro envio
+    assert outbox.drain({"customer_paid": send}) == 0
+    assert len(sends) == 1 and len(outbox) == 1
+
+    sends[0].set_result(None)
+    assert len(outbox) == 0
+    assert "customer_paid:a" in outbox._delivered
+
+
+def test_pending_and_delivered_keys_survive_a_restart(tmp_path):
+    outbox = new_outbox(tmp_path)
+    outbox.add("customer_paid", "customer_paid:a", {"order_id": "a"})
+    outbox.add("customer_paid", "customer_paid:b", {"order_id": "b"})
+    outbox.drain({"customer_paid": lambda payload: None if payload["order_id"] == "a" else Future()})
+    assert outbox.save(force=True)
+
+    restarted = Outbox(outbox.state_file)
+    # O envio de b não foi confirmado antes de gravar: volta como pendente
+    assert restarted.load() == 1
+    assert not restarted.add("customer_paid", "customer_paid:a", {"order_id": "a"})
+    assert not restarted.add("customer_paid", "customer_paid:b", {"order_id": "b"})
+
+    delivered = []
+    restarted.drain({"customer_paid": lambda payload: delivered.append(payload["order_id"])})
+    assert delivered == ["b"]
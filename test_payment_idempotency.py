@@ -0,0 +1,58 @@
+"""Testes da idempotência do checkout PIX."""
+
+import threading
+import time
+
+from payment_idempotency import CheckoutLocks, cart_fingerprint
+
+
+class Item:
+    def __init__(self, name, price, details=None):
+        self.name = name
+        self.price = price
+        self.details = details
+
+
+CART = [{"name": "FAST", "price": 13.5, "details": {"credits": 10, "login": "ana"}},
+        {"name": "GOLD", "price": 6.75, "details": {}}]
+
+
+def test_same_cart_always_gives_the_same_key():
+    key = cart_fingerprint(1, CART, cart_version=7)
+    assert key == cart_fingerprint("1", CART, cart_version=7)
+    # Objetos CartItem e dicts equivalentes, detalhes em outra ordem e preço com erro de ponto flutuante
+    items = [Item("FAST", 13.499999999, {"login": "ana", "credits": 10}), Item("GOLD", 6.75)]
+    assert cart_fingerprint(1, items, cart_version=7) == key
+    assert len(key) == 64
+
+
+def test_any_change_gives_another_key():
+    key = cart_fingerprint(1, CART, cart_version=7)
+    changed_price = [dict(CART[0], price=13.51), CART[1]]
+    assert cart_fingerprint(2, CART, cart_version=7) != key
+    assert cart_fingerprint(1, CART, cart_version=8) != key
+    assert cart_fingerprint(1, CART[:1], cart_version=7) != key
+    assert cart_fingerprint(1, changed_price, cart_version=7) != key
+    assert cart_fingerprint(1, list(reversed(CART)), cart_version=7) != key
+
+
+def test_checkouts_of_the_same_cart_run_one_at_a_time():
+    locks = CheckoutLocks()
+    running, overlaps = [], []
+
+    def checkout(key):
+        with locks.hold(key):
+            running.append(key)
+            overlaps.append(running.count(key))
+            time.sleep(0.02)
+            running.remove(key)
+
+    threads = [threading.Thread(target=checkout, args=(key,)) for key in ["a", "a", "a", "b"]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(overlaps) == 1
+    # Locks descartados quando ninguém mais os usa
+    assert locks._locks == {}
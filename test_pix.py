@@ -1,10 +1,12 @@
-import mercadopago
 import os
 from models import db, CartItem
+from payment_gateway import create_sdk
 
 # Configuração
+# Para testar sem credenciais reais, rode `python fake_mercadopago.py` e defina
+# MERCADO_PAGO_BASE_URL=http://127.0.0.1:8765 (qualquer MERCADO_PAGO_TOKEN serve)
 user_id = int(os.environ.get("ADMIN_ID"))
-mp = mercadopago.SDK(os.environ.get("MERCADO_PAGO_TOKEN"))
+mp = create_sdk(os.environ.get("MERCADO_PAGO_TOKEN"))
 
 # Get user info
 user = db.get_user(user_id)
@@ -0,0 +1,59 @@
+"""Testes do profiling sob demanda."""
+
+import threading
+import time
+from collections import Counter
+
+import profiler
+from profiler import ProfileResult, profile, profile_in_background
+
+
+def busy_loop(stop):
+    total = 0
+    while not stop.is_set():
+        total += sum(range(200))
+    return total
+
+
+def test_profile_samples_busy_threads_and_skips_idle_ones():
+    stop, idle = threading.Event(), threading.Event()
+    busy = threading.Thread(target=busy_loop, args=(stop,), name="busy")
+    waiting = threading.Thread(target=idle.wait, name="waiting")
+    busy.start()
+    waiting.start()
+    try:
+        result = profile(0.3, interval=0.005)
+    finally:
+        stop.set()
+        idle.set()
+        busy.join()
+        waiting.join()
+
+    assert result.samples > 10
+    threads = {stack[0] for stack in result.stacks}
+    assert "busy" in threads and "waiting" not in threads
+    assert any(label.endswith(":busy_loop") for label, _, _ in result.top_functions())
+    line = next(line for line in result.collapsed().splitlines() if line.startswith("busy;"))
+    assert "test_profiler.py:busy_loop" in line and int(line.rsplit(" ", 1)[1]) > 0
+    assert "Funções" in result.report()
+
+
+def test_top_functions_counts_own_and_cumulative_samples():
+    stacks = Counter({("main", "a", "b", "c"): 3, ("main", "a", "b"): 2, ("worker", "x", "c"): 1})
+    result = ProfileResult(1, 6, stacks, [])
+    top = {label: (own, cumulative) for label, own, cumulative in result.top_functions()}
+    assert top == {"c": (4, 4), "b": (2, 5)}
+    assert result.collapsed().splitlines()[0] == "main;a;b;c 3"
+
+
+def test_only_one_collection_at_a_time():
+    results = []
+    assert profile_in_background(0.2, results.append)
+    time.sleep(0.05)
+    assert profile(0.1) is None
+    assert not profile_in_background(0.1, results.append)
+    deadline = time.monotonic() + 5
+    while not results and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert len(results) == 1
+    assert not profiler._lock.locked()
@@ -0,0 +1,72 @@
+"""Testes dos agregados de vendas: idempotência, reconstrução e consultas."""
+
+import pytest
+
+import sales_stats
+from sales_stats import SalesRollup
+
+
+def order(order_id, status, items, day="2026-10-01"):
+    return {"id": order_id, "status": status, "created_at": f"{day}T10:00:00", "items": items}
+
+
+def credits(name, quantity, unit_price, charged=None):
+    return {
+        "name": name,
+        "price": unit_price * quantity if charged is None else charged,
+        "details": {"credits": quantity, "original_price": unit_price},
+    }
+
+
+ORDERS = [
+    order("a", "pago", [credits("FAST", 10, 13.5)]),
+    order("b", "entregue", [credits("FAST", 20, 13.5, charged=256.5), credits("GOLD", 5, 13.5)]),
+    order("c", "pendente", [credits("GOLD", 2, 13.5)], day="2026-10-02"),
+]
+
+
+def test_apply_is_idempotent_and_moves_status_changes():
+    rollup = SalesRollup()
+    assert rollup.apply(ORDERS[0])
+    assert not rollup.apply(ORDERS[0])
+
+    totals = rollup.query(statuses=["pago"])["totals"]
+    assert totals["orders"] == 1 and totals["revenue"] == 135.0
+
+    assert rollup.apply({**ORDERS[0], "status": "entregue"})
+    assert rollup.query(statuses=["pago"])["totals"]["orders"] == 0
+    assert rollup.query(statuses=["entregue"])["totals"]["revenue"] == 135.0
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_rebuild_matches_incremental_updates(monkeypatch, use_numpy):
+    if not use_numpy:
+        monkeypatch.setattr(sales_stats, "np", None)
+    elif sales_stats.np is None:
+        pytest.skip("numpy não instalado")
+
+    incremental = SalesRollup()
+    for entry in ORDERS:
+        incremental.apply(entry)
+    rebuilt = SalesRollup()
+    rebuilt.rebuild(ORDERS)
+
+    assert rebuilt._buckets == pytest.approx(incremental._buckets)
+    assert rebuilt.query() == incremental.query()
+    # Depois da reconstrução, os mesmos pedidos continuam sem efeito
+    assert not any(rebuilt.apply(entry) for entry in ORDERS)
+
+
+def test_query_counts_multi_product_orders_once():
+    rollup = SalesRollup()
+    rollup.rebuild(ORDERS)
+    sales = rollup.query(statuses=sales_stats.SALE_STATUSES, group_by=("day",))
+
+    assert sales["totals"] == {"revenue": 459.0, "orders": 2, "credits": 35, "discount": 13.5}
+    assert sales["rows"] == [{"day": "2026-10-01", **sales["totals"]}]
+
+    by_product = rollup.query(statuses=sales_stats.SALE_STATUSES, group_by=("product",))
+    assert [(row["product"], row["orders"]) for row in by_product["rows"]] == [("FAST", 2), ("GOLD", 1)]
+
+    gold = rollup.query(products=["GOLD"], since="2026-10-02")
+    assert gold["totals"]["orders"] == 1 and gold["totals"]["revenue"] == 27.0
@@ -0,0 +1,78 @@
+"""Testes do journal de sessões: reaplicação, compactação e descarte."""
+
+import json
+import time
+
+from session_persistence import JournalPersistence
+
+
+def journal_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_journal_is_replayed_on_startup(tmp_path):
+    path = str(tmp_path / "sessions.jsonl")
+    persistence = JournalPersistence(path)
+    persistence.get_user_data()
+    persistence.update_user_data(1, {"step": "checkout"})
+    persistence.update_user_data(2, {"step": "catalog"})
+    persistence.update_conversation("registration", (1, 1), 1)
+    assert persistence.save() == 3
+
+    persistence.update_user_data(1, {"step": "paid"})
+    persistence.update_user_data(2, {})
+    persistence.update_conversation("registration", (1, 1), None)
+    persistence.save()
+    # Gravação interrompida no meio de uma linha
+    with open(path, "ab") as f:
+        f.write(b'{"u": 3, "d": {"step"')
+
+    restarted = JournalPersistence(path)
+    assert dict(restarted.get_user_data()) == {1: {"step": "paid"}, 2: {}}
+    assert restarted.get_conversations("registration") == {}
+
+
+def test_only_changed_sessions_are_appended(tmp_path):
+    path = str(tmp_path / "sessions.jsonl")
+    persistence = JournalPersistence(path)
+    persistence.get_user_data()
+    persistence.update_user_data(1, {"step": "checkout"})
+    persistence.update_user_data(2, {"step": "catalog"})
+    persistence.save()
+
+    persistence.update_user_data(1, {"step": "checkout"})  # sem mudança
+    persistence.update_user_data(2, {"step": "cart"})
+    assert persistence.save() == 1
+    assert [record["u"] for record in journal_lines(path)] == [1, 2, 2]
+
+
+def test_journal_is_compacted_when_stale_lines_dominate(tmp_path):
+    path = str(tmp_path / "sessions.jsonl")
+    persistence = JournalPersistence(path, compact_ratio=2, compact_min_lines=10)
+    persistence.get_user_data()
+    for step in range(12):
+        persistence.update_user_data(1, {"step": step})
+        persistence.update_conversation("checkout", (1, 1), step % 3)
+        persistence.save()
+
+    # 24 registros gravados; ao passar de 10 linhas, o arquivo volta ao estado vivo (2 linhas)
+    assert len(journal_lines(path)) < 10
+    restarted = JournalPersistence(path)
+    assert dict(restarted.get_user_data()) == {1: {"step": 11}}
+    assert restarted.get_conversations("checkout") == {(1, 1): 2}
+
+
+def test_inactive_sessions_are_dropped_on_load(tmp_path):
+    path = str(tmp_path / "sessions.jsonl")
+    old = time.time() - 7200
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"u": 1, "d": {"step": "cart"}, "t": old}) + "\n")
+        f.write(json.dumps({"c": "checkout", "k": [1, 1], "s": 2, "t": old}) + "\n")
+        f.write(json.dumps({"u": 2, "d": {"step": "paid"}, "t": time.time()}) + "\n")
+
+    persistence = JournalPersistence(path, ttl_seconds=3600)
+    assert dict(persistence.get_user_data()) == {2: {"step": "paid"}}
+    assert persistence.get_conversations("checkout") == {}
+    # Descartadas também do disco
+    assert [record.get("u") for record in journal_lines(path)] == [2]
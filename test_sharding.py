@@ -0,0 +1,170 @@
+"""Testes do modo multiprocesso: roteamento, confirmações e offset seguro."""
+
+import json
+import queue
+import threading
+
+import sharding
+from sharding import ShardRouter, serve_updates, shard_of
+from update_offset import UpdateOffsetTracker
+
+
+class FakeQueue(queue.Queue):
+    """Fila do multiprocessing sem processo: só o que o roteador usa."""
+
+    def cancel_join_thread(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FakeProcess:
+    def __init__(self, target, args, name):
+        self.args = args
+        self.alive = False
+        self.exitcode = None
+
+    def start(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def join(self, timeout=None):
+        pass
+
+    def terminate(self):
+        self.alive = False
+
+
+class FakeContext:
+    Queue = FakeQueue
+    Process = FakeProcess
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class FakeUpdate:
+    def __init__(self, update_id, user_id):
+        self.update_id = update_id
+        self.effective_user = FakeUser(user_id)
+        self.effective_chat = None
+
+    def to_dict(self):
+        return {"update_id": self.update_id, "user_id": self.effective_user.id}
+
+
+class Promise:
+    def __init__(self):
+        self.done = threading.Event()
+
+
+def make_router(monkeypatch, workers=2):
+    monkeypatch.setattr(sharding.multiprocessing, "get_context", lambda method: FakeContext())
+    router = ShardRouter(target=None, workers=workers, queue_size=10)
+    router.start()
+    return router
+
+
+def test_shard_of_is_stable_and_in_range():
+    assert shard_of(None, 4) == 0
+    assert shard_of(123, 1) == 0
+    owners = {shard_of(user_id, 4) for user_id in range(200)}
+    assert owners == {0, 1, 2, 3}
+    assert [shard_of(user_id, 4) for user_id in range(50)] == [shard_of(str(user_id), 4) for user_id in range(50)]
+
+
+def test_acknowledged_updates_leave_the_pending_list(monkeypatch):
+    router = make_router(monkeypatch)
+    user = next(user_id for user_id in range(100) if shard_of(user_id, 2) == 1)
+    for update_id in (12, 10, 11):
+        router.route(FakeUpdate(update_id, user))
+
+    assert [data["update_id"] for data in router.pending()] == [10, 11, 12]
+    router._acks[1].put(10)
+    router._acks[1].put(12)
+    assert [data["update_id"] for data in router.pending()] == [11]
+
+
+def test_dead_worker_gets_its_unacknowledged_updates_again_in_order(monkeypatch):
+    router = make_router(monkeypatch)
+    user = next(user_id for user_id in range(100) if shard_of(user_id, 2) == 0)
+    for update_id in (1, 2, 3):
+        router.route(FakeUpdate(update_id, user))
+    # O worker leu dois updates, confirmou o primeiro e caiu no segundo
+    old_queue = router._queues[0]
+    old_queue.get_nowait(), old_queue.get_nowait()
+    router._acks[0].put(1)
+    router._processes[0].alive = False
+
+    router.check_workers()
+
+    assert router._queues[0] is not old_queue and old_queue.closed
+    assert router._processes[0].is_alive()
+    redelivered = [router._queues[0].get_nowait()["update_id"] for _ in range(2)]
+    assert redelivered == [2, 3]
+    assert router._queues[0].empty()
+    # O substituto recebe as filas novas
+    assert router._processes[0].args == (router._queues[0], router._acks[0])
+
+
+def test_serve_updates_acks_after_the_handler_and_its_async_work():
+    updates, acks = queue.Queue(), queue.Queue()
+    background = Promise()
+    handled = []
+
+    def handle(data):
+        handled.append(data["update_id"])
+        return [background] if data["update_id"] == 2 else None
+
+    for data in ({"update_id": 1}, {"update_id": 2}, {"update_id": 3}, None):
+        updates.put(data)
+    threading.Timer(0.2, background.done.set).start()
+    serve_updates(updates, handle, threading.Event(), acks)
+
+    assert handled == [1, 2, 3]
+    assert sorted(acks.get_nowait() for _ in range(3)) == [1, 2, 3]
+
+
+def test_serve_updates_acks_failed_updates():
+    updates, acks = queue.Queue(), queue.Queue()
+    updates.put({"update_id": 7})
+
+    def handle(data):
+        raise ValueError("falhou")
+
+    try:
+        serve_updates(updates, handle, threading.Event(), acks)
+    except ValueError:
+        pass
+    assert acks.get_nowait() == 7
+
+
+def test_offset_is_saved_before_the_first_unacknowledged_update(tmp_path):
+    state_file = str(tmp_path / "update_offset.json")
+    pending = [{"update_id": 41, "message": {"text": "oi"}}, {"update_id": 43}]
+    tracker = UpdateOffsetTracker(state_file)
+    tracker.pending_source = lambda: pending
+    for update_id in range(40, 46):
+        tracker.mark(update_id)
+    assert tracker.save()
+    with open(state_file, encoding="utf-8") as f:
+        assert json.load(f)["last_update_id"] == 40
+
+    restarted = UpdateOffsetTracker(state_file)
+    # Deduplicação pelo maior recebido; os não confirmados voltam para reenvio
+    assert restarted.load() == 45
+    assert restarted.pending_updates == pending
+    assert restarted.is_duplicate(44)
+
+    # Confirmados todos, o offset volta a ser o último recebido
+    pending = []
+    assert tracker.save()
+    restarted = UpdateOffsetTracker(state_file)
+    assert restarted.load() == 45
+    assert restarted.pending_updates == []
+    assert not tracker.save()
@@ -0,0 +1,71 @@
+"""Testes do armazenamento compartilhado em SQLite."""
+
+import json
+
+import pytest
+
+from shared_store import SharedStore
+
+
+def order(order_id, status="pendente", user_id=1):
+    return {"id": order_id, "user_id": user_id, "status": status, "items": []}
+
+
+def test_changes_returns_only_rows_written_after_a_sequence(tmp_path):
+    store = SharedStore(str(tmp_path / "store.db"))
+    store.put_order(order("a"))
+    store.put_order(order("b"))
+    _, seq = store.changes("orders")
+
+    store.update_order("a", lambda data: dict(data, status="pago"))
+    changed, last = store.changes("orders", since=seq)
+    assert [(data["id"], data["status"]) for data in changed] == [("a", "pago")]
+    assert last == store.last_seq("orders") > seq
+    assert store.changes("orders", since=last) == ([], last)
+
+    with pytest.raises(ValueError):
+        store.changes("carts")
+
+
+def test_status_transition_is_applied_once_across_processes(tmp_path):
+    path = str(tmp_path / "store.db")
+    first, second = SharedStore(path), SharedStore(path)
+    first.put_order(order("a"))
+
+    def pay(data):
+        # Só transiciona a partir da versão mais recente
+        return dict(data, status="pago") if data["status"] == "pendente" else None
+
+    assert first.update_order("a", pay)["status"] == "pago"
+    assert second.update_order("a", pay) is None
+    assert [data["status"] for data in second.iter_orders()] == ["pago"]
+
+
+def test_failed_transaction_is_rolled_back(tmp_path):
+    store = SharedStore(str(tmp_path / "store.db"))
+    store.put_order(order("a"))
+
+    def fail():
+        raise RuntimeError("notificação não gravada")
+
+    with pytest.raises(RuntimeError):
+        store.update_orders(["a"], lambda data: dict(data, status="pago"), before_commit=fail)
+    assert store.update_order("a", lambda data: None) is None
+    assert next(store.iter_orders())["status"] == "pendente"
+
+
+def test_import_json_only_fills_an_empty_store(tmp_path):
+    orders_file, users_file = tmp_path / "orders.json", tmp_path / "users.json"
+    orders_file.write_text(json.dumps({"a": order("a", "entregue"), "b": order("b", user_id=2)}))
+    users_file.write_text(json.dumps({"1": {"id": 1, "name": "Ana"}}))
+    store = SharedStore(str(tmp_path / "store.db"))
+
+    assert store.import_json(str(orders_file), str(users_file))
+    assert not store.import_json(str(orders_file), str(users_file))
+    assert store.count("orders") == 2
+    assert [data["id"] for data in store.iter_orders(statuses={"entregue"})] == ["a"]
+    assert [data["id"] for data in store.iter_orders(user_id=2)] == ["b"]
+    assert store.get_user(1)["name"] == "Ana"
+
+    reader = SharedStore(store.path, readonly=True)
+    assert reader.count("users") == 1
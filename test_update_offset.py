@@ -0,0 +1,112 @@
+"""Testes do offset de updates: deduplicação e recuperação do backlog."""
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from update_offset import UpdateOffsetTracker, catch_up, is_stale
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class FakeMessage:
+    def __init__(self, date):
+        self.date = date
+
+
+class FakeUpdate:
+    def __init__(self, update_id, user_id, date=None):
+        self.update_id = update_id
+        self.effective_user = FakeUser(user_id)
+        self.effective_chat = None
+        self.message = FakeMessage(date) if date else None
+        self.edited_message = None
+
+
+class FakeBot:
+    """getUpdates sobre uma lista fixa: devolve os updates a partir do offset.
+
+    redeliver_from simula updates que o Telegram ainda entrega porque nenhum
+    getUpdates posterior os confirmou (ex.: queda logo depois de processá-los).
+    """
+
+    def __init__(self, updates, redeliver_from=None):
+        self.updates = updates
+        self.redeliver_from = redeliver_from
+        self.offsets = []
+
+    def get_updates(self, offset, limit, timeout, allowed_updates=None):
+        self.offsets.append(offset)
+        if self.redeliver_from is not None:
+            offset, self.redeliver_from = min(offset, self.redeliver_from), None
+        return [update for update in self.updates if update.update_id >= offset][:limit]
+
+
+class FakeDispatcher:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.processed = []
+        self._lock = threading.Lock()
+
+    def process_update(self, update):
+        time.sleep(self.delay)
+        with self._lock:
+            self.processed.append((update.effective_user.id, update.update_id))
+
+
+def test_duplicates_are_recognized_after_a_restart(tmp_path):
+    state_file = str(tmp_path / "update_offset.json")
+    tracker = UpdateOffsetTracker(state_file)
+    tracker.mark(5)
+    tracker.mark(7)
+    assert tracker.is_duplicate(7) and not tracker.is_duplicate(6)
+    assert tracker.save()
+    assert not tracker.save()  # nada mudou
+
+    restarted = UpdateOffsetTracker(state_file)
+    assert restarted.load() == 7
+    assert restarted.next_offset == 8
+    assert restarted.is_duplicate(6) and restarted.is_duplicate(7)
+    assert not restarted.is_duplicate(8)
+
+
+def test_catch_up_skips_duplicates_and_keeps_each_user_in_order(tmp_path):
+    tracker = UpdateOffsetTracker(str(tmp_path / "update_offset.json"))
+    tracker.adopt(3)  # processado até o 3 pela execução anterior
+    updates = [FakeUpdate(update_id, user_id) for update_id, user_id in
+               [(2, 1), (3, 1), (4, 1), (5, 2), (6, 1), (7, 2), (8, 3), (9, 1), (10, 2)]]
+    dispatcher = FakeDispatcher(delay=0.01)
+
+    offset = catch_up(FakeBot(updates, redeliver_from=2), dispatcher, tracker, workers=3, page_size=4)
+
+    processed = dispatcher.processed
+    assert sorted(update_id for _, update_id in processed) == [4, 5, 6, 7, 8, 9, 10]
+    for user_id in (1, 2, 3):
+        ids = [update_id for user, update_id in processed if user == user_id]
+        assert ids == sorted(ids)
+    assert offset == 11
+    assert tracker.last_update_id == 10
+
+
+def test_next_page_is_requested_only_after_the_current_one(tmp_path):
+    tracker = UpdateOffsetTracker(str(tmp_path / "update_offset.json"))
+    updates = [FakeUpdate(update_id, update_id % 2) for update_id in range(1, 8)]
+    bot = FakeBot(updates)
+    dispatcher = FakeDispatcher()
+
+    catch_up(bot, dispatcher, tracker, page_size=3)
+
+    # Cada pedido confirma a página anterior, já processada
+    assert bot.offsets == [0, 4, 7]
+    assert len(dispatcher.processed) == 7
+
+
+def test_old_messages_from_the_backlog_are_stale():
+    now = datetime.now(timezone.utc)
+    assert is_stale(FakeUpdate(1, 1, date=now - timedelta(hours=2)), max_age=3600)
+    assert not is_stale(FakeUpdate(1, 1, date=now - timedelta(minutes=5)), max_age=3600)
+    assert not is_stale(FakeUpdate(1, 1, date=now - timedelta(hours=2)), max_age=0)
+    assert not is_stale(FakeUpdate(1, 1), max_age=3600)
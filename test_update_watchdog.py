@@ -0,0 +1,40 @@
+"""Testes da vigilância de updates lentos."""
+
+import logging
+import threading
+from types import SimpleNamespace
+
+from update_watchdog import UpdateWatchdog
+
+
+def test_slow_update_is_reported_once_with_fields_in_extra(caplog):
+    watchdog = UpdateWatchdog(threshold=1.0, report_interval=60)
+    update = SimpleNamespace(update_id=7, effective_user=SimpleNamespace(id=42))
+    token = watchdog.begin("checkout", update)
+    started = watchdog._running[token][4]
+
+    assert watchdog.check(now=started + 0.5) == []
+    with caplog.at_level(logging.WARNING, logger="update_watchdog"):
+        report, = watchdog.check(now=started + 2.0)
+    assert watchdog.check(now=started + 3.0) == []
+    watchdog.end(token)
+
+    assert report["handler"] == "checkout" and report["user_id"] == 42 and report["update_id"] == 7
+    assert report["handler_thread"] == threading.current_thread().name
+    assert report["stack"]
+    record, = caplog.records
+    assert record.getMessage() == "Update lento em checkout: 2.0s (usuário 42)"
+    assert record.elapsed == 2.0 and record.stack == report["stack"]
+
+
+def test_reports_are_rate_limited_and_suppressed_ones_counted():
+    watchdog = UpdateWatchdog(threshold=1.0, report_interval=60)
+    first = watchdog.begin("a")
+    second = watchdog.begin("b")
+    started = watchdog._running[second][4]
+
+    assert len(watchdog.check(now=started + 2.0)) == 1
+    third = watchdog.begin("c")
+    assert watchdog.check(now=started + 70.0)[0]["suppressed"] == 1
+    for token in (first, second, third):
+        watchdog.end(token)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de controle do offset de updates do Telegram.
+Grava o último `update_id` processado em data/update_offset.json para que um
+reinício (por exemplo, um deploy) não perca nem repita os toques dos
+clientes. Na inicialização, o backlog acumulado é processado em modo de
+recuperação: em paralelo entre usuários diferentes e em ordem para cada
+usuário, com deduplicação pelo `update_id`.
+
+No modo multiprocesso o update é dado como recebido ao ir para a fila de um
+worker, mas só está seguro quando o worker o confirma. Os encaminhados ainda
+sem confirmação são gravados junto com o offset (o Telegram não os entrega
+de novo depois que o polling avança), e o offset gravado para antes do
+menor deles.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from metrics import registry
+
+logger = logging.getLogger('update_offset')
+
+UPDATE_OFFSET_FILE = os.path.join("data", "update_offset.json")
+UPDATE_CATCHUP_WORKERS = int(os.getenv("UPDATE_CATCHUP_WORKERS", "8"))
+# Mensagens mais antigas que isso no backlog são descartadas (segundos)
+UPDATE_CATCHUP_MAX_AGE = int(os.getenv("UPDATE_CATCHUP_MAX_AGE", "1800"))
+# IDs recentes lembrados para deduplicação além do offset gravado
+RECENT_UPDATE_IDS = 10000
+
+updates_counter = registry.counter(
+    "telegram_updates_total",
+    "Updates do Telegram por origem e resultado",
+    labels=("source", "outcome")
+)
+
+class UpdateOffsetTracker:
+    """Guarda o último update processado e descarta updates repetidos."""
+
+    def __init__(self, state_file=UPDATE_OFFSET_FILE):
+        """Inicializa o controle de offset.
+
+        Args:
+            state_file (str): Arquivo JSON onde o offset é gravado
+        """
+        self.state_file = state_file
+        self.last_update_id = 0
+        self._loaded_update_id = 0  # offset gravado pela execução anterior
+        self._recent = set()
+        self._recent_order = deque()
+        self._lock = threading.Lock()
+        self._dirty = False
+        # Modo multiprocesso: callable que retorna os updates (dicts) ainda não
+        # confirmados pelos workers, em ordem de update_id
+        self.pending_source = None
+        # Updates não confirmados gravados pela execução anterior, a reenviar
+        self.pending_updates = []
+        self._saved_pending = False
+
+    @property
+    def next_offset(self):
+        """Offset a usar no próximo getUpdates."""
+        return self.last_update_id + 1 if self.last_update_id else 0
+
+    def is_duplicate(self, update_id):
+        """True se o update já foi processado (antes ou depois de um reinício)."""
+        with self._lock:
+            return update_id in self._recent or update_id <= self._loaded_update_id
+
+    def mark(self, update_id):
+        """Registra um update como processado."""
+        with self._lock:
+            if update_id in self._recent:
+                return
+            self._recent.add(update_id)
+            self._recent_order.append(update_id)
+            while len(self._recent_order) > RECENT_UPDATE_IDS:
+                self._recent.discard(self._recent_order.popleft())
+            if update_id > self.last_update_id:
+                self.last_update_id = update_id
+                self._dirty = True
+
+    def adopt(self, update_id):
+        """Assume o offset entregue pelo processo anterior na passagem de bastão."""
+        with self._lock:
+            if update_id > self.last_update_id:
+                self.last_update_id = update_id
+                self._dirty = True
+            self._loaded_update_id = max(self._loaded_update_id, update_id)
+
+    def save(self, force=False):
+        """Grava o offset se ele mudou.
+
+        Returns:
+            bool: True se o arquivo foi gravado
+        """
+        pending = self.pending_source() if self.pending_source else []
+        with self._lock:
+            if not (self._dirty or force or pending or self._saved_pending):
+                return False
+            state = {"last_update_id": self.last_update_id, "updated_at": datetime.now().isoformat()}
+            if pending:
+                # Offset seguro: antes do primeiro não confirmado; o maior já
+                # recebido continua valendo para a deduplicação
+                state["last_update_id"] = min(self.last_update_id, pending[0]["update_id"] - 1)
+                state["received_update_id"] = self.last_update_id
+                state["pending"] = pending
+            self._dirty = False
+            self._saved_pending = bool(pending)
+        try:
+            os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+            tmp_file = f"{self.state_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp_file, self.state_file)
+            return True
+        except Exception as e:
+            logger.error("Erro ao salvar o offset de updates: %s", e)
+            with self._lock:
+                self._dirty = True
+            return False
+
+    def load(self):
+        """Carrega o offset gravado; retorna o último update_id (0 se não houver)."""
+        if not os.path.exists(self.state_file):
+            return 0
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.last_update_id = max(int(state.get("last_update_id", 0)), int(state.get("received_update_id", 0)))
+            self._loaded_update_id = self.last_update_id
+            self.pending_updates = state.get("pending", [])
+        except Exception as e:
+            logger.error("Erro ao carregar o offset de updates: %s", e)
+        return self.last_update_id
+
+def update_user_key(update):
+    """Chave de ordenação de um update: o usuário (ou chat) que o originou."""
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+def is_stale(update, max_age):
+    """True para mensagens do backlog antigas demais para ainda serem úteis."""
+    message = update.message or update.edited_message
+    if not message or not message.date or max_age <= 0:
+        return False
+    date = message.date if message.date.tzinfo else message.date.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - date).total_seconds() > max_age
+
+def catch_up(bot, dispatcher, tracker, allowed_updates=None, workers=UPDATE_CATCHUP_WORKERS,
+             max_age=UPDATE_CATCHUP_MAX_AGE, page_size=100):
+    """Processa o backlog de updates pendentes antes de iniciar o polling.
+
+    Cada página é agrupada por usuário: usuários diferentes são atendidos em
+    paralelo e os updates de um mesmo usuário, em ordem. A próxima página só
+    é pedida (o que confirma a anterior ao Telegram) depois que a atual foi
+    totalmente processada.
+
+    Returns:
+        int: Offset a partir do qual o polling normal deve continuar
+    """
+    offset = tracker.next_offset
+    processed = skipped = 0
+    started = time.monotonic()
+
+    def process_user_updates(updates):
+        for update in updates:
+            try:
+                dispatcher.process_update(update)
+            except Exception as e:
+                logger.error("Erro ao processar o update %s na recuperação: %s", update.update_id, e)
+            tracker.mark(update.update_id)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="catch-up") as executor:
+        while True:
+            try:
+                updates = bot.get_updates(offset=offset, limit=page_size, timeout=0,
+                                          allowed_updates=allowed_updates)
+            except Exception as e:
+                logger.warning("Não foi possível buscar o backlog de updates: %s", e)
+                break
+            if not updates:
+                break
+
+            by_user = OrderedDict()
+            for update in updates:
+                if tracker.is_duplicate(update.update_id):
+                    updates_counter.inc(source="catch_up", outcome="duplicate")
+                    skipped += 1
+                    continue
+                if is_stale(update, max_age):
+                    updates_counter.inc(source="catch_up", outcome="stale")
+                    tracker.mark(update.update_id)
+                    skipped += 1
+                    continue
+                by_user.setdefault(update_user_key(update), []).append(update)
+                updates_counter.inc(source="catch_up", outcome="processed")
+                processed += 1
+
+            list(executor.map(process_user_updates, by_user.values()))
+            offset = updates[-1].update_id + 1
+            tracker.mark(updates[-1].update_id)
+            tracker.save()
+
+            if len(updates) < page_size:
+                break
+
+    if processed or skipped:
+        logger.info(
+            "Recuperação concluída: %s updates processados, %s ignorados "
+            "em %.1fs",
+            processed, skipped, time.monotonic() - started
+        )
+    return offset
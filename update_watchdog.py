@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Módulo de vigilância de updates lentos.
+Cada execução de handler instrumentada (instrumentation) registra aqui a
+thread e o instante de início. Uma thread de vigilância verifica as
+execuções em andamento e, quando uma passa do limite, captura a pilha da
+thread que a executa (sys._current_frames) e registra um aviso curto com o
+relatório (handler, usuário, tempo decorrido e pilha) nos campos extras,
+que saem como campos da linha JSON do log. Cada execução é
+relatada uma vez e os relatórios têm intervalo mínimo entre si, então a
+vigilância pode ficar ligada em produção.
+"""
+
+import os
+import sys
+import time
+import logging
+import itertools
+import threading
+import traceback
+from collections import deque
+
+from metrics import registry
+
+logger = logging.getLogger('update_watchdog')
+
+# Tempo de execução a partir do qual um update é relatado (segundos; 0 = desativado)
+SLOW_UPDATE_THRESHOLD = float(os.getenv("SLOW_UPDATE_THRESHOLD", "10"))
+# Intervalo mínimo entre dois relatórios (segundos); os suprimidos são contados no seguinte
+SLOW_UPDATE_REPORT_INTERVAL = float(os.getenv("SLOW_UPDATE_REPORT_INTERVAL", "60"))
+# Quadros da pilha incluídos no relatório (os mais internos)
+STACK_LIMIT = 40
+
+slow_updates_counter = registry.counter(
+    "slow_updates_total",
+    "Execuções de handler que passaram do limite de tempo",
+    labels=("handler",)
+)
+
+def update_user_id(update):
+    """ID do usuário do update, quando o primeiro argumento do handler é um Update."""
+    user = getattr(update, "effective_user", None)
+    return getattr(user, "id", None)
+
+class UpdateWatchdog:
+    """Acompanha as execuções em andamento e relata as que demoram demais."""
+
+    def __init__(self, threshold=SLOW_UPDATE_THRESHOLD, report_interval=SLOW_UPDATE_REPORT_INTERVAL):
+        self.threshold = threshold
+        self.report_interval = report_interval
+        self._ids = itertools.count()
+        # token -> [handler, update, thread ident, thread name, início, já relatado]
+        self._running = {}
+        self._last_report = None
+        self._suppressed = 0
+        self.reports = deque(maxlen=20)
+        self._thread = None
+        self._stop = threading.Event()
+
+    def begin(self, handler, update=None):
+        """Registra o início de uma execução.
+
+        Returns:
+            int: Token a ser passado para end()
+        """
+        token = next(self._ids)
+        thread = threading.current_thread()
+        self._running[token] = [handler, update, thread.ident, thread.name, time.monotonic(), False]
+        return token
+
+    def end(self, token):
+        self._running.pop(token, None)
+
+    def check(self, now=None):
+        """Relata as execuções que passaram do limite (chamado pela thread de vigilância).
+
+        Returns:
+            list: Relatórios emitidos nesta verificação
+        """
+        now = time.monotonic() if now is None else now
+        slow = [(token, entry) for token, entry in self._running.copy().items()
+                if not entry[5] and now - entry[4] >= self.threshold]
+        if not slow:
+            return []
+        frames = sys._current_frames()
+        emitted = []
+        for token, entry in slow:
+            handler, update, ident, thread_name, started, _ = entry
+            entry[5] = True
+            slow_updates_counter.inc(handler=handler)
+            if self._last_report is not None and now - self._last_report < self.report_interval:
+                self._suppressed += 1
+                continue
+            frame = frames.get(ident)
+            report = {
+                "event": "slow_update",
+                "handler": handler,
+                "user_id": update_user_id(update),
+                "update_id": getattr(update, "update_id", None),
+                "elapsed": round(now - started, 3),
+                # "thread" já é o campo da thread que registra o log
+                "handler_thread": thread_name,
+                "suppressed": self._suppressed,
+                "stack": traceback.format_stack(frame)[-STACK_LIMIT:] if frame is not None else [],
+            }
+            self._last_report = now
+            self._suppressed = 0
+            self.reports.append(report)
+            emitted.append(report)
+            logger.warning("Update lento em %s: %.1fs (usuário %s)",
+                           handler, report["elapsed"], report["user_id"], extra=report)
+        return emitted
+
+    def start(self):
+        """Inicia a thread de vigilância (uma vez; nada a fazer se desativada)."""
+        if self.threshold <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._watch, name="update-watchdog", daemon=True)
+        self._thread.start()
+        logger.info("Vigilância de updates lentos ativa (limite de %gs)", self.threshold)
+
+    def _watch(self):
+        # Verificações frequentes o bastante para relatar perto do limite
+        interval = min(max(self.threshold / 4, 0.25), 5)
+        while not self._stop.wait(interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error("Erro na vigilância de updates lentos: %s", e)
+
+    def stop(self):
+        self._stop.set()
+
+watchdog = UpdateWatchdog()
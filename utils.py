@@ -1,9 +1,10 @@
 import logging
 from telegram import ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
 from config import PRODUCT_CATALOG, DISCOUNT_THRESHOLD, DISCOUNT_PERCENTAGE
+from log_setup import setup_logging
 
 # Set up logging
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Main keyboard for regular operations